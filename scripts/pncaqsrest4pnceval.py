@@ -102,28 +102,21 @@ lon.units = 'degrees_east'
 lon.standard_name = 'longitude'
 lon[:] = sites['Longitude'].values
 
-for idx, row in hourly.iterrows():
-    this_time = row['Date GMT_24 Hour GMT']
-    val = row['Sample Measurement']
-    unit = row['Unit of Measure'].strip()
-    aqsid = row['State Code'] + row['County Code'] + row['Site Num']
-    sidx = sitelist.index(aqsid)
-    var_name = row['AQS Parameter Desc']
-    if not var_name in outf.variables.keys():
-        var = outf.createVariable(var_name, 'f', ('time', 'LAY', 'points'))
-        var.units = unit
-        var.standard_name = var_name
-        temp[var_name] = np.zeros((ntimes, 1, nsites), dtype = 'f')
-    tmpvar = temp[var_name]
-    var = outf.variables[var_name]
-    assert(var.units == unit)
-    if last_time != this_time:
-        last_time = this_time
-        tidx = alltimes.index(np.datetime64(this_time))
-    if tidx > ntimes:
-        raise ValueError('Times (%d) exceed expected (%d)' % (tidx, ntimes))
-    
-    tmpvar[tidx, 0, sidx] = val
+# site and time indices of all rows at once instead of a lookup per row
+siteidx = dict([(aqsid, si) for si, aqsid in enumerate(sitelist)])
+hourly['sidx'] = (hourly['State Code'] + hourly['County Code'] + hourly['Site Num']).map(siteidx).values
+hourly['tidx'] = ((hourly['Date GMT_24 Hour GMT'].values - start_time) // np.timedelta64(1, 'h')).astype('i')
+if hourly['tidx'].values.max() >= ntimes:
+    raise ValueError('Times (%d) exceed expected (%d)' % (hourly['tidx'].values.max(), ntimes))
+
+for var_name, group in hourly.groupby('AQS Parameter Desc', sort = False):
+    units = group['Unit of Measure'].str.strip().unique()
+    assert(len(units) == 1)
+    var = outf.createVariable(var_name, 'f', ('time', 'LAY', 'points'))
+    var.units = units[0]
+    var.standard_name = var_name
+    tmpvar = temp[var_name] = np.zeros((ntimes, 1, nsites), dtype = 'f')
+    tmpvar[group['tidx'].values, 0, group['sidx'].values] = group['Sample Measurement'].values
 
 for varkey, tempvals in temp.items():
     outf.variables[varkey][:] = tempvals
@@ -134,6 +134,8 @@ lat.units = 'degrees_north'.ljust(16)
 lon = outf.createVariable('LON', 'f', ('points'))
 lon.units = 'degrees_east'.ljust(16)
 
+starts = np.array([ts for ts, te in time_bounds], dtype = 'datetime64[s]')
+ends = np.array([te for ts, te in time_bounds], dtype = 'datetime64[s]')
 for si, site in enumerate(sites):
     outfn = '%s_%s_%s.txt' % (site, startts.strftime("%Y%m%d%H%M"),
                                   endts.strftime("%Y%m%d%H%M"))
@@ -141,28 +143,21 @@ for si, site in enumerate(sites):
     lat[si] = sitelocs[site][1]
     lon[si] = sitelocs[site][0]
     if data.size == 0: continue
-    times = np.array([datetime.datetime.strptime(d.decode('ascii'), '%Y-%m-%d %H:%M') for d in data['valid']])
-    for ti, (sh, eh) in enumerate(time_bounds):
-        tdata = data[(times > sh) & (times <=  eh)]
-        if 'tmpf' in data.dtype.names:
-            val = F2K(tdata['tmpf']).mean()
-            if not np.ma.is_masked(val):
-                temp2[ti, 0, si] = val
-        if 'drct' in data.dtype.names:
-            val = tdata['drct'].mean()
-            if not np.ma.is_masked(val):
-                wdir10[ti, 0, si] = val
-        if 'sknt' in data.dtype.names:
-            val = tdata['sknt'].mean() * 0.514444444 # convert knot to m/s
-            if not np.ma.is_masked(val):
-                wspd10[ti, 0, si] = val
-        if 'alti' in data.dtype.names:
-            val = tdata['alti'].mean() * 760/29.9213*101325./760. # convert inches to Pa
-            if not np.ma.is_masked(val):
-                prsfc[ti, 0, si] = val
-        if 'p01i' in data.dtype.names:
-            val = tdata['p01i'].mean() * 2.54 # convert inches to cm
-            if not np.ma.is_masked(val):
-                rn[ti, 0, si] = val
+    times = np.array([datetime.datetime.strptime(d.decode('ascii'), '%Y-%m-%d %H:%M') for d in data['valid']], dtype = 'datetime64[s]')
+    # hour of each observation (sh < time <= eh) for all hours at once
+    tidx = np.searchsorted(ends, times, side = 'left')
+    inhours = (times > starts[0]) & (tidx < len(time_bounds))
+    for key, outvar, convert in [('tmpf', temp2, F2K),
+                                 ('drct', wdir10, lambda x: x),
+                                 ('sknt', wspd10, lambda x: x * 0.514444444), # convert knot to m/s
+                                 ('alti', prsfc, lambda x: x * 760/29.9213*101325./760.), # convert inches to Pa
+                                 ('p01i', rn, lambda x: x * 2.54)]: # convert inches to cm
+        if key in data.dtype.names:
+            vals = np.ma.masked_invalid(convert(data[key]))
+            valid = inhours & ~np.ma.getmaskarray(vals)
+            counts = np.bincount(tidx[valid], minlength = len(time_bounds))
+            sums = np.bincount(tidx[valid], weights = np.ma.getdata(vals)[valid], minlength = len(time_bounds))
+            hasval = counts > 0
+            outvar[np.flatnonzero(hasval), 0, si] = sums[hasval] / counts[hasval]
     outf.sync()
 outf.close()
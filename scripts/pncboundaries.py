@@ -6,6 +6,7 @@ from collections import defaultdict
 from netCDF4 import MFDataset, Dataset
 from datetime import datetime, timedelta
 from PseudoNetCDF.coordutil import getmap
+from PseudoNetCDF._sketch import sketch
 
 
 def plot(ifiles, args):
@@ -54,7 +55,7 @@ def plot(ifiles, args):
         for lstr, var in vars:
             bmap = None
             if maskzeros: var = np.ma.masked_values(var, 0)
-            vmin, vmax = np.percentile(np.ma.compressed(var).ravel(), list(minmaxq))
+            vmin, vmax = sketch(var).percentile(list(minmaxq))
             if minmax[0] is not None:
                 vmin = minmax[0]
             if minmax[1] is not None:
@@ -70,7 +71,7 @@ def plot(ifiles, args):
                 elif scale == 'linear':
                     bins = np.linspace(vmin, vmax, 11)
                 elif scale == 'deciles':
-                    bins = np.percentile(np.ma.compressed(np.ma.masked_greater(np.ma.masked_less(var, vmin).view(np.ma.MaskedArray), vmax)).ravel(), [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
+                    bins = sketch(np.ma.masked_greater(np.ma.masked_less(var, vmin).view(np.ma.MaskedArray), vmax)).percentile([0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
                     bins[0] = vmin; bins[-1] = vmax
                 norm = BoundaryNorm(bins, ncolors = 256)
             
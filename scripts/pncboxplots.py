@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from netCDF4 import Dataset
 import matplotlib.pyplot as plt
-from PseudoNetCDF.coordutil import gettimes
+from PseudoNetCDF._timebin import timebins, binstats
 import numpy as np
 import os
 
@@ -17,18 +17,33 @@ def plot_boxplot(ifiles, args):
     ifiles
     for target in args.variables:
         vars = [ifile.variables[target] for ifile in ifiles]
-        vals = [var[:] for var in vars]
         units = [getattr(var, 'units', '') for var in vars]
-        xs = range(len(vars))
         del sax.lines[:]
         del sax.collections[:]
         del sax.patches[:]
+        if args.by is None:
+            # one bin per file; masked values are left out
+            vals = [binstats(var, np.zeros(var.shape[0], dtype = 'i'), 1).values()[0] for var in vars]
+            xs = range(len(vars))
+            ticks, ticklabels = xs, args.xlabels
+        else:
+            bins = [timebins(ifile, args.by) for ifile in ifiles]
+            binlabels = bins[0][1]
+            nbins = len(binlabels)
+            width = 1. / (len(vars) + 1)
+            vals = []
+            xs = []
+            for vi, ((codes, blabels), var) in enumerate(zip(bins, vars)):
+                vals.extend(binstats(var, codes, nbins).values())
+                xs.extend(np.arange(nbins) + (vi + 1) * width)
+            ticks = np.arange(nbins) + .5
+            ticklabels = binlabels
         if args.violin:
             sax.violinplot(vals, positions = xs, **args.boxkwds)
         else:
             sax.boxplot(vals, positions = xs, **args.boxkwds)
-        sax.set_xticks(xs)
-        sax.set_xticklabels(args.xlabels)
+        sax.set_xticks(ticks)
+        sax.set_xticklabels(ticklabels)
         #plt.setp(sax.xaxis.get_ticklabels(),rotation = 45)
         figpath = args.outpath + target + '.' + args.figformat
         fig.savefig(figpath)
@@ -39,6 +54,7 @@ if __name__ == '__main__':
     parser = getparser(plot_options = True, has_ofile = True)
     parser.add_argument('--violin', dest = 'violin', action = 'store_true', default = False, help = 'Use violins')
     parser.add_argument('--xlabel', dest = 'xlabels', action = 'append', default = [], help = 'Use violins')
+    parser.add_argument('--by', default = None, choices = ['hour', 'dayofweek', 'month', 'season'], help = 'Boxes by time bin for each file (default: one box per file)')
     parser.add_argument('--box-keywords', dest = 'boxkwds', type = lambda x: eval('dict(' + x + ')'), default = dict(), help = 'Keywords for boxplot or violinplot')
     parser.epilog += """
     -----
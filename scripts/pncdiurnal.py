@@ -1,31 +1,34 @@
 #!/usr/bin/env python
 from netCDF4 import Dataset
 import matplotlib.pyplot as plt
-from PseudoNetCDF.coordutil import gettimes
+from PseudoNetCDF._timebin import timebins, binstats
 import numpy as np
 import os
 
+xlabels = dict(hour = 'Time (UTC)', dayofweek = 'Day of week (UTC)', month = 'Month', season = 'Season')
+
 def plot_diurnal_box(ifiles, args):
-    times = [gettimes(ifile) for ifile in ifiles]
-    hours = [np.array([t.hour for t in time]) for time in times]
+    by = getattr(args, 'by', 'hour')
+    bins = [timebins(ifile, by) for ifile in ifiles]
+    labels = bins[0][1]
+    nbins = len(labels)
     fig = plt.figure()
     sax = fig.add_subplot(111)
     if len(args.figure_keywords) > 0:
         plt.setp(fig, **args.figure_keywords)
     if len(args.axes_keywords) > 0:
         plt.setp(sax, **args.axes_keywords)
-    sax.set_xlabel('Time (UTC)')
+    sax.set_xlabel(xlabels[by])
     split = 25
     for target in args.variables:
         vars = [ifile.variables[target] for ifile in ifiles]
         unit = getattr(vars[0], 'units', 'unknown')
         sax.set_ylabel(target + ' (' + unit + ')')
-        vals = [var[:] for var in vars]
-        hvars = [[np.ma.compressed(val[hour == i]) for i in range(24)] for hour, val in zip(hours, vals)]
+        hvars = [binstats(var, codes, nbins).values() for (codes, blabels), var in zip(bins, vars)]
         del sax.lines[:]
         nvars = len(vars)
         varwidth = .8/nvars/1.1
-        po = np.arange(24) + 0.1 + varwidth/2
+        po = np.arange(nbins) + 0.1 + varwidth/2
         ncolors = max(float(nvars), 10)
         try:
             from cycler import cycler
@@ -37,9 +40,13 @@ def plot_diurnal_box(ifiles, args):
             plt.setp([i for i in varb.values()], **propd)
             plt.setp(varb['medians'], color = 'k')
             plt.setp(varb['fliers'], markeredgecolor = propd['color'])
-        sax.set_xlim(-.5, 24.5)
-        sax.set_xticks(range(0, 25))
-        sax.set_xticklabels([str(i) for i in range(0, 25)])
+        sax.set_xlim(-.5, nbins + .5)
+        if by == 'hour':
+            sax.set_xticks(range(0, 25))
+            sax.set_xticklabels([str(i) for i in range(0, 25)])
+        else:
+            sax.set_xticks(np.arange(nbins) + .5)
+            sax.set_xticklabels(labels)
         #plt.setp(sax.xaxis.get_ticklabels(),rotation = 45)
         figpath = args.outpath + target + '.' + args.figformat
         fig.savefig(figpath)
@@ -49,6 +56,7 @@ if __name__ == '__main__':
     from PseudoNetCDF.pncparse import getparser, pncparse
     parser = getparser(plot_options = True, has_ofile = True)
     parser.add_argument('--whis', default = None, help = 'See pydoc matplotlib.axes.Axes.boxplot')
+    parser.add_argument('--by', default = 'hour', choices = ['hour', 'dayofweek', 'month', 'season'], help = 'Time bins of the boxes (default: %(default)s)')
     parser.epilog += """
     -----
 box.py inobs inmod target [target ...]
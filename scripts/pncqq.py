@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from netCDF4 import Dataset
 import matplotlib.pyplot as plt
-from PseudoNetCDF.coordutil import gettimes
+from PseudoNetCDF._sketch import sketch
 import numpy as np
 import os
 
@@ -23,22 +23,20 @@ def plot_scatter(ifiles, args):
         varydesc = getattr(vary, 'description', None)
         sax.set_ylabel(varydesc)
         sax.set_xlabel(varxdesc)
-        valx = np.ma.compressed(varx[:])
-        valy = np.ma.compressed(vary[:])
-        if valx.size < valy.size:
-            svalx = np.sort(valx)
-            svaly = np.percentile(valy, np.arange(svalx.size, dtype = 'f')/(svalx.size-1)*100)
-        elif valy.size < valx.size:
-            svaly = np.sort(valy)
-            pctidx = np.arange(svaly.size, dtype = 'f')/(svaly.size-1)*100
-            svalx = np.percentile(valx, pctidx)
-        else:
-            svaly = np.sort(valy)
-            svalx = np.sort(valx)
+        # variables are read in chunks into mergeable sketches; small
+        # inputs are exact and match sorted values
+        skx = sketch(varx)
+        sky = sketch(vary)
+        npts = min(skx.n, sky.n)
+        if not (skx.exact and sky.exact):
+            npts = min(npts, args.nquantiles)
+        q = np.arange(npts, dtype = 'd') / max(1, npts - 1) * 100
+        svalx = skx.percentile(q)
+        svaly = sky.percentile(q)
         
         del sax.lines[:]
-        vmin = np.minimum(varx[:].min(), vary[:].min())
-        vmax = np.maximum(varx[:].max(), vary[:].max())
+        vmin = np.minimum(skx.vmin, sky.vmin)
+        vmax = np.maximum(skx.vmax, sky.vmax)
         sax.plot([vmin, vmax], [vmin, vmax], color = 'k')
         varb = sax.plot(svalx[:], svaly[:], ls = 'none', marker = 'o', markeredgecolor = 'none')
         sax.set_xlim(vmin, vmax)
@@ -50,6 +48,7 @@ def plot_scatter(ifiles, args):
 if __name__ == '__main__':
     from PseudoNetCDF.pncparse import getparser, pncparse
     parser = getparser(plot_options = True, has_ofile = True)
+    parser.add_argument('--nquantiles', type = int, default = 1000, help = 'Quantiles plotted when inputs are too large to sort (default: %(default)s)')
     parser.epilog += """
     -----
 box.py inobs inmod target [target ...]
@@ -44,8 +44,9 @@ setup(name = 'PseudoNetCDF',
       packages = packages,
       package_dir = {'': 'src'},
       package_data = {'PseudoNetCDF': data},
-      scripts = ['scripts/pncmadis2pnceval.py', 'scripts/pncaqsraw4pnceval.py', 'scripts/pncaqsrest4pnceval.py', 'scripts/pncasos4pnceval.py', 'scripts/pnc1d.py', 'scripts/pnc2d.py', 'scripts/pncboundaries.py', 'scripts/pncdiurnal.py', 'scripts/pncdump', 'scripts/pncdump.py', 'scripts/pnceval', 'scripts/pnceval.py', 'scripts/pncgen', 'scripts/pncgen.py', 'scripts/pncglobal2cmaq.py', 'scripts/pncload', 'scripts/pncmap.py', 'scripts/pncqq.py', 'scripts/pncscatter.py', 'scripts/pncts.py', 'scripts/pncvertprofile.py', 'scripts/pncview', 'scripts/pncview.py', 'scripts/pncwindrose.py'],
+      scripts = ['scripts/pncmadis2pnceval.py', 'scripts/pncaqsraw4pnceval.py', 'scripts/pncaqsrest4pnceval.py', 'scripts/pncasos4pnceval.py', 'scripts/pnc1d.py', 'scripts/pnc2d.py', 'scripts/pncbench', 'scripts/pncboundaries.py', 'scripts/pnccatalog', 'scripts/pncdiurnal.py', 'scripts/pncdump', 'scripts/pncdump.py', 'scripts/pnceval', 'scripts/pnceval.py', 'scripts/pncgen', 'scripts/pncgen.py', 'scripts/pncglobal2cmaq.py', 'scripts/pncload', 'scripts/pncmap.py', 'scripts/pncqq.py', 'scripts/pncscatter.py', 'scripts/pncts.py', 'scripts/pncvertprofile.py', 'scripts/pncview', 'scripts/pncview.py', 'scripts/pncwindrose.py'],
       install_requires = ['numpy>=1.2', 'netCDF4', 'pandas', 'scipy', 'matplotlib', 'pyyaml'],
+      entry_points = {'xarray.backends': ['pseudonetcdf = PseudoNetCDF._xarray:PseudoNetCDFBackendEntrypoint']},
       url = 'http://github.com/barronh/pseudonetcdf/',
       classifiers = ['Programming Language :: Python :: 2.7',
                      'Programming Language :: Python :: 3',
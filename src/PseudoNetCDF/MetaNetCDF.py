@@ -18,6 +18,8 @@ RevisionNum= "$LastChangedRevision$"
 ChangedBy  = "$LastChangedBy$"
 __version__ = RevisionNum
 
+from collections import OrderedDict
+import unittest
 from numpy import array, where, logical_or, repeat, mean, sum, zeros
 #This Package modules
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, \
@@ -25,6 +27,7 @@ from PseudoNetCDF.sci_var import PseudoNetCDFFile, \
                     PseudoNetCDFVariables, \
                     PseudoNetCDFVariableConvertUnit
 from PseudoNetCDF.ArrayTransforms import CenterTime
+from PseudoNetCDF.core._lazy import PseudoNetCDFLazyVariable, LazyConcat, LazyMissing, lazynode
                             
 
 class add_derived(PseudoNetCDFFile):
@@ -214,6 +217,22 @@ class newresolution(PseudoNetCDFFile):
             Pseudo2NetCDF().addVariableProperties(ov, v)
             return v
                 
+class _MetaVariables(PseudoNetCDFVariables):
+    """
+    Variables of a MetaNetCDF; keys (and so every lookup) first refresh
+    the index if a child has changed
+    """
+    def __init__(self, meta, func, keys):
+        PseudoNetCDFVariables.__init__(self, func, keys)
+        self._meta = meta
+
+    def keys(self):
+        self._meta._checkindex()
+        return PseudoNetCDFVariables.keys(self)
+
+    def setkeys(self, keys):
+        self._PseudoNetCDFVariables__keys = list(keys)
+
 class MetaNetCDF(PseudoNetCDFFile):
     """
     MetaNetCDF provides a basic interface for combining files
@@ -229,63 +248,144 @@ class MetaNetCDF(PseudoNetCDFFile):
         >>> metfile.addMetaVariable('WS', wind_speed_calc)
         >>> metfile.variables['WS'].shape
         (25, 28, 65, 83)
+
+    Variables are the child variables themselves (no copy) found from an
+    index of keys built when files are added. With concatdim (e.g.,
+    TSTEP), variables of several files that have concatdim are
+    concatenated lazily along it, so only the files holding the
+    requested records are read; records of files that do not have a
+    variable are masked. The index is rebuilt by addfile and when the
+    variables or dimensions of a child change (checked on each variable
+    lookup); reindex rebuilds it explicitly.
     """
     __metavars__ = {}
     def addMetaVariable(self, key, func):
         self.variables.addkey(key)
         self.__metavars__[key] = func
 
-    def __init__(self, files):
-        self.__files = files
-        keys = []
+    def __init__(self, files, concatdim = None):
+        self.__files = list(files)
+        self.__concatdim = concatdim
+        self.__metavars__ = {}
+        self.__signatures = None
+        self.variables = _MetaVariables(self, self.__variables, [])
+        self.reindex()
+
+    def addfile(self, f):
+        """
+        Add f to the children and rebuild the index
+        """
+        self.__files.append(f)
+        self.reindex()
+
+    def _signatures(self):
+        # changes when a child gains or loses variables or dimensions or
+        # a dimension changes length
+        return [(id(f.variables), len(f.variables.keys()), tuple([(k, len(d)) for k, d in f.dimensions.items()])) for f in self.__files]
+
+    def _checkindex(self):
+        """
+        Rebuild the index if a child changed since it was built
+        """
+        if self.__signatures != self._signatures():
+            self.reindex()
+
+    def reindex(self):
+        """
+        Rebuild dimensions, attributes and the key index from the children
+        """
+        concatdim = self.__concatdim
+        self.__signatures = self._signatures()
+        self.__sources = OrderedDict()
+        self.__attrsources = {}
+        self.__cache = {}
         for f in self.__files:
             for k, d in f.dimensions.items():
                 if len(d)==1 and k=='LAY':
                     k = 'SURFLAY'
                 if k not in self.dimensions.keys():
                     self.createDimension(k, len(d))
-            keys.extend(f.variables.keys())
-            for k in f.__dict__.keys():
+            for k in f.variables.keys():
+                self.__sources.setdefault(k, []).append(f)
+            attrs = f.ncattrs() if hasattr(f, 'ncattrs') else f.__dict__.keys()
+            for k in attrs:
                 if k not in self.__dict__.keys():
                     setattr(self, k, getattr(f, k))
-        keys = list(set(keys))
-        self.variables = PseudoNetCDFVariables(self.__variables, keys)
-        self.createDimension('VAR', len(keys) - 1)
-    
+        if concatdim is not None:
+            self.createDimension(concatdim, sum([len(f.dimensions[concatdim]) for f in self.__files if concatdim in f.dimensions]))
+        keys = list(self.__sources.keys()) + [k for k in self.__metavars__ if k not in self.__sources]
+        self.variables.setkeys(keys)
+        self.createDimension('VAR', len(self.__sources) - 1)
+
     def __getattribute__(self, k):
         try:
             return PseudoNetCDFFile.__getattribute__(self, k)
         except AttributeError:
-            for f in self.__files:
-                try:
-                    return getattr(f, k)
-                except:
-                    pass
-            raise AttributeError("%s not found" % k)
+            if k[:1] == '_':
+                raise
+            # the child that answers k is remembered; misses are not,
+            # because a child may get k later
+            attrsources = self.__attrsources
+            if k not in attrsources:
+                for f in self.__files:
+                    if hasattr(f, k):
+                        attrsources[k] = f
+                        break
+                else:
+                    raise AttributeError("%s not found" % k)
+            return getattr(attrsources[k], k)
 
     def childvariables(self, k):
-        for f in self.__files:
-            if k in f.variables.keys():
-                v = f.variables[k]
-                if k=='TFLAG':
-                    v = PseudoNetCDFVariable(self, 'TFLAG', 'i', v.dimensions, values = v[:][:, [0], :].repeat(len(self.dimensions['VAR']), 1))
-                    v.long_name = 'TFLAG'.ljust(16)
-                    v.var_desc = 'TFLAG'.ljust(16)
-                    v.units = 'DATE-TIME'
-                    
-                if k=='LAY' and k in self.dimensions.keys() and len(k.shape) > 1:
-                    if v.shape[1]==1:
-                        dims = list(v.dimensions)
-                        dims[1] = 'SURFLAY'
-                        v.dimensions = tuple(dims)
-                return v
+        sources = self.__sources.get(k, [])
+        if len(sources) == 0:
+            return None
+        concatdim = self.__concatdim
+        v = sources[0].variables[k]
+        concatfiles = [] if concatdim is None else [f for f in self.__files if concatdim in f.dimensions]
+        if concatdim in v.dimensions and len(concatfiles) > 1:
+            v = self.__cache.get(k, None)
+            if v is None:
+                first = sources[0].variables[k]
+                axis = list(first.dimensions).index(concatdim)
+                # records of files without k are masked, so every
+                # variable lines up with the concatdim of the master
+                sourceids = set([id(f) for f in sources])
+                nodes = []
+                for f in concatfiles:
+                    if id(f) in sourceids:
+                        nodes.append(lazynode(f, k))
+                    else:
+                        shape = list(first.shape)
+                        shape[axis] = len(f.dimensions[concatdim])
+                        nodes.append(LazyMissing.get(shape, first.dtype))
+                node = LazyConcat.get(nodes, axis)
+                propd = dict([(pk, getattr(first, pk)) for pk in first.ncattrs()])
+                v = self.__cache[k] = PseudoNetCDFLazyVariable(self, k, node, first.dimensions, **propd)
+        if k=='TFLAG':
+            tflag = self.__cache.get('TFLAG', None)
+            if tflag is None:
+                tflag = PseudoNetCDFVariable(self, 'TFLAG', 'i', v.dimensions, values = v[:][:, [0], :].repeat(len(self.dimensions['VAR']), 1))
+                tflag.long_name = 'TFLAG'.ljust(16)
+                tflag.var_desc = 'TFLAG'.ljust(16)
+                tflag.units = 'DATE-TIME'
+                self.__cache['TFLAG'] = tflag
+            v = tflag
+            
+        if k=='LAY' and k in self.dimensions.keys() and len(v.shape) > 1:
+            if v.shape[1]==1:
+                dims = list(v.dimensions)
+                dims[1] = 'SURFLAY'
+                v.dimensions = tuple(dims)
+        return v
     
     def __variables(self, k):
         if k in self.__metavars__.keys():
             return self.__metavars__[k](self)
-        else:
-            return self.childvariables(k)
-        raise KeyError('%s not in any files' % k)
+        v = self.childvariables(k)
+        if v is None:
+            raise KeyError('%s not in any files' % k)
+        return v
+
 file_master = MetaNetCDF
 
 def WindowFromFile(WindowThis, WindowFrom):
@@ -331,4 +431,84 @@ def WindowFromFile(WindowThis, WindowFrom):
         outf.addMetaVariable(k, lambda self: self.childvariables(k)[:, :, jslice, islice])
     for k in WindowThis.variables.keys():
         AddMetaVar(k, jslice, islice)
-    return outf
\ No newline at end of file
+    return outf
+
+class TestMetaNetCDF(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from numpy import arange
+        self.files = []
+        for fi in range(3):
+            f = PseudoNetCDFFile()
+            f.createDimension('TSTEP', 2 + fi)
+            f.createDimension('VAR', 2)
+            f.createDimension('DATE-TIME', 2)
+            f.createDimension('ROW', 3)
+            f.GDNAM = 'GRID%d' % fi
+            tflag = f.createVariable('TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'))
+            tflag[:, :, 0] = 2016001
+            tflag[:, :, 1] = (arange(2 + fi) + fi * 10)[:, None] * 10000
+            o3 = f.createVariable('O3', 'f', ('TSTEP', 'ROW'), units = 'ppb')
+            o3[:] = arange((2 + fi) * 3).reshape(-1, 3) + fi * 100
+            f.createVariable('X%d' % fi, 'f', ('ROW',), units = 'm')[:] = fi
+            self.files.append(f)
+
+    def testIndex(self):
+        f0, f1, f2 = self.files
+        mf = file_master(self.files)
+        self.assertEqual(sorted(mf.variables.keys()), ['O3', 'TFLAG', 'X0', 'X1', 'X2'])
+        self.assert_(mf.variables['O3'] is f0.variables['O3'])
+        self.assert_(mf.variables['X2'] is f2.variables['X2'])
+        self.assertEqual(mf.GDNAM, 'GRID0')
+        self.assertEqual(mf.variables['TFLAG'].shape, (2, 4, 2))
+        self.assert_(mf.variables['TFLAG'] is mf.variables['TFLAG'])
+        self.assertRaises(AttributeError, getattr, mf, 'NOPE')
+        self.assertRaises(KeyError, mf.variables.__getitem__, 'NOPE')
+        f3 = PseudoNetCDFFile()
+        f3.createDimension('ROW', 3)
+        f3.createVariable('Y', 'f', ('ROW',))
+        mf.addfile(f3)
+        self.assert_(mf.variables['Y'] is f3.variables['Y'])
+        # children that change are reindexed on the next lookup
+        f3.createVariable('Z', 'f', ('ROW',))
+        self.assert_(mf.variables['Z'] is f3.variables['Z'])
+        self.assert_('Z' in mf.variables.keys())
+        f3.NEWATTR = 1
+        self.assertEqual(mf.NEWATTR, 1)
+
+    def testConcat(self):
+        from numpy import concatenate
+        mf = file_master(self.files, concatdim = 'TSTEP')
+        self.assertEqual(len(mf.dimensions['TSTEP']), 9)
+        o3 = mf.variables['O3']
+        expected = concatenate([f.variables['O3'][:] for f in self.files])
+        self.assertEqual(o3.shape, (9, 3))
+        self.assert_((o3[:] == expected).all())
+        self.assert_((o3[3:6, 1] == expected[3:6, 1]).all())
+        self.assert_((o3[[8, 0, 4]] == expected[[8, 0, 4]]).all())
+        self.assertEqual(o3[-1, 2], expected[-1, 2])
+        self.assertEqual(o3.units, 'ppb')
+        self.assertEqual(mf.variables['TFLAG'][:, 0, 1].tolist(), [0, 10000, 100000, 110000, 120000, 200000, 210000, 220000, 230000])
+        self.assert_(mf.variables['X1'] is self.files[1].variables['X1'])
+
+    def testConcatMissing(self):
+        from numpy import arange
+        from numpy.ma import is_masked
+        f0, f1, f2 = self.files
+        f0.createVariable('NO2', 'f', ('TSTEP', 'ROW'))[:] = 1
+        f2.createVariable('NO2', 'f', ('TSTEP', 'ROW'))[:] = 3
+        f1.createVariable('SO2', 'f', ('TSTEP', 'ROW'))[:] = arange(9).reshape(3, 3)
+        mf = file_master(self.files, concatdim = 'TSTEP')
+        no2 = mf.variables['NO2'][:]
+        self.assertEqual(no2.shape, (9, 3))
+        self.assertEqual(no2.mask[:, 0].tolist(), [False] * 2 + [True] * 3 + [False] * 4)
+        self.assertEqual(no2[[0, 5, 8], 0].tolist(), [1, 3, 3])
+        self.assert_(is_masked(mf.variables['NO2'][3, 1]))
+        so2 = mf.variables['SO2']
+        self.assertEqual(so2.shape, (9, 3))
+        self.assertEqual(so2[:, 1].tolist(), [None] * 2 + [1, 4, 7] + [None] * 4)
+
+if __name__ == '__main__':
+    unittest.main()
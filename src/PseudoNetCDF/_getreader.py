@@ -3,6 +3,7 @@ __all__ = ['getreader']
 import os
 from warnings import warn
 from PseudoNetCDF.netcdf import NetCDFFile
+from PseudoNetCDF import _profile
 
 _readers = [('netcdf', NetCDFFile)]
 def testreader(reader, *args, **kwds):
@@ -12,23 +13,51 @@ def testreader(reader, *args, **kwds):
     except:
         return False
 
+def _catalogreader(catalog, path):
+    """
+    Reader recorded for path in catalog (Catalog or database path) or None
+    """
+    from .pnccatalog import Catalog
+    if not isinstance(catalog, Catalog):
+        with Catalog(catalog) as cat:
+            return cat.reader(path)
+    return catalog.reader(path)
+
 def getreader(*args, **kwds):
+    """
+    Return the first reader that can open args[0] (with kwds)
+
+    catalog - pnccatalog.Catalog (or its database path); a reader
+              recorded for an unchanged file is returned without sniffing
+    """
     global _readers
+    catalog = kwds.pop('catalog', None)
     if not os.path.isfile(args[0]):
         warn('The first argument (%s) does not exist as a file.  First arguments are usually paths' % (args[0],))
-    
-    for rn, reader in _readers:
-        if getattr(reader, 'isMine', lambda *args, **kwds: testreader(reader, *args, **kwds))(*args, **kwds):
+    elif catalog is not None:
+        reader = _catalogreader(catalog, args[0])
+        if reader is not None:
             return reader
-    else:
-        raise TypeError('No reader could open a file with these arguments %s %s' % (args, kwds))
+    
+    with _profile.stage('sniff'):
+        for rn, reader in _readers:
+            try:
+                ismine = getattr(reader, 'isMine', lambda *args, **kwds: testreader(reader, *args, **kwds))(*args, **kwds)
+            except Exception:
+                # e.g., a file too short for the reader's header
+                ismine = False
+            if ismine:
+                return reader
+        else:
+            raise TypeError('No reader could open a file with these arguments %s %s' % (args, kwds))
 
 def registerreader(name, reader):
     global _readers
     _readers.insert(0, (name, reader))
 
 def anyfile(*args, **kwds):
-    return getreader(*args, **kwds)(*args, **kwds)
+    catalog = kwds.pop('catalog', None)
+    return getreader(*args, catalog = catalog, **kwds)(*args, **kwds)
 
 def getreaderdict():
     return dict(_readers)
\ No newline at end of file
@@ -0,0 +1,483 @@
+from __future__ import print_function
+__all__ = ['pmap', 'njobs', 'packfile', 'unpackfile', 'spillfile', 'SharedStore', 'openshared']
+__doc__ = """
+Process-pool execution for pncparse (--jobs)
+
+pmap runs a function that returns files (PseudoNetCDFFile or lists of
+them) in a process pool. Results come back in submission order and only
+a bounded number of results are in flight at a time. Files are returned
+either in memory (packfile/unpackfile convert a file to plain arrays
+and properties that can be pickled), spilled to temporary NetCDF files
+(spillfile) that the parent opens and reads on demand, or through
+shared memory (SharedStore/openshared).
+
+Shared files are small picklable descriptions: variables that are
+views of a memmap are described by file name, offset, dtype, shape and
+strides, and other arrays are copied once into shared memory segments
+(multiprocessing.shared_memory, or files in /dev/shm on Pythons without
+it). openshared rebuilds a PseudoNetCDFFile whose variables are views
+of those mappings, so nothing is copied through pipes:
+
+    with SharedStore() as store:
+        shared = store.share(f)
+        pool.map(work, [(shared, site) for site in sites])
+
+    def work(shared, site):
+        f = openshared(shared)
+        ...
+
+The store owns the segments and unlinks them when it is closed. A
+segment stays mapped in each process until the last array viewing it
+is released.
+"""
+import os
+import unittest
+import atexit
+import mmap
+import weakref
+from collections import deque
+from shutil import rmtree
+from tempfile import mkdtemp, mkstemp, gettempdir
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import _posixshmem
+except ImportError:
+    _posixshmem = None
+
+def njobs(args):
+    """
+    Number of processes requested by args.jobs; 0 or less is one per core
+    """
+    jobs = getattr(args, 'jobs', 1)
+    if jobs <= 0:
+        from multiprocessing import cpu_count
+        jobs = cpu_count()
+    return jobs
+
+def packfile(f):
+    """
+    Convert f to a dictionary of plain python and numpy objects
+    that can be pickled
+    """
+    out = dict(attrs = [(k, getattr(f, k)) for k in f.ncattrs()])
+    out['dimensions'] = [(dk, len(dv), dv.isunlimited()) for dk, dv in f.dimensions.items()]
+    variables = []
+    for vk in f.variables.keys():
+        var = f.variables[vk]
+        vals = var[...]
+        # variable subclasses do not pickle; send base arrays
+        if isinstance(vals, np.ma.MaskedArray):
+            vals = np.ma.MaskedArray(np.ma.getdata(vals).view(np.ndarray), mask = np.ma.getmaskarray(vals), fill_value = vals.fill_value)
+        else:
+            vals = np.asarray(vals).view(np.ndarray)
+        props = [(pk, getattr(var, pk)) for pk in var.ncattrs()]
+        variables.append((vk, tuple(var.dimensions), props, vals))
+    out['variables'] = variables
+    return out
+
+def unpackfile(packed):
+    """
+    Rebuild a PseudoNetCDFFile from packfile output
+    """
+    from .sci_var import PseudoNetCDFFile
+    f = PseudoNetCDFFile()
+    for dk, dl, unlim in packed['dimensions']:
+        f.createDimension(dk, dl).setunlimited(unlim)
+    for pk, pv in packed['attrs']:
+        setattr(f, pk, pv)
+    for vk, dims, props, vals in packed['variables']:
+        propd = dict(props)
+        if 'values' in propd:
+            propd['pvalues'] = propd.pop('values')
+        if isinstance(vals, np.ma.MaskedArray):
+            propd.setdefault('fill_value', vals.fill_value)
+        f.createVariable(vk, vals.dtype.char, dims, values = vals, **propd)
+    return f
+
+def spillfile(f, tmpdir):
+    """
+    Write f to a new NetCDF file in tmpdir and return its path
+    """
+    from tempfile import mkstemp
+    from .pncgen import Pseudo2NetCDF
+    fd, path = mkstemp(suffix = '.nc', dir = tmpdir)
+    os.close(fd)
+    Pseudo2NetCDF(verbose = 0).convert(f, path, format = 'NETCDF4').close()
+    return path
+
+def _openspill(path):
+    from .netcdf import NetCDFFile
+    return NetCDFFile(path, 'r')
+
+_shmdir = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else gettempdir()
+
+def _untrack(shm):
+    """
+    Stop the resource tracker of this process from unlinking shm when
+    the process exits; the owning SharedStore (or openshared adopt)
+    unlinks it with _Segment.unlink, which does not unregister again
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+class _Segment(object):
+    """
+    Named block of shared memory; created when name is None and attached
+    otherwise
+    """
+    def __init__(self, name = None, nbytes = 0):
+        create = name is None
+        nbytes = max(1, nbytes)
+        if shared_memory is not None:
+            self._shm = shared_memory.SharedMemory(name = name, create = create, size = nbytes if create else 0)
+            _untrack(self._shm)
+            self.name = self._shm.name
+            self.buffer = self._shm.buf
+        else:
+            if create:
+                fd, name = mkstemp(prefix = 'pncshm', dir = _shmdir)
+                os.close(fd)
+                self.buffer = np.memmap(name, dtype = 'u1', mode = 'w+', shape = (nbytes,))
+            else:
+                self.buffer = np.memmap(name, dtype = 'u1', mode = 'r+')
+            self.name = name
+
+    def array(self, dtype, shape):
+        """
+        Array view of the segment; the view keeps the segment mapped
+        """
+        return np.asarray(_Pinned(self, np.ndarray(shape, dtype = dtype, buffer = self.buffer)))
+
+    def unlink(self):
+        """
+        Remove the name of the segment; mappings stay valid
+        """
+        try:
+            if shared_memory is not None:
+                # SharedMemory.unlink would unregister from the resource
+                # tracker a second time (see _untrack)
+                if _posixshmem is not None:
+                    _posixshmem.shm_unlink(self._shm._name)
+            else:
+                os.remove(self.name)
+        except (OSError, IOError):
+            pass
+
+class _Pinned(object):
+    """
+    Base object for segment views; numpy does not hold the buffer of
+    SharedMemory.buf, so without it the mapping could be closed (when
+    the segment is garbage collected) under a live view
+    """
+    def __init__(self, segment, view):
+        self.segment = segment
+        self.view = view
+        self.__array_interface__ = view.__array_interface__
+
+def _unlinksegments(segments):
+    for seg in segments:
+        seg.unlink()
+
+def _memmapspec(vals):
+    """
+    ('memmap', filename, offset, dtype, shape, strides) if vals is a view
+    of a file-backed memmap with non-negative strides; otherwise None
+    """
+    base = vals
+    while base is not None and not (isinstance(base, np.memmap) and getattr(base, '_mmap', None) is not None and getattr(base, 'filename', None) is not None):
+        base = getattr(base, 'base', None)
+    if base is None or vals.size == 0 or any([st < 0 for st in vals.strides]):
+        return None
+    # numpy maps from offset rounded down to the allocation granularity
+    mmapstart = base.offset - base.offset % mmap.ALLOCATIONGRANULARITY
+    mmapaddr = np.frombuffer(base._mmap, dtype = 'u1').__array_interface__['data'][0]
+    offset = vals.__array_interface__['data'][0] - mmapaddr + mmapstart
+    return ('memmap', base.filename, int(offset), vals.dtype.str, vals.shape, vals.strides)
+
+def _openspec(spec, segments):
+    kind = spec[0]
+    if kind == 'memmap':
+        filename, offset, dtype, shape, strides = spec[1:]
+        dtype = np.dtype(dtype)
+        span = sum([(l - 1) * st for l, st in zip(shape, strides)]) + dtype.itemsize
+        region = np.memmap(filename, dtype = 'u1', mode = 'r', offset = offset, shape = (span,))
+        return np.ndarray(shape, dtype = dtype, buffer = region, strides = strides)
+    name, dtype, shape = spec[1:]
+    if name not in segments:
+        segments[name] = _Segment(name)
+    return segments[name].array(np.dtype(dtype), shape)
+
+class SharedStore(object):
+    """
+    Owner of the shared memory segments of shared files (see share);
+    close (or the end of a with block) unlinks them. Processes that have
+    already opened a shared file keep their views; new processes cannot
+    open it after close.
+    """
+    def __init__(self):
+        self.segments = []
+
+    def _copy(self, vals):
+        seg = _Segment(nbytes = vals.nbytes)
+        self.segments.append(seg)
+        seg.array(vals.dtype, vals.shape)[...] = vals
+        return ('shared', seg.name, vals.dtype.str, vals.shape)
+
+    def share(self, f, memmaps = True):
+        """
+        Return a picklable description of f for openshared
+
+        memmaps - describe variables that are views of file-backed
+                  memmaps by file and offset instead of copying them
+        """
+        out = dict(attrs = [(k, getattr(f, k)) for k in f.ncattrs()])
+        out['dimensions'] = [(dk, len(dv), dv.isunlimited()) for dk, dv in f.dimensions.items()]
+        variables = []
+        for vk in f.variables.keys():
+            var = f.variables[vk]
+            vals = var[...] if not isinstance(var, np.ndarray) else var
+            props = [(pk, getattr(var, pk)) for pk in var.ncattrs()]
+            maskspec = None
+            if isinstance(vals, np.ma.MaskedArray):
+                mask = np.ma.getmaskarray(vals)
+                if mask.any():
+                    maskspec = self._copy(mask)
+                props.append(('fill_value', vals.fill_value))
+            data = np.ma.getdata(vals)
+            spec = _memmapspec(data) if memmaps else None
+            if spec is None:
+                spec = self._copy(np.asarray(data))
+            variables.append((vk, tuple(var.dimensions), props, spec, maskspec))
+        out['variables'] = variables
+        return out
+
+    def release(self):
+        """
+        Forget the segments without unlinking them (e.g., when another
+        process adopts them with openshared(..., adopt = True))
+        """
+        self.segments = []
+
+    def close(self):
+        for seg in self.segments:
+            seg.unlink()
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def openshared(shared, adopt = False):
+    """
+    Rebuild a PseudoNetCDFFile from SharedStore.share output; variables
+    are views of the shared segments or memmapped files
+
+    adopt - unlink the segments when the rebuilt file is released or
+            this process exits, whichever comes first (for files whose
+            store was released by another process)
+    """
+    from .sci_var import PseudoNetCDFFile
+    f = PseudoNetCDFFile()
+    segments = {}
+    for dk, dl, unlim in shared['dimensions']:
+        f.createDimension(dk, dl).setunlimited(unlim)
+    for pk, pv in shared['attrs']:
+        setattr(f, pk, pv)
+    for vk, dims, props, spec, maskspec in shared['variables']:
+        propd = dict(props)
+        if 'values' in propd:
+            propd['pvalues'] = propd.pop('values')
+        vals = _openspec(spec, segments)
+        if maskspec is not None:
+            vals = np.ma.MaskedArray(vals, mask = _openspec(maskspec, segments), copy = False)
+        elif 'fill_value' in propd:
+            vals = np.ma.MaskedArray(vals, copy = False)
+        f.createVariable(vk, vals.dtype.char, dims, values = vals, **propd)
+    # views keep the mappings open until they are released
+    if adopt:
+        weakref.finalize(f, _unlinksegments, list(segments.values()))
+    return f
+
+def _runjob(func, args, tmpdir, shared = False):
+    """
+    Run func(*args) in a worker and package its files for the parent
+    """
+    result = func(*args)
+    islist = isinstance(result, (list, tuple))
+    files = list(result) if islist else [result]
+    if shared:
+        store = SharedStore()
+        packed = [('shared', store.share(f)) for f in files]
+        # the parent adopts the segments
+        store.release()
+    elif tmpdir is None:
+        packed = [('memory', packfile(f)) for f in files]
+    else:
+        packed = [('spill', spillfile(f, tmpdir)) for f in files]
+    return islist, packed
+
+def _receive(job):
+    islist, packed = job
+    opener = dict(memory = unpackfile, spill = _openspill, shared = lambda v: openshared(v, adopt = True))
+    files = [opener[kind](v) for kind, v in packed]
+    return files if islist else files[0]
+
+_spilldirs = []
+@atexit.register
+def _cleanspill():
+    for tmpdir in _spilldirs:
+        rmtree(tmpdir, ignore_errors = True)
+
+def pmap(func, argslist, jobs, spill = False, maxinflight = None, shared = False):
+    """
+    Return [func(*args) for args in argslist] computed in a pool of jobs
+    processes
+
+    func - module level function that returns a file or list of files
+    argslist - sequence of argument tuples
+    jobs - number of processes
+    spill - return files as temporary NetCDF files (removed at exit)
+            instead of in memory
+    maxinflight - results submitted but not yet received (default
+                  2 * jobs); bounds memory held by the pool
+    shared - return files through shared memory segments (unlinked when
+             the returned file is released) and memmap descriptors
+             instead of pickled arrays
+
+    Order of the output matches argslist.
+    """
+    from multiprocessing import Pool
+    if maxinflight is None:
+        maxinflight = 2 * jobs
+    tmpdir = None
+    if spill:
+        tmpdir = mkdtemp(prefix = 'pncjobs')
+        _spilldirs.append(tmpdir)
+    results = []
+    pending = deque()
+    pool = Pool(jobs)
+    try:
+        for args in argslist:
+            pending.append(pool.apply_async(_runjob, (func, args, tmpdir, shared)))
+            if len(pending) >= maxinflight:
+                results.append(_receive(pending.popleft().get()))
+        while len(pending) > 0:
+            results.append(_receive(pending.popleft().get()))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def _testfile(n):
+    from .sci_var import PseudoNetCDFFile
+    f = PseudoNetCDFFile()
+    f.createDimension('time', n).setunlimited(True)
+    f.createDimension('x', 3)
+    f.title = 'file %d' % n
+    v = f.createVariable('O3', 'f', ('time', 'x'))
+    v.units = 'ppb'
+    v[:] = np.arange(n * 3).reshape(n, 3)
+    m = f.createVariable('NO2', 'f', ('time', 'x'), fill_value = -999.)
+    m[:] = np.ma.masked_less(np.arange(n * 3).reshape(n, 3), 2)
+    return f
+
+def _sharedsum(shared, vk):
+    return float(openshared(shared).variables[vk][:].sum())
+
+class TestParallel(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def testPack(self):
+        f = _testfile(4)
+        g = unpackfile(packfile(f))
+        self.assertEqual(g.title, 'file 4')
+        self.assert_(g.dimensions['time'].isunlimited())
+        self.assertEqual(g.variables['O3'].units, 'ppb')
+        self.assertEqual(g.variables['O3'].dimensions, ('time', 'x'))
+        self.assert_((g.variables['O3'][:] == f.variables['O3'][:]).all())
+        self.assert_((g.variables['NO2'][:].mask == f.variables['NO2'][:].mask).all())
+
+    def testShared(self):
+        from multiprocessing import Pool
+        f = _testfile(4)
+        with SharedStore() as store:
+            shared = store.share(f)
+            g = openshared(shared)
+            self.assertEqual(g.title, 'file 4')
+            self.assert_(g.dimensions['time'].isunlimited())
+            self.assertEqual(g.variables['O3'].units, 'ppb')
+            np.testing.assert_equal(g.variables['O3'][:], f.variables['O3'][:])
+            np.testing.assert_equal(g.variables['NO2'][:].mask, f.variables['NO2'][:].mask)
+            # views of one segment
+            openshared(shared).variables['O3'][0, 0] = 100
+            self.assertEqual(g.variables['O3'][0, 0], 100)
+            pool = Pool(2)
+            try:
+                sums = pool.starmap(_sharedsum, [(shared, 'O3'), (shared, 'NO2')])
+            finally:
+                pool.close()
+                pool.join()
+            self.assertEqual(sums, [float(g.variables['O3'][:].sum()), float(g.variables['NO2'][:].sum())])
+
+    def testAdopt(self):
+        import gc
+        f = _testfile(3)
+        store = SharedStore()
+        shared = store.share(f)
+        names = [seg.name for seg in store.segments]
+        store.release()
+        g = openshared(shared, adopt = True)
+        # an attachment that outlives the file (and its own segment)
+        o3 = _openspec([spec for vk, dims, props, spec, maskspec in shared['variables'] if vk == 'O3'][0], {})
+        del g
+        gc.collect()
+        for name in names:
+            self.assertRaises(OSError, _Segment, name)
+        np.testing.assert_equal(o3, f.variables['O3'][:])
+
+    def testSharedMemmap(self):
+        from .benchmarks._synthetic import make_uamiv
+        from .camxfiles.uamiv.Memmap import uamiv
+        tmpdir = mkdtemp()
+        try:
+            f = uamiv(make_uamiv(os.path.join(tmpdir, 'test.uamiv'), ntimes = 3, nlays = 2, nrows = 4, ncols = 5))
+            with SharedStore() as store:
+                shared = store.share(f)
+                kinds = dict([(vk, spec[0]) for vk, dims, props, spec, maskspec in shared['variables']])
+                self.assertEqual(kinds['O3'], 'memmap')
+                self.assertEqual(len(store.segments), len([k for k in kinds.values() if k == 'shared']))
+                g = openshared(shared)
+                for vk in f.variables.keys():
+                    np.testing.assert_equal(g.variables[vk][...], f.variables[vk][...])
+                self.assertEqual(g.variables['O3'].dimensions, f.variables['O3'].dimensions)
+                self.assertEqual(g.NCOLS, f.NCOLS)
+        finally:
+            rmtree(tmpdir)
+
+    def testPmap(self):
+        fs = pmap(_testfile, [(n,) for n in range(1, 4)], jobs = 2, shared = True)
+        self.assertEqual([f.title for f in fs], ['file %d' % n for n in range(1, 4)])
+        np.testing.assert_equal(fs[-1].variables['O3'][:], np.arange(9).reshape(3, 3))
+        self.assertEqual(np.ma.getmaskarray(fs[-1].variables['NO2'][:]).sum(), 2)
+        for spill in (False, True):
+            fs = pmap(_testfile, [(n,) for n in range(1, 6)], jobs = 2, spill = spill, maxinflight = 2)
+            self.assertEqual([len(f.dimensions['time']) for f in fs], [1, 2, 3, 4, 5])
+            self.assertEqual([f.title for f in fs], ['file %d' % n for n in range(1, 6)])
+            self.assert_((fs[-1].variables['O3'][:] == np.arange(15).reshape(5, 3)).all())
+            self.assertEqual(np.ma.getmaskarray(fs[-1].variables['NO2'][:]).sum(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
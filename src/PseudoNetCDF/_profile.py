@@ -0,0 +1,287 @@
+from __future__ import print_function
+__all__ = ['Profiler', 'stage', 'start', 'finish', 'getprofiler']
+__doc__ = """
+Instrumentation for the pnc* pipeline (--profile)
+
+When a Profiler is active, pncparse records wall time, calls and
+resident memory growth for each stage (sniffing and opening inputs,
+variable selection, masks, conventions, subsetting functions, binary
+operations, expressions and writing), how often and how long each
+variable is materialized (PseudoNetCDFVariables) and byte counts. The
+report is written as JSON or CSV (by extension) and optionally with a
+cProfile dump.
+
+Byte counts (bytes section of the report):
+
+    memmap_views - sizes of materialized variables that are views of a
+                   memmap; pages are read when used, so this is an upper
+                   bound on what was read from disk, not a measurement
+    read - sizes of other materialized variables
+    written - bytes written to outputs
+    input_files - sizes of input files
+
+When no Profiler is active, stage returns a shared do-nothing context,
+so instrumented code costs one function call per stage.
+
+Stages run in --jobs worker processes are not included.
+"""
+import os
+import sys
+import time
+import json
+import atexit
+import unittest
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_active = None
+
+def _rss():
+    """
+    Resident set size in bytes (0 if unavailable)
+    """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return 0
+
+def _peakrss():
+    """
+    Peak resident set size in bytes (0 if unavailable)
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on darwin and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _ismemmap(values):
+    base = values
+    while base is not None:
+        if isinstance(base, np.memmap):
+            return True
+        base = getattr(base, 'base', None)
+    return False
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_nostage = _NoStage()
+
+class _Stage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.rss = _rss()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        record = self.profiler.stages.setdefault(self.name, OrderedDict([('calls', 0), ('wall', 0.), ('rss_growth', 0)]))
+        record['calls'] += 1
+        record['wall'] += time.time() - self.start
+        record['rss_growth'] += max(0, _rss() - self.rss)
+        return False
+
+class Profiler(object):
+    """
+    Profiler collects stage timings, variable materialization and byte
+    counts for one pnc* run
+
+    path - report path (.json or .csv); None keeps the report in memory
+    cprofile - path for a cProfile (pstats) dump or None
+    """
+    def __init__(self, path = None, cprofile = None):
+        self.path = path
+        self.cprofile = cprofile
+        self.stages = OrderedDict()
+        self.variables = OrderedDict()
+        self.bytes = OrderedDict([('memmap_views', 0), ('read', 0), ('written', 0), ('input_files', 0)])
+        self.start = time.time()
+        self._cprofiler = None
+        if cprofile is not None:
+            from cProfile import Profile
+            self._cprofiler = Profile()
+            self._cprofiler.enable()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def addinput(self, path):
+        """
+        Record the size of an input path
+        """
+        try:
+            self.bytes['input_files'] += os.path.getsize(path)
+        except (OSError, TypeError):
+            pass
+
+    def addwritten(self, nbytes):
+        self.bytes['written'] += nbytes
+
+    def materialized(self, key, values, wall):
+        """
+        Record that variable key was built in wall seconds; its size is
+        counted as memmap_views when values is a view of a memmap (the
+        pages actually read are not known) and as read otherwise
+        """
+        record = self.variables.setdefault(key, OrderedDict([('count', 0), ('wall', 0.), ('nbytes', 0)]))
+        nbytes = getattr(values, 'nbytes', 0)
+        record['count'] += 1
+        record['wall'] += wall
+        record['nbytes'] += nbytes
+        if _ismemmap(values):
+            self.bytes['memmap_views'] += nbytes
+        else:
+            self.bytes['read'] += nbytes
+
+    def report(self):
+        """
+        Report as an OrderedDict of total wall time, peak RSS, byte
+        counts, stages and variables
+        """
+        out = OrderedDict()
+        out['wall'] = time.time() - self.start
+        out['peak_rss'] = _peakrss()
+        out['bytes'] = self.bytes
+        out['stages'] = self.stages
+        out['variables'] = self.variables
+        return out
+
+    def _csvrows(self, report):
+        yield ['section', 'name', 'calls', 'wall', 'bytes']
+        yield ['total', 'wall', 1, report['wall'], '']
+        yield ['total', 'peak_rss', '', '', report['peak_rss']]
+        for bk, bv in report['bytes'].items():
+            yield ['bytes', bk, '', '', bv]
+        for sk, sv in report['stages'].items():
+            yield ['stage', sk, sv['calls'], sv['wall'], sv['rss_growth']]
+        for vk, vv in report['variables'].items():
+            yield ['variable', vk, vv['count'], vv['wall'], vv['nbytes']]
+
+    def write(self, path = None):
+        """
+        Write the report to path (default self.path); .csv paths are
+        written as CSV and all others as JSON
+        """
+        path = path or self.path
+        report = self.report()
+        if self._cprofiler is not None:
+            self._cprofiler.disable()
+            self._cprofiler.dump_stats(self.cprofile)
+        if path is None:
+            return report
+        if path.endswith('.csv'):
+            import csv
+            with open(path, 'w') as outf:
+                csv.writer(outf).writerows(self._csvrows(report))
+        else:
+            with open(path, 'w') as outf:
+                json.dump(report, outf, indent = 2)
+        return report
+
+def getprofiler():
+    """
+    The active Profiler or None
+    """
+    return _active
+
+def stage(name):
+    """
+    Context manager timing stage name when a Profiler is active
+    """
+    if _active is None:
+        return _nostage
+    return _active.stage(name)
+
+def start(path = None, cprofile = None):
+    """
+    Activate a Profiler (unless one is active) and return it; the report
+    is written by finish or at exit
+    """
+    global _active
+    if _active is None:
+        _active = Profiler(path = path, cprofile = cprofile)
+    return _active
+
+@atexit.register
+def finish():
+    """
+    Write the active Profiler's report, deactivate it and return the
+    report (None when no Profiler is active)
+    """
+    global _active
+    if _active is None:
+        return None
+    profiler, _active = _active, None
+    return profiler.write()
+
+class TestProfile(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def tearDown(self):
+        global _active
+        _active = None
+
+    def testInactive(self):
+        self.assert_(stage('open') is _nostage)
+        self.assertEqual(finish(), None)
+
+    def testReport(self):
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from .sci_var import PseudoNetCDFFile, PseudoNetCDFVariables
+        tmpdir = mkdtemp()
+        try:
+            mpath = os.path.join(tmpdir, 'data.bin')
+            np.arange(10, dtype = 'f').tofile(mpath)
+            profiler = start(os.path.join(tmpdir, 'profile.csv'), cprofile = os.path.join(tmpdir, 'profile.pstats'))
+            profiler.addinput(mpath)
+            f = PseudoNetCDFFile()
+            f.createDimension('x', 10)
+            def getvar(k):
+                vals = np.memmap(mpath, dtype = 'f', mode = 'r') if k == 'M' else np.zeros(10, dtype = 'd')
+                return f.createVariable(k, vals.dtype.char, ('x',), values = vals)
+            f.variables = PseudoNetCDFVariables(getvar, ['M', 'Z'])
+            with stage('select'):
+                f.variables['M']
+                f.variables['Z']
+            report = finish()
+            self.assertEqual(report['stages']['select']['calls'], 1)
+            self.assertEqual(report['variables']['M']['count'], 1)
+            self.assertEqual(report['bytes']['memmap_views'], 40)
+            self.assertEqual(report['bytes']['read'], 80)
+            self.assertEqual(report['bytes']['input_files'], 40)
+            self.assert_(os.path.exists(os.path.join(tmpdir, 'profile.pstats')))
+            lines = open(os.path.join(tmpdir, 'profile.csv')).read().split()
+            self.assertEqual(lines[0], 'section,name,calls,wall,bytes')
+            self.assert_(any([line.startswith('variable,Z,1,') for line in lines]))
+        finally:
+            rmtree(tmpdir)
+
+    def testArgs(self):
+        from argparse import ArgumentParser
+        from .pncparse import add_basic_options
+        parser = ArgumentParser(add_help = False)
+        add_basic_options(parser)
+        args = parser.parse_args(['--profile', 'in.nc', 'out.nc'])
+        self.assertEqual(args.ifiles, ['in.nc', 'out.nc'])
+        self.assertEqual((args.profile, args.profile_path), (True, 'pncprofile.json'))
+        args = parser.parse_args(['--profile', '--profile-path', 'p.csv', 'in.nc'])
+        self.assertEqual((args.ifiles, args.profile_path), (['in.nc'], 'p.csv'))
+        self.assert_(not parser.parse_args(['in.nc']).profile)
+
+if __name__ == '__main__':
+    unittest.main()
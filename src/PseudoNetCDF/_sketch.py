@@ -0,0 +1,186 @@
+from __future__ import print_function
+__all__ = ['QuantileSketch', 'sketch']
+__doc__ = """
+Mergeable quantile sketches
+
+QuantileSketch keeps values exactly until there are more than exactsize
+of them and then becomes a KLL sketch: values are kept in levels where
+each value at level h stands for 2**h inputs, and a full level is
+compacted by sorting it and promoting every other value to the next
+level. Memory is bounded by about 3 * k values and the rank error is
+roughly 2 / k (k = 1024 is about 0.2%), however many values are added.
+
+Sketches can be fed chunk by chunk, merged (e.g., across files or from
+worker processes; sketches pickle), and queried for percentiles:
+
+    sk = sketch(ifile.variables['O3'])
+    sk.merge(sketch(otherfile.variables['O3']))
+    sk.percentile([5, 50, 95]); sk.vmin; sk.vmax; sk.n
+"""
+import unittest
+import numpy as np
+
+chunkbytes = 2**26
+
+class QuantileSketch(object):
+    """
+    Approximate (exact for small inputs) percentiles of values added in
+    batches; masked and non-finite values are ignored
+
+    k - sketch size; rank error is roughly 2 / k
+    exactsize - values kept exactly before compacting
+    seed - seed for the random choices of compaction
+    """
+    def __init__(self, k = 1024, exactsize = 2**16, seed = 0):
+        self.k = k
+        self.exactsize = exactsize
+        self.levels = [np.array([], dtype = 'd')]
+        self.n = 0
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.exact = True
+        self._rs = np.random.RandomState(seed)
+
+    def _capacity(self, h):
+        return max(8, int(self.k * (2. / 3.) ** (len(self.levels) - 1 - h)))
+
+    def _compress(self):
+        if self.exact:
+            if self.levels[0].size <= self.exactsize and len(self.levels) == 1:
+                return
+            self.exact = False
+        h = 0
+        while h < len(self.levels):
+            vals = self.levels[h]
+            if vals.size > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.array([], dtype = 'd'))
+                vals = np.sort(vals)
+                held = vals[:0]
+                if vals.size % 2 == 1:
+                    # an odd value out stays at this level
+                    hi = self._rs.randint(vals.size)
+                    held = vals[hi:hi + 1]
+                    vals = np.delete(vals, hi)
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], vals[self._rs.randint(2)::2]])
+                self.levels[h] = held
+            h += 1
+
+    def add(self, values):
+        """
+        values - array or masked array (any shape)
+        """
+        values = np.asarray(np.ma.compressed(np.ma.masked_invalid(values)), dtype = 'd')
+        if values.size == 0:
+            return self
+        self.n += values.size
+        self.vmin = min(self.vmin, values.min())
+        self.vmax = max(self.vmax, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Add the values summarized by other (a QuantileSketch)
+        """
+        for h, vals in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.array([], dtype = 'd'))
+            self.levels[h] = np.concatenate([self.levels[h], vals])
+        self.n += other.n
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        self.exact = self.exact and other.exact
+        self._compress()
+        return self
+
+    def percentile(self, q):
+        """
+        q - percentile or array of percentiles (0-100); nan when empty
+        """
+        q = np.asarray(q, dtype = 'd')
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        if self.exact:
+            return np.percentile(self.levels[0], q)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(vals.size, 2. ** h) for h, vals in enumerate(self.levels)])
+        order = np.argsort(items, kind = 'mergesort')
+        items = items[order]
+        weights = weights[order]
+        # each item sits at the middle of the ranks it stands for
+        pct = (np.cumsum(weights) - weights / 2.) / weights.sum() * 100.
+        out = np.interp(q, np.concatenate([[0.], pct, [100.]]), np.concatenate([[self.vmin], items, [self.vmax]]))
+        return out
+
+def sketch(var, axis = 0, chunksize = None, out = None, **kwds):
+    """
+    QuantileSketch of var (array, variable or lazy memmap) read chunksize
+    elements of axis at a time (default: about chunkbytes per chunk)
+
+    out - sketch to add to (default: new QuantileSketch(**kwds))
+    """
+    if out is None:
+        out = QuantileSketch(**kwds)
+    shape = tuple(var.shape)
+    if len(shape) == 0:
+        return out.add(var[...])
+    if chunksize is None:
+        rowbytes = np.dtype(getattr(var, 'dtype', 'd')).itemsize * int(np.prod(shape)) // max(1, shape[axis])
+        chunksize = max(1, chunkbytes // max(1, rowbytes))
+    for start in range(0, shape[axis], chunksize):
+        out.add(var[(slice(None),) * axis + (slice(start, start + chunksize),)])
+    return out
+
+class TestSketch(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        rs = np.random.RandomState(1)
+        self.values = rs.lognormal(size = 400000)
+
+    def _rankerror(self, sk, values, q):
+        svals = np.sort(values)
+        ranks = np.searchsorted(svals, sk.percentile(q)) / float(svals.size) * 100
+        return np.abs(ranks - q).max()
+
+    def testExact(self):
+        vals = np.ma.masked_greater(self.values[:1000].reshape(10, 100), 3)
+        sk = sketch(vals, chunksize = 3)
+        self.assert_(sk.exact)
+        q = [0, 10, 50, 99, 100]
+        np.testing.assert_allclose(sk.percentile(q), np.percentile(np.ma.compressed(vals), q))
+        self.assertEqual(sk.n, vals.count())
+        self.assert_(np.isnan(QuantileSketch().percentile([50])).all())
+
+    def testApproximate(self):
+        q = np.array([1, 10, 25, 50, 75, 90, 99.])
+        sk = QuantileSketch()
+        for chunk in np.array_split(self.values, 17):
+            sk.add(chunk)
+        self.assert_(not sk.exact)
+        self.assert_(sum([vals.size for vals in sk.levels]) < 4 * sk.k)
+        self.assertEqual(sk.n, self.values.size)
+        self.assert_(self._rankerror(sk, self.values, q) < .5)
+        self.assertEqual(sk.percentile(0), self.values.min())
+        self.assertEqual(sk.percentile(100), self.values.max())
+
+    def testMerge(self):
+        import pickle
+        q = np.array([5, 50, 95.])
+        half = self.values.size // 2
+        sk0 = sketch(self.values[:half])
+        sk1 = pickle.loads(pickle.dumps(sketch(self.values[half:] * 2)))
+        sk0.merge(sk1)
+        both = np.concatenate([self.values[:half], self.values[half:] * 2])
+        self.assertEqual(sk0.n, both.size)
+        self.assert_(self._rankerror(sk0, both, q) < .5)
+        small = sketch(self.values[:10])
+        small.merge(sketch(self.values[10:20]))
+        self.assert_(small.exact)
+        np.testing.assert_allclose(small.percentile(q), np.percentile(self.values[:20], q))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+from __future__ import print_function
+__all__ = ['SlabCache', 'Prefetcher', 'pyramid', 'decimatebounds']
+__doc__ = """
+Slab access for interactive viewers (pncview)
+
+    SlabCache - least recently used cache of decoded slabs
+                (ifile.variables[key][item]) bounded by bytes
+    Prefetcher - reads slabs (e.g., neighbouring time steps) into a
+                 SlabCache in a background thread
+    pyramid - min, max and mean of 2x2, 4x4, ... blocks of the last two
+              dimensions for drawing large grids at screen resolution
+    decimatebounds - cell edges of the blocks of a pyramid level
+
+Reads of a SlabCache hold SlabCache.readlock (a reentrant lock). Most
+readers are not thread safe, so code that reads a file directly while a
+Prefetcher may be reading it must hold the same lock:
+
+    with cache.readlock:
+        lat = ifile.variables['latitude'][:]
+"""
+import threading
+import unittest
+from collections import OrderedDict
+import numpy as np
+
+class SlabCache(object):
+    """
+    Least recently used cache of decoded slabs; slabs are evicted once
+    more than maxbytes are cached (the newest slab is always kept)
+
+    readlock - held while the cache reads a file
+    """
+    def __init__(self, maxbytes = 2**28):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.reads = 0
+        self._slabs = OrderedDict()
+        self._lock = threading.Lock()
+        self.readlock = threading.RLock()
+
+    def _key(self, ifile, varkey, item, name = None):
+        # slices are not hashable; the file is kept with the slab so its
+        # id is not reused while cached
+        return (id(ifile), varkey, repr(item), name)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._slabs.pop(key, None)
+            if entry is not None:
+                self._slabs[key] = entry
+                return entry[1]
+
+    def _store(self, key, ifile, vals):
+        with self._lock:
+            if key not in self._slabs:
+                self._slabs[key] = (ifile, vals)
+                self.nbytes += _nbytes(vals)
+            while self.nbytes > self.maxbytes and len(self._slabs) > 1:
+                oldkey, (oldfile, oldvals) = self._slabs.popitem(last = False)
+                self.nbytes -= _nbytes(oldvals)
+        return vals
+
+    def __contains__(self, key):
+        return self._key(*key) in self._slabs
+
+    def get(self, ifile, varkey, item = Ellipsis):
+        """
+        ifile.variables[varkey][item] as an array (read once)
+        """
+        key = self._key(ifile, varkey, item)
+        vals = self._lookup(key)
+        if vals is not None:
+            return vals
+        with self.readlock:
+            # a prefetch may have read it while this thread waited
+            vals = self._lookup(key)
+            if vals is not None:
+                return vals
+            vals = ifile.variables[varkey][item]
+            vals = vals.copy() if isinstance(vals, np.ma.MaskedArray) else np.array(vals)
+            self.reads += 1
+        return self._store(key, ifile, vals)
+
+    def derived(self, ifile, varkey, item, name, func):
+        """
+        func(slab) cached as name (e.g., a pyramid of the slab)
+        """
+        key = self._key(ifile, varkey, item, name)
+        out = self._lookup(key)
+        if out is None:
+            out = self._store(key, ifile, func(self.get(ifile, varkey, item)))
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._slabs.clear()
+            self.nbytes = 0
+
+def _nbytes(vals):
+    if isinstance(vals, (list, tuple)):
+        return sum([_nbytes(v) for v in vals])
+    if isinstance(vals, dict):
+        return sum([_nbytes(v) for v in vals.values()])
+    return getattr(vals, 'nbytes', 0)
+
+class Prefetcher(object):
+    """
+    Reads slabs into cache in a background (daemon) thread; each call to
+    prefetch replaces the requests still waiting, so only the
+    neighbours of the latest view are read
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self._pending = []
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def prefetch(self, ifile, requests):
+        """
+        requests - (varkey, item) pairs to read in order
+        """
+        with self._cond:
+            self._pending = [(ifile, varkey, item) for varkey, item in requests]
+            self._cond.notify_all()
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = 'pncprefetch')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                while len(self._pending) == 0:
+                    self._cond.wait()
+                ifile, varkey, item = self._pending.pop(0)
+                self._busy = True
+            try:
+                self.cache.get(ifile, varkey, item)
+            except Exception:
+                # prefetching is best effort; the viewer reports errors
+                pass
+
+    def wait(self):
+        """
+        Block until all requests have been read
+        """
+        with self._cond:
+            while len(self._pending) > 0 or self._busy:
+                self._cond.wait()
+
+def _blocks(vals, fill, func):
+    """
+    func of 2x2 blocks of the last two dimensions; odd edges are padded
+    with fill
+    """
+    ny, nx = vals.shape[-2:]
+    pad = [(0, 0)] * (vals.ndim - 2) + [(0, ny % 2), (0, nx % 2)]
+    vals = np.pad(vals, pad, mode = 'constant', constant_values = fill)
+    vals = vals.reshape(vals.shape[:-2] + (vals.shape[-2] // 2, 2, vals.shape[-1] // 2, 2))
+    return func(func(vals, axis = -1), axis = -2)
+
+def pyramid(values, maxcells = 1):
+    """
+    List of dictionaries (min, max, mean masked arrays and factor) for
+    2x2, 4x4, ... blocks of the last two dimensions of values until
+    neither is longer than maxcells; masked values are ignored and
+    partial blocks at the ends are kept
+    """
+    data = np.ma.getdata(values).astype('d')
+    mask = np.ma.getmaskarray(values)
+    total = np.where(mask, 0., data)
+    count = (~mask).astype('i8')
+    vmin = np.where(mask, np.inf, data)
+    vmax = np.where(mask, -np.inf, data)
+    levels = []
+    factor = 1
+    while max(total.shape[-2:]) > maxcells and max(total.shape[-2:]) > 1:
+        factor *= 2
+        total = _blocks(total, 0, np.sum)
+        count = _blocks(count, 0, np.sum)
+        vmin = _blocks(vmin, np.inf, np.min)
+        vmax = _blocks(vmax, -np.inf, np.max)
+        empty = count == 0
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            mean = np.ma.masked_where(empty, total / count)
+        levels.append(dict(factor = factor, mean = mean, min = np.ma.masked_where(empty, vmin), max = np.ma.masked_where(empty, vmax)))
+    return levels
+
+def decimatebounds(bounds, factor, axes = None):
+    """
+    Edges (0, factor, 2 * factor, ..., n) of bounds (n + 1 edges along
+    each of axes; default: all dimensions)
+    """
+    bounds = np.asarray(bounds)
+    if axes is None:
+        axes = range(bounds.ndim)
+    for axis in axes:
+        n = bounds.shape[axis] - 1
+        idx = np.arange(0, n, factor)
+        bounds = bounds.take(np.append(idx, n), axis = axis)
+    return bounds
+
+class TestSlabs(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from .core._files import PseudoNetCDFFile
+        f = PseudoNetCDFFile()
+        f.createDimension('time', 5)
+        f.createDimension('y', 9)
+        f.createDimension('x', 7)
+        vals = np.ma.masked_greater(np.arange(5 * 9 * 7.).reshape(5, 9, 7) % 11, 9)
+        f.createVariable('O3', 'f', ('time', 'y', 'x'), values = vals)
+        self.f = f
+
+    def testCache(self):
+        cache = SlabCache(maxbytes = 2 * 9 * 7 * 4)
+        item = (slice(1, 2),)
+        vals = cache.get(self.f, 'O3', item)
+        np.testing.assert_equal(vals, self.f.variables['O3'][1:2])
+        self.assert_(cache.get(self.f, 'O3', item) is vals)
+        self.assertEqual(cache.reads, 1)
+        cache.get(self.f, 'O3', (slice(2, 3),))
+        cache.get(self.f, 'O3', (slice(3, 4),))
+        self.assert_((self.f, 'O3', (slice(3, 4),)) in cache)
+        self.assert_((self.f, 'O3', item) not in cache)
+        self.assert_(cache.nbytes <= cache.maxbytes)
+        pyr = cache.derived(self.f, 'O3', item, 'pyramid', pyramid)
+        self.assert_(cache.derived(self.f, 'O3', item, 'pyramid', pyramid) is pyr)
+
+    def testPrefetch(self):
+        cache = SlabCache()
+        pf = Prefetcher(cache)
+        pf.prefetch(self.f, [('O3', (slice(t, t + 1),)) for t in range(5)])
+        pf.wait()
+        self.assertEqual(cache.reads, 5)
+        cache.get(self.f, 'O3', (slice(4, 5),))
+        self.assertEqual(cache.reads, 5)
+        pf.prefetch(self.f, [('NOPE', Ellipsis)])
+        pf.wait()
+        # direct reads under readlock exclude the prefetch thread
+        with cache.readlock:
+            pf.prefetch(self.f, [('O3', Ellipsis)])
+            self.f.variables['O3'][:]
+            cache.get(self.f, 'O3', (slice(0, 1),))
+            self.assertEqual(cache.reads, 5)
+        pf.wait()
+        self.assertEqual(cache.reads, 6)
+
+    def testPyramid(self):
+        vals = self.f.variables['O3'][:]
+        levels = pyramid(vals, maxcells = 2)
+        self.assertEqual([l['factor'] for l in levels], [2, 4, 8])
+        self.assertEqual(levels[0]['mean'].shape, (5, 5, 4))
+        for level in levels:
+            f = level['factor']
+            for j, i in [(0, 0), (1, 0), (-1, -1)]:
+                j0, i0 = (j % level['mean'].shape[1]) * f, (i % level['mean'].shape[2]) * f
+                block = vals[:, j0:j0 + f, i0:i0 + f].reshape(5, -1)
+                np.testing.assert_allclose(level['mean'][:, j, i], block.mean(1))
+                np.testing.assert_equal(level['min'][:, j, i], block.min(1))
+                np.testing.assert_equal(level['max'][:, j, i], block.max(1))
+        edges = decimatebounds(np.arange(8), 4)
+        np.testing.assert_equal(edges, [0, 4, 7])
+        lon, lat = np.meshgrid(np.arange(8), np.arange(10))
+        self.assertEqual(decimatebounds(lon, 2).shape, (6, 5))
+
+if __name__ == '__main__':
+    unittest.main()
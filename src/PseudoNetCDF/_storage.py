@@ -0,0 +1,355 @@
+from __future__ import print_function
+__all__ = ['StoragePolicy', 'chunksizes_for', 'getstoragepolicy', 'benchmark_storage']
+__doc__ = """
+Storage policies for NetCDF4 output
+
+A StoragePolicy turns compression (zlib, complevel, shuffle), chunking
+(explicit chunksizes or an access pattern: timeseries, maps, balanced)
+and lossy packing (least_significant_digit) into keywords for
+netCDF4.Dataset.createVariable. Pseudo2NetCDF.convert and pncgen accept
+a policy; a policy can have per-variable overrides.
+"""
+import os
+import sys
+import unittest
+from time import time
+import numpy as np
+
+_chunk_patterns = ('timeseries', 'maps', 'balanced')
+_time_names = ('time', 'tstep', 't')
+
+def _timeaxis(dimensions, unlimited = ()):
+    """
+    Index of the time-like dimension: the first unlimited dimension, then
+    the first dimension named time/TSTEP/t, then the first dimension
+    """
+    for di, dk in enumerate(dimensions):
+        if dk in unlimited:
+            return di
+    for di, dk in enumerate(dimensions):
+        if dk.lower() in _time_names:
+            return di
+    return 0
+
+def _fill(shape, budget, order):
+    """
+    Assign chunk lengths greedily in order (list of axes) until the
+    budget (elements) is used
+    """
+    chunks = [1] * len(shape)
+    for ai in order:
+        chunks[ai] = int(max(1, min(shape[ai], budget)))
+        budget = max(1, budget // chunks[ai])
+    return chunks
+
+def _balanced(shape, budget, axes):
+    """
+    Scale the lengths of axes by a common factor so that their product is
+    close to budget
+    """
+    chunks = [1] * len(shape)
+    axes = [ai for ai in axes if shape[ai] > 1]
+    if len(axes) == 0:
+        return chunks
+    total = float(np.prod([shape[ai] for ai in axes]))
+    factor = min(1., (budget / total) ** (1. / len(axes)))
+    for ai in axes:
+        chunks[ai] = int(max(1, min(shape[ai], round(shape[ai] * factor))))
+    # rounding can overshoot the budget; shrink the longest chunk
+    while np.prod(chunks) > budget and max(chunks) > 1:
+        ai = int(np.argmax(chunks))
+        chunks[ai] -= 1
+    return chunks
+
+def chunksizes_for(shape, pattern, itemsize = 4, chunkbytes = 2**20, timeaxis = 0):
+    """
+    Return chunk lengths for a variable of shape tuned to an access pattern
+
+    shape - variable shape (unlimited dimensions with length 0 count as 1)
+    pattern - timeseries: whole time series of few cells per chunk
+              maps: one time with whole horizontal slices per chunk
+              balanced: all dimensions scaled by a common factor
+    itemsize - bytes per value
+    chunkbytes - target bytes per chunk
+    timeaxis - index of the time dimension
+    """
+    if pattern not in _chunk_patterns:
+        raise ValueError('chunk pattern must be one of %s; got %s' % (', '.join(_chunk_patterns), pattern))
+    shape = [max(1, int(s)) for s in shape]
+    ndim = len(shape)
+    budget = max(1, chunkbytes // itemsize)
+    others = [ai for ai in range(ndim) if ai != timeaxis]
+    if pattern == 'timeseries':
+        chunks = _fill(shape, budget, [timeaxis])
+        rest = _balanced(shape, max(1, budget // chunks[timeaxis]), others)
+        for ai in others:
+            chunks[ai] = rest[ai]
+    elif pattern == 'maps':
+        # innermost dimensions are filled first (e.g., COL, ROW, LAY)
+        chunks = _fill(shape, budget, others[::-1])
+        chunks[timeaxis] = 1
+    else:
+        chunks = _balanced(shape, budget, range(ndim))
+    return tuple(chunks)
+
+class StoragePolicy(object):
+    """
+    StoragePolicy holds default storage options and per-variable overrides
+
+    zlib - use compression
+    complevel - compression level 1-9 (implies zlib when given)
+    shuffle - use the shuffle filter with compression
+    chunk_for - timeseries, maps or balanced (None for library default)
+    chunksizes - explicit chunk lengths (overrides chunk_for)
+    chunkbytes - target bytes per chunk for chunk_for
+    least_significant_digit - quantize floating point values to this
+                              many decimal digits before compression
+    variables - dictionary of variable name to dictionary of the options
+                above for that variable
+    """
+    _options = ('zlib', 'complevel', 'shuffle', 'chunk_for', 'chunksizes', 'chunkbytes', 'least_significant_digit')
+    def __init__(self, zlib = False, complevel = None, shuffle = True, chunk_for = None, chunksizes = None, chunkbytes = 2**20, least_significant_digit = None, variables = None):
+        self.zlib = zlib
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.chunk_for = chunk_for
+        self.chunksizes = chunksizes
+        self.chunkbytes = chunkbytes
+        self.least_significant_digit = least_significant_digit
+        self.variables = {}
+        for vk, vopts in (variables or {}).items():
+            self.setvariable(vk, **vopts)
+
+    def setvariable(self, key, **opts):
+        """
+        Override options for variable key
+        """
+        for ok in opts:
+            if ok not in self._options:
+                raise KeyError('Unknown storage option %s; use one of %s' % (ok, ', '.join(self._options)))
+        if opts.get('chunk_for', None) not in (None,) + _chunk_patterns:
+            raise ValueError('chunk_for must be one of %s' % ', '.join(_chunk_patterns))
+        self.variables.setdefault(key, {}).update(opts)
+
+    def options(self, key):
+        """
+        Options for variable key with overrides applied
+        """
+        opts = dict([(ok, getattr(self, ok)) for ok in self._options])
+        opts.update(self.variables.get(key, {}))
+        return opts
+
+    def kwds(self, pfile, key, typecode = None):
+        """
+        Keywords for createVariable of variable key from pfile
+        """
+        pvar = pfile.variables[key]
+        dtype = np.dtype(typecode or pvar.dtype)
+        opts = self.options(key)
+        out = {}
+        if opts['zlib'] or opts['complevel'] is not None:
+            out['zlib'] = True
+            out['complevel'] = 4 if opts['complevel'] is None else int(opts['complevel'])
+            out['shuffle'] = bool(opts['shuffle'])
+        if opts['least_significant_digit'] is not None and dtype.kind == 'f':
+            out['least_significant_digit'] = int(opts['least_significant_digit'])
+        dims = tuple(pvar.dimensions)
+        if len(dims) > 0:
+            if opts['chunksizes'] is not None:
+                out['chunksizes'] = tuple(opts['chunksizes'])
+            elif opts['chunk_for'] is not None:
+                unlimited = [dk for dk in dims if dk in pfile.dimensions and pfile.dimensions[dk].isunlimited()]
+                shape = [len(pfile.dimensions[dk]) if dk in pfile.dimensions else pvar.shape[di] for di, dk in enumerate(dims)]
+                out['chunksizes'] = chunksizes_for(shape, opts['chunk_for'], dtype.itemsize, opts['chunkbytes'], _timeaxis(dims, unlimited))
+        return out
+
+    def __repr__(self):
+        opts = ', '.join(['%s=%r' % (ok, getattr(self, ok)) for ok in self._options])
+        return 'StoragePolicy(%s, variables=%r)' % (opts, self.variables)
+
+def _parsevaropt(varopt):
+    """
+    Variable key and options of a --variable-storage value
+    VAR,key=value,...; values are python literals (9, False, (1, 5, 5))
+    or plain strings (maps)
+    """
+    from ast import literal_eval
+    pieces = varopt.split(',')
+    vk = pieces[0]
+    items = []
+    for piece in pieces[1:]:
+        if '=' in piece:
+            ok, ov = piece.split('=', 1)
+            items.append([ok.strip(), ov])
+        elif len(items) > 0:
+            # commas inside a value (e.g., chunksizes=(1,5,5))
+            items[-1][1] += ',' + piece
+        else:
+            raise ValueError('--variable-storage options must be key=value; got %s' % varopt)
+    opts = {}
+    for ok, ov in items:
+        try:
+            opts[ok] = literal_eval(ov.strip())
+        except (ValueError, SyntaxError):
+            opts[ok] = ov.strip()
+    return vk, opts
+
+def getstoragepolicy(options):
+    """
+    StoragePolicy from pncparse options or None when no storage options
+    were used
+
+    --variable-storage values are VAR,key=value,... (e.g., O3,complevel=9
+    or O3,chunk_for=maps; see _parsevaropt)
+    """
+    varopts = getattr(options, 'variable_storage', [])
+    kwds = dict(zlib = getattr(options, 'zlib', False),
+                complevel = getattr(options, 'complevel', None),
+                shuffle = getattr(options, 'shuffle', True),
+                chunk_for = getattr(options, 'chunk_for', None),
+                least_significant_digit = getattr(options, 'least_significant_digit', None))
+    if not kwds['zlib'] and kwds['complevel'] is None and kwds['chunk_for'] is None and kwds['least_significant_digit'] is None and len(varopts) == 0:
+        return None
+    policy = StoragePolicy(**kwds)
+    for varopt in varopts:
+        vk, vkwds = _parsevaropt(varopt)
+        policy.setvariable(vk, **vkwds)
+    return policy
+
+def benchmark_storage(pfile, policies, outdir = None, nreads = 5, verbose = 1):
+    """
+    Write pfile with each policy and report size, write throughput and
+    read latency for a time series (all times at a middle cell) and a
+    map (all cells at a middle time) of each variable with two or more
+    dimensions
+
+    pfile - file to write
+    policies - dictionary of name to StoragePolicy (or None for defaults)
+    outdir - directory for output files (default: temporary directory)
+    nreads - repetitions for read timing
+
+    Returns a list of dictionaries with name, bytes, write_MBps, ts_ms,
+    map_ms
+    """
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from netCDF4 import Dataset
+    from .pncgen import Pseudo2NetCDF
+    cleanup = outdir is None
+    if cleanup:
+        outdir = mkdtemp()
+    nbytes = sum([np.asarray(v.shape).prod() * np.dtype(v.dtype).itemsize for v in pfile.variables.values()])
+    results = []
+    try:
+        for name, policy in policies.items():
+            outpath = os.path.join(outdir, 'storage_%s.nc' % name)
+            start = time()
+            p2n = Pseudo2NetCDF(verbose = 0)
+            p2n.convert(pfile, outpath, format = 'NETCDF4', storage = policy).close()
+            wtime = time() - start
+            nfile = Dataset(outpath)
+            tstime = maptime = 0.
+            for vk, nvar in nfile.variables.items():
+                if nvar.ndim < 2:
+                    continue
+                unlimited = [dk for dk in nvar.dimensions if nfile.dimensions[dk].isunlimited()]
+                taxis = _timeaxis(nvar.dimensions, unlimited)
+                tsidx = tuple([slice(None) if di == taxis else n // 2 for di, n in enumerate(nvar.shape)])
+                mapidx = tuple([nvar.shape[di] // 2 if di == taxis else slice(None) for di in range(nvar.ndim)])
+                for ri in range(nreads):
+                    start = time()
+                    nvar[tsidx]
+                    tstime += time() - start
+                    start = time()
+                    nvar[mapidx]
+                    maptime += time() - start
+            nfile.close()
+            results.append(dict(name = name, bytes = os.path.getsize(outpath), write_MBps = nbytes / 1e6 / max(wtime, 1e-9), ts_ms = tstime / nreads * 1e3, map_ms = maptime / nreads * 1e3))
+    finally:
+        if cleanup:
+            rmtree(outdir)
+    if verbose:
+        print('%-20s %12s %12s %10s %10s' % ('policy', 'bytes', 'write MB/s', 'ts ms', 'map ms'), file = sys.stdout)
+        for r in results:
+            print('%(name)-20s %(bytes)12d %(write_MBps)12.1f %(ts_ms)10.2f %(map_ms)10.2f' % r, file = sys.stdout)
+    return results
+
+def _synthetic_file(ntime = 48, nlay = 4, nrow = 60, ncol = 80):
+    from .sci_var import PseudoNetCDFFile
+    f = PseudoNetCDFFile()
+    f.createDimension('TSTEP', ntime).setunlimited(True)
+    f.createDimension('LAY', nlay)
+    f.createDimension('ROW', nrow)
+    f.createDimension('COL', ncol)
+    t, l, r, c = np.indices((ntime, nlay, nrow, ncol))
+    o3 = f.createVariable('O3', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'))
+    o3.units = 'ppb'
+    o3[:] = 40 + 20 * np.sin(t / 24. * 2 * np.pi) * np.cos(r / float(nrow)) + l + np.random.RandomState(0).normal(0, 1, t.shape)
+    return f
+
+class TestStorage(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def testChunksizes(self):
+        shape = (24, 4, 50, 60)
+        self.assertEqual(chunksizes_for(shape, 'maps', 4, 50 * 60 * 4), (1, 1, 50, 60))
+        self.assertEqual(chunksizes_for(shape, 'maps', 4, 2 * 50 * 60 * 4), (1, 2, 50, 60))
+        ts = chunksizes_for(shape, 'timeseries', 4, 24 * 4 * 10)
+        self.assertEqual(ts[0], 24)
+        self.assert_(np.prod(ts) <= 24 * 10)
+        bal = chunksizes_for(shape, 'balanced', 4, 2**16)
+        self.assert_(all([0 < c <= s for c, s in zip(bal, shape)]))
+        self.assert_(np.prod(bal) <= 2**14)
+        self.assertEqual(chunksizes_for((0, 5), 'timeseries', 4, 400, 0), (1, 5))
+        self.assertRaises(ValueError, chunksizes_for, shape, 'columns')
+
+    def testPolicy(self):
+        f = _synthetic_file(4, 2, 3, 5)
+        policy = StoragePolicy(complevel = 5, chunk_for = 'maps', least_significant_digit = 2)
+        policy.setvariable('O3', complevel = 9, shuffle = False)
+        kwds = policy.kwds(f, 'O3')
+        self.assertEqual(kwds, dict(zlib = True, complevel = 9, shuffle = False, least_significant_digit = 2, chunksizes = (1, 2, 3, 5)))
+        self.assertEqual(StoragePolicy().kwds(f, 'O3'), {})
+        self.assertRaises(KeyError, policy.setvariable, 'O3', level = 1)
+
+    def testVariableStorage(self):
+        self.assertEqual(_parsevaropt('O3,complevel=9,chunk_for=maps,zlib=True'), ('O3', dict(complevel = 9, chunk_for = 'maps', zlib = True)))
+        self.assertEqual(_parsevaropt("NO2,chunksizes=(1,5,5),chunk_for='timeseries'"), ('NO2', dict(chunksizes = (1, 5, 5), chunk_for = 'timeseries')))
+        self.assertEqual(_parsevaropt('O3'), ('O3', {}))
+        self.assertRaises(ValueError, _parsevaropt, 'O3,9')
+        # values are never evaluated as code
+        self.assertEqual(_parsevaropt('O3,chunk_for=__import__("os")')[1]['chunk_for'], '__import__("os")')
+        class options(object):
+            variable_storage = ['O3,chunk_for=maps', 'NO2,least_significant_digit=2']
+        policy = getstoragepolicy(options)
+        self.assertEqual(policy.variables, dict(O3 = dict(chunk_for = 'maps'), NO2 = dict(least_significant_digit = 2)))
+
+    def testConvert(self):
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        from .pncgen import Pseudo2NetCDF
+        f = _synthetic_file(6, 2, 10, 12)
+        tmpdir = mkdtemp()
+        try:
+            outpath = os.path.join(tmpdir, 'test.nc')
+            policy = StoragePolicy(complevel = 4, chunk_for = 'timeseries', chunkbytes = 6 * 4 * 4, least_significant_digit = 1)
+            nfile = Pseudo2NetCDF(verbose = 0).convert(f, outpath, format = 'NETCDF4', storage = policy)
+            nvar = nfile.variables['O3']
+            filters = nvar.filters()
+            self.assert_(filters['zlib'])
+            self.assertEqual(filters['complevel'], 4)
+            self.assertEqual(nvar.chunking(), [6, 1, 2, 2])
+            self.assert_(np.allclose(nvar[:], f.variables['O3'][:], atol = 0.1))
+            nfile.close()
+        finally:
+            rmtree(tmpdir)
+
+if __name__ == '__main__':
+    benchmark_storage(_synthetic_file(),
+                      dict(default = None,
+                           zlib = StoragePolicy(complevel = 4),
+                           timeseries = StoragePolicy(complevel = 4, chunk_for = 'timeseries'),
+                           maps = StoragePolicy(complevel = 4, chunk_for = 'maps'),
+                           balanced = StoragePolicy(complevel = 4, chunk_for = 'balanced'),
+                           lsd2 = StoragePolicy(complevel = 4, chunk_for = 'balanced', least_significant_digit = 2)))
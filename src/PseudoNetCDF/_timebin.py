@@ -0,0 +1,280 @@
+from __future__ import print_function
+__all__ = ['gettimes64', 'timebins', 'groupindices', 'BinStats', 'binstats', 'binners']
+__doc__ = """
+Time-binning engine for diurnal, weekly, monthly and seasonal analyses
+
+Times are decoded once as datetime64 with array arithmetic (no datetime
+object per time), bin codes are computed from them with array
+arithmetic, and values are grouped with one stable argsort per chunk
+instead of a boolean scan per bin.
+
+    gettimes64 - datetime64[ms] times of a file (time, TFLAG or tau0)
+    timebins - integer bin codes and labels (hour, dayofweek, month, season)
+    groupindices - time indices of each bin from one argsort
+    BinStats - count, sum, mean, min, max and (optionally) values by bin
+    binstats - BinStats of a variable read a chunk of times at a time
+
+    codes, labels = timebins(ifile, 'hour')
+    stats = binstats(ifile.variables['O3'], codes, len(labels))
+    stats.mean(); stats.quantile([25, 50, 75]); stats.values()
+"""
+import unittest
+import numpy as np
+
+chunkbytes = 2**26
+
+_seconds = dict(weeks = 604800., days = 86400., hours = 3600., minutes = 60., seconds = 1., milliseconds = 1e-3)
+
+def _todatetime64(rdate):
+    """
+    datetime64[ms] of a (possibly timezone aware) datetime in UTC
+    """
+    if rdate.tzinfo is not None:
+        rdate = (rdate - rdate.utcoffset()).replace(tzinfo = None)
+    return np.datetime64(rdate, 'ms')
+
+def _offsets(values, unit):
+    """
+    timedelta64[ms] of values in unit (days, hours, ...)
+    """
+    unit = unit.strip().lower()
+    if not unit.endswith('s'):
+        unit = unit + 's'
+    ms = np.round(np.asarray(values, dtype = 'd') * (_seconds[unit] * 1000.))
+    return ms.astype('i8').astype('timedelta64[ms]')
+
+def gettimes64(ifile):
+    """
+    datetime64[ms] array of the times of ifile; same conventions as
+    coordutil.gettimes (time with units '<unit> since <date>', TFLAG or
+    tau0) without a datetime object per time
+    """
+    from .coordutil import _parse_ref_date, gettimes
+    keys = ifile.variables.keys()
+    if 'time' in keys:
+        time = ifile.variables['time']
+        units = getattr(time, 'units', '')
+        if 'since' in units:
+            unit, base = units.strip().split(' since ')
+            if unit.strip().lower().rstrip('s') + 's' in _seconds:
+                return _todatetime64(_parse_ref_date(base)) + _offsets(time[:], unit)
+    elif 'TFLAG' in keys:
+        tflag = np.asarray(ifile.variables['TFLAG'][:, 0]).astype('i8')
+        dates, times = tflag[:, 0], tflag[:, 1]
+        years = (dates // 1000 - 1970).astype('datetime64[Y]').astype('datetime64[ms]')
+        seconds = (times // 10000) * 3600 + (times % 10000 // 100) * 60 + times % 100
+        return years + ((dates % 1000 - 1) * 86400 + seconds).astype('timedelta64[s]')
+    elif 'tau0' in keys:
+        return np.datetime64('1985-01-01T00', 'ms') + _offsets(ifile.variables['tau0'][:], 'hours')
+    return np.array(list(gettimes(ifile)), dtype = 'datetime64[ms]')
+
+def _hour(times):
+    return (times - times.astype('datetime64[D]')).astype('timedelta64[h]').astype('i')
+
+def _dayofweek(times):
+    # 1970-01-01 was a Thursday; Monday is 0
+    return ((times.astype('datetime64[D]').astype('i8') + 3) % 7).astype('i')
+
+def _month(times):
+    return (times.astype('datetime64[M]').astype('i8') % 12).astype('i')
+
+def _season(times):
+    # DJF, MAM, JJA, SON
+    return ((_month(times) + 1) % 12 // 3).astype('i')
+
+binners = dict(
+    hour = (_hour, [str(i) for i in range(24)]),
+    dayofweek = (_dayofweek, ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']),
+    month = (_month, ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']),
+    season = (_season, ['DJF', 'MAM', 'JJA', 'SON']),
+)
+
+def timebins(times, by = 'hour'):
+    """
+    Return (codes, labels) where codes are integer bins (0 to
+    len(labels) - 1) of each time
+
+    times - file (see gettimes64), datetime64 array or datetime objects
+    by - hour, dayofweek (Monday is 0), month or season (DJF is 0)
+    """
+    if hasattr(times, 'variables'):
+        times = gettimes64(times)
+    else:
+        times = np.asarray(times)
+        if times.dtype.kind != 'M':
+            times = np.array(list(times), dtype = 'datetime64[ms]')
+    try:
+        func, labels = binners[by]
+    except KeyError:
+        raise KeyError('by must be one of %s; got %s' % (', '.join(sorted(binners)), by))
+    return func(times), list(labels)
+
+def groupindices(codes, nbins):
+    """
+    List of index arrays (one per bin) of the positions of each code in
+    codes; indices keep their order within each bin
+    """
+    codes = np.asarray(codes)
+    order = np.argsort(codes, kind = 'mergesort')
+    bounds = np.searchsorted(codes[order], np.arange(nbins + 1))
+    return [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+class BinStats(object):
+    """
+    Per-bin statistics accumulated from chunks of values (see add); masked
+    values are ignored. With keep, valid values are kept by bin for
+    values and quantile (e.g., boxplots); otherwise memory is
+    proportional to the number of bins.
+    """
+    def __init__(self, nbins, keep = True):
+        self.nbins = nbins
+        self.keep = keep
+        self.count = np.zeros(nbins, dtype = 'i8')
+        self.sum = np.zeros(nbins, dtype = 'd')
+        self.min = np.full(nbins, np.inf)
+        self.max = np.full(nbins, -np.inf)
+        self._values = [[] for bi in range(nbins)]
+
+    def add(self, codes, values, axis = 0):
+        """
+        codes - bin of each position of values along axis
+        values - array or masked array
+        """
+        codes = np.asarray(codes)
+        data = np.moveaxis(np.ma.getdata(values), axis, 0).reshape(codes.size, -1)
+        mask = np.moveaxis(np.ma.getmaskarray(values), axis, 0).reshape(codes.size, -1)
+        valid = ~mask & ((codes >= 0) & (codes < self.nbins))[:, None]
+        vcodes = np.broadcast_to(codes[:, None], data.shape)[valid]
+        vals = data[valid]
+        self.sum += np.bincount(vcodes, weights = vals, minlength = self.nbins)
+        order = np.argsort(vcodes, kind = 'mergesort')
+        vals = vals[order]
+        bounds = np.searchsorted(vcodes[order], np.arange(self.nbins + 1))
+        self.count += np.diff(bounds)
+        for bi in np.flatnonzero(np.diff(bounds)):
+            seg = vals[bounds[bi]:bounds[bi + 1]]
+            self.min[bi] = min(self.min[bi], seg.min())
+            self.max[bi] = max(self.max[bi], seg.max())
+            if self.keep:
+                self._values[bi].append(seg)
+        return self
+
+    def mean(self):
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.ma.masked_where(self.count == 0, self.sum / self.count)
+
+    def values(self):
+        """
+        List of 1-D arrays of the valid values of each bin
+        """
+        if not self.keep:
+            raise ValueError('values were not kept; use keep = True')
+        out = []
+        for bi, segs in enumerate(self._values):
+            vals = np.concatenate(segs) if len(segs) > 0 else np.array([], dtype = 'd')
+            self._values[bi] = [vals]
+            out.append(vals)
+        return out
+
+    def quantile(self, q):
+        """
+        Masked array (nbins, len(q)) of percentiles q (0-100) of each bin
+        """
+        q = np.atleast_1d(q)
+        out = np.ma.masked_all((self.nbins, q.size), dtype = 'd')
+        for bi, vals in enumerate(self.values()):
+            if vals.size > 0:
+                out[bi] = np.percentile(vals, q)
+        return out
+
+def binstats(var, codes, nbins, axis = 0, keep = True, chunksize = None):
+    """
+    BinStats of var (array or variable) with codes for each position along
+    axis (time); var is read chunksize positions at a time (default: about
+    chunkbytes per chunk)
+    """
+    shape = tuple(var.shape)
+    codes = np.asarray(codes)
+    if codes.size != shape[axis]:
+        raise ValueError('%d codes for %d times' % (codes.size, shape[axis]))
+    if chunksize is None:
+        rowbytes = np.dtype(getattr(var, 'dtype', 'd')).itemsize * int(np.prod(shape)) // max(1, shape[axis])
+        chunksize = max(1, chunkbytes // max(1, rowbytes))
+    stats = BinStats(nbins, keep = keep)
+    for start in range(0, shape[axis], chunksize):
+        chunk = slice(start, min(start + chunksize, shape[axis]))
+        stats.add(codes[chunk], var[(slice(None),) * axis + (chunk,)], axis = axis)
+    return stats
+
+class TestTimeBin(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from .core._files import PseudoNetCDFFile
+        f = PseudoNetCDFFile()
+        f.createDimension('time', 96)
+        f.createDimension('points', 3)
+        f.createVariable('time', 'd', ('time',), values = np.arange(96.) - 12, units = 'hours since 2016-02-28 12:00:00Z')
+        vals = np.ma.masked_less(np.arange(96. * 3).reshape(96, 3) % 17, 1)
+        f.createVariable('O3', 'd', ('time', 'points'), values = vals)
+        self.f = f
+
+    def testTimes(self):
+        from .coordutil import gettimes
+        from datetime import datetime
+        times = gettimes64(self.f)
+        self.assertEqual(times[0], np.datetime64('2016-02-28T00:00'))
+        np.testing.assert_equal(times, np.array(list(gettimes(self.f)), dtype = 'datetime64[ms]'))
+        for by, (func, labels) in binners.items():
+            codes, labels = timebins(self.f, by)
+            ref = timebins(gettimes(self.f), by)[0]
+            np.testing.assert_equal(codes, ref)
+        dts = [datetime(2017, 1, 2, 5), datetime(2017, 3, 31, 23), datetime(2017, 7, 9), datetime(2017, 12, 1)]
+        self.assertEqual(list(timebins(dts, 'hour')[0]), [5, 23, 0, 0])
+        self.assertEqual(list(timebins(dts, 'dayofweek')[0]), [0, 4, 6, 4])
+        self.assertEqual(list(timebins(dts, 'month')[0]), [0, 2, 6, 11])
+        self.assertEqual(list(timebins(dts, 'season')[0]), [0, 1, 2, 0])
+
+    def testTFLAG(self):
+        from .core._files import PseudoNetCDFFile
+        f = PseudoNetCDFFile()
+        tflag = np.array([[2016059, 230000], [2016060, 0], [2016060, 13000]], dtype = 'i')[:, None].repeat(2, 1)
+        f.createVariable('TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'), values = tflag)
+        np.testing.assert_equal(gettimes64(f), np.array(['2016-02-28T23', '2016-02-29T00', '2016-02-29T01:30'], dtype = 'datetime64[ms]'))
+
+    def testStats(self):
+        var = self.f.variables['O3']
+        codes, labels = timebins(self.f, 'hour')
+        stats = binstats(var, codes, len(labels), chunksize = 7)
+        vals = stats.values()
+        for hi in range(24):
+            ref = np.ma.compressed(var[:][codes == hi])
+            np.testing.assert_equal(np.sort(vals[hi]), np.sort(ref))
+            self.assertEqual(stats.count[hi], ref.size)
+            self.assertAlmostEqual(stats.mean()[hi], ref.mean())
+            self.assertEqual(stats.min[hi], ref.min())
+            np.testing.assert_allclose(stats.quantile([25, 50])[hi], np.percentile(ref, [25, 50]))
+        groups = groupindices(codes, 24)
+        np.testing.assert_equal(groups[5], np.where(codes == 5)[0])
+        stats = binstats(var[:].T, timebins(self.f, 'dayofweek')[0], 7, axis = 1, keep = False)
+        self.assertEqual(stats.count.sum(), var[:].count())
+        self.assertRaises(ValueError, stats.values)
+
+    def testStatBins(self):
+        from .core._files import PseudoNetCDFFile
+        from .pnceval import stat_bins, MB, NO
+        var = self.f.variables['O3']
+        f1 = PseudoNetCDFFile()
+        f1.createDimension('time', 96)
+        f1.createDimension('points', 3)
+        f1.createVariable('O3', 'd', ('time', 'points'), values = np.ma.masked_greater(np.ma.filled(var[:], 1) * 2., 30))
+        codes, labels = timebins(self.f, 'hour')
+        for func in (MB, NO):
+            out = stat_bins(self.f, f1, func, 'O3', by = 'hour', chunksize = 7)[1]
+            for hi in (0, 5, 23):
+                ref = func(var[:][codes == hi].ravel(), f1.variables['O3'][:][codes == hi].ravel())
+                self.assertAlmostEqual(out[hi], ref)
+
+if __name__ == '__main__':
+    unittest.main()
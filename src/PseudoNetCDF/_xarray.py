@@ -0,0 +1,215 @@
+from __future__ import print_function
+__all__ = ['PseudoNetCDFBackendArray', 'PseudoNetCDFBackendEntrypoint', 'open_dataset']
+__doc__ = """
+xarray backend (engine = 'pseudonetcdf')
+
+    import xarray as xr
+    ds = xr.open_dataset(path, engine = 'pseudonetcdf', format = 'uamiv')
+    ds = xr.open_dataset(path, engine = 'pseudonetcdf', format = 'uamiv', chunks = {'TSTEP': 1})
+
+format is a reader name (as for pncdump -f; default: try every reader)
+and other keywords are passed to the reader. Variables are not read when
+the dataset is opened. Each is a lazily indexed backend array that
+applies basic and outer indexing to the reader's variable (a memmap or
+a decoder), so with chunks each dask task reads only its slab. Files
+are opened through a CachingFileManager, so arrays can be pickled and
+read in other processes.
+
+setup.py registers the entry point, so an installed PseudoNetCDF is
+found by xarray without importing it first.
+"""
+import unittest
+import numpy as np
+
+try:
+    import xarray as xr
+    from xarray.backends import BackendEntrypoint, BackendArray
+    from xarray.backends.file_manager import CachingFileManager
+    from xarray.backends.locks import SerializableLock
+    from xarray.core import indexing
+except ImportError:
+    xr = None
+    BackendEntrypoint = BackendArray = object
+    CachingFileManager = SerializableLock = indexing = None
+
+class _NoLock(object):
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+def _open(path, format = None, **kwds):
+    """
+    Open path with reader format (None tries all readers)
+    """
+    from ._getreader import anyfile, getreaderdict
+    if format is None:
+        return anyfile(path, **kwds)
+    return getreaderdict()[format](path, **kwds)
+
+def _openargs(path, format = None, **kwds):
+    """
+    (opener, args, kwargs) for CachingFileManager; reader keywords are
+    flat because the manager hashes the items of kwargs
+    """
+    return _open, (path,), dict(format = format, **kwds)
+
+def _outerindex(var, key):
+    """
+    Index var with an outer indexing key (ints, slices and 1-D integer
+    arrays, at most one per dimension); arrays are applied one dimension
+    at a time so each selects along its own dimension
+    """
+    key = tuple(key) + (slice(None),) * (len(var.shape) - len(key))
+    basic = tuple([slice(None) if isinstance(k, np.ndarray) else k for k in key])
+    vals = var[basic]
+    # dimensions of vals after integers have been dropped
+    outaxis = 0
+    for k in key:
+        if isinstance(k, np.ndarray):
+            vals = np.take(vals, k, axis = outaxis)
+        if not isinstance(k, (int, np.integer)):
+            outaxis += 1
+    return vals
+
+def _asdata(vals, dtype):
+    """
+    Plain array from vals; masked floating point values become nan
+    """
+    if isinstance(vals, np.ma.MaskedArray):
+        if dtype.kind == 'f' and np.ma.getmaskarray(vals).any():
+            return np.ma.getdata(vals.astype(dtype).filled(np.nan)).view(np.ndarray)
+        vals = np.ma.getdata(vals)
+    return np.asarray(vals, dtype = dtype).view(np.ndarray)
+
+class PseudoNetCDFBackendArray(BackendArray):
+    """
+    Lazily indexed variable of a PseudoNetCDF file
+    """
+    def __init__(self, manager, key, shape, dtype, lock):
+        self._manager = manager
+        self._key = key
+        self._lock = lock
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.OUTER, self._getitem)
+
+    def _getitem(self, key):
+        with self._lock:
+            var = self._manager.acquire().variables[self._key]
+            return _asdata(_outerindex(var, key), self.dtype)
+
+def _vardtype(var):
+    """
+    dtype of the values read from var; masked integers are read as
+    floats so masked values can be nan
+    """
+    dtype = np.dtype(var.dtype)
+    if dtype.kind in 'iu' and isinstance(var, np.ma.MaskedArray):
+        return np.dtype('d')
+    return dtype
+
+def open_dataset(path, format = None, drop_variables = None, lock = None, **kwds):
+    """
+    Open path with PseudoNetCDF reader format as an xarray.Dataset whose
+    variables are read when indexed
+
+    path - file path
+    format - reader name (e.g., uamiv, bpch, arlpackedbit); None tries all
+    drop_variables - variable names to leave out
+    lock - lock held while reading (default: a lock per file, since
+           readers may keep state such as caches or file positions);
+           False reads in parallel threads (e.g., memmap readers)
+    kwds - reader keywords
+    """
+    opener, args, kwargs = _openargs(path, format = format, **kwds)
+    manager = CachingFileManager(opener, *args, kwargs = kwargs)
+    f = manager.acquire()
+    if lock is None:
+        lock = SerializableLock()
+    elif lock is False:
+        lock = _NoLock()
+    drop_variables = set(drop_variables or [])
+    variables = {}
+    for vk in f.variables.keys():
+        if vk in drop_variables:
+            continue
+        var = f.variables[vk]
+        attrs = dict([(pk, getattr(var, pk)) for pk in var.ncattrs() if pk not in ('_FillValue', 'fill_value', 'missing_value')])
+        encoding = {}
+        for pk in ('_FillValue', 'fill_value', 'missing_value'):
+            if pk in var.ncattrs() or hasattr(var, pk):
+                encoding['_FillValue'] = getattr(var, pk)
+                break
+        dims = tuple(var.dimensions)
+        data = indexing.LazilyIndexedArray(PseudoNetCDFBackendArray(manager, vk, var.shape, _vardtype(var), lock))
+        variables[vk] = xr.Variable(dims, data, attrs = attrs, encoding = encoding)
+    attrs = dict([(pk, getattr(f, pk)) for pk in f.ncattrs()])
+    ds = xr.Dataset(variables, attrs = attrs)
+    ds.set_close(manager.close)
+    return ds
+
+class PseudoNetCDFBackendEntrypoint(BackendEntrypoint):
+    """
+    Entry point for xarray.open_dataset(..., engine = 'pseudonetcdf')
+    """
+    description = 'Open CAMx, GEOS-Chem, ARL, ICARTT and other formats that PseudoNetCDF reads'
+    url = 'http://github.com/barronh/pseudonetcdf/'
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables', 'format', 'lock')
+
+    def open_dataset(self, filename_or_obj, drop_variables = None, format = None, lock = None, **kwds):
+        return open_dataset(filename_or_obj, format = format, drop_variables = drop_variables, lock = lock, **kwds)
+
+    def guess_can_open(self, filename_or_obj):
+        # sniffing tries every reader, so require engine = 'pseudonetcdf'
+        return False
+
+class TestXarray(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from .benchmarks._synthetic import make_uamiv
+        import os
+        self.tmpdir = mkdtemp()
+        self.path = make_uamiv(os.path.join(self.tmpdir, 'test.uamiv'), ntimes = 4, nlays = 2, nrows = 5, ncols = 6)
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+
+    def testOuterIndex(self):
+        from .camxfiles.uamiv.Memmap import uamiv
+        var = uamiv(self.path).variables['O3']
+        full = np.asarray(var[:])
+        rows = np.array([0, 2, 3])
+        cols = np.array([5, 1])
+        np.testing.assert_equal(_outerindex(var, (slice(1, 3), 0, rows, cols)), full[1:3, 0][:, rows][:, :, cols])
+        np.testing.assert_equal(_outerindex(var, (rows, slice(None), 4)), full[rows, :, 4])
+        np.testing.assert_equal(_outerindex(var, (2,)), full[2])
+        masked = np.ma.masked_greater(full, full.mean())
+        self.assert_(np.isnan(_asdata(masked, np.dtype('f'))).any())
+
+    def testOpenArgs(self):
+        opener, args, kwargs = _openargs(self.path, format = 'uamiv', endhour = True)
+        # CachingFileManager keys files by hashing the opener arguments
+        hash((opener,) + args + tuple(sorted(kwargs.items())))
+        self.assertEqual(kwargs, dict(format = 'uamiv', endhour = True))
+        f = _open(*args, format = 'uamiv')
+        self.assertEqual(f.variables['O3'].shape, (4, 2, 5, 6))
+
+    @unittest.skipIf(xr is None, 'xarray is not installed')
+    def testOpenDataset(self):
+        from .camxfiles.uamiv.Memmap import uamiv
+        f = uamiv(self.path)
+        ds = xr.open_dataset(self.path, engine = PseudoNetCDFBackendEntrypoint, format = 'uamiv')
+        self.assertEqual(ds['O3'].dims, f.variables['O3'].dimensions)
+        np.testing.assert_equal(ds['O3'][1:3, 0, [0, 2], [1, 4]].values, np.asarray(f.variables['O3'][1:3, 0])[:, [0, 2]][:, :, [1, 4]])
+        self.assertEqual(ds.attrs['NCOLS'], f.NCOLS)
+        ds.close()
+
+if __name__ == '__main__':
+    unittest.main()
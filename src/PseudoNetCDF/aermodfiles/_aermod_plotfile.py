@@ -6,7 +6,8 @@ units = 'm,m,micrograms/m**3,m,m,m,N/A,N/A,YYMMDDHH,N/A'.split(',')
 delimiter = [14] * 3 + [9] * 3 + [2, 6, 2, 8, 10, 2, 8]
 StrLen = 10
 class reader(PseudoNetCDFFile):
-    def isMine(self, path):
+    @classmethod
+    def isMine(cls, path):
         return open(path).read(len('* AERMOD')) == '* AERMOD'
     def __init__(self, path):
         #import pdb; pdb.set_trace()
@@ -0,0 +1,14 @@
+__all__ = ['sizes', 'generators', 'synthesize', 'run', 'compare', 'main']
+__doc__ = """
+Benchmarks for binary readers and writers
+
+Synthetic inputs of configurable size (_synthetic) are timed for open,
+random-slice read, full read, transform and write with throughput and
+peak memory (_suite). Results are JSON and can be compared across
+commits:
+
+    python -m PseudoNetCDF.benchmarks --size small -o before.json
+    python -m PseudoNetCDF.benchmarks --size small -o after.json --compare before.json
+"""
+from ._synthetic import sizes, generators, synthesize
+from ._suite import run, compare, main
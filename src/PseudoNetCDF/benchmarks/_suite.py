@@ -0,0 +1,281 @@
+from __future__ import print_function
+__all__ = ['run', 'compare', 'main']
+__doc__ = """
+Benchmark suite for readers and writers
+
+For each format, a synthetic input (see _synthetic) is timed for:
+
+    open   - construct the reader
+    slice  - read random single-time slabs of random variables
+    full   - read every variable
+    transform - slice_dim every other time and reduce_dim time mean
+    write  - write the opened file with the format's writer and as NetCDF
+
+Each operation is repeated and the fastest time is kept. Peak memory is
+the tracemalloc peak of one extra (untimed) repetition; numpy registers
+its allocations with tracemalloc, and memmap pages are not counted.
+Results record the package commit, versions, size and seed so runs on
+different commits can be compared (compare).
+"""
+import os
+import sys
+import json
+import unittest
+import tracemalloc
+from time import time
+from collections import OrderedDict
+from shutil import rmtree
+from tempfile import mkdtemp
+import numpy as np
+
+from ._synthetic import sizes, generators, synthesize
+
+def _commit():
+    """
+    git commit of the source tree or 'unknown'
+    """
+    from subprocess import check_output
+    try:
+        out = check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = os.path.dirname(__file__), stderr = open(os.devnull, 'w'))
+        return out.decode().strip()
+    except Exception:
+        return 'unknown'
+
+def _varbytes(var):
+    return int(np.prod(var.shape)) * np.dtype(var.dtype).itemsize
+
+def _datakeys(f):
+    """
+    Variables with 2 or more dimensions (or all 1-D variables when there
+    are none)
+    """
+    keys = [k for k, v in f.variables.items() if len(v.shape) > 1 and not k.endswith('TFLAG')]
+    if len(keys) == 0:
+        keys = [k for k, v in f.variables.items() if len(v.shape) == 1]
+    return keys
+
+def _operations(fmt, path, tmpdir, nslices, seed):
+    """
+    OrderedDict of operation name to a function that performs it and
+    returns the number of bytes processed
+    """
+    from .._getreader import getreaderdict
+    from .._getwriter import getwriterdict
+    from ..pncgen import Pseudo2NetCDF
+    from ..sci_var import slice_dim, reduce_dim, getvarpnc
+    readerfmt = generators[fmt][1]
+    reader = getreaderdict()[readerfmt]
+    writer = getwriterdict().get(readerfmt, None)
+    opened = reader(path)
+    keys = _datakeys(opened)
+    tdim = opened.variables[keys[0]].dimensions[0]
+    ops = OrderedDict()
+
+    def openf():
+        reader(path)
+        return os.path.getsize(path)
+    ops['open'] = openf
+
+    def slicef():
+        rs = np.random.RandomState(seed)
+        f = reader(path)
+        nbytes = 0
+        for si in range(nslices):
+            var = f.variables[keys[rs.randint(len(keys))]]
+            nbytes += np.asarray(var[rs.randint(var.shape[0])]).nbytes
+        return nbytes
+    ops['slice'] = slicef
+
+    def fullf():
+        f = reader(path)
+        return sum([np.asarray(f.variables[k][...]).nbytes for k in keys])
+    ops['full'] = fullf
+
+    def transformf():
+        f = reader(path)
+        nbytes = sum([_varbytes(f.variables[k]) for k in keys])
+        out = reduce_dim(slice_dim(getvarpnc(f, None), '%s,0,None,2' % tdim), '%s,mean' % tdim)
+        for k in keys:
+            np.asarray(out.variables[k][...])
+        return nbytes
+    ops['transform'] = transformf
+
+    def writef():
+        f = reader(path)
+        nbytes = sum([_varbytes(f.variables[k]) for k in f.variables.keys()])
+        if writer is not None:
+            outf = writer(f, os.path.join(tmpdir, 'written.' + fmt))
+            getattr(outf, 'close', lambda: None)()
+        Pseudo2NetCDF(verbose = 0).convert(f, os.path.join(tmpdir, 'written.nc'), format = 'NETCDF4_CLASSIC').close()
+        return nbytes * (2 if writer is not None else 1)
+    ops['write'] = writef
+    return ops
+
+def _measure(func, repeat, memory):
+    """
+    Return (fastest seconds, bytes, peak traced bytes or None)
+    """
+    best = None
+    for ri in range(repeat):
+        start = time()
+        nbytes = func()
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, nbytes, peak
+
+def run(formats = None, size = 'small', repeat = 3, nslices = 20, seed = 0, memory = True, workdir = None, verbose = 1, **kwds):
+    """
+    Run the benchmarks and return a dictionary with meta (commit,
+    versions, size parameters) and results (one row per format and
+    operation with seconds, MBps, bytes and peak_bytes)
+
+    formats - keys of generators (default all)
+    size - key of sizes; kwds override its parameters
+    repeat - repetitions; the fastest is reported
+    nslices - random slabs read by the slice operation
+    memory - measure tracemalloc peak with one extra repetition
+    workdir - directory for synthetic and written files (default:
+              temporary directory that is removed)
+    """
+    import platform
+    if formats is None:
+        formats = list(generators.keys())
+    params = dict(sizes[size])
+    params.update(kwds)
+    meta = OrderedDict()
+    meta['commit'] = _commit()
+    meta['python'] = platform.python_version()
+    meta['numpy'] = np.__version__
+    meta['platform'] = platform.platform()
+    meta['size'] = size
+    meta['params'] = params
+    meta['seed'] = seed
+    meta['repeat'] = repeat
+    meta['nslices'] = nslices
+    results = []
+    cleanup = workdir is None
+    if cleanup:
+        workdir = mkdtemp(prefix = 'pncbench')
+    try:
+        for fmt in formats:
+            fmtdir = os.path.join(workdir, fmt)
+            if not os.path.exists(fmtdir):
+                os.makedirs(fmtdir)
+            start = time()
+            try:
+                path = synthesize(fmt, fmtdir, size = size, seed = seed, **kwds)
+            except Exception as e:
+                # one broken generator does not stop the other formats
+                row = OrderedDict([('format', fmt), ('op', 'synthesize'), ('error', '%s: %s' % (type(e).__name__, str(e)))])
+                results.append(row)
+                if verbose > 0:
+                    print(_formatrow(row), file = sys.stderr)
+                continue
+            if verbose > 0:
+                print('%s: synthesized %.1f MB in %.2f s' % (fmt, os.path.getsize(path) / 1e6, time() - start), file = sys.stderr)
+            for op, func in _operations(fmt, path, fmtdir, nslices, seed).items():
+                row = OrderedDict([('format', fmt), ('op', op)])
+                try:
+                    seconds, nbytes, peak = _measure(func, repeat, memory)
+                    row['seconds'] = seconds
+                    row['bytes'] = nbytes
+                    row['MBps'] = nbytes / 1e6 / max(seconds, 1e-9)
+                    row['peak_bytes'] = peak
+                except Exception as e:
+                    row['error'] = '%s: %s' % (type(e).__name__, str(e))
+                results.append(row)
+                if verbose > 0:
+                    print(_formatrow(row), file = sys.stderr)
+    finally:
+        if cleanup:
+            rmtree(workdir, ignore_errors = True)
+    return OrderedDict([('meta', meta), ('results', results)])
+
+def _formatrow(row):
+    if 'error' in row:
+        return '%-17s %-10s error %s' % (row['format'], row['op'], row['error'])
+    peak = '' if row['peak_bytes'] is None else '%10.1f MB peak' % (row['peak_bytes'] / 1e6)
+    return '%-17s %-10s %10.4f s %10.1f MB/s%s' % (row['format'], row['op'], row['seconds'], row['MBps'], peak)
+
+def compare(old, new, threshold = 0.1):
+    """
+    Compare two run results; returns rows of (format, op, old seconds,
+    new seconds, ratio, flag) where flag is 'slower' or 'faster' when
+    the ratio differs from 1 by more than threshold
+    """
+    oldrows = dict([((r['format'], r['op']), r) for r in old['results'] if 'error' not in r])
+    out = []
+    for r in new['results']:
+        key = (r['format'], r['op'])
+        if key not in oldrows or 'error' in r:
+            continue
+        ratio = r['seconds'] / max(oldrows[key]['seconds'], 1e-9)
+        flag = 'slower' if ratio > 1 + threshold else ('faster' if ratio < 1 - threshold else '')
+        out.append((r['format'], r['op'], oldrows[key]['seconds'], r['seconds'], ratio, flag))
+    return out
+
+def main(args = None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog = 'python -m PseudoNetCDF.benchmarks', description = 'Time open, slice, full read, transform and write of synthetic files for each format')
+    parser.add_argument('--formats', default = ','.join(generators.keys()), help = 'Formats separated by , (default: %(default)s)')
+    parser.add_argument('--size', default = 'small', choices = list(sizes.keys()), help = 'Size preset (default: %(default)s)')
+    parser.add_argument('--set', dest = 'params', action = 'append', default = [], metavar = 'key=value', help = 'Override a size parameter (e.g., --set ntimes=48); keys: ' + ', '.join(sizes['small'].keys()))
+    parser.add_argument('--repeat', type = int, default = 3, help = 'Repetitions; the fastest is reported (default: %(default)s)')
+    parser.add_argument('--slices', type = int, default = 20, help = 'Random slabs read by the slice operation (default: %(default)s)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'Seed for synthetic data and slices (default: %(default)s)')
+    parser.add_argument('--no-memory', dest = 'memory', action = 'store_false', default = True, help = 'Skip the tracemalloc peak memory repetition')
+    parser.add_argument('--workdir', default = None, help = 'Keep synthetic and written files in this directory')
+    parser.add_argument('-o', '--output', default = None, help = 'Write results as JSON')
+    parser.add_argument('--compare', default = None, help = 'JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.1, help = 'Relative change flagged by --compare (default: %(default)s)')
+    args = parser.parse_args(args)
+    params = dict([(k, int(v)) for k, v in [p.split('=') for p in args.params]])
+    result = run(formats = args.formats.split(','), size = args.size, repeat = args.repeat, nslices = args.slices, seed = args.seed, memory = args.memory, workdir = args.workdir, **params)
+    for row in result['results']:
+        print(_formatrow(row))
+    if args.output is not None:
+        with open(args.output, 'w') as outf:
+            json.dump(result, outf, indent = 2)
+    if args.compare is not None:
+        old = json.load(open(args.compare))
+        if old['meta']['params'] != result['meta']['params']:
+            print('Warning: sizes differ from %s' % args.compare, file = sys.stderr)
+        print('%-17s %-10s %10s %10s %7s' % ('format', 'op', old['meta']['commit'], result['meta']['commit'], 'ratio'))
+        for fmt, op, olds, news, ratio, flag in compare(old, result, threshold = args.threshold):
+            print('%-17s %-10s %10.4f %10.4f %7.2f %s' % (fmt, op, olds, news, ratio, flag))
+    return result
+
+class TestSuite(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def testRun(self):
+        result = run(formats = ['uamiv', 'ioapi'], size = 'tiny', repeat = 1, nslices = 3, verbose = 0)
+        ops = [(r['format'], r['op']) for r in result['results']]
+        self.assertEqual(ops[:5], [('uamiv', op) for op in ('open', 'slice', 'full', 'transform', 'write')])
+        for row in result['results']:
+            self.assert_('error' not in row, row)
+            self.assert_(row['peak_bytes'] > 0)
+        self.assertEqual(result['meta']['params']['nrows'], sizes['tiny']['nrows'])
+        rows = compare(result, result)
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(set([flag for fmt, op, olds, news, ratio, flag in rows]), set(['']))
+
+    def testSynthesizeError(self):
+        result = run(formats = ['nope', 'uamiv'], size = 'tiny', repeat = 1, nslices = 1, memory = False, verbose = 0)
+        row = result['results'][0]
+        self.assertEqual((row['format'], row['op']), ('nope', 'synthesize'))
+        self.assert_('error' in row)
+        self.assertEqual([r['format'] for r in result['results'][1:]], ['uamiv'] * 5)
+        self.assertEqual(compare(result, result)[0][:2], ('uamiv', 'open'))
+
+if __name__ == '__main__':
+    unittest.main()
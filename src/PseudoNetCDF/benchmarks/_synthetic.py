@@ -0,0 +1,310 @@
+from __future__ import print_function
+__all__ = ['sizes', 'generators', 'synthesize', 'make_uamiv', 'make_point_source', 'make_lateral_boundary', 'make_bpch', 'make_arl', 'make_icartt', 'make_ioapi']
+__doc__ = """
+Synthetic inputs of configurable size for benchmarks
+
+Each make_<format>(path, ...) writes a file of that format with the
+package's own writer. CAMx, bpch and ICARTT files are built from the
+small test case files by tiling their dimensions to the requested sizes
+(so headers, names and value ranges stay realistic) and perturbing the
+values with a seeded random number generator. ARL packed-bit files are
+built from scratch. All generators are deterministic for a given seed.
+"""
+import os
+import unittest
+from datetime import datetime, timedelta
+from collections import OrderedDict
+import numpy as np
+
+# size presets; keys are arguments of the make_ functions
+sizes = OrderedDict()
+sizes['tiny'] = dict(ntimes = 2, nlays = 2, nrows = 20, ncols = 25, nstk = 10, npoints = 50)
+sizes['small'] = dict(ntimes = 24, nlays = 5, nrows = 60, ncols = 70, nstk = 2000, npoints = 10000)
+sizes['medium'] = dict(ntimes = 24, nlays = 15, nrows = 150, ncols = 180, nstk = 20000, npoints = 100000)
+sizes['large'] = dict(ntimes = 48, nlays = 30, nrows = 300, ncols = 350, nstk = 100000, npoints = 1000000)
+
+def _tile(template, dimsizes, seed = 0, skipkeys = ()):
+    """
+    Copy template into a PseudoNetCDFFile with dimensions resized to
+    dimsizes; values are repeated along resized dimensions and floating
+    point variables with 2 or more dimensions are perturbed by a factor
+    between 0.5 and 1.5
+    """
+    from ..sci_var import PseudoNetCDFFile
+    rs = np.random.RandomState(seed)
+    out = PseudoNetCDFFile()
+    for pk in template.ncattrs():
+        setattr(out, pk, getattr(template, pk))
+    for dk, dv in template.dimensions.items():
+        out.createDimension(dk, dimsizes.get(dk, len(dv))).setunlimited(dv.isunlimited())
+    for vk, invar in template.variables.items():
+        if vk in skipkeys:
+            continue
+        vals = np.asarray(invar[...])
+        for ai, dk in enumerate(invar.dimensions):
+            if dk in dimsizes:
+                vals = np.take(vals, np.arange(dimsizes[dk]) % vals.shape[ai], axis = ai)
+        if vals.dtype.kind == 'f' and vals.ndim > 1 and not vk.endswith('TFLAG'):
+            vals = (vals * rs.uniform(.5, 1.5, size = vals.shape)).astype(vals.dtype)
+        propd = dict([(pk, getattr(invar, pk)) for pk in invar.ncattrs()])
+        if 'values' in propd:
+            propd['pvalues'] = propd.pop('values')
+        out.createVariable(vk, vals.dtype.char, invar.dimensions, values = vals, **propd)
+    return out
+
+def _settflag(f, ntimes, tstep = 10000):
+    """
+    Rewrite TFLAG/ETFLAG and IOAPI time attributes for ntimes hourly steps
+    starting at f.SDATE and f.STIME
+    """
+    sdate = int(f.SDATE)
+    if sdate < 1000000:
+        # CAMx 2-digit years
+        sdate += 2000000
+    start = datetime.strptime('%07d' % sdate, '%Y%j') + timedelta(hours = int(f.STIME) // 10000)
+    times = [start + timedelta(hours = i * tstep // 10000) for i in range(ntimes + 1)]
+    yyyyjjj = np.array([int(t.strftime('%Y%j')) for t in times], dtype = 'i')
+    hhmmss = np.array([int(t.strftime('%H0000')) for t in times], dtype = 'i')
+    for key, sl in [('TFLAG', slice(None, -1)), ('ETFLAG', slice(1, None))]:
+        if key in f.variables:
+            tflag = f.variables[key]
+            tflag[:, :, 0] = yyyyjjj[sl, None]
+            tflag[:, :, 1] = hhmmss[sl, None]
+    f.NSTEPS = ntimes
+    f.TSTEP = tstep
+
+def _template(reader, key, group):
+    from ..testcase import camxfiles_paths, geoschemfiles_paths, icarttfiles_paths
+    paths = dict(camx = camxfiles_paths, geoschem = geoschemfiles_paths, icartt = icarttfiles_paths)[group]
+    return reader(paths[key])
+
+def make_uamiv(path, ntimes = 24, nlays = 5, nrows = 60, ncols = 70, seed = 0, **ignore):
+    """
+    Write a CAMx uamiv file with ntimes hours, nlays layers and nrows by
+    ncols cells (21 species)
+    """
+    from ..camxfiles.Memmaps import uamiv
+    from ..camxfiles.uamiv.Write import ncf2uamiv
+    out = _tile(_template(uamiv, 'uamiv', 'camx'), dict(TSTEP = ntimes, LAY = nlays, ROW = nrows, COL = ncols), seed = seed)
+    out.NLAYS, out.NROWS, out.NCOLS = nlays, nrows, ncols
+    _settflag(out, ntimes)
+    ncf2uamiv(out, path).close()
+    return path
+
+def make_point_source(path, ntimes = 24, nstk = 2000, seed = 0, **ignore):
+    """
+    Write a CAMx point_source file with ntimes hours and nstk stacks
+    """
+    from ..camxfiles.Memmaps import point_source
+    from ..camxfiles.point_source.Write import ncf2point_source
+    template = _template(point_source, 'point_source', 'camx')
+    out = _tile(template, dict(TSTEP = ntimes, NSTK = nstk), seed = seed)
+    # stack locations are spread across the domain
+    rs = np.random.RandomState(seed + 1)
+    for key, org, cell, n in [('XSTK', 'XORIG', 'XCELL', 'NCOLS'), ('YSTK', 'YORIG', 'YCELL', 'NROWS')]:
+        if key in out.variables:
+            loc = float(getattr(out, org)) + rs.uniform(0, float(getattr(out, cell)) * int(getattr(out, n)), size = nstk)
+            out.variables[key][:] = loc.astype(out.variables[key].dtype)
+    _settflag(out, ntimes)
+    ncf2point_source(out, path).close()
+    return path
+
+def make_lateral_boundary(path, ntimes = 24, nlays = 5, nrows = 60, ncols = 70, seed = 0, **ignore):
+    """
+    Write a CAMx lateral_boundary file with ntimes hours, nlays layers
+    and boundaries for nrows by ncols cells
+    """
+    from ..camxfiles.Memmaps import lateral_boundary
+    from ..camxfiles.lateral_boundary.Write import ncf2lateral_boundary
+    template = _template(lateral_boundary, 'lateral_boundary', 'camx')
+    out = _tile(template, dict(TSTEP = ntimes, LAY = nlays, ROW = nrows, COL = ncols), seed = seed)
+    out.NLAYS, out.NROWS, out.NCOLS = nlays, nrows, ncols
+    _settflag(out, ntimes)
+    out._boundary_def = OrderedDict()
+    for iedge, (bkey, bdim) in enumerate([('WEST', nrows), ('EAST', nrows), ('SOUTH', ncols), ('NORTH', ncols)]):
+        indef = template._boundary_def[bkey]
+        bound_fmt = np.dtype(dict(names = ['SPAD', 'ione', 'iedge', 'ncell', 'edgedata', 'EPAD'], formats = ['>i', '>i', '>i', '>i', '(%d,%d)>i' % (bdim, 4), '>i']))
+        bdef = np.zeros((1,), dtype = bound_fmt)
+        bdef['SPAD'] = bdef['EPAD'] = bound_fmt.itemsize - 8
+        bdef['ione'] = indef['ione']
+        bdef['iedge'] = indef['iedge']
+        bdef['ncell'] = bdim
+        bdef['edgedata'][0] = np.take(indef['edgedata'][0], np.arange(bdim) % indef['edgedata'].shape[1], axis = 0)
+        out._boundary_def[bkey] = bdef
+    ncf2lateral_boundary(out, path).close()
+    return path
+
+def make_bpch(path, ntimes = 24, nrows = 60, ncols = 70, seed = 0, **ignore):
+    """
+    Write a GEOS-Chem bpch file (and tracerinfo.dat and diaginfo.dat in
+    the same directory) with ntimes outputs on an nrows by ncols window
+    of the global 2 x 2.5 grid (at most 91 by 144) starting at the
+    south west corner
+    """
+    from ..geoschemfiles import bpch
+    from ..geoschemfiles._bpch import ncf2bpch
+    template = _template(bpch, 'bpch', 'geoschem')
+    nrows = min(nrows, 91)
+    ncols = min(ncols, 144)
+    out = _tile(template, dict(time = ntimes, latitude = nrows, longitude = ncols), seed = seed)
+    for var in out.variables.values():
+        if hasattr(var, 'STARTI'):
+            var.STARTI = var.STARTJ = 0
+    out.variables['tau0'][:] = template.variables['tau0'][0] + np.arange(ntimes)
+    out.variables['tau1'][:] = out.variables['tau0'][:] + 1
+    out._tracerinfofile = template._tracerinfofile
+    out._diaginfofile = template._diaginfofile
+    ncf2bpch(out, path).close()
+    return path
+
+def make_arl(path, ntimes = 24, nlays = 5, nrows = 60, ncols = 70, seed = 0, **ignore):
+    """
+    Write a NOAA ARL packed-bit file with ntimes hours, nlays layers and
+    nrows by ncols cells with surface (PRSS, T02M, U10M, V10M) and layer
+    (TEMP, UWND, VWND, SPHU) variables
+    """
+    from ..sci_var import PseudoNetCDFFile
+    from ..noaafiles._arl import writearlpackedbit, thdtype
+    # the index record (header and variable definitions) must fit in
+    # one record of 50 + nrows * ncols bytes
+    minncell = thdtype.itemsize + 108 + (8 + 8 * 4) * (nlays + 1) - 50
+    if nrows * ncols < minncell:
+        raise ValueError('ARL records need nrows * ncols >= %d; got %d' % (minncell, nrows * ncols))
+    rs = np.random.RandomState(seed)
+    f = PseudoNetCDFFile()
+    for key in thdtype.names:
+        setattr(f, key, ' ' * thdtype[key].itemsize)
+    f.YYMMDDHHFF = b'1601010000'
+    f.LEVEL = b' 0'
+    f.GRID = b'99'
+    f.INDX = b'INDX'
+    f.Z1 = b'   0'
+    f.SRCE = b'SYNT'
+    f.MGRID = b' 99'
+    f.VSYS = b' 2'
+    for key, val in [('POLLAT', 90.), ('POLLON', 0.), ('REFLAT', .25), ('REFLON', .25),
+                     ('GRIDX', 0.), ('ORIENT', 0.), ('TANLAT', 90.), ('SYNCHX', 1.),
+                     ('SYNCHY', 1.), ('SYNCHLAT', 20.), ('SYNCHLON', -130.), ('RESERVED', 0.)]:
+        setattr(f, key, ('%7.2f' % val).encode('ascii'))
+    f.VSYS2 = b' 1'
+    f.SFCVGLVL = 1.
+    f.createDimension('time', ntimes)
+    f.createDimension('z', nlays)
+    f.createDimension('y', nrows)
+    f.createDimension('x', ncols)
+    timev = f.createVariable('time', 'i', ('time',))
+    timev.units = 'hours since 2016-01-01 00:00:00'
+    timev[:] = np.arange(ntimes)
+    z = f.createVariable('z', 'f', ('z',))
+    z[:] = np.linspace(.99, .5, nlays)
+    y, x = np.meshgrid(np.linspace(0, 1, nrows), np.linspace(0, 1, ncols), indexing = 'ij')
+    smooth = np.sin(np.pi * x) * np.cos(np.pi * y)
+    vheadprops = dict(grid = b'99', VKEY = b'    ')
+    for key, base, scale, dims in [('PRSS', 1000., 20., ('time', 'y', 'x')), ('T02M', 290., 10., ('time', 'y', 'x')),
+                                   ('U10M', 0., 5., ('time', 'y', 'x')), ('V10M', 0., 5., ('time', 'y', 'x')),
+                                   ('TEMP', 280., 10., ('time', 'z', 'y', 'x')), ('UWND', 0., 10., ('time', 'z', 'y', 'x')),
+                                   ('VWND', 0., 10., ('time', 'z', 'y', 'x')), ('SPHU', .005, .003, ('time', 'z', 'y', 'x'))]:
+        shape = tuple([len(f.dimensions[dk]) for dk in dims])
+        vals = base + scale * (smooth + .1 * rs.normal(size = shape))
+        var = f.createVariable(key, 'f', dims, values = vals.astype('f'))
+        for pk, pv in vheadprops.items():
+            setattr(var, pk, pv)
+    writearlpackedbit(f, path)
+    return path
+
+def make_icartt(path, npoints = 10000, seed = 0, **ignore):
+    """
+    Write an ICARTT (ffi1001) file with npoints records
+    """
+    from ..icarttfiles.ffi1001 import ffi1001, ncf2ffi1001
+    template = _template(ffi1001, 'ffi1001', 'icartt')
+    out = _tile(template, dict(POINTS = npoints), seed = seed)
+    rs = np.random.RandomState(seed)
+    start = np.asarray(template.variables[template.INDEPENDENT_VARIABLE][0])
+    for key, var in out.variables.items():
+        if key.endswith('_UTC'):
+            var[:] = start + np.arange(npoints) + (var[0] - start)
+        else:
+            var[:] = np.asarray(var[:]) * rs.uniform(.5, 1.5, size = npoints)
+    ncf2ffi1001(out, path).close()
+    return path
+
+def make_ioapi(path, ntimes = 24, nlays = 5, nrows = 60, ncols = 70, seed = 0, **ignore):
+    """
+    Write an IOAPI NetCDF (NETCDF3_CLASSIC) file with ntimes hours,
+    nlays layers and nrows by ncols cells (21 species)
+    """
+    from ..camxfiles.Memmaps import uamiv
+    from ..pncgen import Pseudo2NetCDF
+    template = _template(uamiv, 'uamiv', 'camx')
+    species = [k for k, v in template.variables.items() if v.dimensions == ('TSTEP', 'LAY', 'ROW', 'COL')]
+    skipkeys = [k for k in template.variables.keys() if k not in species + ['TFLAG']]
+    out = _tile(template, dict(TSTEP = ntimes, LAY = nlays, ROW = nrows, COL = ncols), seed = seed, skipkeys = skipkeys)
+    out.NLAYS, out.NROWS, out.NCOLS, out.NVARS = nlays, nrows, ncols, len(species)
+    out.VGLVLS = np.linspace(1, 0, nlays + 1).astype('f')
+    _settflag(out, ntimes)
+    for pk in ('PLON', 'PLAT', 'TLAT1', 'TLAT2', 'IUTM', 'ISTAG', 'CPROJ', 'NAME', 'NOTE', 'ITZON'):
+        if pk in out.ncattrs():
+            delattr(out, pk)
+    Pseudo2NetCDF(verbose = 0).convert(out, path, format = 'NETCDF3_CLASSIC').close()
+    return path
+
+# format name: (generator, reader format for -f)
+generators = OrderedDict()
+generators['uamiv'] = (make_uamiv, 'uamiv')
+generators['point_source'] = (make_point_source, 'point_source')
+generators['lateral_boundary'] = (make_lateral_boundary, 'lateral_boundary')
+generators['bpch'] = (make_bpch, 'bpch')
+generators['arlpackedbit'] = (make_arl, 'arlpackedbit')
+generators['ffi1001'] = (make_icartt, 'ffi1001')
+generators['ioapi'] = (make_ioapi, 'netcdf')
+
+def synthesize(fmt, outdir, size = 'small', seed = 0, **kwds):
+    """
+    Write a synthetic fmt file in outdir and return its path
+
+    fmt - key of generators
+    size - key of sizes
+    kwds - override size parameters (e.g., ntimes = 48)
+    """
+    make, readerfmt = generators[fmt]
+    opts = dict(sizes[size])
+    opts.update(kwds)
+    path = os.path.join(outdir, 'synthetic.' + fmt)
+    make(path, seed = seed, **opts)
+    return path
+
+class TestSynthetic(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def testGenerators(self):
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from .._getreader import getreaderdict
+        readers = getreaderdict()
+        opts = sizes['tiny']
+        expected = dict(uamiv = ('O3', (2, 2, 20, 25)),
+                        point_source = ('NO', (2, 10)),
+                        lateral_boundary = ('WEST_O3', (2, 20, 2)),
+                        arlpackedbit = ('TEMP', (2, 2, 20, 25)),
+                        ffi1001 = ('Start_UTC', (50,)),
+                        ioapi = ('O3', (2, 2, 20, 25)))
+        for fmt in generators:
+            tmpdir = mkdtemp()
+            try:
+                path = synthesize(fmt, tmpdir, size = 'tiny')
+                f = readers[generators[fmt][1]](path)
+                if fmt == 'bpch':
+                    self.assertEqual(len(f.dimensions['time']), opts['ntimes'])
+                    self.assertEqual(len(f.dimensions['latitude']), opts['nrows'])
+                    continue
+                key, shape = expected[fmt]
+                self.assertEqual(f.variables[key].shape, shape)
+                if fmt != 'ffi1001':
+                    self.assert_(np.isfinite(f.variables[key][:]).all())
+            finally:
+                rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
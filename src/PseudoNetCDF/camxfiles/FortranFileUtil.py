@@ -1,5 +1,5 @@
 from __future__ import print_function, unicode_literals
-__all__ = ['platform_is_bigendian', 'freadnumpy', 'freadstruct', 'fread', 'needs_byteswap', 'check_read', 'RecordFile', 'unpack_from_file', 'seek_to_record', 'read_into', 'writeline', 'OpenRecordFile', 'Int2Asc', 'Asc2Int']
+__all__ = ['platform_is_bigendian', 'freadnumpy', 'freadstruct', 'fread', 'needs_byteswap', 'check_read', 'RecordFile', 'unpack_from_file', 'seek_to_record', 'read_into', 'writeline', 'OpenRecordFile', 'Int2Asc', 'Asc2Int', 'record_dtype', 'check_record_pads', 'count_leading']
 
 __doc__ = """
 .. _FortranFileUtil
@@ -315,6 +315,39 @@ def OpenRecordFile(rf):
     rf._newrecord(0)
     return rf
 
+def record_dtype(*fields):
+    """
+    Structured dtype of one big-endian Fortran unformatted record; fields
+    are numpy dtype field tuples between the leading and trailing record
+    lengths (pad1 and pad2).  A memmap with this dtype exposes each field
+    as a strided view without copying.
+    """
+    return np.dtype([('pad1', '>i4')] + list(fields) + [('pad2', '>i4')])
+
+def check_record_pads(records):
+    """
+    Raise ValueError unless the record lengths around the first and last
+    of records (an array of record_dtype) agree with the record size;
+    checks the layout without touching the rest of the file
+    """
+    nbytes = records.dtype.itemsize - 8
+    first = records[(0,) * records.ndim]
+    last = records[(-1,) * records.ndim]
+    if not (array([first['pad1'], first['pad2'], last['pad1'], last['pad2']]) == nbytes).all():
+        raise ValueError('Fortran unformatted record start and end padding do not match %d byte records' % nbytes)
+
+def count_leading(values, chunk = 256):
+    """
+    Number of leading elements of values that equal values[0]; values is
+    compared a chunk at a time so only leading elements are read
+    """
+    first = values[0]
+    for start in range(0, len(values), chunk):
+        diff, = np.where(values[start:start + chunk] != first)
+        if diff.size > 0:
+            return start + int(diff[0])
+    return len(values)
+
 def Int2Asc(mspec):
     """Some CAMx input files have text stored as
     integers.  This function helps to undo that
@@ -367,6 +400,11 @@ class TestFileUtils(unittest.TestCase):
         self.failIf(self.tmprf.previous())
         self.assertEquals(self.tmprf.tell(),4)
         
+    def testCountLeading(self):
+        self.assertEqual(count_leading(array([1, 1, 1, 2, 1])), 3)
+        self.assertEqual(count_leading(array([1] * 300 + [2]), chunk = 256), 300)
+        self.assertEqual(count_leading(zeros(600), chunk = 256), 600)
+
     def testFloat(self):
         from numpy import arange
         self.tmprf._newrecord(0)
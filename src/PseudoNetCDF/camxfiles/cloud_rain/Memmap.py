@@ -29,7 +29,7 @@ import numpy as np
 
 #This Package modules
 from PseudoNetCDF.camxfiles.timetuple import timediff, timeadd
-from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc
+from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc,record_dtype,check_record_pads
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
@@ -72,7 +72,6 @@ class cloud_rain(PseudoNetCDFFile):
         f.seek(0, 2)
         flen = f.tell()
         offset = struct.unpack('>i', open(rf, 'rb').read(4))[0] + 8
-        self.__memmap = memmap(rf, dtype = '>f', mode = 'r', offset = offset)
         ncols, nrows, nlays = struct.unpack({35:'>i15ciiii', 40:'>i20ciiii'}[offset], open(rf, 'rb').read(offset))[-4:-1]
         self.createDimension('COL', ncols)
         self.createDimension('ROW', nrows)
@@ -87,7 +86,11 @@ class cloud_rain(PseudoNetCDFFile):
             
         self.createDimension('DATE-TIME', 2)
         self.VERSION, varkeys = {35:('<4.3', ['CLOUD', 'PRECIP', 'COD', 'TFLAG']), 40:('4.3', ['CLOUD', 'RAIN', 'SNOW', 'GRAUPEL', 'COD', 'TFLAG'])}[offset]
-        self.createDimension('TSTEP', (flen - offset) // ((len(varkeys) - 1) * nlays * (nrows * ncols + 2) * 4 + 16))
+        # each hour is a time record and a record for each layer and
+        # variable; a memmap of hours exposes each variable as a view
+        step = dtype([('head', record_dtype(('time', '>f4'), ('date', '>i4'))), ('data', record_dtype(('data', '>f4', (nrows, ncols))), (nlays, len(varkeys) - 1))])
+        self.__memmap = memmap(rf, dtype = step, mode = 'r', offset = offset, shape = ((flen - offset) // step.itemsize,))
+        self.createDimension('TSTEP', self.__memmap.shape[0])
         self.createDimension('VAR', len(varkeys) - 1)
         
         self.NVARS = len(self.dimensions['VAR'])
@@ -96,64 +99,28 @@ class cloud_rain(PseudoNetCDFFile):
         self.NCOLS = len(self.dimensions['COL'])
         self.FTYPE = 1
         
+        self.__varkeys = varkeys[:-1]
         self.variables = PseudoNetCDFVariables(self.__var_get, varkeys)
         
         self.SDATE,self.STIME = self.variables['TFLAG'][0, 0, :]
 
-    def __set_var(self, key, vals_idx):
-        times = len(self.dimensions['TSTEP'])
-        lays = len(self.dimensions['LAY'])
-        rows = len(self.dimensions['ROW'])
-        cols = len(self.dimensions['COL'])
-        v = PseudoNetCDFVariable(self, key, 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = self.__memmap[vals_idx].reshape(times, lays, rows, cols))
+    def __set_var(self, key, vals):
+        v = PseudoNetCDFVariable(self, key, 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = vals)
         v.units = {'COD':'None'}.get(key, 'g/m**3')
         v.long_name = key
         v.var_desc = key
         self.variables[key] = v
         
     def __var_get(self, key):
-        times = len(self.dimensions['TSTEP'])
-        rows = len(self.dimensions['ROW'])
-        cols = len(self.dimensions['COL'])
-        lays = len(self.dimensions['LAY'])
-        vars = len(list(self.variables.keys())) - 1
-        hour = 1
-        date = 2
-        cloud = 3
-        rain = 4
-        snow = 5
-        graupel = 6
-        cod = 7
-        stagger = 8
-        out_idx = zeros(self.__memmap.shape,dtype = 'b')
-        out_idx.reshape(times, lays * vars * (rows * cols + 2) + 4)[:,1] = hour
-        out_idx.reshape(times, lays * vars * (rows * cols + 2) + 4)[:,2] = date
+        head = self.__memmap['head']
+        data = self.__memmap['data']
+        check_record_pads(head)
+        check_record_pads(data)
         
-        self.variables['TFLAG'] = ConvertCAMxTime(self.__memmap[out_idx==date].view('>i'), self.__memmap[out_idx==hour], len(self.dimensions['VAR']))
+        self.variables['TFLAG'] = ConvertCAMxTime(head['date'], head['time'], len(self.dimensions['VAR']))
         
-        val_shape = out_idx.reshape(times, lays * vars * (rows * cols + 2) + 4)[:,4:].reshape(times, lays, vars, rows * cols + 2)[:, :,:,1:-1].reshape(times, lays, vars, rows, cols)
-        if self.VERSION=='<4.3':
-            val_shape[:, :,0, :, :] = cloud
-            val_shape[:, :,1, :, :] = rain
-            val_shape[:, :,2, :, :] = cod
-            self.__set_var('CLOUD', out_idx==cloud)
-            self.__set_var('PRECIP', out_idx==rain)
-            self.__set_var('COD', out_idx==cod)
-        else:
-            val_shape[:, :,0, :, :] = cloud
-            val_shape[:, :,1, :, :] = rain
-            val_shape[:, :,2, :, :] = snow
-            val_shape[:, :,3, :, :] = graupel
-            val_shape[:, :,4, :, :] = cod
-            self.__set_var('CLOUD', out_idx==cloud)
-            self.__set_var('RAIN', out_idx==rain)
-            self.__set_var('SNOW', out_idx==snow)
-            self.__set_var('GRAUPEL', out_idx==graupel)
-            self.__set_var('COD', out_idx==cod)
-        
-        buf = self.__memmap[out_idx==0].reshape(vars * times * lays + times, 2)
-        if not (buf[:,0]==buf[:,1]).all():
-            raise ValueError("Buffer")
+        for vi, vark in enumerate(self.__varkeys):
+            self.__set_var(vark, data['data'][:, :, vi])
         
         return self.variables[key]
 
@@ -20,12 +20,13 @@ __version__ = RevisionNum
 #Distribution packages
 import unittest
 import struct
+import os
 
 #Site-Packages
 from numpy import zeros,array,where,memmap,newaxis,dtype,nan
 
 #This Package modules
-from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc
+from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc,record_dtype,check_record_pads,count_leading
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
@@ -66,31 +67,31 @@ class height_pressure(PseudoNetCDFFile):
     id_fmt='fi'
     data_fmt='f'
     def __init__(self,rf,rows=None,cols=None):
-        self.__memmap=memmap(rf,'>f','r',offset=0)
-        rowsXcols=self.__memmap[0].view('i')/4-2
-        record_length=rowsXcols+4
-        records=self.__memmap.size/record_length
-        
-        times=self.__memmap.reshape(records,record_length)[:,1:3]
-        self.STIME,self.SDATE=times[0]
-        for i,(t,d) in enumerate(times):
-            if (t,d)!=(self.STIME,self.SDATE):
-                break
-        self.SDATE=self.SDATE.view('i')
-        self.createDimension('LAY',i/2)
-        self.createDimension('TSTEP',times.shape[0]/i)
+        # each record is time, date and one layer of HGHT or PRES
+        rowsXcols=int(memmap(rf,'>i','r',shape=(1,))[0])//4-2
         
         if rows==None and cols==None:
             rows=rowsXcols
             cols=1
         elif rows==None:
-            rows=rowsXcols/cols
+            rows=rowsXcols//cols
         elif cols==None:
-            cols=rowsXcols/rows
+            cols=rowsXcols//rows
         else:
             if cols*rows!=rowsXcols:
                 raise ValueError("The product of cols (%d) and rows (%d) must equal cells (%d)" %  (cols,rows,rowsXcols))
         
+        recdtype=record_dtype(('time','>f4'),('date','>i4'),('data','>f4',(rows,cols)))
+        records=memmap(rf,recdtype,'r',shape=(os.path.getsize(rf)//recdtype.itemsize,))
+        # records of the first hour (2 per layer)
+        i=min(count_leading(records['time']),count_leading(records['date']))
+        self.STIME=records['time'][0]
+        self.SDATE=records['date'][0]
+        self.createDimension('LAY',i//2)
+        self.createDimension('TSTEP',records.shape[0]//i)
+        # zero-copy view (TSTEP, LAY, HGHT/PRES) of records
+        self.__records=records[:len(self.dimensions['TSTEP'])*i].reshape(len(self.dimensions['TSTEP']),i//2,2)
+        
         self.createDimension('ROW',rows)
         self.createDimension('COL',cols)
         self.createDimension('DATE-TIME',2)
@@ -107,32 +108,17 @@ class height_pressure(PseudoNetCDFFile):
         self.variables=PseudoNetCDFVariables(self.__var_get,['HGHT','PRES','TFLAG'])
     
     def __var_get(self,key):
-        lays=len(self.dimensions['LAY'])
-        times=len(self.dimensions['TSTEP'])
-        rows=len(self.dimensions['ROW'])
-        cols=len(self.dimensions['COL'])
-        hght=1
-        pres=2
-        time=3
-        date=4
-        out_idx=zeros(self.__memmap.shape,dtype='b').reshape(times,lays,2,rows*cols+4)
-        out_idx[:,:,0,3:-1]=hght
-        out_idx[:,:,1,3:-1]=pres
-        out_idx[:,:,:,1]=time
-        out_idx[:,:,:,2]=date
-        out_idx=out_idx.ravel()
-        buf=self.__memmap[out_idx==0].reshape(lays*2*times,2)
-        if not (buf[:,0]==buf[:,1]).all():
-            raise ValueError("Buffer")
-        v=self.variables['HGHT']=PseudoNetCDFVariable(self,'HGHT','f',('TSTEP','LAY','ROW','COL'),values=self.__memmap[out_idx==1].reshape(times,lays,rows,cols))
+        records=self.__records
+        check_record_pads(records)
+        v=self.variables['HGHT']=PseudoNetCDFVariable(self,'HGHT','f',('TSTEP','LAY','ROW','COL'),values=records['data'][:,:,0])
         v.units='m'
         v.long_name='HGHT'.ljust(16)
         v.var_desc='Top Height'
-        v=self.variables['PRES']=PseudoNetCDFVariable(self,'PRES','f',('TSTEP','LAY','ROW','COL'),values=self.__memmap[out_idx==2].reshape(times,lays,rows,cols))
+        v=self.variables['PRES']=PseudoNetCDFVariable(self,'PRES','f',('TSTEP','LAY','ROW','COL'),values=records['data'][:,:,1])
         v.units='hPA'
         v.long_name='PRES'.ljust(16)
         v.var_desc='Pressure at center'
-        self.variables['TFLAG']=ConvertCAMxTime(self.__memmap[out_idx==4][slice(None,None,len(self.dimensions['LAY'])*2)].view('>i'),self.__memmap[out_idx==3][slice(None,None,len(self.dimensions['LAY'])*2)],len(self.dimensions['VAR']))
+        self.variables['TFLAG']=ConvertCAMxTime(records['date'][:,0,0],records['time'][:,0,0],len(self.dimensions['VAR']))
         
         return self.variables[key]
 
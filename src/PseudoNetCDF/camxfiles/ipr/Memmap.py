@@ -20,6 +20,8 @@ __version__ = RevisionNum
 #Distribution packages
 import unittest
 import struct
+import os
+from functools import partial
 from warnings import warn
 from mmap import error as MemmapLimitError
 
@@ -79,13 +81,20 @@ class ipr(PseudoNetCDFFile):
     dt_fmt="if"
     data_fmt="f"
     
-    def __init__(self,rf,multi=False, **props):
+    def __init__(self,rf,multi=False, transpose_cache=False, **props):
         """
         Initialization included reading the header and learning
         about the format.
         
         see __readheader and __gettimestep() for more info
 
+        transpose_cache - False (default) reads processes directly from the
+                          interleaved records; True or a path writes (once)
+                          and uses a process-major sidecar file so that each
+                          process/species pair is contiguous on disk. True
+                          puts the sidecar next to the ipr file with a
+                          .prcmajor suffix.
+
         Keywords (i.e., props) for projection: P_ALP, P_BET, P_GAM, XCENT, YCENT, XORIG, YORIG, XCELL, YCELL
         """
         self.__rffile=OpenRecordFile(rf)
@@ -122,36 +131,49 @@ class ipr(PseudoNetCDFFile):
                 'EPAD']
         varkeys=['_'.join(i) for i in cartesian(prcs,self.spcnames)]
         varkeys+=['SPAD','DATE','TIME','PAGRID','NEST','I','J','K','TFLAG']
+        
+        # name -> (species index, record field) is the same for every
+        # domain; build it once so variable access is a dictionary hit
+        # rather than a scan of process names with prefix checks.
+        spclookup = dict([(spc, spci) for spci, spc in enumerate(self.spcnames)])
+        prclookup = dict([(prc + '_' + spc, (spclookup[spc], prc)) for prc, spc in cartesian(prcs, self.spcnames)])
+        prclookup.update([(prc, (0, prc)) for prc in varkeys[-9:-1]])
+        
+        # process fields that are float data (i.e., not record metadata)
+        self.__pm_prcs = [k for k in self.__ipr_record_type.names if self.__ipr_record_type[k].kind == 'f' and k != 'TIME']
         self.groups = {}
+        self.__ipr_lookup = {}
         NSTEPS = len([i_ for i_ in self.timerange()])
         NVARS = len(varkeys)
         self.createDimension('VAR', NVARS)
         self.createDimension('DATE-TIME', 2)
         self.createDimension('TSTEP', NSTEPS)
         padatatype = []
-        pavarkeys = []
+        pmdatatype = []
         for di, domain in enumerate(self.padomains):
             dk = 'PA%02d' % di
-            prefix = dk + '_'
             if len(self.padomains) == 1:
                 grp = self.groups[dk] = self
             else:
                 grp = self.groups[dk] = PseudoNetCDFFile()
-            pavarkeys.extend([prefix + k for k in varkeys])
             grp.createDimension('VAR', NVARS)
             grp.createDimension('DATE-TIME', 2)
             grp.createDimension('TSTEP', NSTEPS)
             grp.createDimension('COL', domain['iend'] - domain['istart'] + 1)
             grp.createDimension('ROW', domain['jend'] - domain['jstart'] + 1)
             grp.createDimension('LAY', domain['tlay'] - domain['blay'] + 1)
-            padatatype.append((dk, self.__ipr_record_type, (len(grp.dimensions['ROW']), len(grp.dimensions['COL']), len(grp.dimensions['LAY']))))
-            grp.varget  = eval("lambda k: self._ipr__variables('%s', k)""" % dk, dict(self = self), locals())
-            if len(self.padomains) == 1:
-                self.variables = PseudoNetCDFVariables(varget,varkeys)
-            else:
-                grp.variables = PseudoNetCDFVariables(varget,varkeys)
+            nrow, ncol, nlay = len(grp.dimensions['ROW']), len(grp.dimensions['COL']), len(grp.dimensions['LAY'])
+            padatatype.append((dk, self.__ipr_record_type, (nrow, ncol, nlay)))
+            pmdatatype.append((dk, '<f', (len(self.__pm_prcs), len(self.spcnames), NSTEPS, nlay, nrow, ncol)))
+            self.__ipr_lookup[dk] = dict([(k, (dk,) + v) for k, v in prclookup.items()])
+            grp.variables = PseudoNetCDFVariables(partial(self.__variables, dk), list(varkeys))
         
         self.__memmaps=memmap(self.__rffile.infile.name,dtype(padatatype),'r',self.data_start_byte).reshape(NSTEPS, len(self.spcnames))
+        self.__pmmemmap = None
+        if transpose_cache:
+            if transpose_cache is True:
+                transpose_cache = self.__rffile.infile.name + '.prcmajor'
+            self.__pmmemmap = self.__transpose(transpose_cache, dtype(pmdatatype))
         for k, v in props.items():
             setattr(self, k, v)
         try:
@@ -159,6 +181,33 @@ class ipr(PseudoNetCDFFile):
         except:
             pass
 
+    def __transpose(self, path, pmtype):
+        """
+        Return a memmap of a process-major copy of the float process
+        data (domain, process, species, time, layer, row, col). The copy
+        is written one time step at a time and is reused while it is
+        newer than the ipr file.
+        """
+        srcpath = self.__rffile.infile.name
+        if not (os.path.exists(path) and
+                os.path.getmtime(path) >= os.path.getmtime(srcpath) and
+                os.path.getsize(path) == pmtype.itemsize):
+            tmppath = path + '.tmp'
+            out = memmap(tmppath, pmtype, 'w+', shape = (1,))
+            for ti in range(self.__memmaps.shape[0]):
+                tvals = self.__memmaps[ti]
+                for dk in pmtype.names:
+                    dout = out[dk][0]
+                    dvals = tvals[dk]
+                    for pi, prc in enumerate(self.__pm_prcs):
+                        dout[pi, :, ti] = dvals[prc].transpose(0, 3, 1, 2)
+            out.flush()
+            del out
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmppath, path)
+        return memmap(path, pmtype, 'r', shape = (1,))
+
     def __del__(self):
         try:
             self.__memmaps.close()
@@ -182,23 +231,21 @@ class ipr(PseudoNetCDFFile):
         return pncfv
         
     def __variables(self,pk, proc_spc):
-        if proc_spc in self.__ipr_record_type.names:
-            proc=proc_spc
-            proc_spc=proc_spc+'_'+self.spcnames[0]
-            return PseudoNetCDFVariable(self,proc_spc,'f',('TSTEP','LAY','ROW','COL'),values=self.__memmaps[pk][:,0,:,:,:][proc].swapaxes(1, 3).swapaxes(2, 3))
         if proc_spc=='TFLAG':
-            thisdate = self.__memmaps[pk][:,0,:,:,:]['DATE'].swapaxes(1, 3).swapaxes(2, 3)[..., 0, 0, 0]
-            thistime = self.__memmaps[pk][:,0,:,:,:]['TIME'].swapaxes(1, 3).swapaxes(2, 3)[..., 0, 0, 0]
+            thisdate = self.__memmaps[pk][:,0,0,0,0]['DATE']
+            thistime = self.__memmaps[pk][:,0,0,0,0]['TIME']
             return ConvertCAMxTime(thisdate, thistime, len(self.groups[pk].dimensions['VAR']))
-        for k in self.__ipr_record_type.names:
-            proc=proc_spc[:len(k)]
-            spc=proc_spc[len(k)+1:]
-            if proc==k and spc in self.spcnames:
-                spc=self.spcnames.index(spc)
-                dvals = self.__memmaps[pk][:,spc][proc].swapaxes(1, 3).swapaxes(2, 3)
-                return self.__decorator(proc_spc,PseudoNetCDFVariable(self,proc_spc,'f',('TSTEP','LAY','ROW','COL'),values=dvals))
-        raise KeyError("Bad!")
-                
+        try:
+            dk, spc, proc = self.__ipr_lookup[pk][proc_spc]
+        except KeyError:
+            raise KeyError('%s not in %s' % (proc_spc, pk))
+        if self.__pmmemmap is not None and proc in self.__pm_prcs:
+            dvals = self.__pmmemmap[dk][0, self.__pm_prcs.index(proc), spc]
+        else:
+            dvals = self.__memmaps[dk][:,spc][proc].swapaxes(1, 3).swapaxes(2, 3)
+        if proc_spc == proc:
+            return PseudoNetCDFVariable(self,proc_spc+'_'+self.spcnames[0],'f',('TSTEP','LAY','ROW','COL'),values=dvals)
+        return self.__decorator(proc_spc,PseudoNetCDFVariable(self,proc_spc,'f',('TSTEP','LAY','ROW','COL'),values=dvals))
                 
     def __readheader(self):
         """
@@ -223,7 +270,7 @@ class ipr(PseudoNetCDFFile):
         
         self.spcnames = []
         for spc in range(self.__rffile.read("i")[-1]):
-            self.spcnames.append(char.decode(self.__rffile.read("10s")[-1]).strip())
+            self.spcnames.append(self.__rffile.read("10s")[-1].strip())
             
         self.nspec=len(self.spcnames)
         self.padomains=[]
@@ -262,10 +309,69 @@ class TestMemmap(unittest.TestCase):
     def runTest(self):
         pass
     def setUp(self):
-        pass
+        from tempfile import mkdtemp
+        from numpy import arange
+        from PseudoNetCDF.camxfiles.FortranFileUtil import writeline
+        self.tmpdir = mkdtemp()
+        self.iprpath = os.path.join(self.tmpdir, 'camx_ipr.bin')
+        self.spcnames = ['NO', 'O3']
+        self.shape = (2, 2, 3, 4) # TSTEP, LAY, ROW, COL
+        nt, nl, nr, nc = self.shape
+        out = open(self.iprpath, 'wb')
+        out.write(writeline(['test'.ljust(80).encode()], '80s'))
+        out.write(writeline([5185, 0., 5185, 200.], 'ifif'))
+        out.write(writeline([1], 'i'))
+        out.write(writeline([0, 0, nc, nr, 4000, 4000], 'iiiiii'))
+        out.write(writeline([len(self.spcnames)], 'i'))
+        for spc in self.spcnames:
+            out.write(writeline([spc.ljust(10).encode()], '10s'))
+        out.write(writeline([1], 'i'))
+        out.write(writeline([1, 1, nc, 1, nr, 1, nl], 'iiiiiii'))
+        out.write(writeline([24], 'i'))
+        for pi in range(24):
+            out.write(writeline([('P%02d' % pi).ljust(25).encode()], '25s'))
+        # CHEM holds a unique value per time, species, layer, row, col
+        self.chem = arange(nt * len(self.spcnames) * nl * nr * nc, dtype = 'f').reshape(nt, len(self.spcnames), nl, nr, nc)
+        for ti, time in enumerate([100., 200.]):
+            for si, spc in enumerate(self.spcnames):
+                for ri in range(nr):
+                    for ci in range(nc):
+                        for li in range(nl):
+                            prcvals = [0.] * 24
+                            prcvals[1] = self.chem[ti, si, li, ri, ci]
+                            prcvals[2] = -self.chem[ti, si, li, ri, ci]
+                            out.write(writeline([5185, time, spc.ljust(10).encode(), 1, 1, ci + 1, ri + 1, li + 1] + prcvals, ipr.id_fmt + '24f'))
+        out.close()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
         
     def testIPR(self):
-        warn('Test not implemented')
+        iprfile = ipr(self.iprpath)
+        self.assertEqual(iprfile.spcnames, self.spcnames)
+        for si, spc in enumerate(self.spcnames):
+            chem = iprfile.variables['CHEM_' + spc]
+            self.assertEqual(chem.shape, self.shape)
+            self.assert_((chem == self.chem[:, si]).all())
+            self.assert_((iprfile.variables['EMIS_' + spc] == -self.chem[:, si]).all())
+        self.assert_((iprfile.variables['TFLAG'][:, 0] == [[2005185, 10000], [2005185, 20000]]).all())
+        self.assertRaises(KeyError, lambda: iprfile.variables['CHEM_NO2'])
+
+    def testIPRTransposeCache(self):
+        iprfile = ipr(self.iprpath, transpose_cache = True)
+        self.assert_(os.path.exists(self.iprpath + '.prcmajor'))
+        for si, spc in enumerate(self.spcnames):
+            chem = iprfile.variables['CHEM_' + spc]
+            self.assertEqual(chem.shape, self.shape)
+            self.assert_(chem.flags['C_CONTIGUOUS'])
+            self.assert_((chem == self.chem[:, si]).all())
+            self.assert_((iprfile.variables['EMIS_' + spc] == -self.chem[:, si]).all())
+        # a second open reuses the sidecar
+        mtime = os.path.getmtime(self.iprpath + '.prcmajor')
+        iprfile = ipr(self.iprpath, transpose_cache = True)
+        self.assertEqual(mtime, os.path.getmtime(self.iprpath + '.prcmajor'))
+        self.assert_((iprfile.variables['CHEM_O3'] == self.chem[:, 1]).all())
        
 if __name__ == '__main__':
     unittest.main()
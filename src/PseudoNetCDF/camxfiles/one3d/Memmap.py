@@ -20,13 +20,14 @@ __version__ = RevisionNum
 #Distribution packages
 import unittest
 import struct
+import os
 
 #Site-Packages
 from numpy import zeros,array,where,memmap,newaxis,dtype,nan
 
 #This Package modules
 from PseudoNetCDF.camxfiles.timetuple import timediff,timeadd
-from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc
+from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc,record_dtype,check_record_pads,count_leading
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
@@ -80,22 +81,16 @@ class one3d(PseudoNetCDFFile):
         
         self.rffile=rf
 
-        self.__memmap=memmap(self.rffile,'>f','r',offset=0)
+        # each record is time, date and one layer
+        recdtype=record_dtype(('time','>f4'),('date','>i4'),('data','>f4',(rows,cols)))
+        records=memmap(self.rffile,recdtype,'r',shape=(os.path.getsize(self.rffile)//recdtype.itemsize,))
 
-        self.__record_items=rows*cols+4
+        lays=min(count_leading(records['time']),count_leading(records['date']))
+        time_steps=records.shape[0]//lays
 
-        self.__records=self.__memmap.shape[0]/self.__record_items
-        time_date=array(self.__memmap.reshape(self.__records,self.__record_items)[:,1:3])
-
-        lays=where(time_date!=time_date[newaxis,0])[0][0]
-
-        new_hour=slice(0,None,lays)
-
-        dates=time_date[:,1].view('>i')
-        times=time_date[:,0]
-
-        self.__tflag=array([dates[new_hour],times[new_hour]],dtype='>f').swapaxes(0,1)
-        time_steps=self.__records/lays
+        # zero-copy view (TSTEP, LAY) of records
+        self.__records=records[:time_steps*lays].reshape(time_steps,lays)
+        self.__tflag=array([self.__records['date'][:,0],self.__records['time'][:,0]],dtype='>f').swapaxes(0,1)
 
         self.createDimension('VAR', 1)
         self.createDimension('TSTEP', time_steps)
@@ -122,11 +117,8 @@ class one3d(PseudoNetCDFFile):
         return pncfv
         
     def __variables(self,k):
-        tsteps=len(self.dimensions['TSTEP'])
-        lays=len(self.dimensions['LAY'])
-        rows=len(self.dimensions['ROW'])
-        cols=len(self.dimensions['COL'])
-        return self.__decorator(k,PseudoNetCDFVariable(self,k,'f',('TSTEP','LAY','ROW','COL'),values=self.__memmap.reshape(self.__records,self.__record_items)[:,3:-1].reshape(tsteps,lays,rows,cols)))
+        check_record_pads(self.__records)
+        return self.__decorator(k,PseudoNetCDFVariable(self,k,'f',('TSTEP','LAY','ROW','COL'),values=self.__records['data']))
 
 class TestMemmap(unittest.TestCase):
     def runTest(self):
@@ -94,7 +94,7 @@ class point_source(PseudoNetCDFFile):
         self.__time_hdr_fmt=dtype(dict(names=['SPAD','ibdate','btime','iedate','etime','EPAD'],formats=[ep+'i',ep+'i',ep+'f',ep+'i',ep+'f',ep+'i']))
         self.__nstk_hdr_fmt=dtype(dict(names=['SPAD','ione','nstk','EPAD'],formats=[ep+'i',ep+'i',ep+'i',ep+'i']))
         self.__stk_prop_fmt=dtype(dict(names=['XSTK','YSTK','HSTK','DSTK','TSTK','VSTK'],formats=[ep+'f',ep+'f',ep+'f',ep+'f',ep+'f',ep+'f']))
-        self.__stk_time_prop_fmt=dtype(dict(names=['IONE','ITWO','KCELL','FLOW','PLMHT'],formats=[ep+'i',ep+'i',ep+'f',ep+'f',ep+'f']))
+        self.__stk_time_prop_fmt=dtype(dict(names=['IONE','ITWO','KCELL','FLOW','PLMHT'],formats=[ep+'i',ep+'i',ep+'i',ep+'f',ep+'f']))
 
         self.__globalheader()
         varkeys=['ETFLAG', 'TFLAG', 'XSTK', 'YSTK', 'HSTK', 'DSTK', 'TSTK', 'VSTK', 'IONE', 'ITWO', 'KCELL', 'FLOW', 'PLMHT', 'NSTKS']+[i.strip() for i in self.__spc_names]
@@ -168,6 +168,22 @@ class point_source(PseudoNetCDFFile):
     def __getspcidx(self,spc):
         return self.__spc_names.index(spc)
 
+    def stack_table(self):
+        """
+        Return stack parameters (XSTK, YSTK, HSTK, DSTK, TSTK, VSTK) as a
+        structured array with shape (NSTK,) that views the file
+        """
+        return self.__stk_props.reshape(-1)
+
+    def hourly_stack_table(self):
+        """
+        Return time varying stack parameters (IONE, ITWO, KCELL, FLOW, PLMHT)
+        as a structured array with shape (TSTEP, NSTK) that views the file
+        """
+        props = self.__hourly_stk_props
+        offset = props.__array_interface__['data'][0] - self.__memmap.__array_interface__['data'][0]
+        return np.ndarray(props.shape[:2], dtype = self.__stk_time_prop_fmt, buffer = self.__memmap, offset = offset, strides = props.strides[:2])
+
     def __time_stks(self):
         ep = self.__endianprefix
         i=offset=0
@@ -229,12 +245,10 @@ class point_source(PseudoNetCDFFile):
             return v
         elif k in ['IONE', 'ITWO', 'KCELL','FLOW','PLMHT']:
             data_type={'IONE':'i', 'ITWO':'i', 'KCELL':'i','FLOW':'f','PLMHT':'f'}[k]
-            v=self.createVariable(k,data_type,('TSTEP','NSTK'))
+            v=PseudoNetCDFVariable(self,k,data_type,('TSTEP','NSTK'),values=self.hourly_stack_table()[k])
             v.units={'IONE':'#', 'ITWO':'#', 'KCELL':'#', 'FLOW':'m**3/hr', 'PLMHT':'m'}[k]
             v.long_name=k.ljust(16)
             v.var_desc=k.ljust(16)
-            vals = self.__hourly_stk_props[:,:,['IONE','ITWO','KCELL','FLOW','PLMHT'].index(k)]
-            v[:] = vals.view('>' + data_type)
             return v
         elif k in self.__spc_names:
             v=PseudoNetCDFVariable(self,k,'f',('TSTEP','NSTK'),values=self.__emiss_data[:,self.__getspcidx(k),:])
@@ -257,6 +271,18 @@ class TestMemmap(unittest.TestCase):
         v = emissfile.variables['NO2']
         self.assert_((v[:] == np.array([  0.00000000e+00, 3.12931000e+02, 1.23599997e+01, 0.00000000e+00, 5.27999992e+01, 0.00000000e+00, 3.12931000e+02, 1.23599997e+01, 0.00000000e+00, 5.27999992e+01], dtype = 'f').reshape(2,5)).all())
 
+    def testStackTable(self):
+        import PseudoNetCDF.testcase
+        emissfile=point_source(PseudoNetCDF.testcase.camxfiles_paths['point_source'])
+        stks = emissfile.stack_table()
+        self.assertEqual(stks.shape, (5,))
+        self.assert_((stks['HSTK'] == emissfile.variables['HSTK'][:]).all())
+        hstks = emissfile.hourly_stack_table()
+        self.assertEqual(hstks.shape, (2, 5))
+        self.assert_((hstks['KCELL'] == 1).all())
+        self.assert_((hstks['PLMHT'] == emissfile.variables['PLMHT'][:]).all())
+        self.assert_((emissfile.variables['IONE'][0] == [49, 50, 63, 39, 57]).all())
+
     def testNCF2PT(self):
         import PseudoNetCDF.testcase
         from PseudoNetCDF.pncgen import pncgen
@@ -0,0 +1,173 @@
+__all__ = ['grid_point_sources', 'sparse_point_sources']
+__doc__ = """
+.. _Transforms
+:mod:`Transforms` -- CAMx point_source transformations
+======================================================
+
+.. module:: Transforms
+   :platform: Unix, Windows
+   :synopsis: Provides :ref:`PseudoNetCDF` transformations for CAMx
+              point_source files: gridding stacks onto a model grid
+              and a sparse view of emissions.
+.. moduleauthor:: Barron Henderson <barronh@unc.edu>
+"""
+
+import unittest
+import numpy as np
+from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables
+
+_stack_keys = ('ETFLAG', 'TFLAG', 'XSTK', 'YSTK', 'HSTK', 'DSTK', 'TSTK', 'VSTK', 'IONE', 'ITWO', 'KCELL', 'FLOW', 'PLMHT', 'NSTKS')
+
+def _emission_keys(ps, spcs):
+    if spcs is None:
+        spcs = [k for k in ps.variables.keys() if k not in _stack_keys]
+    return list(spcs)
+
+def _effective_height(ps):
+    """
+    Plume height (TSTEP, NSTK) from PLMHT when it is set (CAMx uses the
+    absolute value of an override) and otherwise stack height (HSTK)
+    """
+    hstk = np.asarray(ps.variables['HSTK'][:])
+    if 'PLMHT' not in ps.variables.keys():
+        return hstk[None, :]
+    plmht = np.asarray(ps.variables['PLMHT'][:])
+    return np.where(plmht != 0, np.abs(plmht), hstk[None, :])
+
+def grid_point_sources(ps, gridfile, heights = None, spcs = None):
+    """
+    Bin point source emissions onto a model grid with dimensions
+    (TSTEP, LAY, ROW, COL).
+
+    ps - point_source file with XSTK, YSTK, HSTK (and optionally PLMHT)
+         and emission variables with dimensions (TSTEP, NSTK)
+    gridfile - file with IOAPI grid properties (XORIG, YORIG, XCELL, YCELL,
+               NCOLS, NROWS) in the same projected units as XSTK/YSTK
+    heights - layer top heights (m) as (LAY,) or (TSTEP, LAY, ROW, COL);
+              defaults to gridfile.variables['HGHT'] when available and
+              otherwise all emissions go into a single layer
+    spcs - emission variables to grid (default: all emission variables)
+
+    Cell indices are computed once from the stack coordinates and plume
+    heights; each species is then gridded with a single np.bincount when
+    it is accessed. Stacks outside the grid are ignored.
+    """
+    xorig, yorig = gridfile.XORIG, gridfile.YORIG
+    xcell, ycell = gridfile.XCELL, gridfile.YCELL
+    ncol, nrow = int(gridfile.NCOLS), int(gridfile.NROWS)
+    if heights is None and 'HGHT' in gridfile.variables.keys():
+        heights = gridfile.variables['HGHT']
+
+    col = np.floor((np.asarray(ps.variables['XSTK'][:]) - xorig) / xcell).astype('i')
+    row = np.floor((np.asarray(ps.variables['YSTK'][:]) - yorig) / ycell).astype('i')
+    inside, = np.where((col >= 0) & (col < ncol) & (row >= 0) & (row < nrow))
+    col = col[inside]
+    row = row[inside]
+    ntime = len(ps.dimensions['TSTEP'])
+    heff = np.broadcast_to(_effective_height(ps), (ntime, len(ps.dimensions['NSTK'])))[:, inside]
+    if heights is None:
+        nlay = 1
+        lay = np.zeros(heff.shape, dtype = 'i')
+    else:
+        heights = np.asarray(heights[:])
+        if heights.ndim == 1:
+            nlay = heights.shape[0]
+            lay = np.searchsorted(heights, heff, side = 'left')
+        else:
+            nlay = heights.shape[1]
+            lay = np.empty(heff.shape, dtype = 'i')
+            for ti in range(ntime):
+                # layer tops for each stack column in this hour (LAY, NSTK)
+                colheights = heights[min(ti, heights.shape[0] - 1)][:, row, col]
+                lay[ti] = (colheights < heff[ti][None, :]).sum(0)
+        lay = np.minimum(lay, nlay - 1)
+
+    ncell = nlay * nrow * ncol
+    cellidx = ((np.arange(ntime)[:, None] * nlay + lay) * nrow + row[None, :]) * ncol + col[None, :]
+    cellidx = cellidx.ravel()
+
+    outf = PseudoNetCDFFile()
+    for pk in ('XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS', 'GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT'):
+        if hasattr(gridfile, pk):
+            setattr(outf, pk, getattr(gridfile, pk))
+    outf.NLAYS = nlay
+    outf.createDimension('TSTEP', ntime).setunlimited(True)
+    outf.createDimension('LAY', nlay)
+    outf.createDimension('ROW', nrow)
+    outf.createDimension('COL', ncol)
+
+    def gridvar(k):
+        invar = ps.variables[k]
+        vals = np.asarray(invar[:])[:, inside]
+        out = np.bincount(cellidx, weights = vals.ravel(), minlength = ntime * ncell)
+        out = out.astype('f').reshape(ntime, nlay, nrow, ncol)
+        propd = dict([(pk, getattr(invar, pk)) for pk in invar.ncattrs()])
+        return PseudoNetCDFVariable(outf, k, 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = out, **propd)
+
+    outf.variables = PseudoNetCDFVariables(gridvar, _emission_keys(ps, spcs))
+    if 'TFLAG' in ps.variables.keys():
+        tflag = ps.variables['TFLAG']
+        for dk in tflag.dimensions[1:]:
+            outf.createDimension(dk, len(ps.dimensions[dk]))
+        outf.variables['TFLAG'] = tflag
+    return outf
+
+def sparse_point_sources(ps, spcs = None, threshold = 0.):
+    """
+    Return emissions whose absolute value exceeds threshold as a
+    structured array with fields TSTEP, NSTK, SPC (index into spcs)
+    and EMIS sorted by time, stack and species.
+
+    ps - point_source file
+    spcs - emission variables (default: all emission variables)
+    threshold - values with abs(value) <= threshold are dropped
+
+    Each species is scanned once, so only one dense (TSTEP, NSTK)
+    species is in memory at a time.
+    """
+    spcs = _emission_keys(ps, spcs)
+    outtype = np.dtype([('TSTEP', 'i'), ('NSTK', 'i'), ('SPC', 'i'), ('EMIS', 'f')])
+    parts = []
+    for si, spc in enumerate(spcs):
+        vals = np.asarray(ps.variables[spc][:])
+        tidx, sidx = np.nonzero(np.abs(vals) > threshold)
+        part = np.empty(tidx.shape, dtype = outtype)
+        part['TSTEP'] = tidx
+        part['NSTK'] = sidx
+        part['SPC'] = si
+        part['EMIS'] = vals[tidx, sidx]
+        parts.append(part)
+    out = np.concatenate(parts) if len(parts) > 0 else np.empty((0,), dtype = outtype)
+    return out[np.lexsort((out['SPC'], out['NSTK'], out['TSTEP']))]
+
+class TestTransforms(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        import PseudoNetCDF.testcase
+        from .Memmap import point_source
+        self.ps = point_source(PseudoNetCDF.testcase.camxfiles_paths['point_source'])
+
+    def testGrid(self):
+        ps = self.ps
+        gridded = grid_point_sources(ps, ps, heights = np.array([20., 50., 100.]))
+        no2 = gridded.variables['NO2']
+        self.assertEqual(no2.shape, (2, 3, ps.NROWS, ps.NCOLS))
+        self.assertAlmostEqual(no2[:].sum(), ps.variables['NO2'][:].sum(), 3)
+        col = int((ps.variables['XSTK'][1] - ps.XORIG) // ps.XCELL)
+        row = int((ps.variables['YSTK'][1] - ps.YORIG) // ps.YCELL)
+        # second stack has a 76.2 m plume, so it lands in the top layer
+        self.assertAlmostEqual(no2[0, 2, row, col], ps.variables['NO2'][0, 1], 3)
+        self.assert_((gridded.variables['TFLAG'][:] == ps.variables['TFLAG'][:]).all())
+
+    def testSparse(self):
+        ps = self.ps
+        sparse = sparse_point_sources(ps, spcs = ['NO', 'NO2'])
+        no2 = ps.variables['NO2'][:]
+        isno2 = sparse['SPC'] == 1
+        self.assertEqual(isno2.sum(), (no2 != 0).sum())
+        self.assert_((sparse['EMIS'][isno2] == no2[no2 != 0]).all())
+        self.assert_((np.diff(sparse['TSTEP']) >= 0).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,11 +9,12 @@ __doc__ = """
    based file interfaces for CAMx point source files.
 .. moduleauthor:: Barron Henderson <barronh@unc.edu>
 """
-__all__=['Memmap','Read','Write']
+__all__=['Memmap','Read','Write','Transforms']
 
 from . import Memmap
 from . import Read
 from . import Write
+from . import Transforms
 
 if __name__ == '__main__':
     from PseudoNetCDF.camxfiles.point_source.Memmap import point_source
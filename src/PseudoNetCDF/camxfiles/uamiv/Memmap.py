@@ -34,6 +34,17 @@ from PseudoNetCDF.camxfiles.units import get_uamiv_units, get_chemparam_names
 from PseudoNetCDF.conventions.ioapi import add_cf_from_ioapi
 #for use in identifying uncaught nan
 
+def _hdrfmts(ep):
+    """
+    Emission, grid, cell and time header record dtypes for endian
+    prefix ep ('>' or '<')
+    """
+    emiss_hdr_fmt=dtype(dict(names=['SPAD', 'name', 'note', 'itzon', 'nspec', 'ibdate', 'btime', 'iedate', 'etime', 'EPAD'], formats=[ep + 'i', '(10, 4)%sS1' % ep, '(60,4)%sS1' % ep, ep + 'i', ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
+    grid_hdr_fmt=dtype(dict(names=['SPAD', 'plon', 'plat', 'iutm', 'xorg', 'yorg', 'delx', 'dely', 'nx', 'ny', 'nz', 'iproj', 'istag', 'tlat1', 'tlat2', 'rdum', 'EPAD'], formats=[ep + 'i', ep + 'f', ep + 'f', ep + 'i', ep + 'f', ep + 'f', ep + 'f', ep + 'f', ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'f', ep + 'f', ep + 'f', ep + 'i']))
+    cell_hdr_fmt=dtype(dict(names=['SPAD', 'ione1', 'ione2', 'nx', 'ny', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'i']))
+    time_hdr_fmt=dtype(dict(names=['SPAD', 'ibdate', 'btime', 'iedate', 'etime', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
+    return emiss_hdr_fmt, grid_hdr_fmt, cell_hdr_fmt, time_hdr_fmt
+
 class uamiv(PseudoNetCDFFile):
     """
     uamiv provides a PseudoNetCDF interface for CAMx
@@ -80,10 +91,7 @@ class uamiv(PseudoNetCDFFile):
             self._aerosol_names = get_chemparam_names(chemparam)['aerosol']
         
         ep = self.__endianprefix = dict(big = '>', little = '<')[endian]
-        self.__emiss_hdr_fmt=dtype(dict(names=['SPAD', 'name', 'note', 'itzon', 'nspec', 'ibdate', 'btime', 'iedate', 'etime', 'EPAD'], formats=[ep + 'i', '(10, 4)%sS1' % ep, '(60,4)%sS1' % ep, ep + 'i', ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
-        self.__grid_hdr_fmt=dtype(dict(names=['SPAD', 'plon', 'plat', 'iutm', 'xorg', 'yorg', 'delx', 'dely', 'nx', 'ny', 'nz', 'iproj', 'istag', 'tlat1', 'tlat2', 'rdum', 'EPAD'], formats=[ep + 'i', ep + 'f', ep + 'f', ep + 'i', ep + 'f', ep + 'f', ep + 'f', ep + 'f', ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'f', ep + 'f', ep + 'f', ep + 'i']))
-        self.__cell_hdr_fmt=dtype(dict(names=['SPAD', 'ione1', 'ione2', 'nx', 'ny', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'i', ep + 'i']))
-        self.__time_hdr_fmt=dtype(dict(names=['SPAD', 'ibdate', 'btime', 'iedate', 'etime', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
+        self.__emiss_hdr_fmt, self.__grid_hdr_fmt, self.__cell_hdr_fmt, self.__time_hdr_fmt = _hdrfmts(ep)
         self.__spc_fmt=dtype("(10,4)%sS1" % ep)
         self.__rffile=rf
         self.__mode=mode
@@ -146,21 +154,17 @@ class uamiv(PseudoNetCDFFile):
         return flen
 
     @classmethod
-    def isMine(self, path):
-        offset=0
-        emiss_hdr = memmap(path,  mode = 'r', dtype = self.__emiss_hdr_fmt, shape = 1, offset = offset)
-        
-        if not emiss_hdr['SPAD'] == emiss_hdr['EPAD'] and emiss_hdr['SPAD'] == emiss_hdr.dtype.itemsize - 8:
-            return False
-        offset += emiss_hdr.dtype.itemsize * emiss_hdr.size
-
-        grid_hdr = memmap(path, mode = 'r', dtype = self.__grid_hdr_fmt, shape=1, offset=offset)
-        if not grid_hdr['SPAD'] == grid_hdr['EPAD'] and grid_hdr['SPAD'] == grid_hdr.dtype.itemsize - 8:
-            return False
-        offset += grid_hdr.dtype.itemsize * grid_hdr.size
-        cell_hdr = memmap(path, mode = 'r', dtype = self.__cell_hdr_fmt, shape=1, offset=offset)
-        if not cell_hdr['SPAD'] == cell_hdr['EPAD'] and cell_hdr['SPAD'] == cell_hdr.dtype.itemsize - 8:
-            return False
+    def isMine(cls, path):
+        """
+        True if the emission, grid and cell headers of path are big
+        endian Fortran records of the expected sizes
+        """
+        offset = 0
+        for fmt in _hdrfmts('>')[:3]:
+            hdr = memmap(path, mode = 'r', dtype = fmt, shape = 1, offset = offset)
+            if not (hdr['SPAD'] == hdr['EPAD'] and hdr['SPAD'] == hdr.dtype.itemsize - 8):
+                return False
+            offset += hdr.dtype.itemsize * hdr.size
         return True
         
     def __readheader(self):
@@ -267,8 +271,9 @@ class uamiv(PseudoNetCDFFile):
         pass
     
     def close(self):
+        # numpy memmaps have no close; the map is released with its
+        # last reference
         self.sync()
-        self.__memmap__.close()
         
 
 class TestMemmap(unittest.TestCase):
@@ -283,5 +288,10 @@ class TestMemmap(unittest.TestCase):
         v=emissfile.variables['NO2']
         self.assert_((v==array([ 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.24175494e-04, 2.79196858e-04, 1.01672206e-03, 4.36782313e-04, 0.00000000e+00, 1.54810550e-04, 3.90250643e-04, 6.18023798e-04, 3.36963218e-04, 0.00000000e+00, 1.85579920e-04, 1.96825975e-04, 2.16468165e-04, 2.19882189e-04], dtype='f').reshape(1, 1, 4, 5)).all())
 
+    def testIsMine(self):
+        import PseudoNetCDF.testcase
+        self.assert_(uamiv.isMine(PseudoNetCDF.testcase.camxfiles_paths['uamiv']))
+        self.assert_(not uamiv.isMine(PseudoNetCDF.testcase.camxfiles_paths['wind']))
+
 if __name__ == '__main__':
     unittest.main()
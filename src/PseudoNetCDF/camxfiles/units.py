@@ -9,7 +9,7 @@ _camx_units = {'EMISSIONS ': {True: 'g/time', False: 'mol/time'},
                'DEPOSITION': {True: 'g/ha', False: 'mol/ha'},}
 
 def get_chemparam_names(chemparampath):
-    inlines = open(chemparampath, 'rU').readlines()
+    inlines = open(chemparampath, 'r').readlines()
     startaero = None
     for li, l in enumerate(inlines):
         if l[:14] == "     Gas Spec ":
@@ -20,13 +20,14 @@ __version__ = RevisionNum
 #Distribution packages
 import unittest
 import struct
+import os
 
 #Site-Packages
 from numpy import zeros,array,where,memmap,newaxis,dtype,nan
 
 #This Package modules
 from PseudoNetCDF.camxfiles.timetuple import timediff,timeadd
-from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc
+from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,Int2Asc,record_dtype,check_record_pads
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables, OrderedDict
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
@@ -77,18 +78,17 @@ class wind(PseudoNetCDFFile):
         while rf.record_size==record_size:
             lays+=1
             rf.next()
-        self.__dummy_length=(rf.record_size+8)/4
+        dummy_size=rf.record_size
         lays//=2
-        record=rows*cols*4+8
-        total_size=self.__dummy_length
-        times=0
-        while total_size<rf.length:
-            times+=1
-            total_size+=record*2*lays+self.__time_hdr_fmts_size+8
-        times-=1
-        
-        self.variables=OrderedDict
         del rf
+        
+        # each hour is a time record, U and V records for each layer and
+        # a trailing record; a memmap of hours exposes U and V as views
+        head_fields=[('time','>f4'),('date','>i4')]+([('stagger','>i4')] if self.__time_hdr_fmts_size==12 else [])
+        step=dtype([('head',record_dtype(*head_fields)),('data',record_dtype(('data','>f4',(rows,cols))),(lays,2)),('tail',record_dtype(('dummy','V%d' % dummy_size)))])
+        self.__memmap=memmap(rffile,step,'r',shape=(os.path.getsize(rffile)//step.itemsize,))
+        times=self.__memmap.shape[0]
+        
         self.createDimension('TSTEP',times)
         self.createDimension('DATE-TIME',2)
         self.createDimension('LAY',lays)
@@ -102,10 +102,8 @@ class wind(PseudoNetCDFFile):
         self.NCOLS=len(self.dimensions['COL'])
         self.FTYPE=1
         
-        self.__memmap=memmap(rffile,'>f','r',offset=0)
-        
         if self.__time_hdr_fmts_size==12:
-            self.LSTAGGER=self.__memmap[3].view('i')
+            self.LSTAGGER=self.__memmap['head']['stagger'][0]
         else:
             self.LSTAGGER=nan
 
@@ -122,32 +120,14 @@ class wind(PseudoNetCDFFile):
         return pncfv
         
     def __add_variables(self):
-        tsteps=len(self.dimensions['TSTEP'])
-        lays=len(self.dimensions['LAY'])
-        rows=len(self.dimensions['ROW'])
-        cols=len(self.dimensions['COL'])
-        offset=len(self.__time_hdr_fmts)+2
-        block=(rows*cols+2)*2*lays
-        out_idx=zeros(self.__memmap.shape,'b')
-        for t in range(tsteps):
-            start=(t+1)*offset+t*block+t*self.__dummy_length
-            stop=start+block
-            
-            out_idx[start:stop].reshape(lays*2,rows*cols+2)[:,1:-1]=1
-            out_idx[start:stop].reshape(lays*2,rows*cols+2)[:,[0,-1]]=2
-            out_idx[start-offset:start]=3
-
-        buffer=self.__memmap[out_idx==2].reshape(tsteps,lays,2,2)
-        if not (buffer[:,:,:,0]==buffer[:,:,:,1]).all():
-            raise ValueError('Fortran unformatted record start and end padding do not match.')
-        date=self.__memmap[out_idx==3].reshape(tsteps,(out_idx==3).sum()/tsteps)[:,2].view('>i')
-        time=self.__memmap[out_idx==3].reshape(tsteps,(out_idx==3).sum()/tsteps)[:,1]
-
-        self.variables['TFLAG']=ConvertCAMxTime(date,time,2)
-        self.variables['U']=self.__decorator('U',PseudoNetCDFVariable(self,'U','f',('TSTEP','LAY','ROW','COL'),values=self.__memmap[out_idx==1].reshape(tsteps,lays,2,rows,cols)[:,:,0,:,:]))
-        self.variables['V']=self.__decorator('V',PseudoNetCDFVariable(self,'V','f',('TSTEP','LAY','ROW','COL'),values=self.__memmap[out_idx==1].reshape(tsteps,lays,2,rows,cols)[:,:,1,:,:]))
+        head=self.__memmap['head']
+        data=self.__memmap['data']
+        check_record_pads(head)
+        check_record_pads(data)
+        self.variables['TFLAG']=ConvertCAMxTime(head['date'],head['time'],2)
+        self.variables['U']=self.__decorator('U',PseudoNetCDFVariable(self,'U','f',('TSTEP','LAY','ROW','COL'),values=data['data'][:,:,0]))
+        self.variables['V']=self.__decorator('V',PseudoNetCDFVariable(self,'V','f',('TSTEP','LAY','ROW','COL'),values=data['data'][:,:,1]))
         
-    
 class TestMemmap(unittest.TestCase):
     def runTest(self):
         pass
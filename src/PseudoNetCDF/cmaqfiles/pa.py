@@ -46,7 +46,7 @@ def mrgidx(ipr_paths, irr_paths, idx):
     outf.createDimension("PROCESS", len(prcs))
     outf.createDimension("SPECIES", len(spcs))
     outf.createDimension("RXN", len(rr_keys))
-    outf.createDimension("TSTEP", pr_tmp[:,0,0,0].shape[0])
+    outf.createDimension("TSTEP", pr_tmp.shape[0])
     outf.createDimension("TSTEP_STAG", len(outf.dimensions["TSTEP"])+1)
     outf.createDimension("ROW", 1)
     outf.createDimension("LAY", 1)
@@ -55,7 +55,7 @@ def mrgidx(ipr_paths, irr_paths, idx):
     outf.createDimension("DATE-TIME", 2)
     tflag = outf.createVariable("TFLAG", "i", ('TSTEP', 'VAR', 'DATE-TIME'))
     tflag.__dict__.update(dict(units = "<YYYYJJJ,HHDDMM>", var_desc = 'TFLAG'.ljust(16), long_name = 'TFLAG'.ljust(16)))
-    tflag[:,:,:] = iprf.variables['TFLAG'][:][:,[0],:]
+    tflag[:,:,:] = iprf.variables['TFLAG'][:,[0],:]
     shape = outf.createVariable("SHAPE", "i", ("TSTEP", "LAY", "ROW", "COL"))
     shape.__dict__.update(dict(units = "ON/OFF", var_desc = "SHAPE".ljust(16), long_name = "SHAPE".ljust(16)))
     shape[:] = 1
@@ -65,12 +65,12 @@ def mrgidx(ipr_paths, irr_paths, idx):
     irr.__dict__.update(dict(units = pr_tmp.units, var_desc = "IPR".ljust(16), long_name = "IPR".ljust(16)))
 
     for rr, var in zip(rr_keys,irr.swapaxes(0,1)):
-        var[:] = irrf.variables[rr][:][idx]
+        var[:] = irrf.variables[rr][idx]
         
     for prc, prcvar in zip(prcs,ipr.swapaxes(0,2)):
         for spc, spcvar in zip(spcs,prcvar):
             try:
-                spcvar[:] = iprf.variables['_'.join([prc,spc])][:][idx]
+                spcvar[:] = iprf.variables['_'.join([prc,spc])][idx]
             except KeyError as es:
                 warn(str(es))
 
@@ -0,0 +1,142 @@
+from __future__ import print_function
+__all__ = ['gridcached', 'ioapisignature']
+__doc__ = """
+Per-grid cache of derived coordinates
+
+Coordinates derived from grid attributes (x/y, latitude/longitude and
+their bounds) depend only on the grid definition, so they are computed
+once per grid signature and shared, read-only, by every file on that
+grid. Results are kept in memory and, when they are costly (e.g.,
+projected with pyproj), in cachedir as one .npz per signature
+(PNC_GRID_CACHE overrides cachedir and an empty value disables the disk
+cache).
+
+    geom = gridcached(ioapisignature(ifile, a, b), lambda: {...})
+"""
+import os
+import hashlib
+import unittest
+from warnings import warn
+import numpy as np
+
+cachedir = os.environ.get('PNC_GRID_CACHE', os.path.join(os.path.expanduser('~'), '.pncgrids'))
+
+_ioapiattrs = 'GDTYP P_ALP P_BET P_GAM XCENT YCENT XORIG YORIG XCELL YCELL NROWS NCOLS'.split()
+
+_memory = {}
+
+def _readonly(arrays):
+    for v in arrays.values():
+        v.flags.writeable = False
+    return arrays
+
+def ioapisignature(ifileo, semi_major_axis, semi_minor_axis, *extra):
+    """
+    Tuple identifying the IOAPI grid of ifileo: grid attributes, sphere,
+    whether it is a boundary (PERIM) grid and any extra values
+    """
+    attrs = tuple([repr(getattr(ifileo, k, None)) for k in _ioapiattrs])
+    return ('ioapi', 'PERIM' in ifileo.dimensions) + attrs + (repr(semi_major_axis), repr(semi_minor_axis)) + extra
+
+def gridcached(signature, func, disk = True, cachedir = None):
+    """
+    Dictionary of read-only arrays made by func() for signature (a tuple
+    of grid parameters) from the memory or disk cache
+
+    disk - use the disk cache (for results that are costly to compute)
+    cachedir - directory of cached grids (default: module cachedir; ''
+               disables the disk cache)
+    """
+    if signature in _memory:
+        return _memory[signature]
+    if cachedir is None:
+        cachedir = globals()['cachedir']
+    path = None
+    if disk and cachedir:
+        key = hashlib.sha1(repr(signature).encode('ascii')).hexdigest()
+        path = os.path.join(cachedir, key + '.npz')
+    out = None
+    if path is not None and os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                out = dict([(k, data[k]) for k in data.files])
+        except Exception as e:
+            warn('Ignoring unreadable grid cache %s; %s' % (path, e))
+    if out is None:
+        out = dict([(k, np.asarray(v)) for k, v in func().items()])
+        if path is not None:
+            try:
+                if not os.path.exists(cachedir):
+                    os.makedirs(cachedir)
+                tmppath = '%s.%d.npz' % (path[:-4], os.getpid())
+                np.savez(tmppath, **out)
+                os.rename(tmppath, path)
+            except (IOError, OSError) as e:
+                warn('Grid coordinates were not cached; ' + str(e))
+    _memory[signature] = out = _readonly(out)
+    return out
+
+class TestGridCache(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+        _memory.clear()
+
+    def _ioapifile(self, **attrs):
+        from PseudoNetCDF.sci_var import PseudoNetCDFFile
+        f = PseudoNetCDFFile()
+        f.createDimension('TSTEP', 1)
+        f.createDimension('LAY', 1)
+        f.createDimension('ROW', 4)
+        f.createDimension('COL', 6)
+        props = dict(GDTYP = 1, P_ALP = 0., P_BET = 0., P_GAM = 0., XCENT = 0., YCENT = 0., XORIG = -100., YORIG = 30., XCELL = .5, YCELL = .25, NROWS = 4, NCOLS = 6, SDATE = 2016001, STIME = 0, TSTEP = 10000)
+        props.update(attrs)
+        for k, v in props.items():
+            setattr(f, k, v)
+        f.createVariable('O3', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'))
+        return f
+
+    def testCached(self):
+        calls = []
+        def func():
+            calls.append(1)
+            return dict(x = np.arange(3.))
+        sig = ('test', 1)
+        out = gridcached(sig, func, cachedir = self.tmpdir)
+        self.assert_(gridcached(sig, func, cachedir = self.tmpdir) is out)
+        self.assertRaises(ValueError, out['x'].__setitem__, 0, 1)
+        _memory.clear()
+        out2 = gridcached(sig, func, cachedir = self.tmpdir)
+        np.testing.assert_equal(out2['x'], out['x'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 1)
+
+    def testIOAPI(self):
+        from ._ioapi import add_cf_from_ioapi
+        f1 = self._ioapifile()
+        f2 = self._ioapifile()
+        f3 = self._ioapifile(XORIG = -99.)
+        for f in (f1, f2, f3):
+            add_cf_from_ioapi(f)
+        lat1 = f1.variables['latitude']
+        lon1 = f1.variables['longitude']
+        np.testing.assert_allclose(lat1[:, 0], 30.125 + .25 * np.arange(4))
+        np.testing.assert_allclose(lon1[0], -99.75 + .5 * np.arange(6))
+        latb = f1.variables['latitude_bounds'][:]
+        lonb = f1.variables['longitude_bounds'][:]
+        np.testing.assert_allclose(latb[1, 2], [30.25, 30.25, 30.5, 30.5])
+        np.testing.assert_allclose(lonb[1, 2], [-99, -98.5, -98.5, -99])
+        self.assert_(np.shares_memory(lat1, f2.variables['latitude']))
+        self.assert_(not np.shares_memory(lon1, f3.variables['longitude']))
+        np.testing.assert_allclose(f3.variables['longitude'][:], lon1[:] + 1)
+        self.assertEqual(f1.variables['O3'].coordinates, 'time level latitude longitude')
+
+if __name__ == '__main__':
+    unittest.main()
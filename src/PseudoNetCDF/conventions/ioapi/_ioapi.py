@@ -1,5 +1,6 @@
 from warnings import warn
 import numpy as np
+from ._gridcache import gridcached, ioapisignature
 _withlatlon = False
 for impstmt in ['import pyproj', 'from mpl_toolkits.basemap import pyproj']:
     try:
@@ -142,6 +143,58 @@ def get_ioapi_sphere():
     else:
         return isph_parts * 2
 
+def _lcc_geometry(ifileo, mapdef, haslatlon):
+    """
+    Dictionary of x, y and (with haslatlon) lon, lat, lone and late
+    (bounds) of the IOAPI grid of ifileo
+    """
+    perim = 'PERIM' in ifileo.dimensions.keys()
+    if perim:
+        _x = np.arange(-ifileo.XCELL, (ifileo.NCOLS + 1) * ifileo.XCELL, ifileo.XCELL) + ifileo.XORIG + ifileo.XCELL / 2.
+        _y = np.arange(-ifileo.YCELL, (ifileo.NROWS + 1) * ifileo.YCELL, ifileo.YCELL) + ifileo.YORIG + ifileo.YCELL / 2.
+        bx = _x[1:]
+        by = _y[0].repeat(ifileo.NCOLS + 1)
+        ex = _x[-1].repeat(ifileo.NROWS + 1)
+        ey = _y[1:]
+        tx = _x[0:-1]
+        ty = _y[-1].repeat(ifileo.NCOLS + 1)
+        wx = _x[0].repeat(ifileo.NROWS + 1)
+        wy = _y[:-1]
+        lcc_x = x = np.concatenate([bx, ex, tx, wx])
+        lcc_y = y = np.concatenate([by, ey, ty, wy])
+        lcc_xe = np.array([x - ifileo.XCELL / 2., x + ifileo.XCELL / 2., x + ifileo.XCELL / 2., x - ifileo.XCELL / 2.]).T
+        lcc_ye = np.array([y - ifileo.YCELL / 2., y - ifileo.YCELL / 2., y + ifileo.YCELL / 2., y + ifileo.YCELL / 2.]).T
+    else:
+        x = np.arange(0, ifileo.NCOLS) * ifileo.XCELL + ifileo.XCELL / 2. + ifileo.XORIG
+        y = np.arange(0, ifileo.NROWS) * ifileo.YCELL  + ifileo.YCELL / 2. + ifileo.YORIG
+        lcc_x, lcc_y = np.meshgrid(x, y)
+        # cells share corners, so only (NROWS + 1) x (NCOLS + 1) corners
+        # are projected
+        xe = np.arange(0, ifileo.NCOLS + 1) * ifileo.XCELL + ifileo.XORIG
+        ye = np.arange(0, ifileo.NROWS + 1) * ifileo.YCELL + ifileo.YORIG
+        lcc_xe, lcc_ye = np.meshgrid(xe, ye)
+    out = dict(x = x, y = y)
+    if not haslatlon:
+        return out
+    if ifileo.GDTYP == 2:
+        mapstr = '+proj=lcc +lon_0=%s +lat_1=%s +lat_2=%s +a=%s +b=%s +lat_0=%s' % (mapdef.longitude_of_central_meridian, mapdef.standard_parallel[0], mapdef.standard_parallel[1], mapdef.semi_major_axis, mapdef.semi_minor_axis, mapdef.latitude_of_projection_origin,) 
+        mapproj = pyproj.Proj(mapstr)
+    elif ifileo.GDTYP == 7:
+        mapstr = '+proj=merc +a=%s +b=%s +lat_ts=0 +lon_0=%s' % (mapdef.semi_major_axis, mapdef.semi_minor_axis, mapdef.longitude_of_central_meridian)
+        mapproj = pyproj.Proj(mapstr)
+    elif ifileo.GDTYP == 1:
+        mapproj = lambda x, y, inverse: (x, y)
+    lon, lat = mapproj(lcc_x, lcc_y, inverse = True)
+    lone, late = mapproj(lcc_xe.ravel(), lcc_ye.ravel(), inverse = True)
+    lone = np.asarray(lone).reshape(*lcc_xe.shape)
+    late = np.asarray(late).reshape(*lcc_ye.shape)
+    if not perim:
+        # ll, lr, ur, ul corners of each cell
+        lone = np.concatenate([lone[:-1, :-1, None], lone[:-1, 1:, None], lone[1:, 1:, None], lone[1:, :-1, None]], axis = 2)
+        late = np.concatenate([late[:-1, :-1, None], late[:-1, 1:, None], late[1:, 1:, None], late[1:, :-1, None]], axis = 2)
+    out.update(lon = np.asarray(lon), lat = np.asarray(lat), lone = lone, late = late)
+    return out
+
 def add_lcc_coordinates(ifileo, lccname = 'LambertConformalProjection'):
     mapdef = ifileo.createVariable(lccname, 'i', ())
     if ifileo.GDTYP == 2:
@@ -157,23 +210,11 @@ def add_lcc_coordinates(ifileo, lccname = 'LambertConformalProjection'):
     mapdef._CoordinateTransformType = "Projection" ;
     mapdef._CoordinateAxes = "x y" ;
 
+    # lat/lon grids need no projection
+    haslatlon = _withlatlon or ifileo.GDTYP == 1
     if 'PERIM' in ifileo.dimensions.keys():
         xdim = 'PERIM'
         ydim = 'PERIM'
-        _x = np.arange(-ifileo.XCELL, (ifileo.NCOLS + 1) * ifileo.XCELL, ifileo.XCELL) + ifileo.XORIG + ifileo.XCELL / 2.
-        _y = np.arange(-ifileo.YCELL, (ifileo.NROWS + 1) * ifileo.YCELL, ifileo.YCELL) + ifileo.YORIG + ifileo.YCELL / 2.
-        bx = _x[1:]
-        by = _y[0].repeat(ifileo.NCOLS + 1)
-        ex = _x[-1].repeat(ifileo.NROWS + 1)
-        ey = _y[1:]
-        tx = _x[0:-1]
-        ty = _y[-1].repeat(ifileo.NCOLS + 1)
-        wx = _x[0].repeat(ifileo.NROWS + 1)
-        wy = _y[:-1]
-        lcc_x = x = np.concatenate([bx, ex, tx, wx])
-        lcc_y = y = np.concatenate([by, ey, ty, wy])
-        lcc_xe = np.array([x - ifileo.XCELL / 2., x + ifileo.XCELL / 2., x + ifileo.XCELL / 2., x - ifileo.XCELL / 2.]).T
-        lcc_ye = np.array([y - ifileo.YCELL / 2., y - ifileo.YCELL / 2., y + ifileo.YCELL / 2., y + ifileo.YCELL / 2.]).T
         latlon_dim = ('PERIM',)
         latlone_dim = ('PERIM', 'nv')
         latlon_coord = 'PERIM'
@@ -183,35 +224,21 @@ def add_lcc_coordinates(ifileo, lccname = 'LambertConformalProjection'):
         latlon_dim = (ydim, xdim)
         latlon_coord = 'latitude longitude'
         latlone_dim = (ydim, xdim, 'nv')
-        xe = np.arange(0, ifileo.NCOLS) * ifileo.XCELL + ifileo.XORIG
-        ye = np.arange(0, ifileo.NROWS) * ifileo.YCELL + ifileo.YORIG
-        lcc_xe, lcc_ye = np.meshgrid(xe, ye)
-        lcc_xe = np.concatenate([lcc_xe[:, :, None], lcc_xe[:, :, None] + ifileo.XCELL, lcc_xe[:, :, None] + ifileo.XCELL, lcc_xe[:, :, None]], axis = 2)
-        lcc_ye = np.concatenate([lcc_ye[:, :, None], lcc_ye[:, :, None], lcc_ye[:, :, None] + ifileo.YCELL, lcc_ye[:, :, None] + ifileo.YCELL], axis = 2)
-        x = np.arange(0, ifileo.NCOLS) * ifileo.XCELL + ifileo.XCELL / 2. + ifileo.XORIG
-        y = np.arange(0, ifileo.NROWS) * ifileo.YCELL  + ifileo.YCELL / 2. + ifileo.YORIG
-        lcc_x, lcc_y = np.meshgrid(x, y)
 
-    if _withlatlon:
-        if ifileo.GDTYP == 2:
-            mapstr = '+proj=lcc +lon_0=%s +lat_1=%s +lat_2=%s +a=%s +b=%s +lat_0=%s' % (mapdef.longitude_of_central_meridian, mapdef.standard_parallel[0], mapdef.standard_parallel[1], mapdef.semi_major_axis, mapdef.semi_minor_axis, mapdef.latitude_of_projection_origin,) 
-            mapproj = pyproj.Proj(mapstr)
-        elif ifileo.GDTYP == 7:
-            mapstr = '+proj=merc +a=%s +b=%s +lat_ts=0 +lon_0=%s' % (mapdef.semi_major_axis, mapdef.semi_minor_axis, mapdef.longitude_of_central_meridian)
-            mapproj = pyproj.Proj(mapstr)
-        elif ifileo.GDTYP == 1:
-            mapproj = lambda x, y, inverse: (x, y)
-        lon, lat = mapproj(lcc_x, lcc_y, inverse = True)
-        lone, late = mapproj(lcc_xe.ravel(), lcc_ye.ravel(), inverse = True)
-        lone = lone.reshape(*lcc_xe.shape)
-        late = late.reshape(*lcc_ye.shape)
+    # coordinates depend only on the grid, so files on the same grid
+    # share one read-only copy
+    signature = ioapisignature(ifileo, mapdef.semi_major_axis, mapdef.semi_minor_axis, haslatlon)
+    geom = gridcached(signature, lambda: _lcc_geometry(ifileo, mapdef, haslatlon), disk = haslatlon and ifileo.GDTYP != 1)
+    x = geom['x']
+    y = geom['y']
+    if haslatlon:
+        lon, lat, lone, late = geom['lon'], geom['lat'], geom['lone'], geom['late']
         
     if not 'x' in ifileo.variables.keys() and 'COL' in ifileo.dimensions:
         """
         Not necessary for cdo
         """
-        var = ifileo.createVariable('x', x.dtype.char, (xdim,))
-        var[:] = x[:]
+        var = ifileo.createVariable('x', x.dtype.char, (xdim,), values = x)
         var.units = 'km'
         var._CoordinateAxisType = "GeoX" ;
         var.long_name = "synthesized coordinate from XORIG XCELL global attributes" ;
@@ -221,43 +248,38 @@ def add_lcc_coordinates(ifileo, lccname = 'LambertConformalProjection'):
         """
         Not necessary for cdo
         """
-        var = ifileo.createVariable('y', x.dtype.char, (ydim,))
-        var[:] = y[:]
+        var = ifileo.createVariable('y', x.dtype.char, (ydim,), values = y)
         var.units = 'km'
         var._CoordinateAxisType = "GeoY" ;
         var.long_name = "synthesized coordinate from YORIG YCELL global attributes" ;
 
 
-    if _withlatlon and 'latitude' not in ifileo.variables.keys():
-        var = ifileo.createVariable('latitude', lat.dtype.char, latlon_dim)
-        var[:] = lat
+    if haslatlon and 'latitude' not in ifileo.variables.keys():
+        var = ifileo.createVariable('latitude', lat.dtype.char, latlon_dim, values = lat)
         var.units = 'degrees_north'
         var.standard_name = 'latitude'
         var.bounds = 'latitude_bounds'
         var.coordinates = latlon_coord
 
-    if _withlatlon and 'longitude' not in ifileo.variables.keys():
-        var = ifileo.createVariable('longitude', lon.dtype.char, latlon_dim)
-        var[:] = lon
+    if haslatlon and 'longitude' not in ifileo.variables.keys():
+        var = ifileo.createVariable('longitude', lon.dtype.char, latlon_dim, values = lon)
         var.units = 'degrees_east'
         var.standard_name = 'longitude';
         var.bounds = 'longitude_bounds'
         var.coordinates = latlon_coord
 
-    if _withlatlon:
+    if haslatlon:
         for dk, dl in zip(latlone_dim, late.shape):
             if not dk in ifileo.dimensions:
                 ifileo.createDimension(dk, dl)
 
-    if _withlatlon and 'latitude_bounds' not in ifileo.variables.keys():
-        var = ifileo.createVariable('latitude_bounds', lat.dtype.char, latlone_dim)
-        var[:] = late
+    if haslatlon and 'latitude_bounds' not in ifileo.variables.keys():
+        var = ifileo.createVariable('latitude_bounds', lat.dtype.char, latlone_dim, values = late)
         var.units = 'degrees_north'
         var.standard_name = 'latitude_bounds'
 
-    if _withlatlon and 'longitude_bounds' not in ifileo.variables.keys():
-        var = ifileo.createVariable('longitude_bounds', lon.dtype.char, latlone_dim)
-        var[:] = lone
+    if haslatlon and 'longitude_bounds' not in ifileo.variables.keys():
+        var = ifileo.createVariable('longitude_bounds', lon.dtype.char, latlone_dim, values = lone)
         var.units = 'degrees_east'
         var.standard_name = 'longitude_bounds';
 
@@ -268,7 +290,7 @@ def add_lcc_coordinates(ifileo, lccname = 'LambertConformalProjection'):
         except:
             pass
         olddims = list(var.dimensions)
-        if _withlatlon:
+        if haslatlon:
             dims = map(lambda x: {'ROW': 'latitude', 'COL': 'longitude', 'TSTEP': 'time', 'LAY': 'level'}.get(x, x), olddims)
         dims = [d for d in dims] # Why was I excluding time  if d != 'time'
         if olddims != dims:
@@ -90,12 +90,16 @@ def get_proj(ifile):
         var.standard_parallel = ifile.MOAD_CEN_LAT
     
     from PseudoNetCDF.coordutil import getproj4_from_cf_var
-    from mpl_toolkits.basemap import pyproj
+    from ._gridcache import gridcached
     projstr = getproj4_from_cf_var(var)
-    proj = pyproj.Proj(projstr)
-    gcx, gcy = proj(ifile.CEN_LON, ifile.CEN_LAT)
-    glx = gcx - x0_from_cen
-    gly = gcy - y0_from_cen
+    def getorigin():
+        from mpl_toolkits.basemap import pyproj
+        proj = pyproj.Proj(projstr)
+        gcx, gcy = proj(ifile.CEN_LON, ifile.CEN_LAT)
+        return dict(origin = np.array([gcx - x0_from_cen, gcy - y0_from_cen]))
+    # the grid origin only depends on the projection, center and size
+    signature = ('wrf', projstr, repr(ifile.CEN_LON), repr(ifile.CEN_LAT), repr(x0_from_cen), repr(y0_from_cen))
+    glx, gly = gridcached(signature, getorigin, disk = False)['origin']
     var.false_easting = -glx
     var.false_northing = -gly
     return projname
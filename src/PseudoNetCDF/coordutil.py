@@ -460,9 +460,18 @@ def getproj4_from_cf_var(gridmapping, withgrid = False):
     mapstr = ' '.join(['+%s=%s' % (k, v if isinstance(v, str) else repr(v)) for k, v in mapstr_bits.items()])
     return mapstr
 
+_projs = {}
+
 def getproj(ifile, withgrid = False):
+    """
+    pyproj.Proj of ifile; files with the same projection share one Proj
+    """
     import pyproj
-    return pyproj.Proj(getproj4(ifile, withgrid = withgrid), preserve_units = withgrid)
+    proj4 = getproj4(ifile, withgrid = withgrid)
+    key = (proj4, withgrid)
+    if key not in _projs:
+        _projs[key] = pyproj.Proj(proj4, preserve_units = withgrid)
+    return _projs[key]
 
 def getproj4(ifile, withgrid = False):
     """
@@ -1,3 +1,7 @@
 from ._files import *
 from ._variables import *
-from ._functions import *
\ No newline at end of file
+from ._functions import *
+from ._lazy import *
+from ._plan import *
+from ._interp import *
+from ._sitemap import *
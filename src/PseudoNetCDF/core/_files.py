@@ -1,6 +1,8 @@
 import unittest
 from PseudoNetCDF._getreader import registerreader
 from PseudoNetCDF.netcdf import NetCDFFile
+from PseudoNetCDF import _profile
+from time import time
 from collections import OrderedDict
 from ._dimensions import PseudoNetCDFDimension
 from ._variables import PseudoNetCDFVariable, PseudoNetCDFMaskedVariable
@@ -118,70 +120,72 @@ class PseudoNetCDFFile(PseudoNetCDFSelfReg):
         return setattr(self, k, v)
     
     def __add__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '+', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __sub__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '-', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __mul__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '*', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __div__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '/', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
+    __truediv__ = __div__
+
     def __floordiv__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '//', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __pow__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '**', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __and__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '&', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __or__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '|', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
 
     def __xor__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '^', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
 
     def __mod__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '%', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __lt__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '<', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __gt__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '>', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
 
     def __eq__(self, lhs):
         if isinstance(lhs, (NetCDFFile, PseudoNetCDFFile)):
-            from _functions import pncbo
+            from ._functions import pncbo
             return pncbo(op = ' == ', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
         else:
             return lhs.__eq__(self)
 
     def __le__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '<=', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     def __ge__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '>=', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
 
     def __ne__(self, lhs):
-        from _functions import pncbo
+        from ._functions import pncbo
         return pncbo(op = '!=', ifile1 = self, ifile2 = lhs, verbose = 0, coordkeys = self._operator_exclude_vars)
     
     
@@ -225,7 +229,13 @@ class PseudoNetCDFVariables(OrderedDefaultDict):
         specifie function to create the variable.
         """
         if k in self.keys():
-            return self.__func(k)
+            profiler = _profile.getprofiler()
+            if profiler is None:
+                return self.__func(k)
+            start = time()
+            var = self.__func(k)
+            profiler.materialized(k, var, time() - start)
+            return var
         else:
             raise KeyError('missing "%s"' % (k, ))
 
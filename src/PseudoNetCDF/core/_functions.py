@@ -11,9 +11,12 @@ import numpy as np
 from collections import defaultdict, OrderedDict
 
 
-from ._files import PseudoNetCDFFile
+from ._files import PseudoNetCDFFile, PseudoNetCDFVariables
 from ._variables import PseudoNetCDFMaskedVariable, PseudoNetCDFVariable
+from ._interp import contract
+from ._sitemap import sitemap, gather
 from ..userfuncs import *
+from ..userfuncs import _calendarfuncs
 
 import datetime
 
@@ -149,6 +152,7 @@ def interpvars(f, weights, dimension, loginterp = []):
         for grpk, grpv in f.groups.items():
             outf.groups[grpk] = interpvars(grpv, weights, dimension)
     
+    weights = np.asarray(weights)
     oldd = f.dimensions[dimension]
     didx, = [i for i, l in enumerate(weights.shape) if len(oldd) == l]
     
@@ -164,21 +168,12 @@ def interpvars(f, weights, dimension, loginterp = []):
             newvar = outf.createVariable(vark, oldvar.dtype.char, oldvar.dimensions, **kwds)
             for ak in oldvar.ncattrs():
                 setattr(newvar, ak, getattr(oldvar, ak))
-            if len(weights.shape) <= len(oldvar.dimensions):
-                weightslice = (None,) * (dimidx) + (Ellipsis,) + (None,) * len(oldvar.dimensions[dimidx + 1:])
-            else:
-                weightslice = slice(None)        
-            varslice = (slice(None,),) * dimidx + (None,)
-            weightsv = weights[weightslice]
-            oldvarv = oldvar[varslice]
-            if not (weightsv.ndim - 1) == oldvar.ndim:
+            if not (weights.ndim == 2 or weights.ndim == oldvar.ndim + 1):
                 warn('Wrong number of dimensions for %s' % (vark,))
-            elif vark in loginterp:
-                logv = np.ma.exp((weightsv * np.ma.log(oldvarv)).sum(dimidx + 1))
-                newvar[:] = logv
             else:
-                linv = (weightsv * oldvarv).sum(dimidx + 1)
-                newvar[:] = linv
+                # contract weights with oldvar a chunk at a time instead of
+                # broadcasting them against each other
+                newvar[:] = contract(oldvar, weights, dimidx, log = vark in loginterp)
         else:
             outf.variables[vark] = oldvar
     return outf
@@ -235,47 +230,23 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
         raise e
     outf.lonlatcoords = lonlat
     latlon1d = longitude.ndim == 1 and latitude.ndim == 1
-    if method == 'nn':
-        if latlon1d and gridded:
-            latitude = latitude[(slice(None), None, None)]
-            longitude = longitude[(None, slice(None), None)]
-        else:
-            latitude = latitude[Ellipsis, None]
-            longitude = longitude[Ellipsis, None]
-    
-        lonlatdims = latitude.ndim - 1
-        londists = longitude - lons[(None,) * lonlatdims]
-        latdists = latitude - lats[(None,) * lonlatdims]
-        totaldists = ((latdists**2 + londists**2)**.5)
+    sm = None
+    if method in ('nn', 'KDTree', 'linear'):
+        # cell indices and weights are computed once per grid and site list
+        sm = sitemap(f, longitude, latitude, lons, lats, method = method, gridded = gridded)
         if latlon1d and not gridded:
-            latidxs, = lonidxs, = np.unravel_index(totaldists.reshape(-1, latdists.shape[-1]).argmin(0), totaldists.shape[:-1])
+            latidxs, = lonidxs, = sm.unravel()
         else:
-            latidxs, lonidxs = np.unravel_index(totaldists.reshape(-1, latdists.shape[-1]).argmin(0), totaldists.shape[:-1])
+            latidxs, lonidxs = sm.unravel()
+        weights = sm.weights if sm.method == 'linear' else None
         def extractfunc(v, thiscoords):
             newslice = tuple([{'latitude': latidxs, 'longitude': lonidxs, 'points': latidxs, 'PERIM': latidxs}.get(d, slice(None)) for d in thiscoords])
             if newslice == ():
                 return v
-            else:
-                return v[:][newslice]
-    elif method == 'KDTree':
-        if latlon1d and gridded:
-            longitude, latitude = np.meshgrid(longitude, latitude)
-        from scipy.spatial import KDTree
-        tree = KDTree(np.ma.array([latitude.ravel(), longitude.ravel()]).T)
-        dists, idxs = tree.query(np.ma.array([lats, lons]).T)
-        if latlon1d and not gridded:
-            latidxs, = lonidxs, = np.unravel_index(idxs, latitude.shape)
-        else:
-            latidxs, lonidxs = np.unravel_index(idxs, latitude.shape)
-        def extractfunc(v, thiscoords):
-            newslice = tuple([{'latitude': latidxs, 'longitude': lonidxs, 'points': latidxs, 'PERIM': latidxs}.get(d, slice(None)) for d in thiscoords])
-            return v[newslice]
-    elif method in ('linear', 'cubic'):
-        from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator
-        if method == 'cubic':
-            interpclass = CloughTocher2DInterpolator
-        else:
-            interpclass = LinearNDInterpolator
+            return gather(v, newslice, weights)
+    elif method == 'cubic':
+        from scipy.interpolate import CloughTocher2DInterpolator
+        interpclass = CloughTocher2DInterpolator
         if latlon1d and gridded:
             longitude, latitude = np.meshgrid(longitude, latitude)
         points = np.array([longitude.ravel(), latitude.ravel()]).T
@@ -292,7 +263,7 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
             out = np.rollaxis(np.ma.array([i2df(lon, lat) for lat, lon in zip(lats, lons)]), 0, len(newshape))
             return out
         latidxs = extractfunc(latitude, ('latitude', 'longitude'))
-    elif method in ('cubic', 'quintic'):
+    elif method == 'quintic':
         from scipy.interpolate import interp2d
         if latlon1d and gridded:
             longitude, latitude = np.meshgrid(longitude, latitude)
@@ -301,16 +272,20 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
             return np.ma.array([i2df(lat, lon) for lat, lon in zip(lats, lons)])
         latidxs = extractfunc(latitude, '')
     else:
-        raise ValueError('method must be: nn, KDTree')
+        raise ValueError('method must be: nn, KDTree, linear, cubic or quintic')
     if unique:
+        if sm is None or sm.method != 'nn':
+            raise ValueError('unique requires method nn or KDTree')
         tmpx = OrderedDict()
-        for lon, lat, lonlatstr in zip(lonidxs, latidxs, outf.lonlatcoords.split('/')):
+        for si, (lon, lat) in enumerate(zip(lonidxs[:, 0], latidxs[:, 0])):
             if (lon, lat) not in tmpx:
-                tmpx[(lon, lat)] = lonlatstr
-        
-        lonidxs, latidxs = np.array(tmpx.keys()).T
+                tmpx[(lon, lat)] = si
+        keep = np.array(list(tmpx.values()))
+        lonidxs = lonidxs[keep]
+        latidxs = latidxs[keep]
+        lonlatstrs = outf.lonlatcoords.split('/')
         outf.lonlatcoords_orig = outf.lonlatcoords
-        outf.lonlatcoords = '/'.join([tmpx[k] for k in zip(lonidxs, latidxs)])
+        outf.lonlatcoords = '/'.join([lonlatstrs[si] for si in keep])
     
     for k, v in f.variables.items():
         try:
@@ -418,12 +393,15 @@ def slice_dim(f, slicedef, fuzzydim = True):
 
     return outf
     
-def _getfunc(a, func):
+def _getfunc(a, func, **kwds):
     """
-    Get an approriate function that takes one optional keyword (axis)
+    Get an approriate function that takes one optional keyword (axis);
+    kwds are passed to user functions (e.g., times for daymax)
     """
     if not hasattr(func, '__call__'):
-        if hasattr(a, func):
+        if len(kwds) > 0:
+            outfunc = lambda axis = None, keepdims = True: eval(func)(a, axis = axis, keepdims = keepdims, **kwds)
+        elif hasattr(a, func):
             outfunc = getattr(a, func)
         elif isinstance(a, np.ma.MaskedArray):
             outfunc = lambda axis = None, keepdims = True: getattr(np.ma, func)(a, axis = axis, keepdims = keepdims)
@@ -434,7 +412,70 @@ def _getfunc(a, func):
     else:
         outfunc = lambda axis = None, keepdims = True: np.apply_along_axis(func1d = func, axis = axis, arr = a, keepdims = keepdims)
     return outfunc
-    
+
+def _calendar(f, dimkey):
+    """
+    times, days and utcoffset (or {}) for daily user functions (e.g.,
+    mda8) reducing dimkey; utcoffset is the utcoffset variable (hours
+    to add to UTC for local standard time) if f has one
+    """
+    from .._timebin import gettimes64
+    try:
+        times = gettimes64(f)
+    except Exception as e:
+        warn('Daily functions will assume hourly times from hour 0; ' + str(e))
+        return {}
+    if times.shape != (len(f.dimensions[dimkey]),):
+        warn('%s has %d times; daily functions will assume hourly times from hour 0' % (dimkey, times.size))
+        return {}
+    out = dict(times = times)
+    if 'utcoffset' in f.variables:
+        out['utcoffset'] = f.variables['utcoffset']
+    out['days'] = daygroups(times, out.get('utcoffset', None))[0]
+    return out
+
+def _celloffset(utcoffset, var, dimkey):
+    """
+    utcoffset (a variable) reshaped to broadcast to the dimensions of var
+    other than dimkey or None if var lacks its dimensions
+    """
+    celldims = [d for d in var.dimensions if d != dimkey]
+    odims = list(utcoffset.dimensions)
+    if not all([d in celldims for d in odims]):
+        return None
+    order = sorted(odims, key = celldims.index)
+    vals = np.transpose(np.asarray(utcoffset[...]), [odims.index(d) for d in order])
+    return vals.reshape([vals.shape[order.index(d)] if d in order else 1 for d in celldims])
+
+def _daylabels(var, varkey, dimkey, times, days):
+    """
+    metadata variable var (e.g., time or TFLAG) for each day (datetime64[D])
+    along dimkey: time (<unit> since <date>), TFLAG and ETFLAG are computed
+    for 00 UTC of each day (ETFLAG for 00 UTC of the next); other variables
+    take their row of the first time on or after 00 UTC (or the last)
+    """
+    from .._timebin import _todatetime64, _offsets
+    from ..coordutil import _parse_ref_date
+    axis = list(var.dimensions).index(dimkey)
+    starts = days.astype('datetime64[ms]')
+    rows = np.searchsorted(times, starts).clip(0, len(times) - 1)
+    out = np.ma.masked_array(np.ma.take(var[...], rows, axis = axis))
+    shape = [1] * out.ndim
+    shape[axis] = -1
+    units = getattr(var, 'units', '').strip()
+    if varkey == 'time' and ' since ' in units:
+        unit, base = units.split(' since ')
+        vals = (starts - _todatetime64(_parse_ref_date(base))) / _offsets(1, unit)
+        out[...] = vals.reshape(shape)
+    elif varkey in ('TFLAG', 'ETFLAG') and out.shape[-1] == 2:
+        if varkey == 'ETFLAG':
+            days = days + np.timedelta64(1, 'D')
+        years = days.astype('datetime64[Y]')
+        jdays = (years.astype('i8') + 1970) * 1000 + (days - years).astype('i8') + 1
+        out[..., 0] = jdays.reshape(shape[:-1])
+        out[..., 1] = 0
+    return out
+
 def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latitude longitude time_bounds latitude_bounds longitude_bounds ROW COL LAY TFLAG ETFLAG'.split()):
     """
     variable dimensions can be reduced using
@@ -444,6 +485,12 @@ def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latit
     e.g., reduce_dim(layer,mean,weight).
     
     Weighting is not fully functional.
+
+    Daily functions (mda8, daymax, daymin, daymean, daystd, dayvar) group
+    by calendar day using the times of f; days are local standard time
+    where f has a utcoffset variable (hours) and UTC otherwise. Metadata
+    variables (metakeys) are labeled from the days (see _daylabels) and
+    results keep the floating point type of each variable.
     """
     inf = f
     metakeys = [k for k in metakeys if k in inf.variables.keys()]
@@ -481,6 +528,9 @@ def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latit
         return inf
 
     from PseudoNetCDF.sci_var import Pseudo2NetCDF
+    calendar = {}
+    if func in _calendarfuncs:
+        calendar = _calendar(inf, dimkey)
     p2p = Pseudo2NetCDF(verbose = 0)
     outf = PseudoNetCDFFile()
     p2p.addDimensions(inf, outf)
@@ -503,7 +553,14 @@ def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latit
         #    return var[(slice(None),) * (axis + 1) + (None,)]
         vreshape = var[slice(None)]
         #vreshape = addunitydim(var)
-        if not varkey in metakeys:
+        if len(calendar) > 0 and numweightkey is None and varkey in metakeys:
+            vout = _daylabels(var, varkey, dimkey, calendar['times'], calendar['days'])
+        elif len(calendar) > 0 and numweightkey is None:
+            kwds = dict(calendar)
+            if 'utcoffset' in kwds:
+                kwds['utcoffset'] = _celloffset(kwds['utcoffset'], var, dimkey)
+            vout = _getfunc(vreshape, func, **kwds)(axis = axis, keepdims = True)
+        elif not varkey in metakeys:
             if numweightkey is None:
                 vout = _getfunc(vreshape, func)(axis = axis, keepdims = True)
             elif denweightkey is None:
@@ -589,30 +646,36 @@ def pncbo(op, ifile1, ifile2, coordkeys = [], verbose = 0):
     rfile = ifile1 <op> ifile2
     
     op can be any valid operator (e.g., +, -, /, *, **, &, ||)
+
+    Variables of rfile are deferred expressions (PseudoNetCDFLazyVariable)
+    that are only computed for the indices requested. Using rfile in
+    another pncbo extends the expression rather than computing rfile.
     """
     from PseudoNetCDF.sci_var import Pseudo2NetCDF
-    # Copy infile1 to a temporary PseudoNetCDFFile
+    from ._lazy import PseudoNetCDFLazyVariable, LazyBinaryOp, lazynode
     p2p = Pseudo2NetCDF()
     p2p.verbose = verbose
     tmpfile = PseudoNetCDFFile()
     p2p.addGlobalProperties(ifile1, tmpfile)
     p2p.addDimensions(ifile1, tmpfile)
+    in2keys = set(ifile2.variables.keys())
     
-    # For each variable, assign the new value
-    # to the tmpfile variables.
-    for k in ifile1.variables.keys():
+    # Each variable is defined when it is first requested
+    def getbovar(k):
         in1var = ifile1.variables[k]
-        if k not in ifile2.variables.keys() or k in coordkeys:
-            warn('%s not found in ifile2' % k)
-            p2p.addVariable(ifile1, tmpfile, k)
-        else:
-            in2var = ifile2.variables[k]
-            propd = dict([(ak, getattr(in1var, ak)) for ak in in1var.ncattrs()])
-            unit1 = getattr(in1var, 'units', 'unknown')
-            unit2 = getattr(in2var, 'units', 'unknown')
-            propd['units'] = '(%s) %s (%s)' % (unit1, op, unit2)
-            outval = np.ma.masked_invalid(eval('in1var[...] %s in2var[...]' % op).view(np.ndarray))
-            outvar = tmpfile.createVariable(k, in1var.dtype.char, in1var.dimensions, fill_value = -999, values = outval)
+        if k not in in2keys or k in coordkeys:
+            if k not in in2keys:
+                warn('%s not found in ifile2' % k)
+            return in1var
+        in2var = ifile2.variables[k]
+        propd = dict([(ak, getattr(in1var, ak)) for ak in in1var.ncattrs() if ak not in ('fill_value', '_FillValue', 'missing_value')])
+        unit1 = getattr(in1var, 'units', 'unknown')
+        unit2 = getattr(in2var, 'units', 'unknown')
+        propd['units'] = '(%s) %s (%s)' % (unit1, op, unit2)
+        node = LazyBinaryOp.get(op, lazynode(ifile1, k), lazynode(ifile2, k))
+        return PseudoNetCDFLazyVariable(tmpfile, k, node, in1var.dimensions, fill_value = -999, **propd)
+    
+    tmpfile.variables = PseudoNetCDFVariables(getbovar, list(ifile1.variables.keys()))
     return tmpfile
 
 def pncbfunc(func, ifile1, ifile2, coordkeys = [], verbose = 0):
@@ -0,0 +1,185 @@
+from __future__ import print_function
+__all__ = ['contract']
+__doc__ = """
+Contraction engine for interpvars
+
+Interpolation weights (new, old) are applied to the old dimension of a
+variable without broadcasting weights against the whole variable:
+
+    2-D weights (new, old) are applied with np.tensordot
+    weights that vary with other dimensions (pre..., new, old, post...)
+    are banded (vertical weights have at most two nonzero old levels for
+    each new level), so each old level only updates the new levels that
+    use it
+
+Work is chunked along the first dimension that is not interpolated, so
+memory is proportional to one chunk of input plus the output.
+"""
+import unittest
+import numpy as np
+
+chunkbytes = 2**26
+
+def _prepare(vals, log):
+    """
+    Return data with masked (and, for log, non-positive) values set to 0
+    and the mask of values that were excluded
+    """
+    data = np.ma.getdata(vals)
+    mask = np.ma.getmaskarray(vals)
+    if log:
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            mask = mask | ~(data > 0)
+            data = np.log(np.where(mask, 1, data))
+    elif mask.any():
+        data = np.where(mask, 0, data)
+    return data, mask
+
+def _banded(data, weights, axis):
+    """
+    sum_k weights[..., :, k, ...] * data[..., k, ...] for weights with
+    new and old at axis and axis + 1 of weights
+    """
+    nnew = weights.shape[axis]
+    outshape = data.shape[:axis] + (nnew,) + data.shape[axis + 1:]
+    out = np.zeros(outshape, dtype = np.result_type(data, weights))
+    otheraxes = tuple([i for i in range(weights.ndim - 1) if i != axis])
+    for k in range(data.shape[axis]):
+        wk = np.take(weights, k, axis = axis + 1)
+        used, = np.where((wk != 0).any(axis = otheraxes) if len(otheraxes) > 0 else wk != 0)
+        if used.size == 0:
+            continue
+        band = (slice(None),) * axis + (slice(used[0], used[-1] + 1),)
+        out[band] += wk[band] * np.take(data, [k], axis = axis)
+    return out
+
+def contract(values, weights, axis, log = False, chunkbytes = None):
+    """
+    Apply interpolation weights to dimension axis of values and return a
+    masked array with the old dimension replaced by the new one
+
+    values - array or variable (pre..., old, post...); read a chunk at a
+             time
+    weights - (new, old) or (pre..., new, old, post...) where pre and
+              post dimensions are either the variable's or 1
+    axis - index of the old dimension in values
+    log - interpolate on log scale (exp of weighted log values)
+    chunkbytes - input bytes per chunk (default: module chunkbytes)
+
+    Masked (and, for log, non-positive) values contribute nothing; new
+    values are masked where all old values were masked
+    """
+    if chunkbytes is None:
+        chunkbytes = globals()['chunkbytes']
+    weights = np.asarray(weights)
+    shape = tuple(values.shape)
+    ndim = len(shape)
+    if weights.ndim == ndim + 1:
+        otherw = [l for i, l in enumerate(weights.shape) if i not in (axis, axis + 1)]
+        if all([l == 1 for l in otherw]):
+            # weights that do not vary are a matrix
+            weights = weights.reshape(weights.shape[axis:axis + 2])
+    elif weights.ndim != 2:
+        raise ValueError('weights must be (new, old) or have %d dimensions; got %s' % (ndim + 1, weights.shape))
+    nnew = weights.shape[-2] if weights.ndim == 2 else weights.shape[axis]
+    outshape = shape[:axis] + (nnew,) + shape[axis + 1:]
+    dtype = np.result_type(np.dtype(getattr(values, 'dtype', 'd')), weights.dtype, np.float32)
+    out = np.empty(outshape, dtype = dtype)
+    outmask = np.zeros(outshape, dtype = 'bool')
+    # chunk along the first dimension that is not interpolated
+    caxis = 0 if axis != 0 else 1
+    if caxis < ndim:
+        rowbytes = dtype.itemsize * int(np.prod(shape)) // max(1, shape[caxis])
+        nrows = max(1, chunkbytes // max(1, rowbytes))
+        chunks = [slice(s, min(s + nrows, shape[caxis])) for s in range(0, shape[caxis], nrows)]
+    else:
+        chunks = [slice(None)]
+    waxis = caxis if caxis < axis else caxis + 1
+    for chunk in chunks:
+        vsel = (slice(None),) * caxis + (chunk,)
+        data, mask = _prepare(values[vsel] if caxis < ndim else values[...], log)
+        if weights.ndim == 2:
+            result = np.moveaxis(np.tensordot(data, weights, axes = ([axis], [1])), -1, axis)
+        else:
+            wchunk = weights if weights.shape[waxis] == 1 else weights[(slice(None),) * waxis + (chunk,)]
+            result = _banded(data, wchunk, axis)
+        if log:
+            result = np.exp(result)
+        out[vsel] = result
+        outmask[vsel] = mask.all(axis = axis)[(slice(None),) * axis + (None,)]
+    return np.ma.MaskedArray(out, mask = outmask) if outmask.any() else np.ma.MaskedArray(out)
+
+def _broadcastinterp(values, weights, axis, log = False):
+    """
+    Reference: weights broadcast against values (the original interpvars)
+    """
+    if weights.ndim == 2:
+        weights = weights[(None,) * axis + (Ellipsis,) + (None,) * (values.ndim - axis - 1)]
+    valuesv = values[(slice(None),) * axis + (None,)]
+    if log:
+        return np.ma.exp((weights * np.ma.log(valuesv)).sum(axis + 1))
+    return (weights * valuesv).sum(axis + 1)
+
+class TestInterp(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.values = rs.uniform(1, 2, size = (3, 6, 4, 5))
+        # each new level uses two adjacent old levels
+        weights = np.zeros((4, 6))
+        for j, k in enumerate([0, 1, 3, 4]):
+            weights[j, k:k + 2] = [.25, .75]
+        self.weights = weights
+        fullweights = np.zeros((3, 4, 6, 4, 5))
+        for j, k in enumerate([0, 2, 3, 4]):
+            frac = rs.uniform(size = (3, 4, 5))
+            fullweights[:, j, k] = frac
+            fullweights[:, j, k + 1] = 1 - frac
+        self.fullweights = fullweights
+
+    def testMatrix(self):
+        for axis in (0, 1, 3):
+            values = np.moveaxis(self.values, 1, axis)
+            for log in (False, True):
+                out = contract(values, self.weights, axis, log = log, chunkbytes = 200)
+                np.testing.assert_allclose(out, _broadcastinterp(values, self.weights, axis, log = log))
+
+    def testBanded(self):
+        for log in (False, True):
+            out = contract(self.values, self.fullweights, 1, log = log, chunkbytes = 200)
+            self.assertEqual(out.shape, (3, 4, 4, 5))
+            np.testing.assert_allclose(out, _broadcastinterp(self.values, self.fullweights, 1, log = log))
+        # weights broadcast over time
+        out = contract(self.values, self.fullweights[:1], 1)
+        np.testing.assert_allclose(out, _broadcastinterp(self.values, self.fullweights[:1], 1))
+        # weights that only vary by level are a matrix
+        out = contract(self.values, self.weights[None, :, :, None, None], 1)
+        np.testing.assert_allclose(out, _broadcastinterp(self.values, self.weights, 1))
+
+    def testMasked(self):
+        values = np.ma.masked_greater(self.values, 1.9)
+        values[0, :, 0, 0] = np.ma.masked
+        ref = _broadcastinterp(values, self.weights, 1)
+        out = contract(values, self.weights, 1)
+        np.testing.assert_allclose(out.filled(-1), ref.filled(-1))
+        self.assert_(out.mask[0, :, 0, 0].all())
+        self.assertEqual(out.mask.sum(), ref.mask.sum())
+
+    def testVariable(self):
+        from ._files import PseudoNetCDFFile
+        from ._functions import interpvars
+        f = PseudoNetCDFFile()
+        for dk, dl in zip(('TSTEP', 'LAY', 'ROW', 'COL'), self.values.shape):
+            f.createDimension(dk, dl)
+        v = f.createVariable('O3', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = self.values.astype('f'), units = 'ppb')
+        f.createVariable('TSTEP', 'i', ('TSTEP',), values = np.arange(3, dtype = 'i'))
+        outf = interpvars(f, self.fullweights, 'LAY', loginterp = ['O3'])
+        self.assertEqual(len(outf.dimensions['LAY']), 4)
+        self.assertEqual(outf.variables['O3'].units, 'ppb')
+        np.testing.assert_allclose(outf.variables['O3'][:], _broadcastinterp(self.values, self.fullweights, 1, log = True), rtol = 1e-6)
+        self.assert_(outf.variables['TSTEP'] is f.variables['TSTEP'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,646 @@
+from __future__ import print_function
+__all__ = ['PseudoNetCDFLazyVariable', 'LazyLeaf', 'LazyConstant', 'LazyMissing', 'LazyBinaryOp', 'LazyAffine', 'LazyConcat', 'lazynode', 'lazyconvert']
+__doc__ = """
+Deferred variable arithmetic
+
+Binary file operations (pncbo, PseudoNetCDFFile.__add__, etc.) build an
+expression graph per variable instead of computing a new array. Leaves
+refer to a variable in a file and operators refer to other nodes. Nodes
+are interned, so the same operation on the same inputs is one node that
+is evaluated once per chunk even when it appears several times in an
+expression (e.g., (a - b) / (a - b)).
+
+Unit conversions are affine nodes (scale and offset); converting a
+converted variable fuses the two into one node, so a chain of
+conversions touches each value once.
+
+Concatenation nodes join nodes (e.g., one variable of several files)
+along an axis; an index is split into one read per node it touches.
+
+A PseudoNetCDFLazyVariable wraps a graph and only evaluates it when it is
+indexed. Evaluation is done in chunks along the leading dimension so that
+temporaries are bounded by PseudoNetCDFLazyVariable.chunkbytes.
+"""
+import unittest
+from weakref import WeakValueDictionary
+import numpy as np
+
+from ._variables import PseudoNetCDFMaskedVariable
+
+def _broadcast_shape(shape1, shape2):
+    ndim = max(len(shape1), len(shape2))
+    shape1 = (1,) * (ndim - len(shape1)) + tuple(shape1)
+    shape2 = (1,) * (ndim - len(shape2)) + tuple(shape2)
+    out = []
+    for l1, l2 in zip(shape1, shape2):
+        if l1 != l2 and 1 not in (l1, l2):
+            raise ValueError('Shapes %s and %s cannot be broadcast' % (shape1, shape2))
+        out.append(max(l1, l2))
+    return tuple(out)
+
+class LazyNode(object):
+    """
+    Base for expression graph nodes. Subclasses define shape, dtype and
+    _evaluate(item, memo)
+    """
+    _interned = WeakValueDictionary()
+    @classmethod
+    def _intern(cls, key, factory):
+        node = cls._interned.get(key, None)
+        if node is None:
+            node = factory()
+            cls._interned[key] = node
+        return node
+
+    def evaluate(self, item, memo):
+        """
+        item - tuple of indices (one per dimension)
+        memo - dictionary shared by all nodes for one item
+        """
+        key = id(self)
+        if key not in memo:
+            memo[key] = self._evaluate(item, memo)
+        return memo[key]
+
+class LazyLeaf(LazyNode):
+    """
+    Leaf node for variable (key) of a file or for a variable (var) that
+    is not in a file. File leaves look up f.variables[key] when they are
+    evaluated, so a replaced variable is not read stale; leaves hold
+    their file or variable, so interned ids are not reused while they
+    exist.
+    """
+    @classmethod
+    def get(cls, f, key):
+        return cls._intern(('leaf', id(f), key), lambda: cls(f, key))
+
+    @classmethod
+    def fromvariable(cls, var):
+        return cls._intern(('var', id(var)), lambda: cls(None, None, var))
+
+    def __init__(self, f, key, var = None):
+        self._file = f
+        self._key = key
+        self._var = var
+        var = f.variables[key] if var is None else var
+        self.shape = tuple(var.shape)
+        self.dtype = var.dtype
+
+    def _evaluate(self, item, memo):
+        var = self._var
+        if var is None:
+            var = self._file.variables[self._key]
+            if tuple(var.shape) != self.shape:
+                raise ValueError('%s changed shape from %s to %s after it was used in an expression' % (self._key, self.shape, tuple(var.shape)))
+        if item is None:
+            return var[...]
+        return var[item]
+
+class LazyConstant(LazyNode):
+    """
+    Scalar or array operand (e.g., the 2 in var * 2); scalars are used
+    whole for every item
+    """
+    def __init__(self, value):
+        self._value = np.asarray(value)
+        self.shape = self._value.shape
+        self.dtype = self._value.dtype
+
+    def _sample(self):
+        return self._value if self._value.ndim == 0 else np.ones(1, dtype = self.dtype)
+
+    def _evaluate(self, item, memo):
+        if item is None or self._value.ndim == 0:
+            return self._value
+        return self._value[item]
+
+class LazyMissing(LazyNode):
+    """
+    Fully masked values of shape and dtype (e.g., the records of a
+    concatenated variable that one of the files does not have)
+    """
+    @classmethod
+    def get(cls, shape, dtype):
+        return cls._intern(('missing', tuple(shape), np.dtype(dtype).str), lambda: cls(shape, dtype))
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def _evaluate(self, item, memo):
+        # index a broadcast scalar to get the result shape without
+        # allocating the whole block
+        vals = np.broadcast_to(np.zeros((), dtype = self.dtype), self.shape)
+        if item is not None:
+            vals = vals[item]
+        return np.ma.masked_all(vals.shape, dtype = self.dtype)
+
+class LazyBinaryOp(LazyNode):
+    """
+    Operator (e.g., +, -, /, **, <) applied to two nodes
+    """
+    @classmethod
+    def get(cls, op, lhs, rhs):
+        return cls._intern((op, id(lhs), id(rhs)), lambda: cls(op, lhs, rhs))
+
+    def __init__(self, op, lhs, rhs):
+        self._op = op
+        self._lhs = lhs
+        self._rhs = rhs
+        self._code = compile('lhs %s rhs' % op, '<pncbo %s>' % op, 'eval')
+        self.shape = _broadcast_shape(lhs.shape, rhs.shape)
+        # operands that broadcast cannot share an index, so they are
+        # evaluated whole and the result is indexed (scalars apply to any
+        # item)
+        self._indexable = (lhs.shape == rhs.shape or () in (lhs.shape, rhs.shape))
+        sample = lambda node: node._sample() if isinstance(node, LazyConstant) else np.ones(1, dtype = node.dtype)
+        with np.errstate(all = 'ignore'):
+            self.dtype = self._apply(sample(lhs), sample(rhs)).dtype
+
+    def _apply(self, lhs, rhs):
+        out = eval(self._code, None, dict(lhs = lhs, rhs = rhs))
+        if isinstance(out, np.ma.MaskedArray):
+            return np.ma.masked_array(np.ma.getdata(out), mask = np.ma.getmaskarray(out))
+        return np.asarray(out).view(np.ndarray)
+
+    def _evaluate(self, item, memo):
+        if not self._indexable and item is not None:
+            return self.evaluate(None, memo.setdefault('full', {}))[item]
+        lhs = self._lhs.evaluate(item, memo)
+        rhs = self._rhs.evaluate(item, memo)
+        with np.errstate(all = 'ignore'):
+            return self._apply(lhs, rhs)
+
+class LazyAffine(LazyNode):
+    """
+    Affine transform (units.Affine; e.g., a unit conversion) of a node;
+    masks of the node are kept
+    """
+    @classmethod
+    def get(cls, node, affine):
+        if isinstance(node, LazyAffine):
+            node, affine = node._node, node._affine.then(affine)
+        return cls._intern(('affine', id(node), affine.scale, affine.offset), lambda: cls(node, affine))
+
+    def __init__(self, node, affine):
+        self._node = node
+        self._affine = affine
+        self.shape = node.shape
+        self.dtype = np.asarray(affine(np.ones(1, dtype = node.dtype))).dtype
+
+    def _evaluate(self, item, memo):
+        return self._affine(self._node.evaluate(item, memo))
+
+def _asslice(idx):
+    """
+    slice equivalent to increasing, evenly spaced indices or idx
+    """
+    if idx.size == 1:
+        return slice(idx[0], idx[0] + 1)
+    step = idx[1] - idx[0]
+    if step > 0 and (np.diff(idx) == step).all():
+        return slice(idx[0], idx[-1] + 1, step)
+    return idx
+
+class LazyConcat(LazyNode):
+    """
+    Nodes concatenated along axis; each read only evaluates the nodes
+    that hold the requested indices
+    """
+    @classmethod
+    def get(cls, nodes, axis):
+        return cls._intern(('concat', axis) + tuple([id(node) for node in nodes]), lambda: cls(nodes, axis))
+
+    def __init__(self, nodes, axis):
+        self._nodes = list(nodes)
+        self._axis = axis
+        shapes = [node.shape for node in self._nodes]
+        for shape in shapes[1:]:
+            if len(shape) != len(shapes[0]) or shape[:axis] + shape[axis + 1:] != shapes[0][:axis] + shapes[0][axis + 1:]:
+                raise ValueError('Shapes %s and %s cannot be concatenated on axis %d' % (shapes[0], shape, axis))
+        self._offsets = np.cumsum([0] + [shape[axis] for shape in shapes])
+        self.shape = shapes[0][:axis] + (int(self._offsets[-1]),) + shapes[0][axis + 1:]
+        self.dtype = np.result_type(*[node.dtype for node in self._nodes])
+
+    def _evaluate(self, item, memo):
+        axis = self._axis
+        if item is None:
+            item = (slice(None),) * len(self.shape)
+        idx = item[axis]
+        n = self.shape[axis]
+        # nodes are evaluated with their own memos because each gets a
+        # different item
+        if not isinstance(idx, slice) and np.ndim(idx) == 0:
+            idx = int(idx) % n
+            ni = np.searchsorted(self._offsets, idx, side = 'right') - 1
+            return self._nodes[ni].evaluate(item[:axis] + (idx - self._offsets[ni],) + item[axis + 1:], {})
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(n))
+        idx = np.asarray(idx) % n
+        outaxis = axis - sum([not isinstance(i, slice) and np.ndim(i) == 0 for i in item[:axis]])
+        nodei = np.searchsorted(self._offsets, idx, side = 'right') - 1
+        parts = []
+        positions = []
+        for ni in np.unique(nodei):
+            sel = np.flatnonzero(nodei == ni)
+            local = _asslice(idx[sel] - self._offsets[ni])
+            parts.append(self._nodes[ni].evaluate(item[:axis] + (local,) + item[axis + 1:], {}))
+            positions.append(sel)
+        if len(parts) == 0:
+            return self._nodes[0].evaluate(item[:axis] + (idx,) + item[axis + 1:], {})
+        if len(parts) == 1:
+            out = parts[0]
+        elif any([isinstance(part, np.ma.MaskedArray) for part in parts]):
+            out = np.ma.concatenate(parts, axis = outaxis)
+        else:
+            out = np.concatenate([np.asarray(part) for part in parts], axis = outaxis)
+        positions = np.concatenate(positions)
+        if (np.diff(positions) < 0).any():
+            out = out.take(np.argsort(positions), axis = outaxis)
+        return out
+
+def lazynode(f, key):
+    """
+    Return the graph node for variable key in file f; lazy variables
+    contribute their own graph so that sequential operations compose.
+    """
+    var = f.variables[key]
+    if isinstance(var, PseudoNetCDFLazyVariable):
+        return var._node
+    return LazyLeaf.get(f, key)
+
+def lazyconvert(var, affine, parent = None, name = None, **kwds):
+    """
+    PseudoNetCDFLazyVariable of affine(var) with the properties of var
+    updated by kwds (e.g., units); nothing is read until it is indexed
+
+    var - variable (lazy variables are fused with affine)
+    affine - units.Affine
+    parent - file of the result (default: var's file, if known)
+    """
+    if isinstance(var, PseudoNetCDFLazyVariable):
+        node = var._node
+        parent = var._parent if parent is None else parent
+        name = var._name if name is None else name
+    else:
+        node = LazyLeaf.fromvariable(var)
+    # values are unpacked, so packing attributes no longer apply
+    propd = dict([(k, getattr(var, k)) for k in var.ncattrs() if k not in ('scale_factor', 'add_offset')])
+    propd.update(kwds)
+    return PseudoNetCDFLazyVariable(parent, name, LazyAffine.get(node, affine), var.dimensions, **propd)
+
+class PseudoNetCDFLazyVariable(object):
+    """
+    PseudoNetCDFLazyVariable presents a variable interface (dimensions,
+    shape, dtype, ncattrs, indexing) for an expression graph that is
+    evaluated only when indexed. Indexing returns a masked variable with
+    invalid values masked (fill_value -999).
+    """
+    chunkbytes = 2**26
+    def __init__(self, parent, name, node, dimensions, **kwds):
+        object.__setattr__(self, '_ncattrs', ())
+        self._parent = parent
+        self._name = name
+        self._node = node
+        self.dimensions = tuple(dimensions)
+        for k, v in kwds.items():
+            setattr(self, k, v)
+
+    def __setattr__(self, k, v):
+        if k[:1] != '_' and k not in ('dimensions',):
+            if k not in self._ncattrs:
+                self._ncattrs += (k,)
+        object.__setattr__(self, k, v)
+
+    def __delattr__(self, k):
+        if k in self._ncattrs:
+            self._ncattrs = tuple([k_ for k_ in self._ncattrs if k_ != k])
+        object.__delattr__(self, k)
+
+    def ncattrs(self):
+        return self._ncattrs
+
+    def setncattr(self, k, v):
+        return setattr(self, k, v)
+
+    def typecode(self):
+        return self.dtype.char
+
+    @property
+    def shape(self):
+        return self._node.shape
+
+    @property
+    def dtype(self):
+        return self._node.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return object.__repr__(self).replace(' at ', ' %s%s (lazy) at ' % (self._name, str(self.dimensions)))
+
+    def chunkrows(self):
+        """
+        Number of leading dimension elements evaluated at a time
+        """
+        rowbytes = self.dtype.itemsize * int(np.prod(self.shape[1:]))
+        return max(1, self.chunkbytes // max(1, rowbytes))
+
+    def chunkslices(self):
+        """
+        Leading dimension slices that each evaluate within chunkbytes
+        """
+        if self.ndim == 0:
+            return [Ellipsis]
+        nrows = self.chunkrows()
+        n = self.shape[0]
+        return [slice(s, min(s + nrows, n)) for s in range(0, n, nrows)]
+
+    def _expanditem(self, item):
+        """
+        Return item as a tuple with one entry per dimension or None when
+        item uses indexing that cannot be split by dimension
+        """
+        if not isinstance(item, tuple):
+            item = (item,)
+        if any([i is None or isinstance(i, (np.ndarray, list)) and np.asarray(i).dtype.kind == 'b' for i in item]):
+            return None
+        nellipsis = sum([i is Ellipsis for i in item])
+        if nellipsis > 1:
+            return None
+        if nellipsis == 1:
+            ei = [i is Ellipsis for i in item].index(True)
+            item = item[:ei] + (slice(None),) * (self.ndim - len(item) + 1) + item[ei + 1:]
+        item = item + (slice(None),) * (self.ndim - len(item))
+        if len(item) > self.ndim:
+            return None
+        return item
+
+    def _evaluate(self, item):
+        if self.ndim == 0:
+            return self._node.evaluate(None, {})
+        item = self._expanditem(item)
+        if item is None:
+            raise IndexError('unsupported index for lazy variable')
+        first, rest = item[0], item[1:]
+        nrows = self.chunkrows()
+        if isinstance(first, slice):
+            first = np.arange(*first.indices(self.shape[0]))
+            if first.size <= nrows:
+                return self._node.evaluate(item, {})
+        elif np.ndim(first) == 0:
+            return self._node.evaluate(item, {})
+        first = np.asarray(first)
+        if first.size <= nrows:
+            return self._node.evaluate((first,) + rest, {})
+        out = None
+        for start in range(0, first.size, nrows):
+            chunkidx = first[start:start + nrows]
+            if chunkidx.size > 1 and (np.diff(chunkidx) == chunkidx[1] - chunkidx[0]).all() and chunkidx[1] > chunkidx[0]:
+                chunkidx = slice(chunkidx[0], chunkidx[-1] + 1, chunkidx[1] - chunkidx[0])
+            chunk = self._node.evaluate((chunkidx,) + rest, {})
+            if out is None:
+                empty = np.ma.empty if isinstance(chunk, np.ma.MaskedArray) else np.empty
+                out = empty((first.size,) + chunk.shape[1:], dtype = chunk.dtype)
+            out[start:start + nrows] = chunk
+        return out
+
+    def __getitem__(self, item):
+        try:
+            vals = self._evaluate(item)
+        except IndexError:
+            vals = self._evaluate(Ellipsis)[item]
+        vals = np.ma.masked_invalid(np.ma.asarray(vals))
+        if np.ndim(vals) != self.ndim:
+            return vals
+        propd = dict([(k, getattr(self, k)) for k in self.ncattrs() if k != 'fill_value'])
+        return PseudoNetCDFMaskedVariable(self._parent, self._name, vals.dtype.char, self.dimensions, values = vals, fill_value = getattr(self, 'fill_value', -999), **propd)
+
+    def __array__(self, dtype = None):
+        out = np.ma.getdata(self[...])
+        if dtype is not None:
+            out = out.astype(dtype)
+        return out
+
+    def getValue(self):
+        """
+        Return scalar value
+        """
+        return self[...].item()
+
+    def __iter__(self):
+        return iter(self[...])
+
+    # arithmetic extends the graph; ufuncs and ndarray methods (mean,
+    # max, swapaxes, ...) are applied to the evaluated variable
+    def _operand(self, other):
+        if isinstance(other, PseudoNetCDFLazyVariable):
+            return other._node
+        if np.ndim(other) == 0:
+            return LazyConstant(np.ma.getdata(other))
+        return LazyLeaf.fromvariable(other)
+
+    def _binaryop(self, op, other, reflected = False):
+        lhs, rhs = self._node, self._operand(other)
+        if reflected:
+            lhs, rhs = rhs, lhs
+        node = LazyBinaryOp.get(op, lhs, rhs)
+        dims = self.dimensions
+        if node.shape != self.shape:
+            dims = getattr(other, 'dimensions', dims)
+        propd = dict([(k, getattr(self, k)) for k in self.ncattrs()])
+        return PseudoNetCDFLazyVariable(self._parent, self._name, node, dims, **propd)
+
+    def __add__(self, other): return self._binaryop('+', other)
+    def __radd__(self, other): return self._binaryop('+', other, True)
+    def __sub__(self, other): return self._binaryop('-', other)
+    def __rsub__(self, other): return self._binaryop('-', other, True)
+    def __mul__(self, other): return self._binaryop('*', other)
+    def __rmul__(self, other): return self._binaryop('*', other, True)
+    def __truediv__(self, other): return self._binaryop('/', other)
+    def __rtruediv__(self, other): return self._binaryop('/', other, True)
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+    def __floordiv__(self, other): return self._binaryop('//', other)
+    def __rfloordiv__(self, other): return self._binaryop('//', other, True)
+    def __mod__(self, other): return self._binaryop('%', other)
+    def __rmod__(self, other): return self._binaryop('%', other, True)
+    def __pow__(self, other): return self._binaryop('**', other)
+    def __rpow__(self, other): return self._binaryop('**', other, True)
+    def __lt__(self, other): return self._binaryop('<', other)
+    def __le__(self, other): return self._binaryop('<=', other)
+    def __gt__(self, other): return self._binaryop('>', other)
+    def __ge__(self, other): return self._binaryop('>=', other)
+    def __eq__(self, other): return self._binaryop('==', other)
+    def __ne__(self, other): return self._binaryop('!=', other)
+    __hash__ = object.__hash__
+    def __neg__(self): return self._binaryop('*', -1)
+    def __pos__(self): return self
+    def __abs__(self): return abs(self[...])
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwds):
+        inputs = tuple([i[...] if isinstance(i, PseudoNetCDFLazyVariable) else i for i in inputs])
+        if 'out' in kwds:
+            kwds['out'] = tuple([o[...] if isinstance(o, PseudoNetCDFLazyVariable) else o for o in kwds['out']])
+        return getattr(ufunc, method)(*inputs, **kwds)
+
+    def __getattr__(self, k):
+        # only called for names that are not attributes of the variable;
+        # properties such as fill_value are not delegated so that probing
+        # them does not read the data
+        if k[:1] != '_' and (k == 'T' or callable(getattr(np.ma.MaskedArray, k, None))):
+            return getattr(self[...], k)
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, k))
+
+class TestLazy(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from ._files import PseudoNetCDFFile
+        self.files = []
+        for seed in (1., 2.):
+            f = PseudoNetCDFFile()
+            f.createDimension('TIME', 6)
+            f.createDimension('ROW', 3)
+            f.createDimension('COL', 4)
+            v = f.createVariable('O3', 'f', ('TIME', 'ROW', 'COL'))
+            v[:] = np.arange(6 * 3 * 4).reshape(6, 3, 4) + seed
+            v.units = 'ppb'
+            v = f.createVariable('TIME', 'i', ('TIME',))
+            v[:] = np.arange(6)
+            self.files.append(f)
+
+    def testLazyBinaryOp(self):
+        from ._functions import pncbo, seqpncbo
+        a, b = self.files
+        diff = pncbo('-', a, b, coordkeys = ['TIME'])
+        o3 = diff.variables['O3']
+        self.assert_(isinstance(o3, PseudoNetCDFLazyVariable))
+        self.assertEqual(o3.shape, (6, 3, 4))
+        self.assertEqual(o3.units, '(ppb) - (ppb)')
+        self.assert_(diff.variables['TIME'] is a.variables['TIME'])
+        rel, = seqpncbo(['/'], [diff, b])
+        a3, b3 = a.variables['O3'][:], b.variables['O3'][:]
+        self.assert_(np.allclose(rel.variables['O3'][:], (a3 - b3) / b3))
+        self.assert_(np.allclose(rel.variables['O3'][2:4, 1], ((a3 - b3) / b3)[2:4, 1]))
+        self.assert_(np.allclose(rel.variables['O3'][-1, :, [0, 2]], ((a3 - b3) / b3)[-1, :, [0, 2]]))
+
+    def testLazyReplaced(self):
+        from ._functions import pncbo
+        a, b = self.files
+        o3 = pncbo('-', a, b, coordkeys = ['TIME']).variables['O3']
+        a.createVariable('O3', 'f', ('TIME', 'ROW', 'COL'))[:] = 10
+        np.testing.assert_allclose(o3[:], 10 - b.variables['O3'][:])
+        a.createVariable('O3', 'f', ('TIME', 'ROW'))
+        self.assertRaises(ValueError, o3.__getitem__, Ellipsis)
+
+    def testLazyChunks(self):
+        a, b = self.files
+        o3 = (a - b).variables['O3']
+        # 2 rows of 12 floats per chunk
+        o3.chunkbytes = 2 * 12 * 4
+        self.assertEqual(o3.chunkslices(), [slice(0, 2), slice(2, 4), slice(4, 6)])
+        expected = a.variables['O3'][:] - b.variables['O3'][:]
+        self.assert_((o3[:] == expected).all())
+        self.assert_((o3[::-1, 1] == expected[::-1, 1]).all())
+        self.assert_((o3[[5, 0, 3]] == expected[[5, 0, 3]]).all())
+
+    def testLazyShared(self):
+        a, b = self.files
+        n1 = LazyBinaryOp.get('-', lazynode(a, 'O3'), lazynode(b, 'O3'))
+        n2 = LazyBinaryOp.get('-', lazynode(a, 'O3'), lazynode(b, 'O3'))
+        self.assert_(n1 is n2)
+        calls = []
+        class Counter(LazyLeaf):
+            def _evaluate(self, item, memo):
+                calls.append(item)
+                return LazyLeaf._evaluate(self, item, memo)
+        leaf = Counter(a, 'O3')
+        node = LazyBinaryOp('*', leaf, leaf)
+        var = PseudoNetCDFLazyVariable(a, 'O3SQ', node, ('TIME', 'ROW', 'COL'))
+        self.assert_((var[1] == a.variables['O3'][1] ** 2).all())
+        self.assertEqual(len(calls), 1)
+
+    def testLazyPncgen(self):
+        from PseudoNetCDF.pncgen import Pseudo2NetCDF
+        a, b = self.files
+        diff = a - b
+        diff.variables['O3'].chunkbytes = 12 * 4
+        out = Pseudo2NetCDF().convert(diff)
+        self.assert_((out.variables['O3'][:] == a.variables['O3'][:] - b.variables['O3'][:]).all())
+        self.assertEqual(out.variables['O3'].units, '(ppb) - (ppb)')
+
+    def testLazyArray(self):
+        a, b = self.files
+        o3 = (a - b).variables['O3']
+        expected = a.variables['O3'][:] - b.variables['O3'][:]
+        twice = o3 * 2
+        self.assert_(isinstance(twice, PseudoNetCDFLazyVariable))
+        self.assertEqual(twice.units, o3.units)
+        self.assert_((twice[1] == expected[1] * 2).all())
+        self.assert_(((1 - o3 / 2)[:] == 1 - expected / 2).all())
+        self.assert_(((o3 + a.variables['O3'])[:] == expected + a.variables['O3'][:]).all())
+        self.assert_((-o3)[:].sum() == -expected.sum())
+        self.assertEqual((o3 > 0)[:].sum(), (expected > 0).sum())
+        self.assertEqual(o3.mean(), expected.mean())
+        self.assertEqual(o3.max(axis = 0).shape, (3, 4))
+        self.assertEqual(o3.swapaxes(0, 1).shape, (3, 6, 4))
+        self.assert_((np.sqrt(o3 ** 2) == np.abs(expected)).all())
+        self.assert_(((a.variables['O3'][:] * o3) == a.variables['O3'][:] * expected).all())
+        self.assertRaises(AttributeError, getattr, o3, 'nope')
+        self.assertEqual(getattr(o3, 'missing_value', None), None)
+
+    def testLazyAffine(self):
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from PseudoNetCDF.units import Affine
+        from PseudoNetCDF.pncgen import Pseudo2NetCDF
+        from ._transforms import PseudoNetCDFVariableConvertUnit
+        a = self.files[0]
+        o3 = a.variables['O3']
+        o3[0, 0, 0] = np.ma.masked
+        o3.long_name = 'O3'
+        self.assert_(PseudoNetCDFVariableConvertUnit(o3, 'ppb') is o3)
+        ppm = PseudoNetCDFVariableConvertUnit(o3, 'ppm')
+        self.assert_('fill_value' not in ppm.ncattrs())
+        ppt = PseudoNetCDFVariableConvertUnit(ppm, 'ppt')
+        self.assert_(isinstance(ppt._node, LazyAffine))
+        self.assert_(ppt._node._node is ppm._node._node)
+        self.assertEqual(ppt._node._affine, Affine(1000.))
+        self.assertEqual(ppt.units, 'ppt')
+        vals = ppt[:]
+        self.assert_(vals.mask[0, 0, 0])
+        np.testing.assert_allclose(vals[1:], o3[1:] * 1000., rtol = 1e-6)
+        ppt.chunkbytes = 12 * 4
+        np.testing.assert_allclose(ppt[[4, 1]], o3[[4, 1]] * 1000., rtol = 1e-6)
+        a.variables['O3'] = ppt
+        tmpdir = mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'packed.nc')
+            out = Pseudo2NetCDF(verbose = 0, packunits = True).convert(a, path)
+            out.close()
+            from PseudoNetCDF.netcdf import NetCDFFile
+            with NetCDFFile(path) as out:
+                var = out.variables['O3']
+                self.assertEqual(var.scale_factor, 1000.)
+                self.assertEqual(var.units, 'ppt')
+                np.testing.assert_allclose(var[:], vals, rtol = 1e-6)
+                self.assert_(var[:].mask[0, 0, 0])
+                var.set_auto_scale(False)
+                np.testing.assert_allclose(var[1:], o3[1:])
+        finally:
+            rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,299 @@
+from __future__ import print_function
+__all__ = ['PNCPlan', 'fuse_slices', 'exprdependencies']
+__doc__ = """
+Query planning for pncparse
+
+pncprep applies variable selection (-v), slicing (-s), reduction (-r),
+extraction and expressions (--expr) as a chain of whole-file
+transformations. PNCPlan collects that chain before any file is opened
+and works out which variables (selected variables, coordinates and the
+variables that expressions use) and which index ranges (all slices on a
+dimension fused into one) are needed. PNCPlan.apply then asks the reader
+only for those variables and slabs.
+"""
+import unittest
+from warnings import warn
+from collections import OrderedDict
+from symtable import symtable
+import numpy as np
+
+from ._files import PseudoNetCDFFile, PseudoNetCDFVariables
+
+def _readscript(path):
+    with open(path) as sf:
+        return sf.read()
+
+def _parseslice(slicedef):
+    """
+    Parse dim,start[,stop[,step]] as slice_dim does
+    """
+    slicedef = slicedef.split(',')
+    slicedef = [slicedef[0]] + list(map(eval, slicedef[1:]))
+    if len(slicedef) == 2:
+        slicedef.append(slicedef[-1] + 1)
+    slicedef = (slicedef + [None,])[:4]
+    return slicedef[0], slice(*slicedef[1:])
+
+def _range2slice(r):
+    """
+    Convert a range to an equivalent slice
+    """
+    if len(r) == 0:
+        return slice(0, 0)
+    stop = r[-1] + (1 if r.step > 0 else -1)
+    if stop < 0:
+        stop = None
+    return slice(r[0], stop, r.step)
+
+def fuse_slices(slicedefs, dimensions, fuzzydim = True):
+    """
+    Combine a sequence of slice_dim definitions into one slice per
+    dimension
+
+    slicedefs - list of 'dim,start[,stop[,step]]' applied in order
+    dimensions - dictionary of dimension name to dimension (or length)
+    fuzzydim - apply slices on dim also to dim1, dim2, ... (as slice_dim)
+
+    Returns an OrderedDict of dimension name to slice relative to the
+    original dimension
+    """
+    ranges = OrderedDict()
+    for slicedef in slicedefs:
+        dimkey, dslice = _parseslice(slicedef)
+        if dimkey not in dimensions:
+            warn('%s not in file' % dimkey)
+            continue
+        targets = [dimkey]
+        if fuzzydim:
+            targets += [key for key in dimensions if dimkey == key[:len(dimkey)] and key[len(dimkey):].isdigit()]
+        for dk in targets:
+            if dk not in ranges:
+                ranges[dk] = range(len(dimensions[dk]) if not isinstance(dimensions[dk], int) else dimensions[dk])
+            ranges[dk] = ranges[dk][dslice]
+    return OrderedDict([(dk, _range2slice(r)) for dk, r in ranges.items()])
+
+def exprdependencies(expr):
+    """
+    Return (referenced, assigned) names of expr (after name mangling)
+    """
+    symbols = symtable(expr, '<pncexpr>', 'exec').get_symbols()
+    referenced = [s.get_name() for s in symbols if s.is_referenced()]
+    assigned = [s.get_name() for s in symbols if s.is_assigned()]
+    return referenced, assigned
+
+class PNCPlan(object):
+    """
+    PNCPlan describes what a pncparse option chain needs from each input
+    file
+
+    varkeys - variables the output contains (None for all)
+    slices - list of slice_dim definitions that can be pushed into reads
+    residual_slices - slice_dim definitions that must be applied later
+    coordkeys - coordinate variables kept with any selection
+    """
+    def __init__(self, varkeys = None, slices = [], residual_slices = [], expressions = [], coordkeys = []):
+        self.varkeys = None if varkeys is None else list(varkeys)
+        self.slices = list(slices)
+        self.residual_slices = list(residual_slices)
+        self.coordkeys = list(coordkeys)
+        self.expressions = list(expressions)
+        referenced = []
+        assigned = []
+        for expr in self.expressions:
+            ref, asg = exprdependencies(expr)
+            referenced.extend([k for k in ref if k not in referenced])
+            assigned.extend([k for k in asg if k not in assigned])
+        self.assigned = assigned
+        self.referenced = referenced
+
+    @classmethod
+    def fromargs(cls, args):
+        """
+        Plan for pncparse arguments (args) or None when there is nothing
+        to push into the reader or -v includes expressions
+        """
+        varkeys = args.variables
+        if varkeys is not None and not all([k.isidentifier() for k in varkeys]):
+            return None
+        expressions = list(args.expressions) + [_readscript(script) for script in args.expressionscripts]
+        laddconv = args.fromconv is not None and args.toconv is not None
+        # slices that change dimensions before other operations that
+        # depend on full dimensions cannot be pushed into the read
+        canpush = not (laddconv or args.stack is not None or args.mangle or
+                       any([rename.split(',')[0] in ('d', 'dimension') for rename in args.rename]) or
+                       any([mask.split(',')[0] == 'where' for mask in args.masks]))
+        slices = list(args.slice) if canpush else []
+        residual_slices = [] if canpush else list(args.slice)
+        if varkeys is None and len(slices) == 0:
+            return None
+        return cls(varkeys = varkeys, slices = slices, residual_slices = residual_slices, expressions = expressions, coordkeys = args.coordkeys)
+
+    def readvars(self, f):
+        """
+        Variables of f that are needed (selected variables, expression
+        dependencies and coordinates) as an OrderedDict in the file's
+        order; each variable of f is accessed once
+        """
+        from ._functions import _namemangler
+        fkeys = list(f.variables.keys())
+        if self.varkeys is None:
+            return OrderedDict([(k, f.variables[k]) for k in fkeys])
+        invars = {}
+        def getinvar(k):
+            if k not in invars:
+                invars[k] = f.variables[k]
+            return invars[k]
+        mangled = dict([(_namemangler(k), k) for k in fkeys])
+        needed = set([k for k in self.varkeys if k in fkeys])
+        missing = [k for k in self.varkeys if k not in fkeys and k not in self.assigned]
+        if len(missing) > 0:
+            warn('Skipping %s' % ', '.join(missing))
+        needed.update([mangled[k] for k in self.referenced if k in mangled])
+        dims = set()
+        for k in needed:
+            dims.update(getinvar(k).dimensions)
+        coordkeys = set(self.coordkeys).union(dims)
+        for dk in dims:
+            if dk in fkeys and hasattr(getinvar(dk), 'bounds'):
+                coordkeys.add(getinvar(dk).bounds.strip())
+        needed.update([k for k in coordkeys if k in fkeys])
+        return OrderedDict([(k, getinvar(k)) for k in fkeys if k in needed])
+
+    def dropkeys(self, f):
+        """
+        Variables in f that were read only for expressions
+        """
+        if self.varkeys is None:
+            return []
+        fkeys = list(f.variables.keys())
+        keep = set(self.varkeys).union(self.coordkeys).union(self.assigned)
+        for k in list(keep):
+            if k in fkeys:
+                keep.update(f.variables[k].dimensions)
+        # cell bounds of kept coordinates (readvars adds them)
+        for k in list(keep):
+            if k in fkeys and hasattr(f.variables[k], 'bounds'):
+                keep.add(f.variables[k].bounds.strip())
+        return [k for k in f.variables.keys() if k not in keep and k not in f.dimensions]
+
+    def history(self):
+        """
+        History entries for the pushed slices
+        """
+        return ''.join(["slice_dim(f, %s, fuzzydim = True); " % slicedef for slicedef in self.slices])
+
+    def apply(self, f):
+        """
+        Return a file with only the needed variables of f, each read as a
+        single slab with all slices applied. Variables are read when they
+        are first accessed.
+        """
+        invars = self.readvars(f)
+        keys = list(invars.keys())
+        slices = fuse_slices(self.slices, f.dimensions)
+        outf = PseudoNetCDFFile()
+        for pk in f.ncattrs():
+            setattr(outf, pk, getattr(f, pk))
+        for k, invar in invars.items():
+            for dk in invar.dimensions:
+                if dk not in outf.dimensions:
+                    dlen = len(f.dimensions[dk])
+                    if dk in slices:
+                        dlen = len(range(dlen)[slices[dk]])
+                    outf.createDimension(dk, dlen).setunlimited(f.dimensions[dk].isunlimited())
+        for dk in self.coordkeys:
+            if dk in f.dimensions and dk not in outf.dimensions:
+                outf.createDimension(dk, len(f.dimensions[dk])).setunlimited(f.dimensions[dk].isunlimited())
+
+        def getvar(k):
+            invar = invars[k]
+            idx = tuple([slices.get(dk, slice(None)) for dk in invar.dimensions])
+            if len(idx) == 0:
+                vals = invar[...]
+            else:
+                vals = invar[idx]
+            vals = np.ma.array(vals, copy = True) if isinstance(vals, np.ma.MaskedArray) else np.array(vals, copy = True)
+            propd = dict([(pk, getattr(invar, pk)) for pk in invar.ncattrs()])
+            if isinstance(vals, np.ma.MaskedArray) and 'fill_value' not in propd:
+                propd['fill_value'] = vals.fill_value
+            if 'values' in propd:
+                propd['pvalues'] = propd.pop('values')
+            if 'name' in propd:
+                propd.setdefault('standard_name', propd['name'])
+                del propd['name']
+            # createVariable stores the variable, so each is read once
+            return outf.createVariable(k, vals.dtype.char, invar.dimensions, values = vals, **propd)
+
+        outf.variables = PseudoNetCDFVariables(getvar, keys)
+        return outf
+
+    def __repr__(self):
+        return 'PNCPlan(varkeys=%r, slices=%r, residual_slices=%r, expressions=%r)' % (self.varkeys, self.slices, self.residual_slices, self.expressions)
+
+class TestPlan(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        self.accessed = accessed = []
+        f = self.f = PseudoNetCDFFile()
+        f.createDimension('time', 10).setunlimited(True)
+        f.createDimension('layer', 5)
+        f.createDimension('layer1', 5)
+        f.createDimension('lat', 4)
+        data = OrderedDict()
+        data['time'] = np.arange(10.)
+        data['NO'] = np.arange(10 * 5 * 4.).reshape(10, 5, 4)
+        data['NO2'] = data['NO'] * 2
+        data['O3'] = data['NO'] * 3
+        data['PRES'] = np.arange(10 * 5 * 4.).reshape(10, 5, 4)
+        dims = dict(time = ('time',), PRES = ('time', 'layer1', 'lat'))
+        def getvar(k):
+            accessed.append(k)
+            from ._variables import PseudoNetCDFVariable
+            return PseudoNetCDFVariable(f, k, 'd', dims.get(k, ('time', 'layer', 'lat')), values = data[k], units = 'ppb')
+        f.variables = PseudoNetCDFVariables(getvar, list(data.keys()))
+
+    def testFuse(self):
+        fused = fuse_slices(['time,2,10', 'time,0,8,2', 'layer,3'], self.f.dimensions)
+        self.assertEqual(fused['time'], slice(2, 9, 2))
+        self.assertEqual(fused['layer'], slice(3, 4, 1))
+        self.assertEqual(fused['layer1'], slice(3, 4, 1))
+        fused = fuse_slices(['time,None,None,-3'], self.f.dimensions)
+        self.assertEqual(list(range(10)[fused['time']]), [9, 6, 3, 0])
+
+    def testApply(self):
+        from ._functions import slice_dim, getvarpnc
+        plan = PNCPlan(varkeys = ['NO2', 'NOX'], slices = ['time,2,10', 'time,0,8,2', 'layer,1,3'], expressions = ['NOX = NO + NO2'], coordkeys = ['time'])
+        expected = getvarpnc(self.f, ['NO2'], coordkeys = ['time'])
+        for slicedef in plan.slices:
+            expected = slice_dim(expected, slicedef)
+        del self.accessed[:]
+        outf = plan.apply(self.f)
+        self.assertEqual(list(outf.variables.keys()), ['time', 'NO', 'NO2'])
+        # PRES and O3 are never built
+        self.assertEqual(sorted(self.accessed), ['NO', 'NO2', 'time'])
+        self.assertEqual(len(outf.dimensions['time']), 4)
+        self.assert_(outf.dimensions['time'].isunlimited())
+        self.assert_((outf.variables['NO2'][:] == expected.variables['NO2'][:]).all())
+        self.assert_((outf.variables['time'][:] == [2, 4, 6, 8]).all())
+        self.assertEqual(len(self.accessed), 3)
+        self.assertEqual(plan.dropkeys(outf), ['NO'])
+
+    def testBounds(self):
+        from ._variables import PseudoNetCDFVariable
+        f = PseudoNetCDFFile()
+        f.createDimension('time', 3)
+        f.createDimension('nv', 2)
+        f.createVariable('time', 'd', ('time',), values = np.arange(3.), bounds = 'time_bnds')
+        f.createVariable('time_bnds', 'd', ('time', 'nv'), values = np.arange(3.)[:, None] + [0, 1])
+        f.createVariable('O3', 'd', ('time',), values = np.ones(3))
+        f.createVariable('NO', 'd', ('time',), values = np.ones(3))
+        plan = PNCPlan(varkeys = ['O3'], slices = ['time,1,3'])
+        outf = plan.apply(f)
+        self.assertEqual(list(outf.variables.keys()), ['time', 'time_bnds', 'O3'])
+        self.assertEqual(plan.dropkeys(outf), [])
+        np.testing.assert_equal(outf.variables['time_bnds'][:], [[1, 2], [2, 3]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+from __future__ import print_function
+__all__ = ['SiteMap', 'sitemap', 'gather', 'gridkey']
+__doc__ = """
+Site mapping engine for extract
+
+Sites (longitude, latitude pairs) are resolved to grid cells and
+interpolation weights once per grid definition and site list:
+
+    nn/KDTree - nearest cell; separable searches for 1-D latitude and
+                longitude, a KDTree for 2-D or point coordinates
+    linear - the three vertices and barycentric weights of the Delaunay
+             triangle holding each site (as LinearNDInterpolator)
+
+SiteMaps are cached in memory and on disk (one .npz per key in
+cachedir; PNC_SITEMAP_CACHE overrides it and an empty value disables
+the disk cache). The key is a digest of the grid attributes (IOAPI or
+WRF projection and grid definition), the coordinate values, the sites
+and the method, so subset grids with unchanged metadata do not collide.
+
+gather applies a SiteMap to a variable with one fancy index per chunk
+of the first non-spatial dimension (e.g., time) for all sites at once.
+"""
+import os
+import unittest
+import hashlib
+from warnings import warn
+import numpy as np
+
+chunkbytes = 2**26
+
+cachedir = os.environ.get('PNC_SITEMAP_CACHE', os.path.join(os.path.expanduser('~'), '.pncsitemaps'))
+
+_gridattrs = ('GDTYP P_ALP P_BET P_GAM XCENT YCENT XORIG YORIG XCELL YCELL NCOLS NROWS ' +
+              'MAP_PROJ TRUELAT1 TRUELAT2 STAND_LON CEN_LAT CEN_LON DX DY').split()
+
+_memory = {}
+
+class SiteMap(object):
+    """
+    Grid cells and weights of sites
+
+    shape - spatial shape of the grid (e.g., (nlat, nlon) or (npoints,))
+    indices - (nsites, nweights) flat indices into shape
+    weights - (nsites, nweights) weights; nan for sites outside the grid
+              (linear only)
+    method - nn or linear
+    """
+    def __init__(self, shape, indices, weights, method = 'nn'):
+        self.shape = tuple([int(s) for s in shape])
+        self.indices = np.asarray(indices, dtype = 'i8')
+        self.weights = np.asarray(weights, dtype = 'd')
+        self.method = method
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    def unravel(self):
+        """
+        Tuple of (nsites, nweights) index arrays; one per dimension of shape
+        """
+        return np.unravel_index(self.indices, self.shape)
+
+    @classmethod
+    def build(cls, longitude, latitude, lons, lats, method = 'nn', gridded = True):
+        """
+        longitude, latitude - grid coordinates; 1-D with gridded are the
+                              axes of a (latitude, longitude) grid
+        lons, lats - site coordinates
+        method - nn, KDTree (same as nn) or linear
+        """
+        longitude = np.ma.getdata(longitude)
+        latitude = np.ma.getdata(latitude)
+        lons = np.asarray(lons, dtype = 'd')
+        lats = np.asarray(lats, dtype = 'd')
+        latlon1d = longitude.ndim == 1 and latitude.ndim == 1
+        if method in ('nn', 'KDTree'):
+            if latlon1d and gridded:
+                # the nearest cell of a rectilinear grid has the nearest
+                # latitude and the nearest longitude
+                shape = (latitude.size, longitude.size)
+                rows = np.abs(latitude[:, None] - lats[None, :]).argmin(0)
+                cols = np.abs(longitude[:, None] - lons[None, :]).argmin(0)
+                indices = np.ravel_multi_index((rows, cols), shape)
+            else:
+                from scipy.spatial import cKDTree
+                shape = latitude.shape
+                tree = cKDTree(np.array([latitude.ravel(), longitude.ravel()]).T)
+                dists, indices = tree.query(np.array([lats, lons]).T)
+            return cls(shape, indices[:, None], np.ones((lons.size, 1)), 'nn')
+        elif method == 'linear':
+            from scipy.spatial import Delaunay
+            if latlon1d and gridded:
+                longitude, latitude = np.meshgrid(longitude, latitude)
+            shape = latitude.shape
+            tri = Delaunay(np.array([longitude.ravel(), latitude.ravel()]).T)
+            xi = np.array([lons, lats]).T
+            simplex = tri.find_simplex(xi)
+            transform = tri.transform[simplex]
+            bary = np.einsum('ijk,ik->ij', transform[:, :2], xi - transform[:, 2])
+            weights = np.concatenate([bary, 1 - bary.sum(1)[:, None]], axis = 1)
+            indices = tri.simplices[simplex]
+            outside = simplex < 0
+            indices[outside] = 0
+            weights[outside] = np.nan
+            return cls(shape, indices, weights, 'linear')
+        else:
+            raise ValueError('method must be nn, KDTree or linear; got %s' % (method,))
+
+    def save(self, path):
+        np.savez(path, shape = np.array(self.shape), indices = self.indices, weights = self.weights, method = np.array(self.method))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['shape'], data['indices'], data['weights'], str(data['method']))
+
+def gridkey(f, longitude, latitude, lons, lats, method = 'nn', gridded = True):
+    """
+    Hex digest identifying a grid definition, its coordinates, the sites
+    and the method
+    """
+    method = {'KDTree': 'nn'}.get(method, method)
+    digest = hashlib.sha1()
+    attrs = [(k, getattr(f, k)) for k in _gridattrs if hasattr(f, k)]
+    digest.update(repr((method, bool(gridded), attrs)).encode('ascii'))
+    for vals in (longitude, latitude, lons, lats):
+        vals = np.ascontiguousarray(np.ma.getdata(vals), dtype = 'd')
+        digest.update(repr(vals.shape).encode('ascii'))
+        digest.update(vals.tobytes())
+    return digest.hexdigest()
+
+def sitemap(f, longitude, latitude, lons, lats, method = 'nn', gridded = True, cachedir = None):
+    """
+    SiteMap of lons, lats on the grid of f (see SiteMap.build) from the
+    memory or disk cache when the grid and sites have been seen before
+
+    cachedir - directory of cached SiteMaps (default: module cachedir;
+               '' disables the disk cache)
+    """
+    if cachedir is None:
+        cachedir = globals()['cachedir']
+    key = gridkey(f, longitude, latitude, lons, lats, method = method, gridded = gridded)
+    if key in _memory:
+        return _memory[key]
+    path = os.path.join(cachedir, key + '.npz') if cachedir else None
+    sm = None
+    if path is not None and os.path.exists(path):
+        try:
+            sm = SiteMap.load(path)
+        except Exception as e:
+            warn('Ignoring unreadable site map %s; %s' % (path, e))
+    if sm is None:
+        sm = SiteMap.build(longitude, latitude, lons, lats, method = method, gridded = gridded)
+        if path is not None:
+            try:
+                if not os.path.exists(cachedir):
+                    os.makedirs(cachedir)
+                tmppath = '%s.%d.npz' % (path[:-4], os.getpid())
+                sm.save(tmppath)
+                os.rename(tmppath, path)
+            except (IOError, OSError) as e:
+                warn('Site map was not cached; ' + str(e))
+    _memory[key] = sm
+    return sm
+
+def gather(values, index, weights = None, chunksize = None):
+    """
+    Values at sites from one fancy index per chunk
+
+    values - array or variable
+    index - tuple with slice(None) or a (nsites, nweights) index array
+            (see SiteMap.unravel) for each dimension of values
+    weights - (nsites, nweights) weights (default: first index only)
+    chunksize - positions of the first sliced dimension read at a time
+                (default: about chunkbytes per chunk)
+    """
+    shape = tuple(values.shape)
+    index = tuple(index)
+    arrayaxes = [i for i, idx in enumerate(index) if not isinstance(idx, slice)]
+    if len(arrayaxes) == 0:
+        return values[...]
+    # numpy puts the (nsites, nweights) result where adjacent index arrays
+    # were and at the front otherwise
+    adjacent = arrayaxes == list(range(arrayaxes[0], arrayaxes[-1] + 1))
+    wgtaxis = arrayaxes[0] + 1 if adjacent else 1
+    ndimout = len(shape) - len(arrayaxes) + 2
+    def reduce(vals):
+        if weights is None:
+            return vals.take(0, axis = wgtaxis)
+        w = weights.reshape(weights.shape + (1,) * (ndimout - wgtaxis - 1))
+        return (vals * w).sum(wgtaxis)
+    sliceaxes = [i for i, idx in enumerate(index) if isinstance(idx, slice)]
+    if len(sliceaxes) == 0:
+        return reduce(values[index])
+    axis = sliceaxes[0]
+    if chunksize is None:
+        itemsize = np.dtype(getattr(values, 'dtype', 'd')).itemsize
+        rowbytes = itemsize * int(np.prod(shape)) // max(1, shape[axis])
+        chunksize = max(1, chunkbytes // max(1, rowbytes))
+    # position of axis once sites replace the spatial dimensions
+    if not adjacent:
+        outaxis = 1
+    elif axis < arrayaxes[0]:
+        outaxis = axis
+    else:
+        outaxis = axis - len(arrayaxes) + 1
+    chunks = []
+    for start in range(0, max(1, shape[axis]), chunksize):
+        chunk = index[:axis] + (slice(start, start + chunksize),) + index[axis + 1:]
+        chunks.append(reduce(values[chunk]))
+    if any([isinstance(c, np.ma.MaskedArray) for c in chunks]):
+        return np.ma.concatenate(chunks, axis = outaxis)
+    return np.concatenate(chunks, axis = outaxis)
+
+class TestSiteMap(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        rs = np.random.RandomState(0)
+        self.lat = np.linspace(30, 40, 11)
+        self.lon = np.linspace(-100, -85, 16)
+        self.lons = rs.uniform(-101, -84, size = 25)
+        self.lats = rs.uniform(29, 41, size = 25)
+        self.values = np.ma.masked_greater(rs.uniform(size = (7, 2, 11, 16)), .95)
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+        _memory.clear()
+
+    def _bruteforce(self, longitude, latitude):
+        dists = (latitude[..., None] - self.lats)**2 + (longitude[..., None] - self.lons)**2
+        return dists.reshape(-1, self.lons.size).argmin(0)
+
+    def testNearest(self):
+        sm = SiteMap.build(self.lon, self.lat, self.lons, self.lats)
+        lon2d, lat2d = np.meshgrid(self.lon, self.lat)
+        np.testing.assert_equal(sm.indices[:, 0], self._bruteforce(lon2d, lat2d))
+        sm2d = SiteMap.build(lon2d, lat2d, self.lons, self.lats, method = 'KDTree')
+        np.testing.assert_equal(sm2d.indices, sm.indices)
+        smpts = SiteMap.build(lon2d.ravel(), lat2d.ravel(), self.lons, self.lats, gridded = False)
+        np.testing.assert_equal(smpts.indices, sm.indices)
+        rows, cols = sm.unravel()
+        out = gather(self.values, (slice(None), slice(None), rows, cols), chunksize = 3)
+        np.testing.assert_equal(out, self.values[:, :, rows[:, 0], cols[:, 0]])
+        self.assertEqual(out.shape, (7, 2, 25))
+        np.testing.assert_equal(out.mask, self.values.mask[:, :, rows[:, 0], cols[:, 0]])
+        # spatial dimensions that are not adjacent move to the front
+        vals = self.values.transpose(2, 0, 1, 3)
+        out = gather(vals, (rows, slice(None), slice(None), cols), chunksize = 2)
+        np.testing.assert_equal(out, vals[rows[:, 0], :, :, cols[:, 0]])
+
+    def testLinear(self):
+        from scipy.interpolate import LinearNDInterpolator
+        lon2d, lat2d = np.meshgrid(self.lon, self.lat)
+        sm = SiteMap.build(self.lon, self.lat, self.lons, self.lats, method = 'linear')
+        rows, cols = sm.unravel()
+        vals = self.values.filled(0)
+        out = gather(vals, (slice(None), slice(None), rows, cols), sm.weights, chunksize = 4)
+        interp = LinearNDInterpolator(np.array([lon2d.ravel(), lat2d.ravel()]).T, vals.reshape(14, -1).T)
+        ref = interp(np.array([self.lons, self.lats]).T).T.reshape(7, 2, 25)
+        np.testing.assert_allclose(out, ref)
+        self.assert_(np.isnan(out).any())
+
+    def testCache(self):
+        args = (None, self.lon, self.lat, self.lons, self.lats)
+        sm = sitemap(*args, cachedir = self.tmpdir)
+        self.assert_(sitemap(*args, cachedir = self.tmpdir) is sm)
+        _memory.clear()
+        self.assertEqual(len(os.listdir(self.tmpdir)), 1)
+        cached = sitemap(*args, cachedir = self.tmpdir)
+        self.assert_(cached is not sm)
+        np.testing.assert_equal(cached.indices, sm.indices)
+        self.assertEqual(cached.shape, sm.shape)
+        self.assertEqual(cached.method, 'nn')
+        self.assertNotEqual(gridkey(*args), gridkey(None, self.lon + 1, self.lat, self.lons, self.lats))
+        self.assertEqual(gridkey(*args), gridkey(*args, method = 'KDTree'))
+
+    def testExtract(self):
+        from ._files import PseudoNetCDFFile
+        from ._functions import extract_lonlat
+        import PseudoNetCDF.core._sitemap as module
+        module.cachedir, oldcachedir = self.tmpdir, module.cachedir
+        try:
+            f = PseudoNetCDFFile()
+            f.createDimension('time', 7)
+            f.createDimension('layer', 2)
+            f.createDimension('latitude', 11)
+            f.createDimension('longitude', 16)
+            f.createVariable('latitude', 'd', ('latitude',), values = self.lat)
+            f.createVariable('longitude', 'd', ('longitude',), values = self.lon)
+            f.createVariable('O3', 'd', ('time', 'layer', 'latitude', 'longitude'), values = self.values)
+            lonlat = '/'.join(['%r,%r' % ll for ll in zip(self.lons, self.lats)])
+            outf = extract_lonlat(f, lonlat)
+            idx = self._bruteforce(*np.meshgrid(self.lon, self.lat))
+            rows, cols = np.unravel_index(idx, (11, 16))
+            self.assertEqual(outf.variables['O3'].dimensions, ('time', 'layer', 'points'))
+            np.testing.assert_equal(outf.variables['O3'][:], self.values[:, :, rows, cols])
+            np.testing.assert_equal(outf.variables['latitude'][:], self.lat[rows])
+            uoutf = extract_lonlat(f, lonlat + '/' + lonlat, unique = True)
+            self.assertEqual(len(uoutf.dimensions['points']), np.unique(idx).size)
+        finally:
+            module.cachedir = oldcachedir
+
+if __name__ == '__main__':
+    unittest.main()
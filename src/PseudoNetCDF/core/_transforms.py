@@ -1,17 +1,28 @@
 from ._files import PseudoNetCDFFile
 from ._variables import PseudoNetCDFVariable
-from PseudoNetCDF.units import convert
+from ._lazy import lazyconvert
+from PseudoNetCDF.units import convert, affine
 
 
 def PseudoNetCDFVariableConvertUnit(var,outunit):
     """
     Convert the unit of var and update the 
     associated IOAPI metadata
+
+    Affine conversions (all of units.converter) are deferred: the result
+    is a lazy variable converted a chunk at a time when read or written,
+    and converting it again fuses the conversions. When var is already
+    in outunit, var is returned.
     """
+    func = affine(var.units, outunit)
+    if func is not None and func.isidentity():
+        return var
     do = PseudoNetCDFFile()
     shape=var.shape
     for i,d in enumerate(var.dimensions):
         do.createDimension(d, shape[i])
+    if func is not None:
+        return lazyconvert(var, func, parent = do, name = var.long_name.strip(), units = outunit)
     outvar=PseudoNetCDFVariable(do,var.long_name.strip(),var.typecode(),var.dimensions,values=convert(var,var.units,outunit))
     for k in var.ncattrs():
         v = getattr(var, k)
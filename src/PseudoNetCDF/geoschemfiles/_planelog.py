@@ -1,63 +1,266 @@
 from __future__ import print_function
-import numpy as np
-from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable
-from glob import glob
-from csv import DictReader, Sniffer, QUOTE_NONNUMERIC
+import os
 import re
-import sys
-
-from collections import defaultdict
-
-class defaultdictfromkey(defaultdict):
-    def __init__(self, default_factory, unitdict):
-        defaultdict.__init__(self, default_factory)
-        self._unitdict = unitdict
-    def __missing__(self, key):
-        unit = self._unitdict.get(key, 'ppt')
-        
-        var = self.default_factory(key) * factor
-        var.units = unit
-        return var
-        
+import unittest
+from glob import glob
+from warnings import warn
+import numpy as np
+from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariables, PseudoNetCDFMaskedVariable
+from PseudoNetCDF.core._lazy import lazyconvert
+from PseudoNetCDF.units import Affine
+from PseudoNetCDF.textfiles._table import readtable
+
+desired_unit = dict(O3 = 'ppb', GMAO_TEMP = 'K', PRESS = 'hPa', TEMP = 'K',
+                    POINT = 'none', YYYYMMDD = 'none', HHMM = 'none', LAT = 'degrees_north', LON = 'degrees_east',
+                    OBS = 'none', **{'T-IND': 'none', 'P-I': 'none', 'I-IND': 'none', 'J-IND': 'none'})
+unit_factor = {'ppt': 1e12, 'ppb': 1e9}
+stringkeys = ('TYPE',)
+
+def _split(text):
+    """
+    (header names, body) of plane.log text (bytes)
+    """
+    header, newline, body = text.partition(b'\n')
+    return [name.decode('ascii') for name in header.split()], body
+
+def _countrows(body):
+    body = body.strip()
+    return 0 if len(body) == 0 else body.count(b'\n') + 1
+
+def _isnumber(token, kind):
+    try:
+        kind(token)
+        return True
+    except ValueError:
+        return False
+
+def _parse(text, keys = None):
+    """
+    OrderedDict-like dict of columns (key: array) of plane.log text
+    (bytes) in one numeric pass; string columns (e.g., TYPE) are read
+    with one regular expression and replaced by 0 for the numeric pass
+
+    keys - columns to return (default: all)
+    """
+    names, body = _split(text)
+    ncols = len(names)
+    if keys is None:
+        keys = names
+    first = body.split(None, ncols)[:ncols]
+    if len(first) < ncols:
+        return dict([(key, np.array([], dtype = 'S1' if key in stringkeys else 'd')) for key in keys])
+    strcols = [ci for ci, (name, token) in enumerate(zip(names, first)) if name in stringkeys or not _isnumber(token, float)]
+    intcols = [ci for ci, token in enumerate(first) if ci not in strcols and _isnumber(token, int)]
+    out = {}
+    if len(strcols) > 0:
+        lead = max(strcols) + 1
+        pattern = re.compile(br'^[ \t]*' + br'[ \t]+'.join([br'(\S+)'] * lead), re.M)
+        rows = pattern.findall(body)
+        if lead == 1:
+            rows = [(row,) for row in rows]
+        for ci in strcols:
+            if names[ci] in keys:
+                out[names[ci]] = np.array([row[ci] for row in rows])
+        repl = b' '.join([b'0' if ci in strcols else ('\\%d' % (ci + 1)).encode('ascii') for ci in range(lead)])
+        body = pattern.sub(repl, body)
+    data = readtable(body, ncols = ncols)
+    for ci, name in enumerate(names):
+        if name in keys and ci not in strcols:
+            values = data[:, ci]
+            if ci in intcols and (values == np.round(values)).all():
+                values = values.astype('l')
+            else:
+                values = values.copy()
+            out[name] = values
+    return out
+
+class _planelog(object):
+    """
+    One plane.log file; the header and row count are read when opened
+    and columns are parsed the first time one is requested. With cache,
+    parsed columns are saved to path + '.npz' and read from it (one
+    column at a time) while it is newer than path.
+    """
+    def __init__(self, path, keys = None, cache = False):
+        self.path = path
+        self.keys = keys
+        self.cachepath = path + '.npz' if cache else None
+        self._columns = None
+        if self._cached():
+            with np.load(self.cachepath) as npz:
+                self.names = [str(name) for name in npz['_names']]
+                self.nrows = int(npz['_nrows'])
+        else:
+            with open(path, 'rb') as f:
+                self.names, body = _split(f.read())
+            self.nrows = _countrows(body)
+        if self.names[:2] != ['POINT', 'TYPE']:
+            raise ValueError('%s is not a plane.log file; header should start with POINT TYPE' % path)
+
+    def _cached(self):
+        return self.cachepath is not None and os.path.exists(self.cachepath) and os.path.getmtime(self.cachepath) >= os.path.getmtime(self.path)
+
+    def column(self, key):
+        """
+        Values of column key; each column is returned once (parsed
+        columns are not kept once they are cached)
+        """
+        if self._cached():
+            with np.load(self.cachepath) as npz:
+                return npz['v_' + key]
+        if self._columns is None:
+            with open(self.path, 'rb') as f:
+                text = f.read()
+            cached = False
+            if self.cachepath is None:
+                self._columns = _parse(text, self.keys)
+            else:
+                self._columns = _parse(text)
+                try:
+                    np.savez(self.cachepath, _names = np.array(self.names), _nrows = np.array(self.nrows),
+                             **dict([('v_' + k, v) for k, v in self._columns.items()]))
+                    cached = True
+                except (IOError, OSError) as e:
+                    warn('Could not cache %s; %s' % (self.path, e))
+            nrows = len(self._columns[self.names[0]]) if self.names[0] in self._columns else self.nrows
+            if nrows != self.nrows:
+                raise ValueError('%s has %d rows; expected %d' % (self.path, nrows, self.nrows))
+            if cached:
+                # later columns are read from the cache
+                columns, self._columns = self._columns, None
+                return columns.pop(key)
+        return self._columns.pop(key)
+
 class flightlogs(PseudoNetCDFFile):
-    def __init__(self, pathlike):
+    """
+    GEOS-Chem planeflight output (plane.log); one or more files (a glob
+    pattern or list of paths) are concatenated along time
+
+    Files are parsed when a variable is first used, and only the
+    columns in variables are kept. -1000 is masked and species are
+    scaled to ppt (O3 to ppb) when they are read.
+
+    pathlike - glob pattern or paths
+    variables - columns to read (default: all)
+    cache - save parsed columns beside each file (path + '.npz') and
+            read them from there while they are newer than the file
+    """
+    def __init__(self, pathlike, variables = None, cache = False):
         if isinstance(pathlike, str):
             paths = glob(pathlike)
         else:
-            paths = pathlike
+            paths = list(pathlike)
         paths.sort()
-        pfile = self
-        pfile._vars = dict()
-    
-        files = [open(path) for path in paths]
-        datas = [np.recfromtxt(f, names = True, case_sensitive = True) for f in files]
-        data = np.ma.concatenate(datas)
-        desired_unit = dict(O3 = 'ppb', GMAO_TEMP = 'K', PRESS = 'hPa', TEMP = 'K')
-        unit_factor = {'ppt': 1e12, 'ppb': 1e9}
-        pfile.createDimension('time', data.shape[0])
-        for ki, key in enumerate(data.dtype.names):
-            typecode = data[key].dtype.char
-            if typecode not in ('c', 'S'):
-                unit = desired_unit.get(key, 'ppt')
-                factor = unit_factor.get(unit, 1)
-                values = np.ma.masked_values(data[key], -1000) * factor
-            else:
-                unit = 'unknown'
-                values = data[key]
-            pfile.createVariable(key, typecode, dimensions = ('time',), units = unit, values = values)
-        
-    
+        if len(paths) == 0:
+            raise IOError('No plane.log files match %s' % (pathlike,))
+        keys = None if variables is None else list(variables)
+        self._logs = [_planelog(path, keys, cache = cache) for path in paths]
+        names = self._logs[0].names
+        for log in self._logs[1:]:
+            if log.names != names:
+                raise ValueError('%s has different columns than %s' % (log.path, self._logs[0].path))
+        if keys is None:
+            keys = names
+        else:
+            missing = [key for key in keys if key not in names]
+            if len(missing) > 0:
+                raise KeyError('%s not in %s' % (', '.join(missing), self._logs[0].path))
+            keys = [key for key in names if key in keys]
+        self.createDimension('time', sum([log.nrows for log in self._logs]))
+        self.variables = PseudoNetCDFVariables(self._getvar, keys)
+
+    def _getvar(self, key):
+        columns = [log.column(key) for log in self._logs]
+        nonempty = [col for col in columns if col.size > 0]
+        data = np.concatenate(nonempty if len(nonempty) > 0 else columns)
+        if data.dtype.char not in ('c', 'S'):
+            unit = desired_unit.get(key, 'ppt')
+            factor = unit_factor.get(unit, 1)
+            values = np.ma.masked_values(data, -1000, copy = False)
+        else:
+            unit = 'unknown'
+            factor = 1
+            values = data
+        if factor != 1:
+            # species are scaled from mol/mol when read
+            raw = PseudoNetCDFMaskedVariable(self, key, values.dtype.char, ('time',), units = 'mol/mol', values = values)
+            var = self.variables[key] = lazyconvert(raw, Affine(factor), parent = self, name = key, units = unit)
+        else:
+            var = self.createVariable(key, values.dtype.char, dimensions = ('time',), units = unit, values = values)
+        return var
+
+class TestPlaneLog(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        header = 'POINT    TYPE YYYYMMDD HHMM      LAT     LON   PRESS     OBS   T-IND   P-I   I-IND   J-IND      O3           NO2    GMAO_TEMP\n'
+        row = '%5d %7s %8d %04d %8.3f %8.3f %7.2f %9.3E %6d %5d %6d %6d %13.6E %13.6E %9.3f\n'
+        rs = np.random.RandomState(0)
+        self.paths = []
+        self.rows = []
+        for di in range(3):
+            path = os.path.join(self.tmpdir, 'plane.log.2016010%d' % (di + 1))
+            with open(path, 'w') as f:
+                f.write(header)
+                for pi in range(4 + di):
+                    vals = (pi + 1, 'DC8-%d' % di, 20160101 + di, pi * 100, 30 + pi, -90 - pi, 900. - pi, -1000, 40 + pi, 1, 3, 4,
+                            rs.uniform(1e-8, 1e-7), -1000 if pi == 1 else rs.uniform(1e-11, 1e-10), 280 + pi)
+                    f.write(row % vals)
+                    self.rows.append(vals)
+            self.paths.append(path)
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+
+    def _check(self, f, keys):
+        rows = self.rows
+        self.assertEqual(len(f.dimensions['time']), len(rows))
+        if 'TYPE' in keys:
+            self.assertEqual([t.decode() for t in f.variables['TYPE'][:]], [r[1] for r in rows])
+        if 'LAT' in keys:
+            np.testing.assert_allclose(f.variables['LAT'][:], [r[4] for r in rows])
+            self.assertEqual(f.variables['LAT'].units, 'degrees_north')
+        if 'YYYYMMDD' in keys:
+            self.assertEqual(f.variables['YYYYMMDD'].dtype.kind, 'i')
+            np.testing.assert_equal(f.variables['YYYYMMDD'][:], [r[2] for r in rows])
+        if 'O3' in keys:
+            np.testing.assert_allclose(f.variables['O3'][:], np.array([r[12] for r in rows]) * 1e9, rtol = 1e-6)
+            np.testing.assert_allclose((f.variables['O3'] * 2)[:], np.array([r[12] for r in rows]) * 2e9, rtol = 1e-6)
+            self.assertAlmostEqual(f.variables['O3'].max() / 1e9, max([r[12] for r in rows]))
+            self.assertEqual(f.variables['O3'].units, 'ppb')
+        if 'NO2' in keys:
+            no2 = f.variables['NO2'][:]
+            self.assertEqual(no2.mask.sum(), 3)
+            self.assertEqual((f.variables['NO2'] * 2)[:].mask.sum(), 3)
+            np.testing.assert_allclose(no2.compressed(), np.array([r[13] for r in rows if r[13] != -1000]) * 1e12, rtol = 1e-6)
+
+    def testRead(self):
+        keys = ['POINT', 'TYPE', 'YYYYMMDD', 'LAT', 'O3', 'NO2']
+        f = flightlogs(os.path.join(self.tmpdir, 'plane.log.*'))
+        self.assertEqual(list(f.variables.keys())[:3], ['POINT', 'TYPE', 'YYYYMMDD'])
+        self._check(f, keys)
+        f = flightlogs(self.paths[::-1], variables = ['NO2', 'LAT'])
+        self.assertEqual(list(f.variables.keys()), ['LAT', 'NO2'])
+        self._check(f, ['LAT', 'NO2'])
+        self.assertRaises(KeyError, flightlogs, self.paths, variables = ['NOPE'])
+        junk = os.path.join(self.tmpdir, 'junk.txt')
+        with open(junk, 'w') as f:
+            f.write('a b c\n1 2 3\n')
+        self.assertRaises(ValueError, flightlogs, junk)
+
+    def testCache(self):
+        keys = ['TYPE', 'YYYYMMDD', 'LAT', 'O3', 'NO2']
+        f = flightlogs(self.paths, cache = True)
+        self._check(f, keys)
+        self.assert_(all([os.path.exists(path + '.npz') for path in self.paths]))
+        self.assert_(all([log._columns is None for log in f._logs]))
+        f = flightlogs(self.paths, variables = keys, cache = True)
+        self.assert_(f._logs[0]._cached())
+        self._check(f, keys)
 
 if __name__ == '__main__':
-    import sys
-    bfile1 = flightlogs(sys.argv[1:])
-    from matplotlib.mlab import prctile
-    for label, key in [('O3', 'O3[:]'), ('NO2', 'NO2[:]')]:
-        bvar = eval(key, None, bfile1.variables)
-        b2var = eval(key, None, bfile1.variables)
-        assert((bvar == b2var).all())
-        print('\n%s (BASE: %6.2f)' % (label, bvar.mean()), file = sys.stdout)
-        print('\n      BASE:', sep = '', file = sys.stdout)
-        prctile(bvar, np.ma.arange(.1, 1., .1)* 100).tofile(sys.stdout, sep = ', ', format = '%6.2f')
-    print('', file = sys.stdout)
-    
\ No newline at end of file
+    unittest.main()
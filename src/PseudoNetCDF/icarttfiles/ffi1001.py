@@ -60,7 +60,7 @@ Returns:
         """
         lastattr = None
         PseudoNetCDFFile.__init__(self)
-        f = open(path, 'rU', encoding = encoding)
+        f = open(path, 'r', encoding = encoding)
         missing = []
         units = []
         l = f.readline()
@@ -7,6 +7,12 @@ from warnings import warn
 from datetime import datetime
 
 from PseudoNetCDF import PseudoNetCDFFile
+from PseudoNetCDF.textfiles._table import readtable
+
+# column labels in MORPHO headers: rt[REACTION] for irr and n[SPECIES]
+# for concentrations
+irrlabel = re.compile(r'rt\[[^\]]+\]')
+conclabel = re.compile(r'n\[[^\]]+\]')
 
 #  20 lines reads hourly irr
 def MorphoIRRt(irrpath):
@@ -36,10 +42,9 @@ def MorphoIRRt(irrpath):
         var = mrgfile.createVariable(name, 'f', ('TSTEP',))
         var.units = unit_dict[name]
         var.long_name = var.var_desc = name
-    for ti, line in enumerate(mrglines):
-        for var_name, value in zip(name_line, line.split()):
-            var = mrgfile.variables[var_name]
-            var[ti] = float(value)
+    data = readtable(''.join(mrglines))
+    for var_name, values in zip(name_line, data.T):
+        mrgfile.variables[var_name][:] = values
 
     for name in name_line:
         if name in ('T', 'N'): continue
@@ -64,10 +69,9 @@ def MorphoConc(concpath):
         var = concfile.createVariable(name, 'f', ('TSTEP',))
         var.units = unit_dict[name]
         var.long_name = var.var_desc = name
-    for ti, line in enumerate(conclines):
-        for var_name, value in zip(name_line, line.split()):
-            var = concfile.variables[var_name]
-            var[ti] = float(value)
+    data = readtable(''.join(conclines))
+    for var_name, values in zip(name_line, data.T):
+        concfile.variables[var_name][:] = values
             
     return concfile
 
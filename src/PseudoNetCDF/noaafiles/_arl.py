@@ -1,7 +1,10 @@
 from __future__ import print_function
+import os
+import unittest
 import numpy as np
 from numpy import testing
 from PseudoNetCDF import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables
+from PseudoNetCDF.core._lazy import LazyNode, PseudoNetCDFLazyVariable
 from PseudoNetCDF.coordutil import gettimes
 from datetime import datetime
 from collections import OrderedDict
@@ -251,6 +254,8 @@ def writearlpackedbit(infile, path):
     props['NZ'] = lvar.shape[1] + 1
     props['NY'] = lvar.shape[2]
     props['NX'] = lvar.shape[3]
+    # maparlpackedbit expects layer keys by level
+    props['laykeys'] = [(vglvl, laykeys) for vglvl in vglvls[1:]]
     datamap = maparlpackedbit(path, mode = 'write', shape = (lvar.shape[0],), **props)
     
     theads = datamap['timehead']
@@ -295,7 +300,7 @@ def writearlpackedbit(infile, path):
                 if not varpropk in ('YYMMDDHHFF', 'LEVEL', 'EXP', 'PREC', 'VAR1'):
                     varhead[varpropk][ti] = getattr(invar, varpropk)
             
-            indata = invar[ti]
+            indata = np.ma.getdata(invar[ti])
             CVAR, PREC, NEXP, VAR1, KSUM = pack2d(indata, verbose = False)
                         
             varhead['YYMMDDHHFF'][ti] = timestr
@@ -307,22 +312,23 @@ def writearlpackedbit(infile, path):
             var_time['data'][ti] = CVAR
         for layk in laykeys:
             invar = infile.variables[layk.decode()]
-            var_time = datamap['layers'][layk.decode()][ti]
-            for li, var_time_lay in enumerate(var_time):
-                varhead = var_time_lay['head']            
+            # layers are records by level with a field for each variable
+            for li, levelk in enumerate(datamap['layers'].dtype.names):
+                var_time_lay = datamap['layers'][levelk][layk.decode()]
+                varhead = var_time_lay['head']
                 for varpropk in varhead.dtype.names:
                     if not varpropk in ('YYMMDDHHFF', 'LEVEL', 'EXP', 'PREC', 'VAR1'):
-                        varhead[varpropk] = getattr(invar, varpropk)
+                        varhead[varpropk][ti] = getattr(invar, varpropk)
                 
-                indata = invar[ti, li]
+                indata = np.ma.getdata(invar[ti, li])
                 CVAR, PREC, NEXP, VAR1, KSUM = pack2d(indata)
                 
-                varhead['YYMMDDHHFF'] = timestr
-                varhead['LEVEL'] = '%2d' % (li + 1)
-                var_time_lay['data'] = CVAR
-                varhead['PREC'] = '%14.7E' % PREC
-                varhead['EXP'] = '%4d' % NEXP
-                varhead['VAR1'] = '%14.7E' % VAR1
+                varhead['YYMMDDHHFF'][ti] = timestr
+                varhead['LEVEL'][ti] = '%2d' % (li + 1)
+                var_time_lay['data'][ti] = CVAR
+                varhead['PREC'][ti] = '%14.7E' % PREC
+                varhead['EXP'][ti] = '%4d' % NEXP
+                varhead['VAR1'][ti] = '%14.7E' % VAR1
                 vglvl = vglvls[li + 1]
                 checksums[vglvl, layk] = KSUM
         
@@ -519,6 +525,44 @@ def pack2d(RVARA, verbose = False):
     #assert(KSUM == KSUMT)
     return CVAR.view('>S1'), PREC, NEXP, VAR1, KSUM
 
+class ARLSlabs(LazyNode):
+    """
+    Graph leaf for an ARL variable that decodes only the (time, level)
+    slabs selected by an index; decoded slabs are cached by the file
+    """
+    def __init__(self, f, key):
+        self._file = f
+        self._key = key
+        datamap = f._datamap
+        if key in datamap['surface'].dtype.names:
+            self._records = [datamap['surface'][key]]
+            self._layered = False
+        else:
+            self._records = [datamap['layers'][lk][key] for lk in datamap['layers'].dtype.names if key in datamap['layers'][lk].dtype.names]
+            self._layered = True
+        ny, nx = self._records[0]['data'].shape[1:]
+        self.shape = (datamap.shape[0],) + ((len(self._records),) if self._layered else ()) + (ny, nx)
+        self.dtype = np.dtype('f')
+
+    def _evaluate(self, item, memo):
+        if item is None:
+            item = (slice(None),) * len(self.shape)
+        nslab = 2 if self._layered else 1
+        slabitem, rest = item[:nslab], item[nslab:]
+        # more than one array index would need numpy's pointwise
+        # semantics; PseudoNetCDFLazyVariable then decodes everything
+        if sum([not isinstance(i, slice) and np.ndim(i) > 0 for i in item]) > 1:
+            raise IndexError('multiple array indices')
+        tidx = np.arange(self.shape[0])[slabitem[0]]
+        lidx = np.arange(self.shape[1])[slabitem[1]] if self._layered else np.array(0)
+        pairs = [(t, l) for t in np.ravel(tidx) for l in np.ravel(lidx)]
+        slabs = self._file._decodeslabs(self._key, self._records, pairs)
+        slabs = slabs.reshape((np.size(tidx),) + ((np.size(lidx),) if self._layered else ()) + slabs.shape[1:])
+        sel = (0 if np.ndim(tidx) == 0 else slice(None),)
+        if self._layered:
+            sel += (0 if np.ndim(lidx) == 0 else slice(None),)
+        return slabs[sel + tuple(rest)]
+
 class arlpackedbit(PseudoNetCDFFile):
     """
     Format as follows:
@@ -553,7 +597,22 @@ class arlpackedbit(PseudoNetCDFFile):
     
     P(i,j) = (Ri,j  - Ri-1,j)* (2**(7-(ln dRmax / ln 2)))
     """
-    def __init__(self, path, shape = None):
+    # bytes of decoded slabs kept by each file
+    cachebytes = 2**28
+    # requests with at least this many undecoded slabs are decoded
+    # by nthreads threads
+    parallel_slabs = 8
+    def __init__(self, path, shape = None, nthreads = None):
+        """
+        path - path to ARL packed bit file
+        shape - number of times to read (default: all)
+        nthreads - threads for decoding large requests (default: up to
+                   4, one per core)
+        """
+        from collections import OrderedDict
+        self._nthreads = nthreads if nthreads is not None else min(4, os.cpu_count() or 1)
+        self._slabcache = OrderedDict()
+        self._slabcachebytes = 0
         self._path = path
         self._f = f = open(path, 'r') 
         f.seek(0, 2) 
@@ -634,34 +693,127 @@ class arlpackedbit(PseudoNetCDFFile):
         z.units = {1: 'pressure sigma', 2: 'pressure absolute', 3: 'terrain sigma', 4: 'hybrid sigma'}.get(int(self.VSYS2), 'unknown')
 
     
+    def _decodeslabs(self, key, records, pairs):
+        """
+        Decoded (time, level) slabs of key as an array (len(pairs), ny, nx);
+        slabs that are not cached are unpacked (in threads for large
+        requests) and cached
+        """
+        cache = self._slabcache
+        missing = []
+        missingset = set()
+        for pair in pairs:
+            if (key,) + pair in cache:
+                cache.move_to_end((key,) + pair)
+            elif pair not in missingset:
+                missing.append(pair)
+                missingset.add(pair)
+        ny, nx = records[0]['data'].shape[1:]
+        out = np.empty((len(pairs), ny, nx), dtype = 'f')
+        for pi, pair in enumerate(pairs):
+            if (key,) + pair in cache:
+                out[pi] = cache[(key,) + pair]
+        missingidx = [i for i, pair in enumerate(pairs) if pair in missingset]
+        def decode(group):
+            # one memmap read per level
+            tidx = np.array([t for t, l in group])
+            lidx = np.array([l for t, l in group])
+            out = np.empty((len(group), ny, nx), dtype = 'f')
+            for l in np.unique(lidx):
+                gidx, = np.where(lidx == l)
+                record = np.asarray(records[l][tidx[gidx]])
+                out[gidx] = unpack(record['data'], record['head']['VAR1'], record['head']['EXP'])
+            return out
+        if len(missing) >= self.parallel_slabs and self._nthreads > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            groups = [[missing[i] for i in g] for g in np.array_split(np.arange(len(missing)), self._nthreads) if len(g) > 0]
+            with ThreadPoolExecutor(self._nthreads) as pool:
+                decoded = list(pool.map(decode, groups))
+        elif len(missing) > 0:
+            groups = [missing]
+            decoded = [decode(missing)]
+        else:
+            groups = decoded = []
+        slabs = dict()
+        for group, vals in zip(groups, decoded):
+            for pair, slab in zip(group, vals):
+                slabs[pair] = slab
+                cache[(key,) + pair] = slab
+                self._slabcachebytes += slab.nbytes
+        for pi in missingidx:
+            out[pi] = slabs[pairs[pi]]
+        while self._slabcachebytes > self.cachebytes and len(cache) > 0:
+            self._slabcachebytes -= cache.popitem(last = False)[1].nbytes
+        return out
+
     def _getvar(self, k):
         datamap = self._datamap
         stdname, stdunit = stdprops.get(k, (k, 'unknown'))
         if k in datamap['surface'].dtype.names:
             vhead = datamap['surface'][k]['head']
-            v11 = vhead['VAR1']
-            EXP = vhead['EXP']
             props = dict([(k, vhead[k][0]) for k in vhead.dtype.names if not k in ('YYMMDDHHFF', 'LEVEL')])
-            bytes = datamap['surface'][k]['data']
-            vdata = unpack(bytes, v11, EXP)
-            #if k == 'MXLR':
-            #    CVAR, PREC, NEXP, VAR1, KSUM = pack2d(vdata[21], verbose = True)
-                
-                    
-            return PseudoNetCDFVariable(self, k, 'f', ('time', 'y', 'x'), values = vdata, units = stdunit, standard_name = stdname, **props)
+            dims = ('time', 'y', 'x')
         elif k in self._layvarkeys:
             laykeys = datamap['layers'].dtype.names
             mylaykeys = [laykey for laykey in laykeys if k in datamap['layers'][laykey].dtype.names]
-            bytes = np.array([datamap['layers'][lk][k]['data'] for lk in mylaykeys]).swapaxes(0, 1)
-            vhead = np.array([datamap['layers'][lk][k]['head'] for lk in mylaykeys]).swapaxes(0, 1)
-            v11 = vhead['VAR1']
-            EXP = vhead['EXP']
-            props = dict([(k, vhead[k][0, 0]) for k in vhead.dtype.names if not k in ('YYMMDDHHFF', 'LEVEL')])
-            props['LEVEL_START'] = vhead['LEVEL'][0, 0]
-            props['LEVEL_END'] = vhead['LEVEL'][-1, -1]
-            vdata = unpack(bytes, v11, EXP)
-            return PseudoNetCDFVariable(self, k, 'f', ('time', 'z', 'y', 'x'), values = vdata, units = stdunit, standard_name = stdname, **props)
-            
+            vhead0 = datamap['layers'][mylaykeys[0]][k]['head']
+            props = dict([(k, vhead0[k][0]) for k in vhead0.dtype.names if not k in ('YYMMDDHHFF', 'LEVEL')])
+            props['LEVEL_START'] = vhead0['LEVEL'][0]
+            props['LEVEL_END'] = datamap['layers'][mylaykeys[-1]][k]['head']['LEVEL'][-1]
+            dims = ('time', 'z', 'y', 'x')
+        # slabs are decoded when indexed
+        return PseudoNetCDFLazyVariable(self, k, ARLSlabs(self, k), dims, units = stdunit, standard_name = stdname, **props)
+
+class TestArl(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from PseudoNetCDF.benchmarks._synthetic import make_arl
+        self.tmpdir = mkdtemp()
+        self.path = make_arl(os.path.join(self.tmpdir, 'test.arl'), ntimes = 4, nlays = 3, nrows = 20, ncols = 25)
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+
+    def testLazy(self):
+        f = arlpackedbit(self.path)
+        datamap = f._datamap
+        levels = datamap['layers'].dtype.names
+        raw = np.array([datamap['layers'][lk]['TEMP']['data'] for lk in levels]).swapaxes(0, 1)
+        vhead = np.array([datamap['layers'][lk]['TEMP']['head'] for lk in levels]).swapaxes(0, 1)
+        full = unpack(raw, vhead['VAR1'], vhead['EXP'])
+        temp = f.variables['TEMP']
+        self.assertEqual(temp.shape, (4, 3, 20, 25))
+        self.assertEqual(temp.LEVEL_END.strip(), b'3')
+        testing.assert_allclose(temp[2, 1], full[2, 1])
+        # only the requested slab was decoded
+        self.assertEqual(list(f._slabcache.keys()), [('TEMP', 2, 1)])
+        testing.assert_allclose(temp[1:3, :, 5, 2:4], full[1:3, :, 5, 2:4])
+        testing.assert_allclose(temp[[0, 3], 0], full[[0, 3], 0])
+        self.assertEqual(len(f._slabcache), 8)
+        testing.assert_allclose(temp[[0, 1], [0, 1]], full[[0, 1], [0, 1]])
+        f._nthreads = 2
+        testing.assert_allclose(temp[:], full)
+        # decoded variables keep the ndarray interface
+        testing.assert_allclose((temp * 2)[1, 2], full[1, 2] * 2)
+        testing.assert_allclose((273.15 - temp)[0], 273.15 - full[0], rtol = 1e-6)
+        testing.assert_allclose(temp.mean(), full.mean(), rtol = 1e-6)
+        testing.assert_allclose(temp.max(axis = 0), full.max(axis = 0))
+        self.assertEqual(temp.swapaxes(0, 1).shape, (3, 4, 20, 25))
+        sfc = f.variables['PRSS']
+        self.assertEqual(sfc.shape, (4, 20, 25))
+        testing.assert_allclose(sfc[3, -1], unpack(datamap['surface']['PRSS']['data'], datamap['surface']['PRSS']['head']['VAR1'], datamap['surface']['PRSS']['head']['EXP'])[3, -1])
+
+    def testCacheLimit(self):
+        f = arlpackedbit(self.path)
+        f.cachebytes = 20 * 25 * 4 * 2
+        f.variables['TEMP'][:, 0]
+        self.assertEqual(len(f._slabcache), 2)
+        self.assertEqual(list(f._slabcache.keys()), [('TEMP', 2, 0), ('TEMP', 3, 0)])
+
 from PseudoNetCDF._getwriter import registerwriter
 registerwriter('noaafiles.arlpackedbit', writearlpackedbit)
 registerwriter('arlpackedbit', writearlpackedbit)
@@ -6,21 +6,267 @@ import os
 
 from PseudoNetCDF.pncload import PNCConsole
 from PseudoNetCDF.coordutil import getmap, getlatbnds, getlonbnds, getybnds, getxbnds
-from PseudoNetCDF.sci_var import getvarpnc, slice_dim
 
 import warnings
 warn=warnings.warn
 import numpy as np
 from PseudoNetCDF.plotutil import *
 
+def _getcoords(map, ifile):
+    """
+    Return lat, lon, LAT, LON, latunit, lonunit where LAT/LON are cell
+    bounds for pcolor
+    """
+    lat = ifile.variables['latitude']
+    lon = ifile.variables['longitude']
+    if map.projection in ('lcc', 'merc'):
+        latb, latunit = getybnds(ifile)[:]
+        lonb, lonunit = getxbnds(ifile)[:]
+    else:
+        latb, latunit = getlatbnds(ifile)[:]
+        lonb, lonunit = getlonbnds(ifile)[:]
+    
+    if latb.ndim == lonb.ndim and lonb.ndim == 2:
+        LON, LAT = lonb, latb
+    else:
+        LON, LAT = np.meshgrid(lonb.view(np.ndarray), latb.view(np.ndarray))
+    return lat, lon, LAT, LON, latunit, lonunit
+
+def _getmapvariables(args, ifile):
+    variables = args.variables
+    if variables is None:
+        variables = [key for key, var in ifile.variables.items() if len(set(['latitude', 'longitude']).intersection(getattr(var, 'coordinates', '').split())) == 2]
+    if len(variables) == 0:
+        raise ValueError('Unable to heuristically determin plottable variables; use -v to specify variables for plotting')
+    return variables
+
+def _getnorm(args, varkey, vmin, vmax, sample, percentile):
+    """
+    Return norm, formatter, vmin, vmax from --norm or, by default, from
+    deciles (percentile function) when sample is not normally distributed
+    and otherwise from vmin to vmax
+    """
+    if args.normalize is None:
+        from scipy.stats import normaltest
+        if normaltest(sample)[1] < 0.001:
+            boundaries = np.asarray(percentile(np.arange(0, 110, 10)))
+            warn('Autoselect deciles colormap of %s; override width --norm' % varkey)
+        else:
+            boundaries = np.linspace(vmin, vmax, num = 11)
+            warn('Autoselect linear colormap of %s; override width --norm' % varkey)
+        if (boundaries.max() / np.ma.masked_values(boundaries, 0).min()) > 10000:
+            formatter = LogFormatter(labelOnlyBase = False)
+        else:
+            formatter = None
+        norm = BoundaryNorm(boundaries, ncolors = 256)
+    else:
+        norm = eval(args.normalize)
+        formatter = None
+    if not args.colorbarformatter is None:
+        try:
+            formatter = eval(args.colorbarformatter)
+        except:
+            formatter = args.colorbarformatter
+
+    if not norm.vmin is None:
+        vmin = norm.vmin
+    if not norm.vmax is None:
+        vmax = norm.vmax
+    return norm, formatter, vmin, vmax
+
+def _orientation(ax):
+    height = np.abs(np.diff(ax.get_ylim()))
+    width = np.abs(np.diff(ax.get_xlim()))
+    if width >= height:
+        return 'horizontal'
+    else:
+        return 'vertical'
+
+def _extend(valmin, valmax, vmin, vmax):
+    if valmax > vmax and valmin < vmin:
+        return 'both'
+    elif valmax > vmax:
+        return 'max'
+    elif valmin < vmin:
+        return 'min'
+    else:
+        return 'neither'
+
+def _framevalues(var, axis, i, squeeze):
+    """
+    Read element i of axis from var (the rest of var is not read); with
+    axis None (var does not have the --iter dimension) all of var is the
+    frame
+    """
+    idx = [slice(None)] * len(var.dimensions)
+    if axis is not None:
+        idx[axis] = slice(i, i + 1)
+    vals = var[tuple(idx)]
+    if squeeze:
+        vals = vals.squeeze()
+    return vals
+
+_activeframes = None
+
+def _framepool(jobs):
+    """
+    Pool of jobs forked processes or None where fork is not available;
+    workers inherit _activeframes (figures are not picklable, so spawned
+    workers could not get the renderer)
+    """
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context('fork')
+    except (AttributeError, ValueError):
+        return None
+    return context.Pool(jobs)
+
+def _frameaxis(var, dimk):
+    dims = list(var.dimensions)
+    return dims.index(dimk) if dimk in dims else None
+
+def _renderframes(frames):
+    """
+    Render frames with the FrameRenderer that was active when the
+    process pool started
+    """
+    for args in frames:
+        _activeframes.render(*args)
+
+class FrameRenderer(object):
+    """
+    FrameRenderer draws one variable on a figure and then redraws it
+    for each element of a dimension by updating the mesh array and
+    colorbar label in place (figure, map, mesh and colorbar are reused)
+    """
+    def __init__(self, args, ifile, varkey, norm, formatter, extend, coords, cax = None):
+        self.args = args
+        self.cax = cax
+        self.ifile = ifile
+        self.varkey = varkey
+        self.var = ifile.variables[varkey]
+        self.norm = norm
+        self.formatter = formatter
+        self.extend = extend
+        self.lat, self.lon, self.LAT, self.LON, self.latunit, self.lonunit = coords
+        self.varunit = getattr(self.var, 'units', 'unknown').strip()
+        self.patches = None
+        self.cbar = None
+
+    def _draw(self, vals):
+        args = self.args
+        ax = pl.gca()
+        map = args.map
+        if vals.ndim == 1:
+            # scatter positions depend on the mask, so they are redrawn
+            if self.patches is not None:
+                self.patches.remove()
+            notmasked = ~(np.ma.getmaskarray(self.lon[:]) | np.ma.getmaskarray(self.lat[:]) | np.ma.getmaskarray(vals))
+            self.patches = map.scatter(self.lon[:][notmasked], self.lat[:][notmasked], c = vals[notmasked], edgecolors = 'none', s = 24, norm = self.norm, ax = ax, zorder = 2)
+        elif self.patches is None:
+            if vals.ndim != 2:
+                warn('Maps require 2-d data; values right now %s' % (str(vals.shape),))
+            self.patches = map.pcolormesh(self.LON, self.LAT, vals, norm = self.norm, ax = ax)
+        else:
+            self.patches.set_array(np.ma.masked_invalid(vals).ravel())
+        if self.cbar is None:
+            if self.lonunit == 'x (m)':
+                ax.xaxis.get_major_formatter().set_scientific(True)
+                ax.xaxis.get_major_formatter().set_powerlimits((-3, 3))
+            if self.latunit == 'y (m)':
+                ax.yaxis.get_major_formatter().set_scientific(True)
+                ax.yaxis.get_major_formatter().set_powerlimits((-3, 3))
+            ax.set_xlabel(self.lonunit)
+            ax.set_ylabel(self.latunit)
+            if self.cax is not None:
+                self.cax.cla()
+            self.cbar = pl.gcf().colorbar(self.patches, orientation = _orientation(ax), cax = self.cax, extend = self.extend, format = self.formatter, spacing = 'proportional')
+            del self.cbar.ax.texts[:]
+            self.cbar.update_ticks()
+        self.cbar.set_label(self.varkey + ' (' + self.varunit + '; min=%.3g; max=%.3g)' % (vals.min(), vals.max()))
+
+    def render(self, axis, i, figpath):
+        """
+        Draw element i of axis and save the figure to figpath
+        """
+        args = self.args
+        vals = _framevalues(self.var, axis, i, args.squeeze)
+        self._draw(vals)
+        ax = pl.gca()
+        varkey, ifile, var = self.varkey, self.ifile, self.var
+        if args.interactive:
+            csl = PNCConsole(locals = globals())
+            csl.interact()
+        for cmd in args.plotcommands:
+            exec(cmd)
+        pl.savefig(figpath)
+        if args.verbose > 0: print('Saved fig', figpath)
+
+def makeframes(args, ifile):
+    """
+    Make one map per element of each --iter dimension for each variable
+
+    Each frame reads only its slice of the variable. Colour
+    normalization is computed once per variable from a single streaming
+    pass (QuantileSketch) and the figure is drawn once and updated
+    for each frame. With --jobs, frames are saved by a process pool.
+    """
+    from PseudoNetCDF._parallel import njobs
+    from PseudoNetCDF._sketch import QuantileSketch
+    global _activeframes
+    coords = _getcoords(args.map, ifile)
+    variables = _getmapvariables(args, ifile)
+    frames = []
+    for dimk in args.iter:
+        frames += [(dimk, i) for i in range(len(ifile.dimensions[dimk]))]
+    nframes = len(frames)
+    jobs = 1 if args.interactive else njobs(args)
+    cax = None
+    for varkey in variables:
+        var = ifile.variables[varkey]
+        sk = QuantileSketch()
+        samples = []
+        nsample = 100000
+        for dimk, i in frames:
+            vals = _framevalues(var, _frameaxis(var, dimk), i, args.squeeze)
+            cvals = np.ma.compressed(np.ma.masked_invalid(vals))
+            sk.add(cvals)
+            samples.append(cvals[::max(1, cvals.size * nframes // nsample)])
+        sample = np.concatenate(samples)
+        norm, formatter, vmin, vmax = _getnorm(args, varkey, sk.vmin, sk.vmax, sample, sk.percentile)
+        extend = _extend(sk.vmin, sk.vmax, vmin, vmax)
+        if args.verbose > 0: print(varkey, sep = '')
+        renderer = FrameRenderer(args, ifile, varkey, norm, formatter, extend, coords, cax = cax)
+        tasks = []
+        for fi, (dimk, i) in enumerate(frames):
+            lstr = str(fi).rjust(len(str(nframes)), '0') if nframes > 1 else ''
+            figpath = os.path.join(args.outpath + varkey + lstr + '.' + args.figformat)
+            tasks.append((_frameaxis(var, dimk), i, figpath))
+        # the first frame is drawn here so workers only update it
+        renderer.render(*tasks[0])
+        pool = None
+        if jobs > 1 and len(tasks) > 1:
+            _activeframes = renderer
+            pool = _framepool(jobs)
+        if pool is not None:
+            try:
+                pool.map(_renderframes, [tasks[1:][ji::jobs] for ji in range(jobs)])
+            finally:
+                pool.close()
+                pool.join()
+                _activeframes = None
+        else:
+            _activeframes = None
+            for task in tasks[1:]:
+                renderer.render(*task)
+        cax = renderer.cbar.ax
+        renderer.patches.remove()
+
 def makemaps(args):
     ifiles = args.ifiles
     ifile = ifiles[0]
     if args.iter != []:
         ifile, = ifiles
-        ifiles = []
-        for dimk in args.iter:
-            ifiles += [slice_dim(getvarpnc(ifile, None), '%s,%d' % (dimk,i)) for i in range(len(ifile.dimensions[dimk]))]
     ax = pl.gca()
     map = getmap(ifile, resolution = args.resolution)
     if args.coastlines: map.drawcoastlines(ax = ax)
@@ -43,29 +289,12 @@ def makemaps(args):
         plt.setp(ax, **args.axes_keywords)
     
     map = args.map
+    if args.iter != []:
+        return makeframes(args, ifile)
     nborders = len(ax.collections)
     for fi, ifile in enumerate(ifiles):
-        if map.projection in ('lcc', 'merc'):
-            lat = ifile.variables['latitude']
-            lon = ifile.variables['longitude']
-            latb, latunit = getybnds(ifile)[:]
-            lonb, lonunit = getxbnds(ifile)[:]
-        else:
-            lat = ifile.variables['latitude']
-            lon = ifile.variables['longitude']
-            latb, latunit = getlatbnds(ifile)[:]
-            lonb, lonunit = getlonbnds(ifile)[:]
-        
-        if latb.ndim == lonb.ndim and lonb.ndim == 2:
-            LON, LAT = lonb, latb
-        else:
-            LON, LAT = np.meshgrid(lonb.view(np.ndarray), latb.view(np.ndarray))
-    
-        variables = args.variables
-        if variables is None:
-            variables = [key for key, var in ifile.variables.items() if len(set(['latitude', 'longitude']).intersection(getattr(var, 'coordinates', '').split())) == 2]
-        if len(variables) == 0:
-            raise ValueError('Unable to heuristically determin plottable variables; use -v to specify variables for plotting')
+        lat, lon, LAT, LON, latunit, lonunit = _getcoords(map, ifile)
+        variables = _getmapvariables(args, ifile)
         for varkey in variables:
             ax = pl.gca()
                     
@@ -77,33 +306,7 @@ def makemaps(args):
             else:
                 vals = var[:]
             vmin, vmax = vals.min(), vals.max()
-            if args.normalize is None:
-                from scipy.stats import normaltest
-                if normaltest(vals.ravel())[1] < 0.001:
-                    cvals = np.ma.compressed(vals)
-                    boundaries = np.percentile(cvals, np.arange(0, 110, 10))
-                    warn('Autoselect deciles colormap of %s; override width --norm' % varkey)
-                else:
-                    boundaries = np.linspace(vmin, vmax, num = 11)
-                    warn('Autoselect linear colormap of %s; override width --norm' % varkey)
-                if (boundaries.max() / np.ma.masked_values(boundaries, 0).min()) > 10000:
-                    formatter = LogFormatter(labelOnlyBase = False)
-                else:
-                    formatter = None
-                norm = BoundaryNorm(boundaries, ncolors = 256)
-            else:
-                norm = eval(args.normalize)
-                formatter = None
-            if not args.colorbarformatter is None:
-                try:
-                    formatter = eval(args.colorbarformatter)
-                except:
-                    formatter = args.colorbarformatter
-
-            if not norm.vmin is None:
-                vmin = norm.vmin
-            if not norm.vmax is None:
-                vmax = norm.vmax
+            norm, formatter, vmin, vmax = _getnorm(args, varkey, vmin, vmax, vals.ravel(), lambda q: np.percentile(np.ma.compressed(vals), q))
             varunit = getattr(var, 'units', 'unknown').strip()
             if args.verbose > 0: print(varkey, sep = '')
             if vals.ndim == 1:
@@ -124,25 +327,13 @@ def makemaps(args):
                 ax.yaxis.get_major_formatter().set_powerlimits((-3, 3))
             ax.set_xlabel(lonunit)
             ax.set_ylabel(latunit)
-            height = np.abs(np.diff(ax.get_ylim()))
-            width = np.abs(np.diff(ax.get_xlim()))
-            if width >= height:
-                orientation = 'horizontal'
-            else:
-                orientation = 'vertical'
+            orientation = _orientation(ax)
             try:
                 cax = cbar.ax
                 cax.cla()
             except:
                 cax = None
-            if vals.max() > vmax and vals.min() < vmin:
-                extend = 'both'
-            elif vals.max() > vmax:
-                extend = 'max'
-            elif vals.min() < vmin:
-                extend = 'min'
-            else:
-                extend = 'neither'
+            extend = _extend(vals.min(), vals.max(), vmin, vmax)
             cbar = pl.gcf().colorbar(patches, orientation = orientation, cax = cax, extend = extend, format = formatter, spacing = 'proportional')
             del cbar.ax.texts[:]
             cbar.set_label(varkey + ' (' + varunit + '; min=%.3g; max=%.3g)' % (var[:].min(), var[:].max()))
@@ -0,0 +1,434 @@
+from __future__ import print_function
+__all__ = ['Catalog', 'defaultdb']
+__doc__ = """
+Persistent catalog of files for fast discovery
+
+A Catalog is a SQLite database with one row per file (format, size,
+mtime, time range, domain, grid attributes, dimensions and global
+attributes) and one row per variable (dimensions and attributes).
+Scanning a directory tree sniffs and opens each new or changed file
+once; unchanged files (same size and mtime) are skipped, so rescans are
+cheap. Queries return paths without opening files, and the recorded
+reader lets anyfile/getreader skip format detection:
+
+    cat = Catalog('archive.sqlite')
+    cat.scan('/data/camx')
+    paths = cat.query(start = '2016-07-01', end = '2016-07-02', variables = ['O3'])
+    f = cat.open(paths[0])
+    f = anyfile(paths[0], catalog = cat)
+
+From the shell:
+
+    pnccatalog --db archive.sqlite scan /data/camx
+    pnccatalog --db archive.sqlite query --start 2016-07-01 --variables O3,NO2
+    pnccatalog --db archive.sqlite show /data/camx/camx.20160701.avrg
+"""
+import os
+import sys
+import json
+import sqlite3
+import fnmatch
+import unittest
+import numpy as np
+
+defaultdb = os.path.join(os.path.expanduser('~'), '.pnccatalog.sqlite')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    format TEXT,
+    size INTEGER,
+    mtime REAL,
+    tstart TEXT,
+    tend TEXT,
+    west REAL,
+    east REAL,
+    south REAL,
+    north REAL,
+    grid TEXT,
+    dimensions TEXT,
+    attributes TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS variables (
+    path TEXT,
+    name TEXT,
+    dimensions TEXT,
+    attributes TEXT
+);
+CREATE INDEX IF NOT EXISTS variables_name ON variables (name);
+CREATE INDEX IF NOT EXISTS variables_path ON variables (path);
+CREATE INDEX IF NOT EXISTS files_time ON files (tstart, tend);
+"""
+
+_gridkeys = ['GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT', 'XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS', 'NLAYS', 'VGTYP', 'VGTOP', 'VGLVLS', 'GDNAM', 'PLON', 'PLAT', 'IUTM', 'ISTAG', 'CPROJ']
+
+def _jsonable(value):
+    """
+    JSON compatible copy of an attribute value
+    """
+    if isinstance(value, bytes):
+        return value.decode('ascii', 'replace')
+    if isinstance(value, (np.ndarray, np.generic)):
+        return _jsonable(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        if isinstance(value, float) and not np.isfinite(value):
+            return str(value)
+        return value
+    return str(value)
+
+def _attrs(obj):
+    return dict([(k, _jsonable(getattr(obj, k))) for k in obj.ncattrs()])
+
+def _readername(reader):
+    """
+    Shortest registered name of reader
+    """
+    from ._getreader import getreaderdict
+    names = [k for k, v in getreaderdict().items() if v is reader]
+    if len(names) == 0:
+        return '%s.%s' % (reader.__module__, reader.__name__)
+    return sorted(names, key = lambda k: (k.count('.'), len(k), k))[0]
+
+def _timerange(f):
+    from ._timebin import gettimes64
+    try:
+        times = gettimes64(f)
+    except Exception:
+        return None, None
+    if times.size == 0:
+        return None, None
+    return str(times.min().astype('datetime64[s]')), str(times.max().astype('datetime64[s]'))
+
+def _domain(f):
+    """
+    (west, east, south, north) from longitude and latitude (or their
+    bounds) variables; Nones when they are not available
+    """
+    out = []
+    for keys in (('longitude_bounds', 'longitude'), ('latitude_bounds', 'latitude')):
+        for key in keys:
+            if key in f.variables.keys():
+                try:
+                    vals = np.ma.masked_invalid(f.variables[key][...])
+                    out.extend([float(vals.min()), float(vals.max())])
+                    break
+                except Exception:
+                    pass
+        else:
+            out.extend([None, None])
+    return tuple(out)
+
+class Catalog(object):
+    """
+    SQLite catalog of files (see module doc)
+
+    path - database path (default: ~/.pnccatalog.sqlite); ':memory:'
+           for a catalog that is not saved
+    """
+    def __init__(self, path = None):
+        if path is None:
+            path = defaultdb
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_schema)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _stat(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def isstale(self, path):
+        """
+        True if path is not recorded or its size or mtime changed
+        """
+        path = os.path.abspath(path)
+        row = self._conn.execute('SELECT size, mtime FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None or not os.path.exists(path):
+            return True
+        return tuple(row) != self._stat(path)
+
+    def add(self, path, format = None, **kwds):
+        """
+        Open path (with reader format or by sniffing) and record it;
+        returns the reader name or None if it could not be opened (the
+        error is recorded so unchanged files are not retried)
+
+        kwds - reader keywords
+        """
+        from ._getreader import getreader, getreaderdict
+        path = os.path.abspath(path)
+        size, mtime = self._stat(path)
+        record = dict(path = path, size = size, mtime = mtime, format = None, error = None)
+        variables = []
+        try:
+            if format is None:
+                reader = getreader(path, **kwds)
+            else:
+                reader = getreaderdict()[format]
+            f = reader(path, **kwds)
+            record['format'] = _readername(reader)
+            record['tstart'], record['tend'] = _timerange(f)
+            record['west'], record['east'], record['south'], record['north'] = _domain(f)
+            attrs = _attrs(f)
+            record['grid'] = json.dumps(dict([(k, attrs[k]) for k in _gridkeys if k in attrs]))
+            record['attributes'] = json.dumps(attrs)
+            record['dimensions'] = json.dumps(dict([(k, len(d)) for k, d in f.dimensions.items()]))
+            for vk in f.variables.keys():
+                var = f.variables[vk]
+                variables.append((path, vk, json.dumps(list(var.dimensions)), json.dumps(_attrs(var))))
+            try:
+                f.close()
+            except Exception:
+                pass
+        except Exception as e:
+            record['error'] = '%s: %s' % (type(e).__name__, str(e))
+        keys = list(record.keys())
+        with self._conn:
+            self._conn.execute('DELETE FROM variables WHERE path = ?', (path,))
+            self._conn.execute('INSERT OR REPLACE INTO files (%s) VALUES (%s)' % (', '.join(keys), ', '.join(['?'] * len(keys))), [record[k] for k in keys])
+            self._conn.executemany('INSERT INTO variables (path, name, dimensions, attributes) VALUES (?, ?, ?, ?)', variables)
+        return record['format']
+
+    def remove(self, path):
+        path = os.path.abspath(path)
+        with self._conn:
+            self._conn.execute('DELETE FROM variables WHERE path = ?', (path,))
+            self._conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def scan(self, root, pattern = '*', format = None, verbose = 0, **kwds):
+        """
+        Record new and changed files under root whose names match pattern
+        and forget recorded files under root that no longer exist (or
+        match pattern and were not found)
+
+        Returns a dictionary of counts: added, updated, unchanged, removed
+        and failed
+        """
+        root = os.path.abspath(root)
+        counts = dict(added = 0, updated = 0, unchanged = 0, removed = 0, failed = 0)
+        # exact prefix; LIKE treats _ and % in root as wildcards and
+        # ignores case
+        prefix = os.path.join(root, '')
+        known = dict([(p, (s, m)) for p, s, m in self._conn.execute("SELECT path, size, mtime FROM files WHERE path = ? OR substr(path, 1, ?) = ?", (root, len(prefix), prefix))])
+        found = set()
+        if os.path.isfile(root):
+            paths = [root]
+        else:
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                paths.extend([os.path.join(dirpath, fn) for fn in sorted(filenames) if fnmatch.fnmatch(fn, pattern)])
+        for path in paths:
+            found.add(path)
+            if path in known and known[path] == self._stat(path):
+                counts['unchanged'] += 1
+                continue
+            reader = self.add(path, format = format, **kwds)
+            counts['updated' if path in known else 'added'] += 1
+            if reader is None:
+                counts['failed'] += 1
+            if verbose > 0:
+                print('%s %s' % (reader or 'unreadable', path), file = sys.stderr)
+        for path in set(known).difference(found):
+            if os.path.exists(path) and not fnmatch.fnmatch(os.path.basename(path), pattern):
+                # recorded by a scan with another pattern
+                continue
+            self.remove(path)
+            counts['removed'] += 1
+        return counts
+
+    def query(self, start = None, end = None, variables = None, bbox = None, format = None, pattern = None):
+        """
+        Sorted paths of readable files that overlap the time window
+        (start, end; ISO dates or datetimes), have all variables, overlap
+        bbox (west, south, east, north), were read with format and match
+        pattern (fnmatch of the path)
+        """
+        where = ['error IS NULL']
+        params = []
+        if start is not None:
+            where.append('tend >= ?')
+            params.append(str(np.datetime64(start, 's')))
+        if end is not None:
+            where.append('tstart <= ?')
+            params.append(str(np.datetime64(end, 's')))
+        for vk in (variables or []):
+            where.append('path IN (SELECT path FROM variables WHERE name = ?)')
+            params.append(vk)
+        if bbox is not None:
+            west, south, east, north = bbox
+            where.append('east >= ? AND west <= ? AND north >= ? AND south <= ?')
+            params.extend([west, east, south, north])
+        if format is not None:
+            where.append('format = ?')
+            params.append(format)
+        sql = 'SELECT path FROM files WHERE %s ORDER BY path' % ' AND '.join(where)
+        paths = [row[0] for row in self._conn.execute(sql, params)]
+        if pattern is not None:
+            paths = [p for p in paths if fnmatch.fnmatch(p, pattern)]
+        return paths
+
+    def record(self, path):
+        """
+        Dictionary of the recorded properties of path (None if absent);
+        variables maps names to dimensions and attributes
+        """
+        path = os.path.abspath(path)
+        cur = self._conn.execute('SELECT * FROM files WHERE path = ?', (path,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        out = dict(zip([d[0] for d in cur.description], row))
+        for k in ('grid', 'dimensions', 'attributes'):
+            if out[k] is not None:
+                out[k] = json.loads(out[k])
+        out['variables'] = dict([(name, dict(dimensions = json.loads(dims), attributes = json.loads(attrs))) for name, dims, attrs in self._conn.execute('SELECT name, dimensions, attributes FROM variables WHERE path = ? ORDER BY rowid', (path,))])
+        return out
+
+    def reader(self, path):
+        """
+        Recorded reader class of path or None if path is not recorded,
+        changed since it was recorded or could not be read
+        """
+        from ._getreader import getreaderdict
+        if self.isstale(path):
+            return None
+        row = self._conn.execute('SELECT format FROM files WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return getreaderdict().get(row[0], None)
+
+    def open(self, path, **kwds):
+        """
+        Open path with its recorded reader (sniffing if it is stale)
+        """
+        from ._getreader import anyfile
+        return anyfile(path, catalog = self, **kwds)
+
+def main(args = None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog = 'pnccatalog', description = 'Record files in a catalog and find files by time, variables, domain and format without opening them')
+    parser.add_argument('--db', default = defaultdb, help = 'Catalog database (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest = 'command')
+    scanparser = subparsers.add_parser('scan', help = 'Record new or changed files under paths')
+    scanparser.add_argument('paths', nargs = '+', help = 'Directories or files')
+    scanparser.add_argument('--pattern', default = '*', help = 'File name pattern (default: %(default)s)')
+    scanparser.add_argument('-f', '--format', default = None, help = 'Reader name (default: detect); keywords as for pncdump -f')
+    scanparser.add_argument('-v', '--verbose', action = 'count', default = 0)
+    queryparser = subparsers.add_parser('query', help = 'Print paths of matching files')
+    queryparser.add_argument('--start', default = None, help = 'Files with times at or after (e.g., 2016-07-01T12)')
+    queryparser.add_argument('--end', default = None, help = 'Files with times at or before')
+    queryparser.add_argument('--variables', default = None, type = lambda x: x.split(','), help = 'Files with all of these variables (separated by ,)')
+    queryparser.add_argument('--bbox', default = None, type = lambda x: [float(v) for v in x.split(',')], help = 'Files that overlap west,south,east,north')
+    queryparser.add_argument('-f', '--format', default = None, help = 'Files read with this reader')
+    queryparser.add_argument('--pattern', default = None, help = 'Path pattern')
+    showparser = subparsers.add_parser('show', help = 'Print the record of each path as JSON')
+    showparser.add_argument('paths', nargs = '+')
+    args = parser.parse_args(args)
+    if args.command is None:
+        parser.print_help()
+        return
+    with Catalog(args.db) as cat:
+        if args.command == 'scan':
+            format, kwds = None, {}
+            if args.format is not None:
+                format_options = args.format.split(',')
+                format = format_options.pop(0)
+                kwds = eval('dict(' + ', '.join(format_options) + ')')
+            for path in args.paths:
+                counts = cat.scan(path, pattern = args.pattern, format = format, verbose = args.verbose, **kwds)
+                print('%s: %d added, %d updated, %d unchanged, %d removed, %d unreadable' % (path, counts['added'], counts['updated'], counts['unchanged'], counts['removed'], counts['failed']))
+        elif args.command == 'query':
+            for path in cat.query(start = args.start, end = args.end, variables = args.variables, bbox = args.bbox, format = args.format, pattern = args.pattern):
+                print(path)
+        elif args.command == 'show':
+            for path in args.paths:
+                print(json.dumps(cat.record(path), indent = 2, sort_keys = True))
+
+class TestCatalog(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from .benchmarks._synthetic import make_uamiv, make_icartt
+        self.tmpdir = mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'sub'))
+        self.uamivpath = make_uamiv(os.path.join(self.tmpdir, 'test.uamiv'), ntimes = 3, nlays = 1, nrows = 4, ncols = 5)
+        self.icarttpath = make_icartt(os.path.join(self.tmpdir, 'sub', 'test.ict'), npoints = 20)
+        self.junkpath = os.path.join(self.tmpdir, 'junk.txt')
+        with open(self.junkpath, 'w') as junk:
+            junk.write('not data\n')
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+
+    def testScan(self):
+        from ._getreader import anyfile
+        from .camxfiles.uamiv.Memmap import uamiv
+        cat = Catalog(':memory:')
+        counts = cat.scan(self.tmpdir, pattern = 'test.*')
+        self.assertEqual((counts['added'], counts['failed']), (2, 0))
+        self.assertEqual(cat.scan(self.tmpdir, pattern = 'test.*')['unchanged'], 2)
+        self.assertEqual(cat.add(self.junkpath, format = 'uamiv'), None)
+        self.assert_(cat.record(self.junkpath)['error'] is not None)
+        record = cat.record(self.uamivpath)
+        f = uamiv(self.uamivpath)
+        self.assertEqual(record['format'], 'uamiv')
+        self.assertEqual(record['dimensions']['TSTEP'], 3)
+        self.assertEqual(record['grid']['NCOLS'], 5)
+        self.assertEqual(list(record['variables']), list(f.variables.keys()))
+        self.assertEqual(cat.reader(self.uamivpath), uamiv)
+        self.assertEqual(cat.query(variables = ['O3']), [self.uamivpath])
+        self.assertEqual(cat.query(variables = ['O3', 'NOTAVAR']), [])
+        self.assertEqual(cat.query(format = 'ffi1001'), [self.icarttpath])
+        tstart, tend = record['tstart'], record['tend']
+        self.assertEqual(cat.query(start = tstart, end = tstart, format = 'uamiv'), [self.uamivpath])
+        self.assertEqual(cat.query(start = str(np.datetime64(tend) + np.timedelta64(1, 'h')), format = 'uamiv'), [])
+        np.testing.assert_equal(cat.open(self.uamivpath).variables['O3'][:], f.variables['O3'][:])
+        self.assert_(isinstance(anyfile(self.uamivpath, catalog = cat), uamiv))
+        # changed and removed files
+        os.utime(self.uamivpath, (0, 0))
+        self.assertEqual(cat.reader(self.uamivpath), None)
+        os.remove(self.icarttpath)
+        counts = cat.scan(self.tmpdir, pattern = 'test.*')
+        self.assertEqual((counts['updated'], counts['removed'], counts['unchanged']), (1, 1, 0))
+        self.assertEqual(cat.query(), [self.uamivpath])
+
+    def testScanSibling(self):
+        from .benchmarks._synthetic import make_uamiv
+        cat = Catalog(':memory:')
+        for sub in ('run_1', 'runA1', 'RUN_1x'):
+            os.makedirs(os.path.join(self.tmpdir, sub))
+            make_uamiv(os.path.join(self.tmpdir, sub, 'b.uamiv'), ntimes = 1, nlays = 1, nrows = 2, ncols = 2)
+            cat.scan(os.path.join(self.tmpdir, sub))
+        os.remove(os.path.join(self.tmpdir, 'run_1', 'b.uamiv'))
+        counts = cat.scan(os.path.join(self.tmpdir, 'run_1'))
+        self.assertEqual(counts['removed'], 1)
+        self.assertEqual(cat.query(), [os.path.join(self.tmpdir, sub, 'b.uamiv') for sub in ('RUN_1x', 'runA1')])
+
+    def testMain(self):
+        import io
+        from contextlib import redirect_stdout
+        dbpath = os.path.join(self.tmpdir, 'catalog.sqlite')
+        main(['--db', dbpath, 'scan', self.tmpdir, '--pattern', '*.uamiv'])
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main(['--db', dbpath, 'query', '--variables', 'O3'])
+        self.assertEqual(out.getvalue().split(), [self.uamivpath])
+
+if __name__ == '__main__':
+    main()
@@ -360,7 +360,57 @@ def stat_spatial(ifile0, ifile1, funcs = __all__, variables = ['O3'], counties =
             if counties: bmap.counties(ax = ax)
             show()
 
-def stat_timeseries(ifile0, ifile1, variables = ['O3'], counties = False):
+def _timeaxis(var):
+    dims = list(var.dimensions)
+    for dk in ('time', 'TSTEP'):
+        if dk in dims:
+            return dims.index(dk)
+    return 0
+
+def stat_bins(ifile0, ifile1, func, vark, by = 'hour', chunksize = None):
+    """
+    Return labels and func(obs, mod) for each time bin of vark
+
+    by - hour, dayofweek, month or season (see PseudoNetCDF._timebin);
+         bins use the times of ifile0
+    chunksize - times read at once (default: about _timebin.chunkbytes
+                per chunk from each file)
+    """
+    from . import _timebin
+    codes, labels = _timebin.timebins(ifile0, by)
+    var_0 = ifile0.variables[vark]
+    var_1 = ifile1.variables[vark]
+    tidx = _timeaxis(var_0)
+    shape = tuple(var_0.shape)
+    if chunksize is None:
+        rowbytes = np.dtype(getattr(var_0, 'dtype', 'd')).itemsize * int(np.prod(shape)) // max(1, shape[tidx])
+        chunksize = max(1, _timebin.chunkbytes // max(1, rowbytes))
+    # obs, mod and their masks are binned side by side, so each bin keeps
+    # aligned pairs and masked values for func
+    stats = _timebin.BinStats(len(labels))
+    for start in range(0, shape[tidx], chunksize):
+        chunk = slice(start, min(start + chunksize, shape[tidx]))
+        idx = (slice(None),) * tidx + (chunk,)
+        val_0 = var_0[idx]
+        val_1 = var_1[idx]
+        pairs = np.stack([np.ma.getdata(val_0), np.ma.getdata(val_1), np.ma.getmaskarray(val_0), np.ma.getmaskarray(val_1)], axis = -1)
+        stats.add(codes[chunk], pairs, axis = tidx)
+    statvs = []
+    for vals in stats.values():
+        if vals.size == 0:
+            statvs.append(np.ma.masked)
+            continue
+        vals = vals.reshape(-1, 4)
+        obs = np.ma.masked_array(vals[:, 0], mask = vals[:, 2] != 0)
+        mod = np.ma.masked_array(vals[:, 1], mask = vals[:, 3] != 0)
+        statvs.append(func(obs, mod))
+    return labels, statvs
+
+def stat_timeseries(ifile0, ifile1, variables = ['O3'], counties = False, by = None):
+    """
+    by - None for each time or bin statistics by hour, dayofweek, month or
+         season
+    """
     from pylab import figure, show
     for vark in variables:
         for statname in __all__:
@@ -368,15 +418,21 @@ def stat_timeseries(ifile0, ifile1, variables = ['O3'], counties = False):
             fig = figure()
             ax = fig.add_subplot(111)
             ax.set_title(vark + ' ' + statname)
-            var_0 = ifile0.variables[vark]
-            var_1 = ifile1.variables[vark]
-            tidx = list(var_0.dimensions).index('time')
-            statvs = []
-            for timei in range(var_0.shape[tidx]):
-                val_0 = var_0[:].take([timei], axis = tidx).ravel()
-                val_1 = var_1[:].take([timei], axis = tidx).ravel()
-                statvs.append(statfunc(val_0, val_1))
-            dots = ax.plot(statvs)
+            if by is None:
+                var_0 = ifile0.variables[vark]
+                var_1 = ifile1.variables[vark]
+                tidx = list(var_0.dimensions).index('time')
+                val_0 = var_0[:]
+                val_1 = var_1[:]
+                statvs = []
+                for timei in range(var_0.shape[tidx]):
+                    statvs.append(statfunc(val_0.take([timei], axis = tidx).ravel(), val_1.take([timei], axis = tidx).ravel()))
+                dots = ax.plot(statvs)
+            else:
+                labels, statvs = stat_bins(ifile0, ifile1, statfunc, vark, by = by)
+                dots = ax.plot(statvs)
+                ax.set_xticks(range(len(labels)))
+                ax.set_xticklabels(labels)
             show() 
 
 def pnceval(args):
@@ -418,10 +474,27 @@ def pnceval(args):
         from collections import OrderedDict
         import pandas
         output = OrderedDict()
+    by = getattr(args, 'by', None)
     for k in args.funcs:
         console.locals[k] = func = eval(k)
-        output[k] = OrderedDict()
-        if args.csv: print('# %s: %s' % (k, func.__doc__.strip()))
+        if args.csv:
+            output[k] = OrderedDict()
+            print('# %s: %s' % (k, func.__doc__.strip()))
+        if by is not None:
+            for vk in args.variables:
+                if vk in ('time', 'TFLAG'): continue
+                try:
+                    labels, statvs = stat_bins(ifile0, ifile1, func, vk, by = by)
+                except Exception as e:
+                    warn("Skipped " + k + ';' + str(e))
+                    continue
+                for label, statv in zip(labels, statvs):
+                    statv = float(np.ma.filled(np.ma.masked_invalid(statv), np.nan))
+                    if args.csv:
+                        output[k][vk, label] = statv
+                    else:
+                        print('%s,%s,%s,%s,%f' % (vk, func.__doc__.strip(), k, label, statv))
+            continue
         try:
             console.locals[k+'_f'] = ofile = pncbfunc(func, ifile0, ifile1)
         except Exception as e:
@@ -436,7 +509,14 @@ def pnceval(args):
                 output[k][vk] = outv.ravel()[0]
             else:
                 print('%s,%s,%s,%f' % (vk, func.__doc__.strip(), k, ofile.variables[vk].ravel()[0]))
-    if args.csv:
+    if args.csv and by is not None:
+        print(','.join(['VAR', by.upper()] + args.funcs))
+        keys = []
+        for fk in args.funcs:
+            keys.extend([key for key in output[fk] if key not in keys])
+        for vk, label in keys:
+            print(','.join([vk, label] + ['%f' % output[fk].get((vk, label), np.nan) for fk in args.funcs]))
+    elif args.csv:
         print(','.join(['VAR'] + args.funcs))
         for vk in args.variables:
             print(','.join([vk] + ['%f' % output[fk].get(vk, np.nan) for fk in args.funcs]))
@@ -450,6 +530,7 @@ def main():
 
     parser = getparser(has_ofile = False, plot_options = False, interactive = True)
     parser.add_argument('--csv', dest = 'csv', default = False, action = 'store_true', help = 'Print all data in CSV format')
+    parser.add_argument('--by', default = None, choices = ['hour', 'dayofweek', 'month', 'season'], help = 'Evaluate each time bin of ifile0 times (default: all times together)')
     parser.add_argument('--funcs', default = __all__, type = lambda x: x.split(','), help='Functions to evaluate split by , (default: %s)' % ','.join(__all__))
 
     import numpy as np
@@ -5,6 +5,8 @@ from types import MethodType
 from PseudoNetCDF.netcdf import NetCDFFile, NetCDFVariable
 from .sci_var import PseudoNetCDFFile
 from .sci_var import get_ncf_object
+from .core._lazy import PseudoNetCDFLazyVariable, LazyAffine
+from . import _profile
 import numpy as np
 if sys.version_info > (3,):
     long = int
@@ -27,10 +29,27 @@ class Pseudo2NetCDF:
     special_properties = ['_fillvalue', '_FillValue']
     unlimited_dimensions = []
     create_variable_kwds = {}
-    def __init__(self, datafirst = False, verbose = 1):
+    storage = None
+    packunits = False
+    def __init__(self, datafirst = False, verbose = 1, storage = None, packunits = None):
+        """
+        datafirst - populate each variable when it is defined
+        verbose - print progress
+        storage - StoragePolicy (compression, chunking, quantization) for
+                  NETCDF4 outputs
+        packunits - write unit conversions (lazy affine variables) to
+                    netCDF files as the unconverted values with
+                    scale_factor and add_offset
+        """
         self.datafirst = datafirst
         self.verbose = verbose
-    def convert(self,pfile,npath=None, inmode = 'r', outmode = 'w', format = 'NETCDF4'):
+        if storage is not None:
+            self.storage = storage
+        if packunits is not None:
+            self.packunits = packunits
+    def convert(self,pfile,npath=None, inmode = 'r', outmode = 'w', format = 'NETCDF4', storage = None):
+        if storage is not None:
+            self.storage = storage
         pfile = get_ncf_object(pfile, inmode)
         nfile = get_ncf_object(npath, outmode, format = format)
         if self.verbose: print("Adding dimensions", file = sys.stdout)
@@ -99,12 +118,25 @@ class Pseudo2NetCDF:
                         warn("Could not add %s=%s to variable; %s" % (a,str(value), e))
                         
     
+    def _packed(self, pfile, nfile, k):
+        """
+        Affine node of variable k when it is written packed (packunits)
+        """
+        if not self.packunits or isinstance(nfile, PseudoNetCDFFile):
+            return None
+        pvar = pfile.variables[k]
+        if isinstance(pvar, PseudoNetCDFLazyVariable) and isinstance(pvar._node, LazyAffine):
+            return pvar._node
+
     def addVariable(self,pfile,nfile,k, data = True):
         pvar=pfile.variables[k]
+        packed = self._packed(pfile, nfile, k)
         try:
             typecode = pvar.typecode()
         except:
             typecode = pvar[...].dtype.char
+        if packed is not None:
+            typecode = packed._node.dtype.char
         
         create_variable_kwds = self.create_variable_kwds.copy()
         if hasattr(pvar, 'missing_value'):
@@ -113,9 +145,18 @@ class Pseudo2NetCDF:
             create_variable_kwds['fill_value'] = pvar.fill_value
         elif hasattr(pvar, '_FillValue'):
             create_variable_kwds['fill_value'] = pvar._FillValue
+        elif packed is not None:
+            # masked values are written as the fill of the packed values
+            create_variable_kwds['fill_value'] = -999
+        
+        if self.storage is not None and not isinstance(nfile, PseudoNetCDFFile) and getattr(nfile, 'data_model', 'NETCDF4').startswith('NETCDF4'):
+            create_variable_kwds.update(self.storage.kwds(pfile, k, typecode))
         
         nvar=nfile.createVariable(k,typecode,pvar.dimensions, **create_variable_kwds)
         self.addVariableProperties(pvar,nvar)
+        if packed is not None:
+            nvar.setncattr('scale_factor', pvar.dtype.type(packed._affine.scale))
+            nvar.setncattr('add_offset', pvar.dtype.type(packed._affine.offset))
         if data:
             self.addVariableData(pfile, nfile, k)
         nfile.sync()
@@ -130,14 +171,30 @@ class Pseudo2NetCDF:
         from numpy import ndarray, isscalar
         nvar = nfile.variables[k]
         pvar = pfile.variables[k]
-        if isscalar(nvar) or nvar.ndim == 0:
-            if isinstance(pvar, NetCDFVariable):
-                pvar = pvar[...]
-            nvar[...] = pvar
-        elif isinstance(pvar[...], MaskedArray):
-            nvar[:] = pvar[...].filled(getattr(nvar, 'fill_value', getattr(nvar, '_FillValue', getattr(pvar, 'missing_value', -9999))))
-        else:
-            nvar[:] = pvar[...]
+        packed = self._packed(pfile, nfile, k)
+        if packed is not None:
+            # write the unconverted values; readers apply scale_factor
+            # and add_offset
+            pvar = PseudoNetCDFLazyVariable(pvar._parent, k, packed._node, pvar.dimensions, fill_value = nvar._FillValue)
+            pvar.chunkbytes = pfile.variables[k].chunkbytes
+            nvar.set_auto_scale(False)
+        profiler = _profile.getprofiler()
+        with _profile.stage('write'):
+            if isscalar(nvar) or nvar.ndim == 0:
+                if isinstance(pvar, NetCDFVariable):
+                    pvar = pvar[...]
+                nvar[...] = pvar
+                if profiler is not None:
+                    profiler.addwritten(np.asarray(pvar).nbytes)
+            else:
+                # deferred variables are written one chunk at a time
+                for chunk in getattr(pvar, 'chunkslices', lambda: [slice(None)])():
+                    pvals = pvar[chunk]
+                    if isinstance(pvals, MaskedArray):
+                        pvals = pvals.filled(getattr(nvar, 'fill_value', getattr(nvar, '_FillValue', getattr(pvar, 'missing_value', -9999))))
+                    nvar[chunk] = pvals
+                    if profiler is not None:
+                        profiler.addwritten(np.asarray(pvals).nbytes)
         
 
     def addVariables(self,pfile,nfile):
@@ -201,11 +258,17 @@ outfile = Dataset(outpath, 'w')
             print("var[:] = %s" % (repr(v[:].view(type = vtype))))
 
 
-def pncgen(ifile,outpath, inmode = 'r', outmode = 'w', format = 'NETCDF4_CLASSIC', verbose = 1):
+def pncgen(ifile,outpath, inmode = 'r', outmode = 'w', format = 'NETCDF4_CLASSIC', verbose = 1, storage = None, packunits = False):
+    """
+    storage - StoragePolicy for compression, chunking and quantization
+              (NETCDF4 and NETCDF4_CLASSIC only)
+    packunits - write unit conversions as scale_factor and add_offset
+                (NETCDF formats only)
+    """
     if format[:6] == 'NETCDF':
-        p2n = Pseudo2NetCDF()
+        p2n = Pseudo2NetCDF(packunits = packunits)
         p2n.verbose = verbose
-        return p2n.convert(ifile, outpath, inmode = inmode, outmode = outmode, format = format)
+        return p2n.convert(ifile, outpath, inmode = inmode, outmode = outmode, format = format, storage = storage)
 
     from ._getwriter import getwriterdict
     writerdict = getwriterdict()
@@ -231,11 +294,12 @@ def pncgen(ifile,outpath, inmode = 'r', outmode = 'w', format = 'NETCDF4_CLASSIC
     
 def main():
     from .pncparse import pncparse
+    from ._storage import getstoragepolicy
     ifiles, options = pncparse(has_ofile = True, interactive = False)
     if len(ifiles) != 1:
         raise IOError('pncgen can output only 1 file; user requested %d' % len(ifiles))
     ifile, = ifiles
-    return pncgen(ifile, options.outpath, outmode = options.mode, format = options.outformat, verbose = options.verbose), options
+    return pncgen(ifile, options.outpath, outmode = options.mode, format = options.outformat, verbose = options.verbose, storage = getstoragepolicy(options), packunits = options.packunits), options
 
 if __name__ == '__main__':
     main()
@@ -32,6 +32,10 @@ try:
 except:
     pass
 
+from .core._plan import PNCPlan
+from ._parallel import pmap, njobs
+from . import _profile
+from ._profile import stage
 from .sci_var import reduce_dim, mesh_dim, slice_dim, getvarpnc, extract, mask_vals, seqpncbo, pncexpr, stack_files, add_attr, convolve_dim, manglenames, removesingleton, merge, extract_from_file, pncrename
 
         
@@ -148,6 +152,18 @@ def add_basic_options(parser):
 
     parser.add_argument('--pnc', action = 'append', default = [], help='Set of pseudonetcdf commands to be process separately')
 
+    parser.add_argument("--jobs", dest = "jobs", type = int, default = 1, metavar = "N", help = "Open and process input files (or --sep/--pnc groups) in N processes; at most 2N results are in flight at a time. pncmap --iter renders frames in N processes. 0 uses one process per core (default 1)")
+
+    parser.add_argument("--jobs-spill", dest = "jobs_spill", action = 'store_true', default = False, help = "Return --jobs results as temporary NetCDF files (removed at exit) instead of in memory")
+
+    parser.add_argument("--jobs-shared", dest = "jobs_shared", action = 'store_true', default = False, help = "Return --jobs results through shared memory (removed at exit); variables that are views of memory mapped files are reopened from the file instead of copied")
+
+    parser.add_argument("--profile", dest = "profile", action = 'store_true', default = False, help = "Record wall time and memory growth by stage (open, select, slice_dim, ..., write), variable materialization counts, sizes of materialized variables (memmap views apart from other reads) and bytes written; the report is written to --profile-path at exit")
+
+    parser.add_argument("--profile-path", dest = "profile_path", default = 'pncprofile.json', metavar = 'path', help = "With --profile, write the report to path; paths ending in .csv are written as CSV and others as JSON (default %(default)s)")
+
+    parser.add_argument("--profile-cprofile", dest = "profile_cprofile", default = None, metavar = 'path', help = "With --profile, also write a cProfile (pstats) dump to path")
+
     parser.add_argument("-f", "--format", dest = "format", default = 'netcdf', metavar = '{see --list-formats for choices}', help = "File format (default netcdf), can be one of the choices listed, or an expression that evaluates to a reader. Keyword arguments are passed via ,kwd=value.")
 
     parser.add_argument("--list-formats", dest = "help", default = None, action = _HelpListFormats, help = "Show format options for -f")
@@ -188,7 +204,7 @@ def add_basic_options(parser):
     parser.add_argument("-s", "--slice", dest = "slice", type = str, action = "append", default = [], metavar = 'dim,start[,stop[,step]]',
                         help = "Variables have dimensions (time, layer, lat, lon), which can be subset using dim,start,stop,stride (e.g., --slice=layer,0,47,5 would sample every fifth layer starting at 0)")
 
-    parser.add_argument("-r", "--reduce", dest = "reduce", type = str, action = "append", default = [], metavar = 'dim,function[,weight]', help = "Variable dimensions can be reduced using dim,function,weight syntax (e.g., --reduce=layer,mean,weight). Weighting is not fully functional.")
+    parser.add_argument("-r", "--reduce", dest = "reduce", type = str, action = "append", default = [], metavar = 'dim,function[,weight]', help = "Variable dimensions can be reduced using dim,function,weight syntax (e.g., --reduce=layer,mean,weight). Weighting is not fully functional. Daily functions (e.g., --reduce=time,mda8 or time,daymax) use calendar days in local standard time when the file has a utcoffset variable (hours).")
 
     parser.add_argument("--mesh", dest = "mesh", type = str, action = "append", default = [], metavar = 'dim,weight,function', help = "Variable dimensions can be meshed using dim,function,weight syntax (e.g., --mesh=time,0.5,mean).")
     
@@ -255,6 +271,20 @@ def add_output_options(parser):
 
     parser.add_argument("--mode", dest = "mode", type = str, default = "w", help = "File mode for writing (w, a or r+ or with unbuffered writes ws, as, or r+s; pncgen only).", choices = 'w a r+ ws as r+s'.split())
 
+    parser.add_argument("--zlib", dest = "zlib", action = 'store_true', default = False, help = "Compress variables (NETCDF4 formats; pncgen only)")
+
+    parser.add_argument("--complevel", dest = "complevel", type = int, default = None, choices = range(1, 10), metavar = "1-9", help = "Compression level; implies --zlib (NETCDF4 formats; pncgen only)")
+
+    parser.add_argument("--no-shuffle", dest = "shuffle", action = 'store_false', default = True, help = "Disable the shuffle filter when compressing (NETCDF4 formats; pncgen only)")
+
+    parser.add_argument("--chunk-for", dest = "chunk_for", type = str, default = None, choices = ['timeseries', 'maps', 'balanced'], help = "Choose chunk sizes for an access pattern: timeseries reads all times for few cells, maps reads all cells for one time, balanced scales all dimensions (NETCDF4 formats; pncgen only)")
+
+    parser.add_argument("--least-significant-digit", dest = "least_significant_digit", type = int, default = None, help = "Quantize floating point variables to this many decimal digits before compression (NETCDF4 formats; pncgen only)")
+
+    parser.add_argument("--variable-storage", dest = "variable_storage", action = 'append', default = [], help = "Per-variable storage options VAR,key=value,... where keys are zlib, complevel, shuffle, chunk_for, chunksizes, chunkbytes and least_significant_digit; values are python literals or plain words (e.g., O3,complevel=9,chunk_for=maps or O3,chunksizes=(1,1,50,50); pncgen only)")
+
+    parser.add_argument("--pack-units", dest = "packunits", action = 'store_true', default = False, help = "Write unit conversions as the unconverted values with scale_factor and add_offset (NETCDF formats; pncgen only)")
+
     parser.add_argument('outpath', default = None, type = str, help='path to a output file formatted as --out-format')
 
 def add_interactive_options(parser):
@@ -401,6 +431,8 @@ args : args as parsed
         return [], args
     
     args.inputargs = inputargs or sys.argv
+    if getattr(args, 'profile', False):
+        _profile.start(args.profile_path, cprofile = args.profile_cprofile)
     inpaths = getattr(args, 'ifiles', [])
     inpnc = getattr(args, 'pnc', [])
     inopts = len(inpaths + inpnc)
@@ -414,9 +446,17 @@ args : args as parsed
     subargs = split_positionals(subparser, args)
     ifiles = [ifile for ifile in ifiles]
     ipaths = ['unknown'] * len(ifiles)
-    for subarg in subargs:
-        ipaths.extend(subarg.ifiles)
-        ifiles.extend(pncprep(subarg)[0])
+    if njobs(args) > 1 and len(subargs) > 1:
+        for subarg in subargs:
+            ipaths.extend(subarg.ifiles)
+            # groups run in parallel, so files in a group do not
+            subarg.jobs = 1
+        for groupfiles in pmap(_prepgroup, [(subarg,) for subarg in subargs], njobs(args), spill = args.jobs_spill, shared = args.jobs_shared):
+            ifiles.extend(groupfiles)
+    else:
+        for subarg in subargs:
+            ipaths.extend(subarg.ifiles)
+            ifiles.extend(pncprep(subarg)[0])
     
     # ifile is set to results from parsing
     # this includes the standard ifile
@@ -489,7 +529,8 @@ def do_actions(outargs):
         if len(outargs.ifiles) != 1:
             raise IOError('pncgen can output only 1 file; user requested %d' % len(outargs.ifiles))
         ifile, = outargs.ifiles
-        pncgen(ifile, outargs.outpath, outmode = outargs.mode, format = outargs.outformat, verbose = outargs.verbose)
+        from ._storage import getstoragepolicy
+        pncgen(ifile, outargs.outpath, outmode = outargs.mode, format = outargs.outformat, verbose = outargs.verbose, storage = getstoragepolicy(outargs), packunits = outargs.packunits)
     elif outargs.subcommand == 'eval':
         from .pnceval import pnceval
         if len(outargs.ifiles) != 2:
@@ -556,6 +597,8 @@ variables:
     if nfiles > 0 and len(ifiles) != nfiles:
         raise IOError('PNC can only use files or paths, not both at this time')
     do_actions(outargs)
+    if getattr(outargs, 'profile', False):
+        outargs.profile_report = _profile.finish()
     
     return outargs
 
@@ -574,7 +617,7 @@ Returns:
 def split_positionals(parser, args):
     import shlex
     positionals = args.ifiles
-    parser.set_defaults(**dict([(k, v) for k, v in args._get_kwargs() if args.inherit or k == 'format']))
+    parser.set_defaults(**dict([(k, v) for k, v in args._get_kwargs() if args.inherit or k in ('format', 'jobs', 'jobs_spill', 'jobs_shared')]))
     ins = [shlex.split(pnc) for pnc in args.pnc]
     last_split = 0
     for i in range(len(positionals)):
@@ -604,14 +647,28 @@ def split_positionals(parser, args):
 def pncprep(args):
     #nifiles = len(args.ifiles) - has_ofile
     ipaths = args.ifiles[:]
-    fs = getfiles(ipaths, args)
-    fs = subsetfiles(fs, args)
-    fs = seqpncbo(args.operators, fs, coordkeys = args.coordkeys)
-    for expr in args.expressions:
-        fs = [pncexpr(expr, f) for f in fs]
-    for script in args.expressionscripts:
-        expr = open(script).read()
-        fs = [pncexpr(expr, f) for f in fs]
+    plan = PNCPlan.fromargs(args)
+    if njobs(args) > 1 and len(ipaths) > 1:
+        fileargs, stackargs = _splitsubset(args, plan)
+        fs = getfiles(ipaths, args, plan = plan, subsetargs = fileargs)
+        if stackargs is not None:
+            fs = subsetfiles(fs, stackargs)
+    else:
+        fs = getfiles(ipaths, args, plan = plan)
+        fs = subsetfiles(fs, args, plan = plan)
+    with stage('pncbo'):
+        fs = seqpncbo(args.operators, fs, coordkeys = args.coordkeys)
+    with stage('pncexpr'):
+        for expr in args.expressions:
+            fs = [pncexpr(expr, f) for f in fs]
+        for script in args.expressionscripts:
+            expr = open(script).read()
+            fs = [pncexpr(expr, f) for f in fs]
+    if plan is not None:
+        # remove variables that were only read for expressions
+        for f in fs:
+            for k in plan.dropkeys(f):
+                del f.variables[k]
     args.ifiles = fs
     if getattr(args, 'cdlname', None) is None:
         try:
@@ -620,19 +677,72 @@ def pncprep(args):
             args.cdlname = 'unknown'
     return fs, args
 
-def subsetfiles(ifiles, args):
+def _prepgroup(args):
+    """
+    Process one --sep/--pnc group; used by pncparse with --jobs
+    """
+    return pncprep(args)[0]
+
+_subsetkeys = ('slice', 'reduce', 'mesh', 'convolve', 'extract', 'extractfile', 'removesingleton')
+
+def _splitsubset(args, plan):
+    """
+    Split subset options (subsetfiles) into those that --jobs workers
+    apply to each file and those applied after --stack
+
+    Without --stack, workers apply all subset options. With --stack,
+    workers apply slices and reductions on other dimensions, which give
+    the same result before or after stacking.
+
+    Returns (fileargs, stackargs); stackargs is None when nothing is left
+    """
+    from copy import copy
+    fileargs = copy(args)
+    fileargs.slice = args.slice if plan is None else plan.residual_slices
+    if args.stack is None:
+        return fileargs, None
+    stackargs = copy(args)
+    for key in _subsetkeys:
+        setattr(fileargs, key, [])
+    for key in ('slice', 'reduce'):
+        onstack = [opts for opts in getattr(args, key) if args.stack.startswith(opts.split(',')[0])]
+        setattr(fileargs, key, [opts for opts in getattr(args, key) if opts not in onstack])
+        setattr(stackargs, key, onstack)
+    return fileargs, stackargs
+
+def _prepfile(ipath, args, plan = None, subsetargs = None):
+    """
+    Open and prepare one input; used by getfiles (serially or in --jobs
+    workers)
+    """
+    f = _getfile(ipath, args, plan)
+    if subsetargs is not None:
+        f, = subsetfiles([f], subsetargs)
+    return f
+
+def subsetfiles(ifiles, args, plan = None):
+    """
+    Apply slices, reductions, meshing, convolution, extraction and
+    singleton removal; slices already applied by plan are skipped
+    """
+    slices = args.slice if plan is None else plan.residual_slices
     fs = []
     for f in ifiles:
-        for opts in args.slice:
-            f = slice_dim(f, opts)
+        for opts in slices:
+            with stage('slice_dim'):
+                f = slice_dim(f, opts)
         for opts in args.reduce:
-            f = reduce_dim(f, opts, metakeys = args.coordkeys)
+            with stage('reduce_dim'):
+                f = reduce_dim(f, opts, metakeys = args.coordkeys)
         for opts in args.mesh:
-            f = mesh_dim(f, opts)
+            with stage('mesh_dim'):
+                f = mesh_dim(f, opts)
         for opts in args.convolve:
-            f = convolve_dim(f, opts)
+            with stage('convolve_dim'):
+                f = convolve_dim(f, opts)
         if len(args.extract) > 0:
-            f = extract(f, args.extract, method = args.extractmethod)
+            with stage('extract'):
+                f = extract(f, args.extract, method = args.extractmethod)
         if len(args.extractfile) > 0:
             extractfiles = []
             import shlex
@@ -640,63 +750,96 @@ def subsetfiles(ifiles, args):
                 extractfile, options = pncparse(has_ofile = False, args = shlex.split(extractfile))
                 extractfiles.extend(extractfile)
             
-            f = extract_from_file(f, extractfiles, method = args.extractmethod)
+            with stage('extract_from_file'):
+                f = extract_from_file(f, extractfiles, method = args.extractmethod)
         for rd in args.removesingleton:
-            f = removesingleton(f, rd)
+            with stage('removesingleton'):
+                f = removesingleton(f, rd)
         fs.append(f)
     return fs
 
-def getfiles(ipaths, args):
-    fs = []
-    for ipath in ipaths:
-        format_options = args.format.split(',')
-        file_format = format_options.pop(0)
-        format_options = eval('dict(' + ', '.join(format_options) + ')')
-        if isinstance(ipath, (PseudoNetCDFFile, NetCDFFile)):
-            f = ipath
-        elif isinstance(ipath, (str,)) :
-            try:
-                allreaders = getreaderdict()
+def getfiles(ipaths, args, plan = None, subsetargs = None):
+    """
+    Open ipaths with args.format and apply variable selection, masks,
+    conventions, renaming, stacking and merging. When plan is provided,
+    variable selection and slices are pushed into the reader (PNCPlan).
+    When subsetargs is provided, subsetfiles(subsetargs) is applied to
+    each file before stacking or merging.
+
+    With args.jobs > 1, paths are processed in a process pool and files
+    are returned in the order of ipaths.
+    """
+    jobs = njobs(args)
+    if jobs > 1 and len(ipaths) > 1 and all([isinstance(ipath, str) for ipath in ipaths]):
+        fs = pmap(_prepfile, [(ipath, args, plan, subsetargs) for ipath in ipaths], jobs, spill = getattr(args, 'jobs_spill', False), shared = getattr(args, 'jobs_shared', False))
+    else:
+        fs = [_prepfile(ipath, args, plan, subsetargs) for ipath in ipaths]
+    if args.stack is not None:
+        with stage('stack_files'):
+            fs = [stack_files(fs, args.stack, coordkeys = args.coordkeys)]
+    if args.merge:
+        with stage('merge'):
+            fs = [merge(fs)]
+    return fs
+
+def _getfile(ipath, args, plan = None):
+    """
+    Open ipath and apply variable selection, masks, conventions and
+    renaming
+    """
+    format_options = args.format.split(',')
+    file_format = format_options.pop(0)
+    format_options = eval('dict(' + ', '.join(format_options) + ')')
+    if isinstance(ipath, (PseudoNetCDFFile, NetCDFFile)):
+        f = ipath
+    elif isinstance(ipath, (str,)) :
+        profiler = _profile.getprofiler()
+        if profiler is not None:
+            profiler.addinput(ipath)
+        try:
+            allreaders = getreaderdict()
+            with stage('open'):
                 if file_format in allreaders:
                     f = allreaders[file_format](ipath, **format_options)
                 else:
                     f = eval(file_format)(ipath, **format_options)
-            except Exception as e:
-                oute = IOError('Unable to open path with %s(path, **%s)\n\tpath="%s"\n\terror="%s"' % (file_format, str(format_options), ipath, str(e)))
-                raise oute from e
-        else:
-            warn('File is type %s, which is unknown' % type(ipath))
-            f = ipath
-        
-        history = getattr(f, 'history', getattr(f, 'HISTORY', ''))
-        history += ' '.join(args.inputargs) + ';'
-        laddconv = args.fromconv is not None and args.toconv is not None
-        lslice = len(args.slice + args.reduce) > 0
-        lexpr = len(args.expressions) > 0
-        if args.variables is not None:
+        except Exception as e:
+            oute = IOError('Unable to open path with %s(path, **%s)\n\tpath="%s"\n\terror="%s"' % (file_format, str(format_options), ipath, str(e)))
+            raise oute from e
+    else:
+        warn('File is type %s, which is unknown' % type(ipath))
+        f = ipath
+    
+    history = getattr(f, 'history', getattr(f, 'HISTORY', ''))
+    history += ' '.join(args.inputargs) + ';'
+    laddconv = args.fromconv is not None and args.toconv is not None
+    lslice = len(args.slice + args.reduce) > 0
+    lexpr = len(args.expressions) > 0
+    with stage('select'):
+        if plan is not None:
+            f = plan.apply(f)
+            history += plan.history()
+        elif args.variables is not None:
             f = getvarpnc(f, args.variables, coordkeys = args.coordkeys)
         elif laddconv or lslice or lexpr:
             f = getvarpnc(f, None)
-        for opts in args.attribute:
-            add_attr(f, opts)
-        for opts in args.masks:
+    for opts in args.attribute:
+        add_attr(f, opts)
+    for opts in args.masks:
+        with stage('mask_vals'):
             f = mask_vals(f, opts, metakeys = args.coordkeys)
-        if laddconv:
-            try:
-                eval('add_%s_from_%s' % (args.toconv, args.fromconv))(f, coordkeys = args.coordkeys)
-            except Exception as e:
-                warn('Cannot add %s from %s; %s' % (args.toconv, args.fromconv, str(e)))
-        
+    if laddconv:
         try:
-            setattr(f, 'history', history)
-        except: pass
-        if args.mangle:
-            f = manglenames(f)
-        for rename in args.rename:
-            f = pncrename(f, rename)
-        fs.append(f)
-    if args.stack is not None:
-        fs = [stack_files(fs, args.stack, coordkeys = args.coordkeys)]
-    if args.merge:
-        fs = [merge(fs)]
-    return fs
+            with stage('convention'):
+                eval('add_%s_from_%s' % (args.toconv, args.fromconv))(f, coordkeys = args.coordkeys)
+        except Exception as e:
+            warn('Cannot add %s from %s; %s' % (args.toconv, args.fromconv, str(e)))
+    
+    try:
+        setattr(f, 'history', history)
+    except: pass
+    if args.mangle:
+        f = manglenames(f)
+    for rename in args.rename:
+        f = pncrename(f, rename)
+    return f
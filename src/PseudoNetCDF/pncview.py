@@ -5,6 +5,7 @@ __all__ = ['mapplot', 'profile', 'tileplot', 'presslon', 'presslat', 'timeseries
 from warnings import warn
 import os
 from types import MethodType
+from functools import wraps
 import pylab as pl
 
 import numpy as np
@@ -16,8 +17,28 @@ _coastlines_opt = True
 _countries_opt = True
 _states_opt = True
 _counties_opt = False
+_maxcells_opt = 1000
 
 from PseudoNetCDF.coordutil import *
+from PseudoNetCDF._slabs import SlabCache, Prefetcher, pyramid, decimatebounds
+
+# decoded slabs are shared by all plots; neighbouring time steps are read
+# in the background between plots
+_slabcache = SlabCache()
+_prefetcher = Prefetcher(_slabcache)
+
+def _readlocked(func):
+    """
+    Hold the slab cache read lock while func runs; plots read ifile
+    directly (coordinates, times, attributes) and the prefetch thread
+    may be reading the same file
+    """
+    @wraps(func)
+    def locked(*args, **kwds):
+        with _slabcache.readlock:
+            return func(*args, **kwds)
+    return locked
+
 class OptionDict(dict):
     def __init__(self, *args, **kwds):
         """
@@ -25,12 +46,14 @@ class OptionDict(dict):
         countries = %(_countries_opt)s
         states = %(_states_opt)s
         counties = %(_counties_opt)s
+        timestep = time step to plot (None for all times)
+        maxcells = cells per axis above which grids are drawn from block means (%(_maxcells_opt)s)
         pre_txt = Code to run before any plots (%(_pre_code)s)
         before_txt = Code to run before each variable-plot (%(_before_code)s)
         after_txt = Code to run after each plot (%(_after_code)s)
         post_txt = Code to run after all plots (%(_post_code)s)
         """ % globals()
-        dict.__init__(self, coastlines = _coastlines_opt, countries = _countries_opt, states = _states_opt, counties = _counties_opt, pre_txt = _pre_code, before_txt = _before_code, after_txt = _after_code, post_txt = _post_code)
+        dict.__init__(self, coastlines = _coastlines_opt, countries = _countries_opt, states = _states_opt, counties = _counties_opt, timestep = None, maxcells = _maxcells_opt, pre_txt = _pre_code, before_txt = _before_code, after_txt = _after_code, post_txt = _post_code)
         dict.__init__(self, *args, **kwds)
         if 'outpath' not in self:
             raise KeyError('outpath is a required option')
@@ -168,6 +191,19 @@ class TkApp:
         help.grid(column = 0, row = 7)
         quit = Button(goframe, text = 'Quit', command = self.quit)
         quit.grid(column = 0, row = 8)
+
+        # browsing time steps reads one slab per figure; the next and
+        # previous steps are read in the background
+        self.timestep_txt = StringVar()
+        self.timestep_txt.set('')
+        timestep_label = Label(goframe, text = 'Time step (blank for all):')
+        timestep_label.grid(column = 0, row = 9, sticky = 'W')
+        self.timestep = Entry(goframe, width = 6, textvariable = self.timestep_txt)
+        self.timestep.grid(column = 0, row = 10, sticky = 'W')
+        prev_step = Button(goframe, text = '< Prev', command = lambda: self.step(-1))
+        prev_step.grid(column = 0, row = 11, sticky = 'W')
+        next_step = Button(goframe, text = 'Next >', command = lambda: self.step(1))
+        next_step.grid(column = 0, row = 12, sticky = 'W')
         master.mainloop()
    
     def help(self):
@@ -176,6 +212,11 @@ class TkApp:
     def quit(self):
         self.root.destroy()
 
+    def step(self, delta):
+        timestep = self.timestep_txt.get().strip()
+        self.timestep_txt.set(str(max(0, int(timestep or 0) + delta)))
+        self.execute()
+
     def _get_var(self, list):
         items = list.curselection()
         try: items = map(int, items)
@@ -202,12 +243,15 @@ class TkApp:
         self.options.countries = bool(self.countries.get())
         self.options.states = bool(self.states.get())
         self.options.counties = bool(self.counties.get())
+        timestep = self.timestep_txt.get().strip()
+        self.options.timestep = int(timestep) if timestep != '' else None
         self.options.pre_txt = self.pre_txt.get()
         self.options.before_txt = self.before_txt.get()
         self.options.after_txt = self.after_txt.get()
         self.options.post_txt = self.post_txt.get()
         plotwithopts(self.ncffile, methods, vars, self.options)
 
+@_readlocked
 def plotwithopts(ifile, method, vars, options = defaultoption):
     from PseudoNetCDF.sci_var import getvarpnc
     from PseudoNetCDF.pncgen import pncgen
@@ -226,20 +270,10 @@ def pncview(ifile, options):
 
 def gettime(ifile):
     from PseudoNetCDF import PseudoNetCDFVariable
-    from pylab import date2num
-    from datetime import datetime
-    if 'time' in ifile.variables:
-        time = ifile.variables['time']
-        unit = time.units
-        tunit, datestr = unit.split(' since ')
-        sdate = datetime.strptime(datestr.replace(' UTC', ''), '%Y-%m-%d %H:%M:%S')
-        time = np.array([sdate + timedelta(**{tunit: t}) for t in time[:]])
-        unit = 'time'
-    elif 'TFLAG' in ifile.variables:
-        x = ifile.variables['TFLAG'][:].copy()
-        for axi in range(1, x.ndim - 1):
-            x = x[:, 0]
-        time = np.array([(datetime.strptime('%07d %06d' % (d, t), '%Y%j %H%M%S')) for d, t in x])
+    from PseudoNetCDF._timebin import gettimes64
+    if 'time' in ifile.variables or 'TFLAG' in ifile.variables:
+        # datetime64 arithmetic instead of a datetime per time step
+        time = gettimes64(ifile).astype('datetime64[us]').astype(object)
         unit = 'time'
     elif 'time' in ifile.dimensions:
         time = np.arange(len(ifile.dimensions['time']))
@@ -250,13 +284,65 @@ def gettime(ifile):
     else:
         raise KeyError('No time found')
     return PseudoNetCDFVariable(None, 'time', 'f', ('time',), values = time[:], units = unit)
-    
+
+def _timestep(options):
+    timestep = getattr(options, 'timestep', None)
+    return None if timestep is False else timestep
+
+def _slabitem(var, timestep):
+    """
+    Index of time step timestep of var (Ellipsis when var has no time
+    dimension or timestep is None) and the neighbouring time steps
+    """
+    dims = list(var.dimensions)
+    for tdim in ('time', 'TSTEP', 'Time', 'tstep'):
+        if tdim in dims:
+            break
+    else:
+        return Ellipsis, []
+    if timestep is None:
+        return Ellipsis, []
+    tidx = dims.index(tdim)
+    ntimes = var.shape[tidx]
+    titem = lambda t: (slice(None),) * tidx + (slice(t, t + 1),)
+    timestep = max(0, min(timestep, ntimes - 1))
+    return titem(timestep), [titem(t) for t in (timestep + 1, timestep - 1) if 0 <= t < ntimes]
+
+def getslab(ifile, varkey, options = defaultoption, bytime = True):
+    """
+    Values of varkey read once through the slab cache; with bytime and
+    options.timestep, only that time step is read and the next and
+    previous time steps are read in the background
+    """
+    var = ifile.variables[varkey]
+    item, neighbours = _slabitem(var, _timestep(options) if bytime else None)
+    vals = _slabcache.get(ifile, varkey, item)
+    if len(neighbours) > 0:
+        _prefetcher.prefetch(ifile, [(varkey, n) for n in neighbours])
+    return vals
+
+def getoverview(ifile, varkey, options = defaultoption):
+    """
+    (values, factor) of the 2-D slab of varkey; grids with more than
+    options.maxcells cells along an axis are reduced to the mean of
+    factor x factor blocks (factor is 1 otherwise)
+    """
+    vals = getslab(ifile, varkey, options).squeeze()
+    maxcells = getattr(options, 'maxcells', None) or _maxcells_opt
+    if vals.ndim != 2 or max(vals.shape) <= maxcells:
+        return vals, 1
+    item, neighbours = _slabitem(ifile.variables[varkey], _timestep(options))
+    levels = _slabcache.derived(ifile, varkey, item, 'pyramid%d' % maxcells, lambda slab: pyramid(slab.squeeze(), maxcells))
+    return levels[-1]['mean'], levels[-1]['factor']
+
+@_readlocked
 def timeseries(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     outpath = getattr(options, 'outpath', '.')
     time = gettime(ifile)
     var = ifile.variables[varkey]
-    dims = [(k, l) for l, k in zip(var[:].shape, var.dimensions) if l > 1]
+    vals = getslab(ifile, varkey, options, bytime = False)
+    dims = [(k, l) for l, k in zip(vals.shape, var.dimensions) if l > 1]
     if len(dims) > 1:
         raise ValueError('Time series can have 1 non-unity dimensions; got %d - %s' % (len(dims), str(dims)))
     exec(before)
@@ -265,7 +351,7 @@ def timeseries(ifile, varkey, options, before = '', after = ''):
     if options.logscale:
         ax.set_yscale('log')
         
-    ax.plot_date(time[:].squeeze(), var[:].squeeze())
+    ax.plot_date(time[:].squeeze(), vals.squeeze())
     ax.set_xlabel(time.units.strip())
     ax.set_ylabel(getattr(var, 'standard_name', varkey).strip() + ' ' + var.units.strip())
     fmt = 'png'
@@ -275,11 +361,13 @@ def timeseries(ifile, varkey, options, before = '', after = ''):
     print('Saved fig', figpath)
     return figpath
 
+@_readlocked
 def plot(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     outpath = getattr(options, 'outpath', '.')
     var = ifile.variables[varkey]
-    dims = [(k, l) for l, k in zip(var[:].shape, var.dimensions) if l > 1]
+    vals = getslab(ifile, varkey, options, bytime = False)
+    dims = [(k, l) for l, k in zip(vals.shape, var.dimensions) if l > 1]
     if len(dims) > 1:
         raise ValueError('Plots can have only 1 non-unity dimensions; got %d - %s' % (len(dims), str(dims)))
     exec(before)
@@ -288,7 +376,7 @@ def plot(ifile, varkey, options, before = '', after = ''):
     if options.logscale:
         ax.set_yscale('log')
         
-    ax.plot(var[:].squeeze())
+    ax.plot(vals.squeeze())
     ax.set_xlabel('unknown')
     ax.set_ylabel(getattr(var, 'standard_name', varkey).strip() + ' ' + var.units.strip())
     fmt = 'png'
@@ -298,13 +386,15 @@ def plot(ifile, varkey, options, before = '', after = ''):
     print('Saved fig', figpath)
     return figpath
 
+@_readlocked
 def pressx(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     from matplotlib.colors import Normalize, LogNorm
     outpath = getattr(options, 'outpath', '.')
     vert = getpresbnds(ifile)
     var = ifile.variables[varkey]
-    dims = [(k, l) for l, k in zip(var[:].shape, var.dimensions) if l > 1]
+    vals = getslab(ifile, varkey, options)
+    dims = [(k, l) for l, k in zip(vals.shape, var.dimensions) if l > 1]
     if len(dims) > 2:
         raise ValueError('Press-x can have 2 non-unity dimensions; got %d - %s' % (len(dims), str(dims)))
     if options.logscale:
@@ -314,7 +404,7 @@ def pressx(ifile, varkey, options, before = '', after = ''):
     exec(before)
     ax = pl.gca()
     print(varkey, end = '')
-    vals = var[:].squeeze()
+    vals = vals.squeeze()
     x = np.arange(vals.shape[1])
     patches = ax.pcolor(x, vert, vals, norm = norm)
     #ax.set_xlabel(X.units.strip())
@@ -329,6 +419,7 @@ def pressx(ifile, varkey, options, before = '', after = ''):
     print('Saved fig', figpath)
     return figpath
 
+@_readlocked
 def presslat(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     from matplotlib.colors import Normalize, LogNorm
@@ -337,7 +428,8 @@ def presslat(ifile, varkey, options, before = '', after = ''):
     lat, latunit = getlatbnds(ifile)
     lat = np.append(lat.squeeze()[..., :2].mean(1), lat.squeeze()[-1, 2:].mean(0))
     var = ifile.variables[varkey]
-    dims = [(k, l) for l, k in zip(var[:].shape, var.dimensions) if l > 1]
+    vals = getslab(ifile, varkey, options)
+    dims = [(k, l) for l, k in zip(vals.shape, var.dimensions) if l > 1]
     if len(dims) > 2:
         raise ValueError('Press-lat can have 2 non-unity dimensions; got %d - %s' % (len(dims), str(dims)))
     if options.logscale:
@@ -347,14 +439,14 @@ def presslat(ifile, varkey, options, before = '', after = ''):
     exec(before)
     ax = pl.gca()
     print(varkey, end = '')
-    patches = ax.pcolor(lat, vert, var[:].squeeze(), norm = norm)
+    patches = ax.pcolor(lat, vert, vals.squeeze(), norm = norm)
     #ax.set_xlabel(X.units.strip())
     #ax.set_ylabel(Y.units.strip())
     cbar = pl.colorbar(patches)
     vunit = getattr(var, 'units', 'unknown').strip()
     cbar.set_label(varkey + ' (' + vunit + ')')
-    cbar.ax.text(.5, 1, '%.2g' % var[:].max(), horizontalalignment = 'center', verticalalignment = 'bottom')
-    cbar.ax.text(.5, 0, '%.2g' % var[:].min(), horizontalalignment = 'center', verticalalignment = 'top')
+    cbar.ax.text(.5, 1, '%.2g' % vals.max(), horizontalalignment = 'center', verticalalignment = 'bottom')
+    cbar.ax.text(.5, 0, '%.2g' % vals.min(), horizontalalignment = 'center', verticalalignment = 'top')
     ax.set_ylim(vert.max(), vert.min())
     ax.set_xlim(lat.min(), lat.max())
     fmt = 'png'
@@ -364,6 +456,7 @@ def presslat(ifile, varkey, options, before = '', after = ''):
     print('Saved fig', figpath)
     return figpath
 
+@_readlocked
 def presslon(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     from matplotlib.colors import Normalize, LogNorm
@@ -372,7 +465,8 @@ def presslon(ifile, varkey, options, before = '', after = ''):
     lon, lonunit = getlonbnds(ifile)
     lon = np.append(lon.squeeze()[..., [0, 3]].mean(1), lon.squeeze()[-1, [1, 2]].mean(0))
     var = ifile.variables[varkey]
-    dims = [(k, l) for l, k in zip(var[:].shape, var.dimensions) if l > 1]
+    vals = getslab(ifile, varkey, options)
+    dims = [(k, l) for l, k in zip(vals.shape, var.dimensions) if l > 1]
     if len(dims) > 2:
         raise ValueError('Press-lon plots can have 2 non-unity dimensions; got %d - %s' % (len(dims), str(dims)))
     if options.logscale:
@@ -382,14 +476,14 @@ def presslon(ifile, varkey, options, before = '', after = ''):
     exec(before)
     ax = pl.gca()
     print(varkey, end = '')
-    patches = ax.pcolor(lon, vert, var[:].squeeze(), norm = norm)
+    patches = ax.pcolor(lon, vert, vals.squeeze(), norm = norm)
     #ax.set_xlabel(X.units.strip())
     #ax.set_ylabel(Y.units.strip())
     cbar = pl.colorbar(patches)
     vunit = getattr(var, 'units', 'unknown').strip()
     cbar.set_label(varkey + ' (' + vunit + ')')
-    cbar.ax.text(.5, 1, '%.2g' % var[:].max(), horizontalalignment = 'center', verticalalignment = 'bottom')
-    cbar.ax.text(.5, 0, '%.2g' % var[:].min(), horizontalalignment = 'center', verticalalignment = 'top')
+    cbar.ax.text(.5, 1, '%.2g' % vals.max(), horizontalalignment = 'center', verticalalignment = 'bottom')
+    cbar.ax.text(.5, 0, '%.2g' % vals.min(), horizontalalignment = 'center', verticalalignment = 'top')
 
     ax.set_ylim(vert.max(), vert.min())
     ax.set_xlim(lon.min(), lon.max())
@@ -400,11 +494,13 @@ def presslon(ifile, varkey, options, before = '', after = ''):
     print('Saved fig', figpath)
     return figpath
 
+@_readlocked
 def tileplot(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     from matplotlib.colors import Normalize, LogNorm
     outpath = getattr(options, 'outpath', '.')
     var = ifile.variables[varkey]
+    vals = getslab(ifile, varkey, options)
     if options.logscale:
         norm = LogNorm()
     else:
@@ -412,12 +508,17 @@ def tileplot(ifile, varkey, options, before = '', after = ''):
     exec(before)
     ax = pl.gca()
     print(varkey, end = '')
-    dims = [(k, l) for l, k in zip(var[:].shape, var.dimensions) if l > 1]
+    dims = [(k, l) for l, k in zip(vals.shape, var.dimensions) if l > 1]
     if len(dims) > 2:
         raise ValueError('Tile plots can have 2 non-unity dimensions; got %d - %s' % (len(dims), str(dims)))
-    patches = ax.pcolor(var[:].squeeze(), norm = norm)
-    ax.set_xlim(0, var[:].squeeze().shape[1])
-    ax.set_ylim(0, var[:].squeeze().shape[0])
+    # large grids are drawn from block means at about screen resolution
+    plotvals, factor = getoverview(ifile, varkey, options)
+    ny, nx = vals.squeeze().shape
+    x = decimatebounds(np.arange(nx + 1), factor)
+    y = decimatebounds(np.arange(ny + 1), factor)
+    patches = ax.pcolor(x, y, plotvals, norm = norm)
+    ax.set_xlim(0, nx)
+    ax.set_ylim(0, ny)
     ax.set_xlabel(dims[1][0])
     ax.set_ylabel(dims[0][0])
     #ax.set_xlabel(X.units.strip())
@@ -425,8 +526,8 @@ def tileplot(ifile, varkey, options, before = '', after = ''):
     cbar = pl.colorbar(patches)
     vunit = getattr(var, 'units', 'unknown').strip()
     cbar.set_label(varkey + ' (' + vunit + ')')
-    cbar.ax.text(.5, 1, '%.2g' % var[:].max(), horizontalalignment = 'center', verticalalignment = 'bottom')
-    cbar.ax.text(.5, 0, '%.2g' % var[:].min(), horizontalalignment = 'center', verticalalignment = 'top')
+    cbar.ax.text(.5, 1, '%.2g' % vals.max(), horizontalalignment = 'center', verticalalignment = 'bottom')
+    cbar.ax.text(.5, 0, '%.2g' % vals.min(), horizontalalignment = 'center', verticalalignment = 'top')
     fmt = 'png'
     figpath = os.path.join(outpath + '_2D_' + varkey + '.' + fmt)
     exec(after)
@@ -459,6 +560,7 @@ def minmaxmean(ax, vals, vertcrd, **kwds):
     range, = ax.fill(x, y, **fillkwds)
     return line, range
 
+@_readlocked
 def profile(ifile, varkey, options, before = '', after = ''):
     import pylab as pl
     print(varkey, end = '')
@@ -470,6 +572,7 @@ def profile(ifile, varkey, options, before = '', after = ''):
         vert = getsigmamid(ifile)
         vunit = r'\sigma'
     var = ifile.variables[varkey]
+    vals = getslab(ifile, varkey, options)
     
     dims = list(var.dimensions)
     for knownvert in ['layer', 'LAY'] + ['layer%d' % i for i in range(72)]:
@@ -478,9 +581,9 @@ def profile(ifile, varkey, options, before = '', after = ''):
             break
     else:
         raise KeyError("No known vertical coordinate; got %s" % str(dims))
-    vert = vert[:var[:].shape[vidx]]
+    vert = vert[:vals.shape[vidx]]
     units = var.units.strip()
-    vals = np.rollaxis(var[:], vidx, start = 0).view(np.ma.MaskedArray).reshape(vert.size, -1)
+    vals = np.rollaxis(vals, vidx, start = 0).view(np.ma.MaskedArray).reshape(vert.size, -1)
     ax = pl.gca()
     minmaxmean(ax, vals, vert)
     ax.set_xlabel(varkey + ' ('+units+')')
@@ -494,6 +597,7 @@ def profile(ifile, varkey, options, before = '', after = ''):
     print('Saved fig', figpath)
     return figpath
     
+@_readlocked
 def mapplot(ifile, varkey, options, before = '', after = ''):
     """
     ifile - a pseudonetcdf file
@@ -521,6 +625,7 @@ def mapplot(ifile, varkey, options, before = '', after = ''):
     else:
         norm = Normalize()
     var = ifile.variables[varkey]
+    vals = getslab(ifile, varkey, options)
     exec(before)
     ax = pl.gca()
     vunit = getattr(var, 'units', 'unknown').strip()
@@ -533,7 +638,11 @@ def mapplot(ifile, varkey, options, before = '', after = ''):
     except:
         print('nomap')
         pass
-    patches = map.pcolor(LON, LAT, var[:].squeeze(), norm = norm, ax = ax)
+    plotvals, factor = getoverview(ifile, varkey, options)
+    if factor > 1:
+        LON = decimatebounds(LON, factor)
+        LAT = decimatebounds(LAT, factor)
+    patches = map.pcolor(LON, LAT, plotvals, norm = norm, ax = ax)
     if lonunit == 'x (LCC m)':
         ax.xaxis.get_major_formatter().set_scientific(True)
         ax.xaxis.get_major_formatter().set_powerlimits((-3, 3))
@@ -551,11 +660,11 @@ def mapplot(ifile, varkey, options, before = '', after = ''):
     cbar = pl.gcf().colorbar(patches, orientation = orientation)
     cbar.set_label(varkey + ' (' + vunit + ')')
     if orientation == 'vertical':
-        cbar.ax.text(.5, 1, '%.2g' % var[:].max(), horizontalalignment = 'center', verticalalignment = 'bottom')
-        cbar.ax.text(.5, 0, '%.2g' % var[:].min(), horizontalalignment = 'center', verticalalignment = 'top')
+        cbar.ax.text(.5, 1, '%.2g' % vals.max(), horizontalalignment = 'center', verticalalignment = 'bottom')
+        cbar.ax.text(.5, 0, '%.2g' % vals.min(), horizontalalignment = 'center', verticalalignment = 'top')
     else:
-        cbar.ax.text(1, .5, '%.2g' % var[:].max(), verticalalignment = 'center', horizontalalignment = 'left')
-        cbar.ax.text(0, .5, '%.2g' % var[:].min(), verticalalignment = 'center', horizontalalignment = 'right')
+        cbar.ax.text(1, .5, '%.2g' % vals.max(), verticalalignment = 'center', horizontalalignment = 'left')
+        cbar.ax.text(0, .5, '%.2g' % vals.min(), verticalalignment = 'center', horizontalalignment = 'right')
     try:
         cbar.formatter.set_scientific(True)
         cbar.formatter.set_powerlimits((-3, 3))
@@ -6,6 +6,45 @@ def addTestCasesFromModule(module):
 from . import sci_var
 addTestCasesFromModule(sci_var)
 
+from . import core
+addTestCasesFromModule(core._lazy)
+addTestCasesFromModule(core._plan)
+addTestCasesFromModule(core._interp)
+addTestCasesFromModule(core._sitemap)
+
+from . import _storage
+addTestCasesFromModule(_storage)
+
+from . import _parallel
+addTestCasesFromModule(_parallel)
+
+from . import _profile
+addTestCasesFromModule(_profile)
+
+from . import _xarray
+addTestCasesFromModule(_xarray)
+
+from . import _timebin
+addTestCasesFromModule(_timebin)
+
+from . import _sketch
+addTestCasesFromModule(_sketch)
+from . import _slabs
+addTestCasesFromModule(_slabs)
+from . import userfuncs
+addTestCasesFromModule(userfuncs)
+from . import units
+addTestCasesFromModule(units)
+from . import MetaNetCDF
+addTestCasesFromModule(MetaNetCDF)
+
+from . import pnccatalog
+addTestCasesFromModule(pnccatalog)
+
+from .benchmarks import _synthetic as benchmarks_synthetic, _suite as benchmarks_suite
+addTestCasesFromModule(benchmarks_synthetic)
+addTestCasesFromModule(benchmarks_suite)
+
 from . import ArrayTransforms
 addTestCasesFromModule(ArrayTransforms)
 
@@ -21,6 +60,7 @@ addTestCasesFromModule(camxfiles.cloud_rain.Memmap)
 addTestCasesFromModule(camxfiles.uamiv.Memmap)
 addTestCasesFromModule(camxfiles.uamiv.Write)
 addTestCasesFromModule(camxfiles.point_source.Memmap)
+addTestCasesFromModule(camxfiles.point_source.Transforms)
 addTestCasesFromModule(camxfiles.lateral_boundary.Memmap)
 addTestCasesFromModule(camxfiles.ipr.Memmap)
 addTestCasesFromModule(camxfiles.irr.Memmap)
@@ -34,13 +74,22 @@ from . import geoschemfiles
 addTestCasesFromModule(geoschemfiles._bpch)
 addTestCasesFromModule(geoschemfiles._newbpch)
 addTestCasesFromModule(geoschemfiles._geos)
+addTestCasesFromModule(geoschemfiles._planelog)
+
+from .conventions.ioapi import _gridcache as conventions_gridcache
+addTestCasesFromModule(conventions_gridcache)
 
 from . import textfiles
+from .textfiles import _table as textfiles_table
 addTestCasesFromModule(textfiles._delimited)
+addTestCasesFromModule(textfiles_table)
 
 from . import icarttfiles
 addTestCasesFromModule(icarttfiles.ffi1001)
 
+from . import noaafiles
+addTestCasesFromModule(noaafiles._arl)
+
 def test():
 	TextTestRunner(verbosity=2).run(test_suite)
 
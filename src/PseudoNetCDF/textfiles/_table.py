@@ -0,0 +1,79 @@
+from __future__ import print_function
+__all__ = ['readtable', 'readfixed', 'tablecolumns']
+__doc__ = """
+Numeric text table parsing for text readers
+
+Readers read the whole file once, handle their header lines and pass
+the numeric body here; the body is parsed in one numpy pass instead of
+a float or eval call per value.
+
+    readtable - whitespace or delimiter separated rows
+    readfixed - fixed-width fields with no separators
+    tablecolumns - ordered dictionary of column arrays by name
+"""
+import unittest
+from collections import OrderedDict
+import numpy as np
+
+def _astext(body):
+    if isinstance(body, bytes):
+        return body.decode('ascii', 'replace')
+    return body
+
+def readtable(body, ncols = None, sep = None, dtype = 'd'):
+    """
+    Parse a numeric table body (str or bytes) with whitespace (sep None)
+    or sep between values and return an array (nrows, ncols)
+
+    ncols - values per row (default: count the first row)
+    """
+    text = _astext(body)
+    if ncols is None:
+        firstrow = text.lstrip('\r\n').split('\n', 1)[0]
+        ncols = len(firstrow.split(sep))
+    if sep is not None:
+        text = text.replace(sep, ' ')
+    # sep = ' ' matches any whitespace, including new lines
+    data = np.fromstring(text, dtype = dtype, sep = ' ')
+    if data.size % ncols != 0:
+        raise ValueError('Table has %d values, which is not a multiple of %d columns' % (data.size, ncols))
+    return data.reshape(-1, ncols)
+
+def readfixed(body, width, dtype = 'f'):
+    """
+    Parse back-to-back fixed-width numeric fields (e.g., b'  1 23456' with
+    width 3) from body (str or bytes) and return a 1-D array
+    """
+    if not isinstance(body, bytes):
+        body = body.encode('ascii')
+    nfields = len(body) // width
+    fields = np.frombuffer(body[:nfields * width], dtype = 'S%d' % width)
+    return fields.astype(dtype)
+
+def tablecolumns(data, names):
+    """
+    OrderedDict of names to columns of data (nrows, ncols); extra columns
+    are ignored
+    """
+    return OrderedDict([(name, data[:, i]) for i, name in enumerate(names)])
+
+class TestTable(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def testReadTable(self):
+        data = readtable('1 2.5  3\n4 5 -6e1\n\n')
+        np.testing.assert_equal(data, [[1, 2.5, 3], [4, 5, -60]])
+        data = readtable(b'1, 2,3\n4,5, 6\n', sep = ',')
+        np.testing.assert_equal(data, [[1, 2, 3], [4, 5, 6]])
+        self.assertRaises(ValueError, readtable, '1 2 3\n4 5\n')
+        cols = tablecolumns(data, ['a', 'b'])
+        self.assertEqual(list(cols.keys()), ['a', 'b'])
+        np.testing.assert_equal(cols['b'], [2, 5])
+
+    def testReadFixed(self):
+        np.testing.assert_equal(readfixed(b'  1 23456789', 3), [1, 23, 456, 789])
+        np.testing.assert_equal(readfixed('12 3', 2), [12, 3])
+
+if __name__ == '__main__':
+    unittest.main()
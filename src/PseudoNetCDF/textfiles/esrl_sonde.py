@@ -46,20 +46,21 @@ Oltmans solution correction = Yes
       
 
 from PseudoNetCDF import PseudoNetCDFFile
+from ._table import readtable
 import re
 import numpy as np
 spaces = re.compile(r',\s{0,1000}')
 def skysonde1sec(inpath):
     datafile = open(inpath, 'r')
-    datalines = datafile.read().split('\n')
-    nmeta = int(datalines[1].split(' = ')[1])
+    text = datafile.read()
+    nmeta = int(text.split('\n', 2)[1].split(' = ')[1])
+    # header lines and the data block
+    datalines = text.split('\n', nmeta)
     meta = dict([[w.strip() for w in l.split(' = ')] for l in datalines[1:nmeta-2] if l != ''])
     varline, unitline = datalines[nmeta-2:nmeta]
     varnames = [vn.strip() for vn in spaces.split(varline)]
     units = [u.strip()[1:-1].strip() for u in spaces.split(unitline)]
-    print(units)
-    import pdb; pdb.set_trace()
-    data = np.fromstring(', '.join(datalines[nmeta:]), sep = ',').reshape(-1, len(varnames))
+    data = readtable(datalines[nmeta], len(varnames), sep = ',')
     outf = PseudoNetCDFFile()
     outf.createDimension('time', data.shape[0])
     for varname, unit, vals in zip(varnames, units, data.T):
@@ -3,7 +3,8 @@ __all__ = ['cdtoms']
 
 
 from PseudoNetCDF import PseudoNetCDFFile
-from re import compile
+from PseudoNetCDF.textfiles._table import readfixed
+from re import compile, sub
 from numpy import array, arange
 from datetime import datetime
 dayre = compile(' Day:\s+(?P<jday>\d+) (?P<daystring>.{12})\s+EP/TOMS CORRECTED OZONE GEN:\d+\.\d+\sV\d ALECT:\s+\d+:\d+ [AP]M ')
@@ -13,7 +14,9 @@ latre = compile(' Latitudes\s:\s+(?P<latbins>\d+)\s+bins centered on\s+(?P<blat>
 
 def cdtoms(path):
     outfile = PseudoNetCDFFile()
-    inlines = open(path, 'rU').readlines()
+    inlines = open(path, 'rb').read().replace(b'\r\n', b'\n').split(b'\n', 3)
+    body = inlines.pop(-1)
+    inlines = [l.decode() for l in inlines]
     dayline = dayre.match(inlines[0]).groupdict()
     date = datetime.strptime(dayline['daystring'], '%b %d, %Y')
     lonline = lonre.match(inlines[1]).groupdict()
@@ -38,23 +41,14 @@ def cdtoms(path):
 
     outfile.createDimension('LAT', outfile.latbins)
     outfile.createDimension('LON', outfile.lonbins)
-    datalines = inlines[3:]
-    lats = []
-    for i, line in enumerate(datalines):
-        if 'lat' not in line:
-            datalines[i] = line[1:-1]
-        else:
-            data, lat = line.split('lat =')
-            datalines[i] = data[1:-1].rstrip() + '\n'
-            lats.append(lat.strip())
-    
-    n = 3
-    
-    datalines = ''.join(datalines).split('\n')
+    # each line starts with a space and holds 3 character values; the
+    # last line of each latitude ends with lat = value
+    body = sub(br'\s*lat =\s*\S+[ \t]*', b'', body)
+    body = sub(br'\n.', b'', b'\n' + body).strip(b'\n')
     var = outfile.createVariable('ozone', 'f', ('LAT', 'LON'))
     var.units = 'matm-cm'
     var.long_name = var.var_desc = 'ozone'.ljust(16)
-    var[:] = array([[eval(s[n*i:n*i+n]) for i in range(len(s)/n)] for s in datalines if s.strip() != ''], 'f')
+    var[:] = readfixed(body, 3).reshape(outfile.latbins, outfile.lonbins)
 
     var = outfile.createVariable('lat', 'f', ('LAT',))
     var.units = 'degrees N'
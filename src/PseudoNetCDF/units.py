@@ -9,8 +9,7 @@ __doc__ = r"""
 .. moduleauthor:: Barron Henderson <barronh@unc.edu>
 """
 
-__all__ = ['F2C', 'F2K', 'K2C', 'K2F', 'KCMAQ2F', 'M2km', 'MPS2kph', 'convert', 'converter', 'converters_dict', 'km2m', 'm2ft', 'm2km', 'm2miles', 'min2h', 'molespsCMAQ2molesph', 'mps2kmps', 'mps2kph', 'mps2milesph', 'mps2milesps', 's2h', 's2min']
-
+__all__ = ['Affine', 'F2C', 'F2K', 'K2C', 'K2F', 'KCMAQ2F', 'M2km', 'MPS2kph', 'affine', 'convert', 'converter', 'converters_dict', 'km2m', 'm2ft', 'm2km', 'm2miles', 'min2h', 'molespsCMAQ2molesph', 'mps2kmps', 'mps2kph', 'mps2milesph', 'mps2milesps', 's2h', 's2min']
 
 HeadURL="$HeadURL$"
 ChangeDate = "$LastChangedDate$"
@@ -18,33 +17,76 @@ RevisionNum= "$LastChangedRevision$"
 ChangedBy  = "$LastChangedBy$"
 __version__ = RevisionNum
 
+import unittest
 from collections import defaultdict
 
-s2min=lambda a: a/60.
-min2h=lambda a: a/60.
-s2h=lambda a: min2h(s2min(a))
-m2km=lambda a: a*.001
-M2km=lambda a: a*.001
-km2m=lambda a: a*1000.
-m2ft=lambda a: a*3.2808399
-m2miles=lambda a: a*0.000621371192
-K2C=lambda a: a-273.2
-K2F=lambda a: K2C(a)*9/5.+32
-KCMAQ2F=lambda a: K2C(a)*9/5.+32
-F2C=lambda a: (a-32.)*5/9.
-F2K=lambda a: F2C(a)+273.2
-mps2kph=lambda a: a*3.6
-MPS2kph=lambda a: a*3.6
-mps2kmps=lambda a: a*.001
-mps2milesph=lambda a: a*2.23693629
-mps2milesps=lambda a: a*0.000621371192
-molespsCMAQ2molesph=lambda a: a*60*60
-ppm2ppb = lambda a: a * 1000.
-ppb2ppt = lambda a: a * 1000.
-ppt2ppb = lambda a: a / 1000.
-ppb2ppm = lambda a: a / 1000.
-ppm2ppt = lambda a: ppm2ppb(ppb2ppt(a))
-ppt2ppm = lambda a: ppt2ppb(ppb2ppm(a))
+class Affine(object):
+    """
+    Unit conversion a * scale + offset; conversions compose without
+    touching data (K2F = K2C.then(C2F)), so a chain of conversions is
+    applied to an array once
+    """
+    def __init__(self, scale = 1., offset = 0.):
+        self.scale = scale
+        self.offset = offset
+
+    def then(self, other):
+        """
+        Affine equivalent to other(self(a))
+        """
+        return Affine(self.scale * other.scale, self.offset * other.scale + other.offset)
+
+    def inverse(self):
+        return Affine(1. / self.scale, -self.offset / self.scale)
+
+    def isidentity(self):
+        return self.scale == 1 and self.offset == 0
+
+    def __call__(self, a):
+        if self.isidentity():
+            return a
+        out = a * self.scale
+        if self.offset != 0:
+            out = out + self.offset
+        return out
+
+    def __eq__(self, other):
+        return isinstance(other, Affine) and (self.scale, self.offset) == (other.scale, other.offset)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.scale, self.offset))
+
+    def __repr__(self):
+        return 'Affine(%r, %r)' % (self.scale, self.offset)
+
+s2min = Affine(1 / 60.)
+min2h = Affine(1 / 60.)
+s2h = s2min.then(min2h)
+m2km = Affine(.001)
+M2km = Affine(.001)
+km2m = Affine(1000.)
+m2ft = Affine(3.2808399)
+m2miles = Affine(0.000621371192)
+K2C = Affine(1., -273.2)
+K2F = K2C.then(Affine(9 / 5., 32.))
+KCMAQ2F = K2F
+F2C = Affine(1., -32.).then(Affine(5 / 9.))
+F2K = F2C.then(Affine(1., 273.2))
+mps2kph = Affine(3.6)
+MPS2kph = Affine(3.6)
+mps2kmps = Affine(.001)
+mps2milesph = Affine(2.23693629)
+mps2milesps = Affine(0.000621371192)
+molespsCMAQ2molesph = Affine(60. * 60.)
+ppm2ppb = Affine(1000.)
+ppb2ppt = Affine(1000.)
+ppt2ppb = Affine(1 / 1000.)
+ppb2ppm = Affine(1 / 1000.)
+ppm2ppt = ppm2ppb.then(ppb2ppt)
+ppt2ppm = ppt2ppb.then(ppb2ppm)
 
 class converters_dict(defaultdict):
     def __init__(self,dct):
@@ -52,7 +94,12 @@ class converters_dict(defaultdict):
             self[k]=v
     def __missing__(self,key):
         if type(key)==tuple and key[0]==key[1]:
-            return lambda a: a
+            return Affine()
+        if type(key)==tuple:
+            # IOAPI units are padded to 16 characters
+            stripped = tuple([k.strip() for k in key])
+            if stripped != key and (stripped in self or stripped[0] == stripped[1]):
+                return self[stripped]
             
 converter=converters_dict({('s','min'): s2min, \
                            ('min','h'): min2h, \
@@ -88,3 +135,30 @@ def convert(var, inunit, outunit):
     both units must be in converter dictionary and be compatible
     """
     return converter[(inunit,outunit)](var)
+
+def affine(inunit, outunit):
+    """
+    Affine conversion from inunit to outunit or None if the conversion
+    is unknown or not affine
+    """
+    func = converter[(inunit, outunit)]
+    return func if isinstance(func, Affine) else None
+
+class TestUnits(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def testAffine(self):
+        import numpy as np
+        a = np.array([0., 32., 212.], dtype = 'f')
+        np.testing.assert_allclose(convert(a, 'F', 'K'), (a - 32) * 5 / 9. + 273.2, rtol = 1e-6)
+        self.assertEqual(convert(a, 'F', 'K').dtype, a.dtype)
+        np.testing.assert_allclose(F2K.then(K2F)(a), a, rtol = 1e-6)
+        np.testing.assert_allclose(F2K.inverse()(F2K(a)), a, rtol = 1e-6)
+        self.assertEqual(affine('ppm', 'ppt'), Affine(1e6))
+        self.assert_(affine('ppb', 'ppb').isidentity())
+        self.assertEqual(affine('m/s             ', 'km/h'), mps2kph)
+        self.assert_(affine('ppb', 'K') is None)
+
+if __name__ == '__main__':
+    unittest.main()
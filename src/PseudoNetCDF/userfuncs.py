@@ -1,66 +1,374 @@
+from __future__ import print_function
+__all__ = ['rolling', 'daygroups', 'dayreduce', 'mda8', 'daymax', 'daymin', 'daymean', 'daystd', 'dayvar']
+import unittest
 import numpy as np
-def mda8(arr, axis = None, keepdims = True):
+
+__doc__ = """
+User functions for reductions (e.g., --reduce=time,mda8)
+
+    rolling - running mean, sum, max or min along an axis from cumulative
+              sums (mean, sum) or strided views (max, min)
+    daygroups - local calendar day of each time for each UTC offset
+    dayreduce - mean, sum, max, min, std, var or count of each calendar
+                day (UTC or local standard time per cell)
+    mda8, daymax, daymin, daymean, daystd, dayvar - regulatory metrics
+
+Arrays are processed as (time, cell) columns a chunk of cells at a time,
+so no Python loop runs per cell. Masked and non-finite values are
+missing. Without times, the axis is assumed to be hourly from hour 0.
+Results keep the floating point type of the input (float64 otherwise).
+"""
+
+chunkbytes = 2**26
+
+# functions that take times, utcoffset and days keywords (see reduce_dim)
+_calendarfuncs = ('mda8', 'daymax', 'daymin', 'daymean', 'daystd', 'dayvar')
+
+def _columns(arr, axis):
+    """
+    (data, valid, cellshape) where data (float) and valid (bool) are
+    (len(axis), ncells) arrays and cellshape is the shape of the other axes
+    """
+    data = np.moveaxis(np.asarray(np.ma.getdata(arr), dtype = 'd'), axis, 0)
+    valid = np.moveaxis(~np.ma.getmaskarray(arr), axis, 0) & np.isfinite(data)
+    cellshape = data.shape[1:]
+    nt = data.shape[0]
+    return data.reshape(nt, -1), valid.reshape(nt, -1), cellshape
+
+def _outdtype(arr):
+    """
+    floating point type of arr (float64 for other types)
+    """
+    dtype = np.dtype(getattr(arr, 'dtype', 'd'))
+    return dtype if dtype.kind == 'f' else np.dtype('d')
+
+def _restore(vals, count, minvalid, cellshape, axis, dtype = 'd'):
+    """
+    masked array (of dtype) of (n, ncells) vals with count < minvalid
+    masked and the cell axes restored around axis
+    """
+    shape = (vals.shape[0],) + cellshape
+    out = np.ma.masked_array(vals.astype(dtype, copy = False), mask = count < max(minvalid, 1))
+    return np.moveaxis(out.reshape(shape), 0, axis)
+
+def _cellchunks(ncells, nbytes):
+    step = max(1, chunkbytes // max(nbytes, 1))
+    for start in range(0, ncells, step):
+        yield slice(start, min(start + step, ncells))
+
+def _windowsum(x, window):
+    """
+    sum of window elements starting at each row of x (from a cumulative sum)
+    """
+    csum = np.zeros((x.shape[0] + 1,) + x.shape[1:], dtype = x.dtype)
+    np.cumsum(x, axis = 0, out = csum[1:])
+    return csum[window:] - csum[:-window]
+
+def _windows(x, window):
+    """
+    read-only (nwindows, ncells, window) view of window rows of x starting
+    at each row
+    """
+    from numpy.lib.stride_tricks import as_strided
+    x = np.ascontiguousarray(x)
+    nw = x.shape[0] - window + 1
+    return as_strided(x, shape = (nw, x.shape[1], window), strides = (x.strides[0], x.strides[1], x.strides[0]), writeable = False)
+
+def rolling(arr, window, func = 'mean', axis = 0, minvalid = None, times = None):
+    """
+    Running func of window elements along axis
+    Arguments:
+       arr - array like
+       window - number of elements in each window
+       func - mean, sum, max or min
+       axis - axis along which windows run
+       minvalid - windows with fewer valid elements are masked (default: window)
+       times - datetime64 of each element along axis; windows that span
+               more than window - 1 of the smallest time step (i.e., that
+               cross a gap) are masked; default: contiguous elements
+    Returns:
+       out - masked array shaped like arr; element i summarizes elements
+             i to i + window - 1 (the last window - 1 elements are masked)
+    """
+    if func not in ('mean', 'sum', 'max', 'min'):
+        raise ValueError('func must be mean, sum, max or min; got %s' % func)
+    if minvalid is None:
+        minvalid = window
+    data, valid, cellshape = _columns(arr, axis)
+    nt, ncells = data.shape
+    out = np.zeros(data.shape)
+    count = np.zeros(data.shape, dtype = 'i8')
+    nw = nt - window + 1
+    if nw > 0:
+        for cells in _cellchunks(ncells, nt * window * 8):
+            v = valid[:, cells]
+            count[:nw, cells] = _windowsum(v.astype('i8'), window)
+            if func in ('mean', 'sum'):
+                total = _windowsum(np.where(v, data[:, cells], 0.), window)
+                if func == 'mean':
+                    total /= np.maximum(count[:nw, cells], 1)
+                out[:nw, cells] = total
+            else:
+                fill = -np.inf if func == 'max' else np.inf
+                out[:nw, cells] = getattr(np, func)(_windows(np.where(v, data[:, cells], fill), window), axis = -1)
+        if times is not None and nt > 1:
+            times = _todatetime64(times, nt)
+            step = np.diff(times).min()
+            count[:nw][times[window - 1:] - times[:nw] != step * (window - 1)] = 0
+    return _restore(out, count, minvalid, cellshape, axis, _outdtype(arr))
+
+def _todatetime64(times, n):
+    """
+    datetime64[m] of times (default: n hours from hour 0)
+    """
+    if times is None:
+        return np.datetime64('1970-01-01T00:00', 'm') + np.arange(n).astype('timedelta64[h]')
+    times = np.asarray(times).astype('datetime64[m]')
+    if times.shape != (n,):
+        raise ValueError('Got %d times for an axis of length %d' % (times.size, n))
+    return times
+
+def daygroups(times, utcoffset = None):
+    """
+    Local calendar day of times for each UTC offset
+    Arguments:
+       times - datetime64 array (UTC)
+       utcoffset - hours added to UTC for local (standard) time; scalar or
+                   array (e.g., one per cell); default: 0
+    Returns:
+       days - datetime64[D] of every local day spanned by times
+       offsets - unique offsets (hours)
+       codes - (len(offsets), len(times)) index in days of each time
+    """
+    times = np.asarray(times).astype('datetime64[m]')
+    offsets = np.unique(np.asarray(0. if utcoffset is None else utcoffset, dtype = 'd'))
+    shift = np.round(offsets * 60).astype('i8').astype('timedelta64[m]')
+    ldays = (times[None, :] + shift[:, None]).astype('datetime64[D]')
+    days = np.arange(ldays.min(), ldays.max() + np.timedelta64(1, 'D'))
+    codes = (ldays - days[0]).astype('i8')
+    return days, offsets, codes
+
+def dayreduce(arr, func = 'mean', axis = 0, times = None, utcoffset = None, minvalid = 1, days = None):
+    """
+    Reduce each calendar day along axis with func
+    Arguments:
+       arr - array like
+       func - mean, sum, max, min, std, var or count
+       axis - time axis
+       times - datetime64 of each element along axis (UTC); default:
+               hourly from hour 0
+       utcoffset - hours added to UTC for local standard time; scalar or
+                   array that broadcasts to the other axes (per cell)
+       minvalid - days with fewer valid values are masked
+       days - datetime64[D] days to return (default: all days spanned)
+    Returns:
+       out - masked array with len(days) elements along axis
+    """
+    if func not in ('mean', 'sum', 'max', 'min', 'std', 'var', 'count'):
+        raise ValueError('func must be mean, sum, max, min, std, var or count; got %s' % func)
+    if axis is None:
+        axis = 0
+    data, valid, cellshape = _columns(arr, axis)
+    nt, ncells = data.shape
+    times = _todatetime64(times, nt)
+    order = np.argsort(times, kind = 'mergesort')
+    if (np.diff(order) != 1).any():
+        data, valid, times = data[order], valid[order], times[order]
+    if utcoffset is None:
+        celloffset = np.zeros(ncells)
+    else:
+        celloffset = np.broadcast_to(np.asarray(utcoffset, dtype = 'd'), cellshape).ravel()
+    alldays, offsets, codes = daygroups(times, celloffset)
+    days = alldays if days is None else np.asarray(days).astype('datetime64[D]')
+    nd = len(days)
+    out = np.zeros((nd, ncells))
+    count = np.zeros((nd, ncells), dtype = 'i8')
+    for offset, code in zip(offsets, codes):
+        code = code + (alldays[0] - days[0]).astype('i8')
+        inside = np.flatnonzero((code >= 0) & (code < nd))
+        if inside.size == 0:
+            continue
+        # times are sorted, so each day is one run of times
+        t0, t1 = inside[0], inside[-1] + 1
+        code = code[t0:t1]
+        starts = np.flatnonzero(np.concatenate([[True], code[1:] != code[:-1]]))
+        lengths = np.diff(np.append(starts, code.size))
+        cellidx = np.flatnonzero(celloffset == offset)
+        for chunk in _cellchunks(cellidx.size, (t1 - t0) * 8 * 3):
+            cells = cellidx[chunk]
+            x = data[t0:t1, cells]
+            v = valid[t0:t1, cells]
+            n = np.add.reduceat(v.astype('i8'), starts, axis = 0)
+            if func in ('max', 'min'):
+                fill = -np.inf if func == 'max' else np.inf
+                ufunc = np.maximum if func == 'max' else np.minimum
+                res = ufunc.reduceat(np.where(v, x, fill), starts, axis = 0)
+            elif func == 'count':
+                res = n
+            else:
+                res = np.add.reduceat(np.where(v, x, 0.), starts, axis = 0)
+                if func != 'sum':
+                    res /= np.maximum(n, 1)
+                if func in ('std', 'var'):
+                    dev = np.where(v, x - np.repeat(res, lengths, axis = 0), 0.)
+                    res = np.add.reduceat(dev**2, starts, axis = 0) / np.maximum(n, 1)
+                    if func == 'std':
+                        res = np.sqrt(res)
+            rows = code[starts]
+            out[rows[:, None], cells[None, :]] = res
+            count[rows[:, None], cells[None, :]] = n
+    if func == 'count':
+        return _restore(out, count, 1, cellshape, axis, 'i8')
+    return _restore(out, count, minvalid, cellshape, axis, _outdtype(arr))
+
+def mda8(arr, axis = None, keepdims = True, times = None, utcoffset = None, days = None, nvalid = 6, ndayvalid = 18):
     """
     Daily-Maximum 8-hour average concentration
-       - can be applied to any dimensions, but make sense with time
-       - returns the day max of the a8
+       - can be applied to any dimensions, but make sense with hourly time
+       - returns the day max of the a8 (each a8 is labeled by its first hour)
+       - with times, 8-hour averages that cross a gap in times are masked
     Arguments:
        arr - array like
        axis - axis over which to apply mda8
        keepdims - should be true
+       times, utcoffset, days - see dayreduce
+       nvalid - 8-hour averages with fewer valid hours are masked
+       ndayvalid - days with fewer valid 8-hour averages are masked
     Returns:
-       out - maximum of 8 element running average. For masked inptus, only values with 6 or more valid entries are returned
+       out - maximum of 8 element running average for each day
     """
-    if hasattr(arr, 'mask'):
-        arr_m = np.ma.masked_array(arr)
-        nvalid = np.apply_along_axis(np.convolve, axis = axis, arr = ~np.ma.getarraymask(arr_m), v = [1]*8, mode = 'valid')
-        arra8_m = np.ma.masked_where(nvalid < 6, np.apply_along_axis(np.convolve, axis = axis, arr = arr_m.filled(0), v = [1]*8, mode = 'valid')/nvalid)
-        arrmda8 = np.ma.masked_invalid(daymax(arra8_m, axis = axis))
-    else:
-        arra8 = np.apply_along_axis(np.convolve, axis = axis, arr = arr, v = [1/8.]*8, mode = 'valid')
-        arrmda8 = daymax(arra8, axis = axis)
-    return arrmda8
+    if axis is None:
+        axis = 0
+    arra8 = rolling(arr, 8, 'mean', axis = axis, minvalid = nvalid, times = times)
+    return dayreduce(arra8, 'max', axis = axis, times = times, utcoffset = utcoffset, minvalid = ndayvalid, days = days)
 
-def _dayfunc(func, arr, axis = None, keepdims = True):
+def _dayfunc(func, arr, axis = None, keepdims = True, times = None, utcoffset = None, days = None):
     """
     Arguments:
-       func - function with reduceat property
+       func - dayreduce function name (e.g., max)
        arr - array_like
-       axis - axis overwhich to apply func.reduceat
+       axis - axis overwhich to apply func
        keepdims - must be true
+       times, utcoffset, days - see dayreduce
     Returns:
-       out - array_like with func.reduceat applied at 24 element increments
+       out - array_like with func applied to each calendar day
     """
-    daystartend = np.arange(0, arr.shape[axis], 24)
-    return func.reduceat(arr, daystartend, axis = axis)[(slice(None),)*axis + (slice(-1),)]
+    return dayreduce(arr, func, axis = axis, times = times, utcoffset = utcoffset, days = days)
 
-def daymax(arr, axis = None, keepdims = True):
+def daymax(arr, axis = None, keepdims = True, **kwds):
     """
-    see _dayfunc with np.maximum as func
+    see _dayfunc with max as func
     """
-    return _dayfunc(np.maximum, arr, axis = axis, keepdims = keepdims)
+    return _dayfunc('max', arr, axis = axis, keepdims = keepdims, **kwds)
 
-def daymin(arr, axis = None, keepdims = True):
+def daymin(arr, axis = None, keepdims = True, **kwds):
     """
-    see _dayfunc with np.minimum as func
+    see _dayfunc with min as func
     """
-    return _dayfunc(np.minimum, arr, axis = axis, keepdims = keepdims)
+    return _dayfunc('min', arr, axis = axis, keepdims = keepdims, **kwds)
 
-def daymean(arr, axis = None, keepdims = True):
+def daymean(arr, axis = None, keepdims = True, **kwds):
     """
-    see _dayfunc with np.mean as func
+    see _dayfunc with mean as func
     """
-    return _dayfunc(np.mean, arr, axis = axis, keepdims = keepdims)
+    return _dayfunc('mean', arr, axis = axis, keepdims = keepdims, **kwds)
 
-def daystd(arr, axis = None, keepdims = True):
+def daystd(arr, axis = None, keepdims = True, **kwds):
     """
-    see _dayfunc with np.std as func
+    see _dayfunc with std as func
     """
-    return _dayfunc(np.std, arr, axis = axis, keepdims = keepdims)
+    return _dayfunc('std', arr, axis = axis, keepdims = keepdims, **kwds)
 
-def dayvar(arr, axis = None, keepdims = True):
+def dayvar(arr, axis = None, keepdims = True, **kwds):
     """
-    see _dayfunc with np.var as func
+    see _dayfunc with var as func
     """
-    return _dayfunc(np.var, arr, axis = axis, keepdims = keepdims)
+    return _dayfunc('var', arr, axis = axis, keepdims = keepdims, **kwds)
+
+class TestUserFuncs(unittest.TestCase):
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.vals = np.ma.masked_greater(rs.uniform(0, 100, size = (72, 3, 4)), 95)
+
+    def testRolling(self):
+        vals = self.vals
+        for func in ('mean', 'sum', 'max', 'min'):
+            out = rolling(vals, 8, func, axis = 0, minvalid = 6)
+            self.assertEqual(out.shape, vals.shape)
+            self.assert_(out.mask[-7:].all())
+            for t in (0, 10, 64):
+                win = vals[t:t + 8]
+                check = getattr(win, func)(axis = 0)
+                ok = win.count(axis = 0) >= 6
+                np.testing.assert_allclose(out[t][ok], check[ok])
+                np.testing.assert_equal(out.mask[t], ~ok)
+        out = rolling(vals.transpose(1, 0, 2), 3, axis = 1)
+        check = np.ma.masked_where(vals[5:8].count(0) < 3, vals[5:8].mean(0))
+        np.testing.assert_allclose(out[:, 5].filled(-1), check.filled(-1))
+
+    def testDays(self):
+        vals = self.vals
+        times = np.datetime64('2016-07-01T06') + np.arange(72).astype('timedelta64[h]')
+        out = daymax(vals, axis = 0, times = times)
+        self.assertEqual(out.shape, (4, 3, 4))
+        np.testing.assert_allclose(out[1], vals[18:42].max(0))
+        out = daymean(vals, axis = 0, times = times, utcoffset = [[-6, -5, -5, 0]])
+        self.assertEqual(out.shape, (4, 3, 4))
+        np.testing.assert_allclose(out[1, :, 0], vals[24:48, :, 0].mean(0))
+        np.testing.assert_allclose(out[1, :, 1], vals[23:47, :, 1].mean(0))
+        np.testing.assert_allclose(out[0, :, 3], vals[:18, :, 3].mean(0))
+        self.assert_(out.mask[3, :, 0].all())
+        np.testing.assert_allclose(out[3, :, 1], vals[-1, :, 1])
+        np.testing.assert_allclose(daystd(vals, axis = 0)[1], vals[24:48].std(0))
+        np.testing.assert_allclose(dayvar(vals, axis = 0)[2], vals[48:].var(0))
+
+    def testMDA8(self):
+        vals = self.vals
+        out = mda8(vals, axis = 0)
+        self.assertEqual(out.shape, (3, 3, 4))
+        a8 = rolling(vals, 8, axis = 0, minvalid = 6)
+        np.testing.assert_allclose(out[0], a8[:24].max(0))
+        self.assert_(out.mask[2].all())
+        filled = vals.filled(50)
+        out = mda8(filled.swapaxes(0, 2), axis = 2, ndayvalid = 1)
+        self.assertEqual(out.shape, (4, 3, 3))
+        check = np.array([filled[t:t + 8].mean(0) for t in range(48, 65)]).max(0)
+        np.testing.assert_allclose(out[..., 2], check.T)
+
+    def testGaps(self):
+        vals = self.vals.astype('f')
+        times = np.datetime64('2016-07-01T00') + np.arange(72).astype('timedelta64[h]')
+        times[40:] += np.timedelta64(3, 'h')
+        out = rolling(vals, 8, axis = 0, minvalid = 1, times = times)
+        self.assertEqual(out.dtype, np.dtype('f'))
+        self.assert_(out.mask[33:40].all())
+        self.assert_(not out.mask[32].all() and not out.mask[40].all())
+        self.assertEqual(mda8(vals, axis = 0).dtype, np.dtype('f'))
+        self.assertEqual(dayreduce(vals, 'count', axis = 0).dtype, np.dtype('i8'))
+
+    def testReduceDim(self):
+        from .sci_var import reduce_dim
+        from .core._files import PseudoNetCDFFile
+        f = PseudoNetCDFFile()
+        f.createDimension('time', 72)
+        f.createDimension('ROW', 3)
+        f.createDimension('COL', 4)
+        time = f.createVariable('time', 'd', ('time',))
+        time.units = 'hours since 2016-07-01 00:00:00 UTC'
+        time[:] = np.arange(72)
+        f.createVariable('utcoffset', 'f', ('ROW', 'COL'))[:] = -6
+        o3 = f.createVariable('O3', 'f', ('time', 'ROW', 'COL'))
+        o3[:] = self.vals.filled(0)
+        outf = reduce_dim(f, 'time,daymax', metakeys = ['time'])
+        np.testing.assert_equal(outf.variables['time'][:].filled(-999), [-24, 0, 24, 48])
+        out = outf.variables['O3']
+        self.assertEqual(out.dtype, np.dtype('f'))
+        np.testing.assert_allclose(out[0], o3[:6].max(0))
+        np.testing.assert_allclose(out[1], o3[6:30].max(0))
+
 
+if __name__ == '__main__':
+    unittest.main()